@@ -1,16 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import text, create_engine
+from sqlalchemy import text
 import os
-import shutil
 from datetime import datetime
-import json
 import logging
-import hashlib
+import uuid
+from typing import Optional
 from pydantic import BaseModel
 
 from database_config import SessionLocal, engine, Base
+import db_backup
 import models
 
 router = APIRouter(
@@ -32,30 +32,7 @@ def get_db():
 
 def get_backups_list():
     """Obtiene la lista de backups disponibles"""
-    backup_dir = os.path.join(
-        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backups"
-    )
-    if not os.path.exists(backup_dir):
-        return []
-
-    backups = []
-    for f in os.listdir(backup_dir):
-        if f.startswith("atrio_backup_"):
-            full_path = os.path.join(backup_dir, f)
-            timestamp = f.replace("atrio_backup_", "").replace(".db", "")
-            backups.append(
-                {
-                    "filename": f,
-                    "path": full_path,
-                    "timestamp": timestamp,
-                    "size_bytes": os.path.getsize(full_path),
-                    "created_at": datetime.strptime(
-                        timestamp, "%Y%m%d_%H%M%S"
-                    ).isoformat(),
-                }
-            )
-
-    return sorted(backups, key=lambda x: x["timestamp"], reverse=True)
+    return db_backup.list_backups()
 
 
 @router.get("/backups")
@@ -107,147 +84,59 @@ def get_database_status(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/backup")
-def create_backup(background_tasks: BackgroundTasks):
-    """Crea una copia de seguridad de la base de datos"""
-    try:
-        db_path = os.path.join(
-            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-            "database/secure/atrio.db",
-        )
-        backup_dir = os.path.join(
-            os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backups"
+@router.post("/backup", status_code=202)
+def create_backup(compression: Optional[str] = None):
+    """
+    Encola una copia de seguridad en caliente de la base de datos. Devuelve el
+    ID de la tarea, que informa del progreso en /api/tasks/{task_id}/status.
+    """
+    compression = compression or db_backup.BACKUP_COMPRESSION
+    if not db_backup.compression_available(compression):
+        raise HTTPException(
+            status_code=400, detail=f"Compresión no disponible: {compression}"
         )
+    task_id = db_backup.submit_backup(compression)
+    return {"message": "Backup en curso", "task_id": task_id}
 
-        os.makedirs(backup_dir, exist_ok=True)
-
-        # Forzar un checkpoint para asegurar que los datos del WAL
-        # se escriban al archivo .db principal
-        try:
-            with engine.connect() as connection:
-                # Usar TRUNCATE es generalmente bueno. FULL es otra opción más agresiva.
-                connection.execute(text("PRAGMA wal_checkpoint(TRUNCATE);"))
-                connection.commit()  # Asegurar que el pragma se ejecute y complete
-            logger.info("WAL checkpoint TRUNCATE ejecutado antes del backup.")
-        except Exception as e_checkpoint:
-            logger.error(
-                f"Error al ejecutar WAL checkpoint: {e_checkpoint}", exc_info=True
-            )
-            # Considerar si esto debe ser un error fatal para el backup.
-            # Por ahora, solo loguear.
-
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_path = os.path.join(backup_dir, f"atrio_backup_{timestamp}.db")
 
-        shutil.copy2(db_path, backup_path)
-
-        return {"message": "Backup creado exitosamente", "backup_path": backup_path}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@router.post("/restore")
+@router.post("/restore", status_code=202)
 async def restore_database(backup_file: UploadFile = File(...)):
-    """Restaura la base de datos desde un archivo de backup"""
+    """
+    Encola la restauración de la base de datos desde un archivo de backup
+    subido (SQLite o .tar con los shards, comprimidos o no con zstd).
+    """
+    os.makedirs(db_backup.BACKUP_DIR, exist_ok=True)
+    temp_path = os.path.join(
+        db_backup.BACKUP_DIR,
+        f"upload_{uuid.uuid4().hex}{db_backup.PARTIAL_SUFFIX}",
+    )
     try:
-        db_path = os.path.join(
-            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-            "database/secure/atrio.db",
-        )
-        temp_path = f"temp_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+        # Se guarda por bloques, sin cargar el archivo entero en memoria
         with open(temp_path, "wb") as buffer:
-            content = await backup_file.read()
-            buffer.write(content)
-
-        # Calcular y loguear el hash MD5 del archivo temporal
-        hasher = hashlib.md5()
-        with open(temp_path, "rb") as f_hash:
-            buf = f_hash.read()
-            hasher.update(buf)
-        temp_file_hash = hasher.hexdigest()
-        logger.info(f"MD5 hash del archivo temporal ({temp_path}): {temp_file_hash}")
-
+            while content := await backup_file.read(db_backup.CHUNK_SIZE):
+                buffer.write(content)
         logger.info(
             f"Archivo recibido para restaurar: {backup_file.filename}, tamaño: {os.path.getsize(temp_path)} bytes"
         )
-        try:
-            test_engine = create_engine(f"sqlite:///{temp_path}")
-            conn = test_engine.connect()
-            conn.close()
-            test_engine.dispose()
-        except Exception as e:
-            logger.error(f"Archivo subido no es una base de datos SQLite válida: {e}")
-            os.remove(temp_path)
+        if db_backup.file_kind(temp_path) is None:
+            logger.error(
+                f"Archivo subido no es una base de datos SQLite válida: {backup_file.filename}"
+            )
             raise HTTPException(
                 status_code=400,
                 detail="El archivo no es una base de datos SQLite válida",
             )
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        current_backup = f"pre_restore_backup_{timestamp}.db"
-        shutil.copy2(db_path, current_backup)
-        shutil.copy2(temp_path, db_path)
-        os.remove(temp_path)
-
-        # Forzar al motor principal de SQLAlchemy a cerrar las conexiones existentes
-        # para que las nuevas solicitudes lean el archivo de base de datos restaurado.
-        try:
-            from database_config import engine as main_app_engine  # Motor correcto
-
-            logger.info(
-                "Intentando disponer del motor principal de SQLAlchemy (upload)..."
-            )
-            main_app_engine.dispose()
-            logger.info("Motor principal de SQLAlchemy dispuesto (upload).")
-
-            logger.info(
-                "Intentando operación de lectura post-dispose para refrescar el pool (upload)..."
-            )
-            with main_app_engine.connect() as connection:
-                result = connection.execute(text("SELECT sqlite_version();")).scalar()
-                logger.info(
-                    f"Operación de lectura post-dispose exitosa (upload). Versión de SQLite: {result}"
-                )
-
-        except Exception as e_dispose_refresh:
-            logger.error(
-                f"Error durante el dispose/refresh del motor principal (upload): {e_dispose_refresh}",
-                exc_info=True,
-            )
-
-        # Verificar el estado de la base de datos inmediatamente después de la restauración
-        final_counts_upload = {}
-        try:
-            logger.info(
-                "Verificando conteos post-restauración (upload) inmediatamente..."
-            )
-            with SessionLocal() as db_check:
-                tables_to_check = ["usuarios", "Grupos", "Casos"]
-                for table_name in tables_to_check:
-                    if table_name in Base.metadata.tables:
-                        count = db_check.execute(
-                            text(f"SELECT COUNT(*) FROM {table_name}")
-                        ).scalar_one_or_none()
-                        final_counts_upload[table_name] = count
-                        logger.info(
-                            f"Conteo post-restauración (upload) para tabla '{table_name}': {count}"
-                        )
-                    else:
-                        logger.warning(
-                            f"Tabla '{table_name}' no encontrada en metadatos para conteo post-restauración (upload)."
-                        )
-        except Exception as e_check:
-            logger.error(
-                f"Error al verificar conteos post-restauración (upload): {e_check}",
-                exc_info=True,
-            )
-
-        response_msg = f"Base de datos restaurada exitosamente. Conteos (ver logs): {json.dumps(final_counts_upload)}"
-        return {"message": response_msg, "final_counts_debug": final_counts_upload}
+        task_id = db_backup.submit_restore(temp_path, remove_source=True)
     except Exception as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        if isinstance(e, HTTPException):
+            raise
         logger.error(
             f"Error inesperado al restaurar la base de datos: {e}", exc_info=True
         )
         raise HTTPException(status_code=500, detail=str(e))
+    return {"message": "Restauración en curso", "task_id": task_id}
 
 
 @router.delete("/tables/{table_name}")
@@ -271,8 +160,14 @@ def delete_table_data(table_name: str, db: Session = Depends(get_db)):
 def reset_database(db: Session = Depends(get_db)):
     """Reinicia la base de datos eliminando todas las tablas y creándolas de nuevo"""
     try:
-        # Crear backup antes de resetear
-        create_backup(BackgroundTasks())
+        # Crear backup antes de resetear, sin encolarlo: debe terminar antes
+        db_backup.backup_database(
+            os.path.join(
+                db_backup.BACKUP_DIR,
+                db_backup.backup_filename(db_backup.COMPRESSION_NONE),
+            ),
+            sleep=0,
+        )
         # Eliminar todas las tablas
         Base.metadata.drop_all(bind=engine)
         # Crear las tablas nuevamente
@@ -287,18 +182,8 @@ def reset_database(db: Session = Depends(get_db)):
 
 def get_last_backup_date():
     """Obtiene la fecha del último backup realizado"""
-    backup_dir = os.path.join(
-        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backups"
-    )
-    if not os.path.exists(backup_dir):
-        return None
-
-    backups = [f for f in os.listdir(backup_dir) if f.startswith("atrio_backup_")]
-    if not backups:
-        return None
-
-    latest_backup = max(backups)
-    return latest_backup.replace("atrio_backup_", "").replace(".db", "")
+    backups = db_backup.list_backups()
+    return backups[0]["timestamp"] if backups else None
 
 
 @router.get("/backups/{filename}/download")
@@ -359,22 +244,14 @@ class RestoreRequest(BaseModel):
     filename: str
 
 
-@router.post("/restore_from_filename")
-async def restore_database_from_filename(request_data: RestoreRequest):
-    """Restaura la base de datos desde un archivo de backup existente en el servidor."""
+@router.post("/restore_from_filename", status_code=202)
+def restore_database_from_filename(request_data: RestoreRequest):
+    """Encola la restauración desde un archivo de backup existente en el servidor."""
     backup_filename = request_data.filename
     logger.info(
         f"Solicitud para restaurar desde el archivo en servidor: {backup_filename}"
     )
-
-    db_path = os.path.join(
-        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-        "database/secure/atrio.db",
-    )
-    backup_dir = os.path.join(
-        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backups"
-    )
-    source_backup_path = os.path.join(backup_dir, backup_filename)
+    source_backup_path = os.path.join(db_backup.BACKUP_DIR, backup_filename)
 
     if not os.path.exists(source_backup_path):
         logger.error(
@@ -385,104 +262,18 @@ async def restore_database_from_filename(request_data: RestoreRequest):
         )
         raise HTTPException(status_code=404, detail=error_msg)
 
-    try:
-        # Verificar que el archivo de backup es una BD SQLite válida
-        try:
-            test_engine = create_engine(f"sqlite:///{source_backup_path}")
-            conn = test_engine.connect()
-            conn.close()
-            test_engine.dispose()
-            logger.info(
-                f"Archivo de backup '{backup_filename}' es una BD SQLite válida."
-            )
-        except Exception as e_test:
-            logger.error(
-                f"Archivo de backup '{backup_filename}' no es una BD SQLite válida: {e_test}"
-            )
-            error_msg = (
-                f"El archivo de backup seleccionado ('{backup_filename}') "
-                f"no es una base de datos SQLite válida."
-            )
-            raise HTTPException(status_code=400, detail=error_msg)
-
-        # Crear un backup del estado actual ANTES de restaurar
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        pre_restore_backup_name = f"pre_restore_backup_{timestamp}.db"
-        pre_restore_backup_path = os.path.join(
-            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-            pre_restore_backup_name,
+    if db_backup.file_kind(source_backup_path) is None:
+        logger.error(
+            f"Archivo de backup '{backup_filename}' no es una BD SQLite válida"
         )
-        shutil.copy2(db_path, pre_restore_backup_path)
-        logger.info(f"Backup pre-restauración creado: {pre_restore_backup_name}")
-
-        # Restaurar: copiar el archivo de backup de origen sobre el archivo de BD principal
-        shutil.copy2(source_backup_path, db_path)
-        logger.info(
-            f"Base de datos restaurada desde '{backup_filename}' a '{db_path}'."
+        error_msg = (
+            f"El archivo de backup seleccionado ('{backup_filename}') "
+            f"no es una base de datos SQLite válida."
         )
+        raise HTTPException(status_code=400, detail=error_msg)
 
-        # Forzar al motor principal de SQLAlchemy a cerrar las conexiones existentes
-        try:
-            from database_config import engine as main_app_engine
-
-            logger.info(
-                f"Intentando disponer del motor principal de SQLAlchemy (filename: {backup_filename})..."
-            )
-            main_app_engine.dispose()
-            logger.info(
-                f"Motor principal de SQLAlchemy dispuesto (filename: {backup_filename})."
-            )
-
-            logger.info(
-                f"Intentando operación de lectura post-dispose para refrescar el pool (filename: {backup_filename})..."
-            )
-            with main_app_engine.connect() as connection:
-                result = connection.execute(text("SELECT sqlite_version();")).scalar()
-                logger.info(
-                    f"Operación de lectura post-dispose exitosa (filename: {backup_filename}). Versión de SQLite: {result}"
-                )
-
-        except Exception as e_dispose_refresh:
-            logger.error(
-                f"Error durante el dispose/refresh del motor principal (filename: {backup_filename}): {e_dispose_refresh}",
-                exc_info=True,
-            )
-
-        # Verificar el estado de la base de datos inmediatamente después de la restauración
-        final_counts_filename = {}
-        try:
-            logger.info(
-                f"Verificando conteos post-restauración (filename: {backup_filename}) inmediatamente..."
-            )
-            with SessionLocal() as db_check:
-                tables_to_check = ["usuarios", "Grupos", "Casos"]
-                for table_name in tables_to_check:
-                    if table_name in Base.metadata.tables:
-                        count = db_check.execute(
-                            text(f"SELECT COUNT(*) FROM {table_name}")
-                        ).scalar_one_or_none()
-                        final_counts_filename[table_name] = count
-                        logger.info(
-                            f"Conteo post-restauración (filename: {backup_filename}) para tabla '{table_name}': {count}"
-                        )
-                    else:
-                        logger.warning(
-                            f"Tabla '{table_name}' no encontrada en metadatos para conteo post-restauración (filename: {backup_filename})."
-                        )
-        except Exception as e_check:
-            logger.error(
-                f"Error al verificar conteos post-restauración (filename: {backup_filename}): {e_check}",
-                exc_info=True,
-            )
-
-        response_msg = f"Base de datos restaurada exitosamente desde '{backup_filename}'. Conteos (ver logs): {json.dumps(final_counts_filename)}"
-        return {"message": response_msg, "final_counts_debug": final_counts_filename}
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(
-            f"Error inesperado al restaurar la base de datos desde '{backup_filename}': {e}",
-            exc_info=True,
-        )
-        error_msg = f"Error inesperado al restaurar desde '{backup_filename}': {str(e)}"
-        raise HTTPException(status_code=500, detail=error_msg)
+    task_id = db_backup.submit_restore(source_backup_path)
+    return {
+        "message": f"Restauración desde '{backup_filename}' en curso",
+        "task_id": task_id,
+    }
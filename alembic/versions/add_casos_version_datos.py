@@ -0,0 +1,32 @@
+"""add_casos_version_datos
+
+Revision ID: casos_version_datos_2026
+Revises: gps_capas_ids_lectura_2026
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "casos_version_datos_2026"
+down_revision: Union[str, None] = "gps_capas_ids_lectura_2026"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "Casos",
+        sa.Column("Version_Datos", sa.Integer(), nullable=False, server_default="0"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("Casos") as batch_op:
+        batch_op.drop_column("Version_Datos")
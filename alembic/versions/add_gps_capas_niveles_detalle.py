@@ -0,0 +1,29 @@
+"""add_gps_capas_niveles_detalle
+
+Revision ID: add_gps_capas_niveles_2026
+Revises: add_gps_segmentos_2026
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "add_gps_capas_niveles_2026"
+down_revision: Union[str, None] = "add_gps_segmentos_2026"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("gps_capas", sa.Column("niveles_detalle", sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("gps_capas") as batch_op:
+        batch_op.drop_column("niveles_detalle")
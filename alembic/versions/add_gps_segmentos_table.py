@@ -0,0 +1,63 @@
+"""add_gps_segmentos_table
+
+Revision ID: add_gps_segmentos_2026
+Revises: add_mapas_guardados_2025
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "add_gps_segmentos_2026"
+down_revision: Union[str, None] = "add_mapas_guardados_2025"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "gps_segmentos",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("caso_id", sa.Integer(), nullable=False),
+        sa.Column("matricula", sa.String(length=20), nullable=False),
+        sa.Column("tipo", sa.String(length=10), nullable=False),
+        sa.Column("inicio", sa.DateTime(), nullable=False),
+        sa.Column("fin", sa.DateTime(), nullable=False),
+        sa.Column("duracion_segundos", sa.Float(), nullable=False),
+        sa.Column("distancia_metros", sa.Float(), nullable=False),
+        sa.Column("num_puntos", sa.Integer(), nullable=False),
+        sa.Column("lat_centro", sa.Float(), nullable=True),
+        sa.Column("lon_centro", sa.Float(), nullable=True),
+        sa.Column("lat_inicio", sa.Float(), nullable=False),
+        sa.Column("lon_inicio", sa.Float(), nullable=False),
+        sa.Column("lat_fin", sa.Float(), nullable=False),
+        sa.Column("lon_fin", sa.Float(), nullable=False),
+        sa.Column("lat_min", sa.Float(), nullable=False),
+        sa.Column("lat_max", sa.Float(), nullable=False),
+        sa.Column("lon_min", sa.Float(), nullable=False),
+        sa.Column("lon_max", sa.Float(), nullable=False),
+        sa.Column("id_lectura_inicio", sa.Integer(), nullable=True),
+        sa.Column("id_lectura_fin", sa.Integer(), nullable=True),
+        sa.CheckConstraint("tipo IN ('estancia', 'trayecto')"),
+        sa.ForeignKeyConstraint(["caso_id"], ["Casos.ID_Caso"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_gps_segmentos_id"), "gps_segmentos", ["id"], unique=False)
+    op.create_index(
+        "ix_gps_segmentos_caso_matricula_inicio",
+        "gps_segmentos",
+        ["caso_id", "matricula", "inicio"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_gps_segmentos_caso_matricula_inicio", table_name="gps_segmentos")
+    op.drop_index(op.f("ix_gps_segmentos_id"), table_name="gps_segmentos")
+    op.drop_table("gps_segmentos")
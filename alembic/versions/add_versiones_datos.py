@@ -0,0 +1,34 @@
+"""add_versiones_datos
+
+Revision ID: versiones_datos_2026
+Revises: casos_version_datos_2026
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "versiones_datos_2026"
+down_revision: Union[str, None] = "casos_version_datos_2026"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    versiones = op.create_table(
+        "versiones_datos",
+        sa.Column("Ambito", sa.String(length=50), nullable=False),
+        sa.Column("Version", sa.Integer(), nullable=False, server_default="0"),
+        sa.PrimaryKeyConstraint("Ambito"),
+    )
+    op.bulk_insert(versiones, [{"Ambito": "lectores", "Version": 0}])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("versiones_datos")
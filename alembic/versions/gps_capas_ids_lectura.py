@@ -0,0 +1,102 @@
+"""gps_capas_ids_lectura
+
+Guarda los puntos de las capas GPS como referencias a lectura.ID_Lectura
+en lugar de copiar cada lectura completa en el JSON de la capa.
+
+Revision ID: gps_capas_ids_lectura_2026
+Revises: add_gps_capas_niveles_2026
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+
+import json
+import zlib
+from typing import Sequence, Union
+
+from alembic import op
+import numpy as np
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "gps_capas_ids_lectura_2026"
+down_revision: Union[str, None] = "add_gps_capas_niveles_2026"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _codificar_ids(ids):
+    # Mismo formato que gps_capas.codificar_ids
+    ids = np.asarray(ids, dtype=np.int64)
+    return zlib.compress(np.diff(ids, prepend=0).astype("<i8").tobytes())
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table("gps_capas") as batch_op:
+        batch_op.add_column(sa.Column("ids_lectura", sa.LargeBinary(), nullable=True))
+        batch_op.add_column(
+            sa.Column("num_lecturas", sa.Integer(), nullable=False, server_default="0")
+        )
+        batch_op.alter_column("lecturas", existing_type=sa.JSON(), nullable=True)
+
+    # Convertir las capas existentes cuyas lecturas tienen todas ID_Lectura
+    connection = op.get_bind()
+    capas = connection.execute(sa.text("SELECT id, lecturas FROM gps_capas")).all()
+    for capa_id, lecturas in capas:
+        lecturas = json.loads(lecturas) if isinstance(lecturas, str) else lecturas
+        lecturas = lecturas or []
+        if lecturas and all(isinstance(l.get("ID_Lectura"), int) for l in lecturas):
+            connection.execute(
+                sa.text(
+                    "UPDATE gps_capas SET ids_lectura = :ids, lecturas = NULL, "
+                    "num_lecturas = :num WHERE id = :id"
+                ),
+                {
+                    "ids": _codificar_ids([l["ID_Lectura"] for l in lecturas]),
+                    "num": len(lecturas),
+                    "id": capa_id,
+                },
+            )
+        else:
+            connection.execute(
+                sa.text("UPDATE gps_capas SET num_lecturas = :num WHERE id = :id"),
+                {"num": len(lecturas), "id": capa_id},
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Volver a copiar las lecturas referenciadas dentro de cada capa
+    connection = op.get_bind()
+    capas = connection.execute(
+        sa.text("SELECT id, ids_lectura FROM gps_capas WHERE ids_lectura IS NOT NULL")
+    ).all()
+    for capa_id, datos in capas:
+        ids = np.cumsum(np.frombuffer(zlib.decompress(datos), dtype="<i8")).tolist()
+        lecturas = {}
+        for inicio in range(0, len(ids), 900):
+            filas = connection.execute(
+                sa.text(
+                    "SELECT ID_Lectura, ID_Archivo, Matricula, Fecha_y_Hora, "
+                    "Velocidad, Coordenada_X, Coordenada_Y, Tipo_Fuente "
+                    "FROM lectura WHERE ID_Lectura IN :ids"
+                ).bindparams(sa.bindparam("ids", expanding=True)),
+                {"ids": ids[inicio : inicio + 900]},
+            ).mappings()
+            for fila in filas:
+                lecturas[fila["ID_Lectura"]] = {k: fila[k] for k in fila.keys()}
+        connection.execute(
+            sa.text("UPDATE gps_capas SET lecturas = :lecturas WHERE id = :id"),
+            {
+                "lecturas": json.dumps(
+                    [lecturas[i] for i in ids if i in lecturas], default=str
+                ),
+                "id": capa_id,
+            },
+        )
+
+    op.execute("UPDATE gps_capas SET lecturas = '[]' WHERE lecturas IS NULL")
+    with op.batch_alter_table("gps_capas") as batch_op:
+        batch_op.alter_column("lecturas", existing_type=sa.JSON(), nullable=False)
+        batch_op.drop_column("num_lecturas")
+        batch_op.drop_column("ids_lectura")
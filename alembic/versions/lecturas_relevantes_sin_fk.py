@@ -0,0 +1,59 @@
+"""lecturas_relevantes_sin_fk
+
+Quita la clave foránea de LecturasRelevantes.ID_Lectura a lectura: con los
+shards por caso (case_shards) la lectura marcada puede estar en otro archivo.
+
+Revision ID: lecturas_relevantes_sin_fk_2026
+Revises: versiones_datos_2026
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "lecturas_relevantes_sin_fk_2026"
+down_revision: Union[str, None] = "versiones_datos_2026"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _tabla(*clave_foranea):
+    # Definición de la tabla para recrearla (la clave se creó sin nombre)
+    return sa.Table(
+        "LecturasRelevantes",
+        sa.MetaData(),
+        sa.Column("ID_Relevante", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("ID_Lectura", sa.Integer(), *clave_foranea, nullable=False),
+        sa.Column("Fecha_Marcada", sa.DateTime(), nullable=False),
+        sa.Column("Nota", sa.Text(), nullable=True),
+        sa.UniqueConstraint("ID_Lectura"),
+        sa.Index("ix_LecturasRelevantes_ID_Relevante", "ID_Relevante"),
+        sa.Index("ix_lecturasrelevantes_id_lectura", "ID_Lectura"),
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table(
+        "LecturasRelevantes", recreate="always", copy_from=_tabla()
+    ):
+        pass
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Las marcas de lecturas de un shard no caben en la clave foránea
+    op.execute(
+        'DELETE FROM "LecturasRelevantes" '
+        'WHERE "ID_Lectura" NOT IN (SELECT "ID_Lectura" FROM lectura)'
+    )
+    with op.batch_alter_table(
+        "LecturasRelevantes",
+        recreate="always",
+        copy_from=_tabla(sa.ForeignKey("lectura.ID_Lectura")),
+    ):
+        pass
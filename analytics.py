@@ -0,0 +1,321 @@
+"""
+Motor analítico columnar opcional (DuckDB) para los agregados de un caso
+
+El resumen del caso, los conteos por vehículo y por archivo y los
+histogramas por hora y día de la semana recorren fila a fila todas las
+lecturas del caso en SQLite. Con ATRIO_ANALYTICS=duckdb y los paquetes
+de `requirements-analytics.txt` instalados se calculan en DuckDB, que lee
+por columnas:
+
+- la instantánea Parquet del caso, si existe para su versión de datos
+  vigente (`export_snapshot`, que el precalentamiento genera tras cada
+  importación), o
+- el archivo SQLite (o el shard del caso) en sólo lectura con `sqlite_scan`.
+
+La extensión sqlite de DuckDB se carga del paquete
+`duckdb-extension-sqlite-scanner`, de la misma versión que `duckdb`; nunca
+se descarga al atender una petición. Si falta, o si una consulta de DuckDB
+falla, el error llega a quien la pidió: no se oculta recalculando en
+SQLite. Sin el paquete `duckdb` se calcula todo en SQLite, y las funciones
+devuelven lo mismo con cualquiera de los dos motores.
+`python -m monitoring.benchmark_analytics` compara ambos caminos.
+"""
+
+import glob
+import logging
+import os
+import threading
+import uuid
+import typing
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import Integer, cast, distinct, func, select
+from sqlalchemy.orm import Session
+
+import models
+from cache_warmup import paso_precalentamiento
+from case_shards import is_sharded, lectura_entity, shard_path
+from database_config import engine
+from version_datos import version_caso
+
+try:
+    import duckdb
+except ImportError:  # pragma: no cover - dependencia opcional
+    duckdb = None  # type: ignore[assignment]
+
+try:
+    import duckdb_extension_sqlite_scanner
+except ImportError:  # pragma: no cover - dependencia opcional
+    duckdb_extension_sqlite_scanner = None
+
+logger = logging.getLogger(__name__)
+
+BACKEND_SQLITE = "sqlite"
+BACKEND_DUCKDB = "duckdb"
+ANALYTICS_BACKEND = os.getenv("ATRIO_ANALYTICS", BACKEND_SQLITE)
+
+# Una URL sqlite:/// de archivo siempre tiene la ruta
+DATABASE_PATH = typing.cast(str, engine.url.database)
+SNAPSHOTS_DIR = "./database/secure/analytics"
+
+# Columnas de las lecturas que usan los agregados
+_COLUMNS = (
+    'l."ID_Lectura", l."ID_Archivo", l."Matricula", '
+    'CAST(l."Fecha_y_Hora" AS TIMESTAMP) AS "Fecha_y_Hora", '
+    'l."ID_Lector", l."Tipo_Fuente"'
+)
+
+_lock = threading.Lock()
+_local = threading.local()
+# (pid, conexión): tras un fork cada proceso abre su propia instancia
+_instance = None
+
+
+def enabled() -> bool:
+    """Los agregados se calculan con DuckDB"""
+    return ANALYTICS_BACKEND == BACKEND_DUCKDB and duckdb is not None
+
+
+def sqlite_extension_path() -> str:
+    """Archivo de la extensión sqlite de DuckDB instalado con pip"""
+    if duckdb_extension_sqlite_scanner is None:
+        raise RuntimeError(
+            "ATRIO_ANALYTICS=duckdb necesita el paquete "
+            f"duckdb-extension-sqlite-scanner=={duckdb.__version__}"
+        )
+    ruta = os.path.join(
+        os.path.dirname(duckdb_extension_sqlite_scanner.__file__),
+        "extensions",
+        f"v{duckdb.__version__}",
+        "sqlite_scanner.duckdb_extension",
+    )
+    if not os.path.exists(ruta):
+        raise RuntimeError(
+            "La extensión sqlite instalada no es de la versión de duckdb "
+            f"({duckdb.__version__}): instala "
+            f"duckdb-extension-sqlite-scanner=={duckdb.__version__}"
+        )
+    return ruta
+
+
+def _cursor():
+    """Cursor de DuckDB del hilo sobre la instancia en memoria del proceso"""
+    global _instance
+    with _lock:
+        if _instance is None or _instance[0] != os.getpid():
+            # Sin descargas: las extensiones conocidas no se instalan solas
+            conexion = duckdb.connect(
+                config={
+                    "autoinstall_known_extensions": False,
+                    "autoload_known_extensions": False,
+                }
+            )
+            conexion.execute(f"LOAD {_literal(sqlite_extension_path())}")
+            _instance = (os.getpid(), conexion)
+        conexion = _instance[1]
+    if getattr(_local, "conexion", None) is not conexion:
+        _local.conexion = conexion
+        _local.cursor = conexion.cursor()
+    return _local.cursor
+
+
+def _literal(valor: str) -> str:
+    return "'" + valor.replace("'", "''") + "'"
+
+
+def _scan_source(caso_id: int) -> str:
+    """Lecturas del caso leídas del archivo SQLite con sqlite_scan"""
+    if is_sharded(caso_id):
+        return (
+            f"SELECT {_COLUMNS} "
+            f"FROM sqlite_scan({_literal(shard_path(caso_id))}, 'lectura') l"
+        )
+    base = _literal(DATABASE_PATH)
+    return (
+        f"SELECT {_COLUMNS} FROM sqlite_scan({base}, 'lectura') l "
+        f"JOIN sqlite_scan({base}, 'ArchivosExcel') a "
+        f'ON l."ID_Archivo" = a."ID_Archivo" WHERE a."ID_Caso" = {int(caso_id)}'
+    )
+
+
+def snapshot_path(caso_id: int, version: int) -> str:
+    return os.path.join(SNAPSHOTS_DIR, f"caso_{int(caso_id)}_v{int(version)}.parquet")
+
+
+def _source(db: Session, caso_id: int) -> str:
+    """Instantánea vigente del caso o, si no la hay, su lectura con sqlite_scan"""
+    ruta = snapshot_path(caso_id, version_caso(db, caso_id))
+    if os.path.exists(ruta):
+        return f"SELECT * FROM read_parquet({_literal(ruta)})"
+    return _scan_source(caso_id)
+
+
+def export_snapshot(db: Session, caso_id: int) -> Optional[str]:
+    """
+    Exporta las lecturas del caso a Parquet para su versión de datos vigente
+    y borra las instantáneas anteriores. Si los datos cambian durante la
+    exportación la instantánea se descarta.
+    """
+    if not enabled():
+        return None
+    version = version_caso(db, caso_id)
+    ruta = snapshot_path(caso_id, version)
+    if os.path.exists(ruta):
+        return ruta
+    os.makedirs(SNAPSHOTS_DIR, exist_ok=True)
+    temporal = f"{ruta}.{uuid.uuid4().hex}.tmp"
+    try:
+        # Ordenada por matrícula y fecha: los filtros saltan grupos de filas
+        _cursor().execute(
+            f"COPY ({_scan_source(caso_id)} ORDER BY 3, 4) "
+            f"TO {_literal(temporal)} (FORMAT parquet, COMPRESSION zstd)"
+        )
+        if version_caso(db, caso_id) != version:
+            return None
+        os.replace(temporal, ruta)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    drop_snapshots(caso_id, keep=ruta)
+    logger.info(f"Instantánea analítica del caso {caso_id} (v{version}) en {ruta}")
+    return ruta
+
+
+def drop_snapshots(caso_id: Optional[int] = None, keep: Optional[str] = None):
+    """Borra las instantáneas del caso (o de todos) salvo `keep`"""
+    caso = "*" if caso_id is None else int(caso_id)
+    for ruta in glob.glob(os.path.join(SNAPSHOTS_DIR, f"caso_{caso}_v*.parquet")):
+        if keep is None or os.path.abspath(ruta) != os.path.abspath(keep):
+            try:
+                os.remove(ruta)
+            except OSError as e:
+                logger.warning(f"No se pudo borrar la instantánea {ruta}: {e}")
+
+
+@paso_precalentamiento("instantanea_analitica")
+def _snapshot_step(caso_id: int, db: Session):
+    """Primer paso del precalentamiento: los siguientes ya leen la instantánea"""
+    export_snapshot(db, caso_id)
+
+
+def _rows(
+    db: Session, caso_id: int, sql: str, sqlite: Callable[[], List[Any]]
+) -> List[Any]:
+    """
+    Filas de la agregación `sql` (sobre la relación `t`) con DuckDB si está
+    activo, o de la consulta equivalente `sqlite`.
+    """
+    if enabled():
+        filas: List[Any] = (
+            _cursor().execute(sql.format(t=f"({_source(db, caso_id)}) t")).fetchall()
+        )
+        return filas
+    return [tuple(fila) for fila in sqlite()]
+
+
+def _del_caso(consulta, Lectura, caso_id: int):
+    """Restringe una consulta SQLite sobre `Lectura` a las lecturas del caso"""
+    return consulta.join_from(
+        Lectura,
+        models.ArchivoExcel,
+        Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+    ).where(models.ArchivoExcel.ID_Caso == caso_id)
+
+
+def case_summary(db: Session, caso_id: int) -> Dict[str, Any]:
+    """Totales del caso, como la vista estadisticas_casos"""
+    Lectura = lectura_entity(caso_id)
+    consulta = select(
+        func.count(),
+        func.count(distinct(Lectura.Matricula)),
+        func.count(distinct(Lectura.ID_Lector)),
+        func.min(Lectura.Fecha_y_Hora),
+        func.max(Lectura.Fecha_y_Hora),
+    )
+    (fila,) = _rows(
+        db,
+        caso_id,
+        'SELECT count(*), count(DISTINCT "Matricula"), count(DISTINCT "ID_Lector"), '
+        'min("Fecha_y_Hora"), max("Fecha_y_Hora") FROM {t}',
+        lambda: db.execute(_del_caso(consulta, Lectura, caso_id)).all(),
+    )
+    total_archivos = db.scalar(
+        select(func.count())
+        .select_from(models.ArchivoExcel)
+        .where(models.ArchivoExcel.ID_Caso == caso_id)
+    )
+    return {
+        "total_archivos": total_archivos,
+        "total_lecturas": fila[0],
+        "total_matriculas_unicas": fila[1],
+        "total_lectores_unicos": fila[2],
+        "fecha_primera_lectura": fila[3],
+        "fecha_ultima_lectura": fila[4],
+    }
+
+
+def counts_by_plate(db: Session, caso_id: int) -> Dict[str, Dict[str, int]]:
+    """Lecturas del caso por matrícula y tipo de fuente: {matrícula: {tipo: n}}"""
+    Lectura = lectura_entity(caso_id)
+    consulta = select(Lectura.Matricula, Lectura.Tipo_Fuente, func.count()).group_by(
+        Lectura.Matricula, Lectura.Tipo_Fuente
+    )
+    filas = _rows(
+        db,
+        caso_id,
+        'SELECT "Matricula", "Tipo_Fuente", count(*) FROM {t} GROUP BY 1, 2',
+        lambda: db.execute(_del_caso(consulta, Lectura, caso_id)).all(),
+    )
+    conteos: Dict[str, Dict[str, int]] = {}
+    for matricula, tipo, total in filas:
+        conteos.setdefault(matricula, {})[tipo] = total
+    return conteos
+
+
+def counts_by_file(db: Session, caso_id: int) -> Dict[int, int]:
+    """Lecturas del caso por archivo"""
+    Lectura = lectura_entity(caso_id)
+    consulta = select(Lectura.ID_Archivo, func.count()).group_by(Lectura.ID_Archivo)
+    filas = _rows(
+        db,
+        caso_id,
+        'SELECT "ID_Archivo", count(*) FROM {t} GROUP BY 1',
+        lambda: db.execute(_del_caso(consulta, Lectura, caso_id)).all(),
+    )
+    return dict(filas)
+
+
+def histograms(db: Session, caso_id: int) -> Dict[str, List[int]]:
+    """
+    Lecturas del caso por hora del día (0-23) y por día de la semana
+    (posición 0 = lunes, como el filtro `dia_semana`).
+    """
+    Lectura = lectura_entity(caso_id)
+    hora = cast(func.strftime("%H", Lectura.Fecha_y_Hora), Integer)
+    # 0 = domingo, igual que dayofweek en DuckDB
+    dia = cast(func.strftime("%w", Lectura.Fecha_y_Hora), Integer)
+
+    por_hora = [0] * 24
+    for valor, total in _rows(
+        db,
+        caso_id,
+        'SELECT hour("Fecha_y_Hora"), count(*) FROM {t} GROUP BY 1',
+        lambda: db.execute(
+            _del_caso(select(hora, func.count()).group_by(hora), Lectura, caso_id)
+        ).all(),
+    ):
+        if valor is not None:
+            por_hora[int(valor)] = total
+
+    por_dia = [0] * 7
+    for valor, total in _rows(
+        db,
+        caso_id,
+        'SELECT dayofweek("Fecha_y_Hora"), count(*) FROM {t} GROUP BY 1',
+        lambda: db.execute(
+            _del_caso(select(dia, func.count()).group_by(dia), Lectura, caso_id)
+        ).all(),
+    ):
+        if valor is not None:
+            por_dia[(int(valor) + 6) % 7] = total
+    return {"por_hora": por_hora, "por_dia_semana": por_dia}
@@ -6,12 +6,11 @@ from fastapi import (
     File,
     Form,
     status,
-    BackgroundTasks,
 )
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import and_, or_, text
 from typing import List, Dict, Any, Optional
-import pandas as pd
+from lazy_imports import lazy_import
 from datetime import datetime
 import json
 import logging
@@ -21,11 +20,14 @@ import os
 import shutil
 from pathlib import Path
 
-from database_config import get_db
+from case_shards import lectura_entity
+from database_config import get_db, run_db, WRITE_CHUNK_SIZE
 import models
 import schemas
 from dependencies import get_current_active_user, get_current_active_user_required
 
+pd = lazy_import("pandas")
+
 # Directorio de uploads (usar el mismo que en main.py)
 UPLOADS_DIR = Path("uploads")
 
@@ -39,6 +41,13 @@ logger = logging.getLogger(__name__)
 
 # Importar diccionario de tareas compartido
 from shared_state import task_statuses, mark_task_completed
+from job_queue import (
+    KIND_CROSS,
+    KIND_EXTERNAL_IMPORT,
+    PRIORITY_LOW,
+    check_cancelled,
+    job_queue,
+)
 
 
 class ExternalDataTaskInitResponse(schemas.BaseModel):
@@ -60,6 +69,10 @@ async def get_external_data(
     current_user: models.Usuario = Depends(get_current_active_user),
 ):
     """Obtener datos externos de un caso"""
+    return await run_db(_query_external_data, caso_id, skip, limit, db)
+
+
+def _query_external_data(caso_id: int, skip: int, limit: int, db: Session):
     external_data = (
         db.query(models.ExternalData)
         .filter(models.ExternalData.caso_id == caso_id)
@@ -121,7 +134,6 @@ async def delete_external_data(
     status_code=status.HTTP_202_ACCEPTED,
 )
 async def import_external_data(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     caso_id: int = Form(...),
     source_name: str = Form(...),
@@ -193,7 +205,8 @@ async def import_external_data(
         }
 
         # Iniciar procesamiento en segundo plano
-        background_tasks.add_task(
+        job_queue.submit(
+            KIND_EXTERNAL_IMPORT,
             process_external_data_in_background,
             task_id,
             temp_file_path,
@@ -203,6 +216,7 @@ async def import_external_data(
             column_mappings,
             selected_columns,
             current_user.User,
+            task_id=task_id,
         )
 
         logger.info(
@@ -232,6 +246,13 @@ async def cross_with_lpr(
     current_user: models.Usuario = Depends(get_current_active_user),
 ):
     """Cruzar datos externos con lecturas LPR (versión síncrona)"""
+    # El cruce puede tardar segundos: en el pool de hilos de base de datos
+    return await run_db(_query_cross_with_lpr, filters, db)
+
+
+def _query_cross_with_lpr(
+    filters: schemas.ExternalDataSearchFilters, db: Session
+) -> List[schemas.ExternalDataCrossResult]:
     try:
         # Validar que el caso existe
         caso = (
@@ -267,6 +288,9 @@ async def cross_with_lpr(
 
         # PASO 2: Buscar lecturas LPR que coincidan con esas matrículas usando JOIN
         from sqlalchemy import select, distinct
+
+        # Lecturas del caso: la tabla compartida o su shard
+        Lectura = lectura_entity(filters.caso_id)
         
         # Crear subconsulta con las matrículas externas para hacer JOIN
         external_matriculas_list = list(external_matriculas)
@@ -286,43 +310,43 @@ async def cross_with_lpr(
         
         lpr_query = (
             db.query(
-                models.Lectura.ID_Lectura,
-                models.Lectura.Matricula,
-                models.Lectura.Fecha_y_Hora,
-                models.Lectura.ID_Lector,
+                Lectura.ID_Lectura,
+                Lectura.Matricula,
+                Lectura.Fecha_y_Hora,
+                Lectura.ID_Lector,
                 models.Lector.Nombre.label("lector_nombre"),
             )
             .join(
                 models.ArchivoExcel,
-                models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+                Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
             )
             .join(
                 external_matriculas_subquery,
-                models.Lectura.Matricula == external_matriculas_subquery.c.matricula
+                Lectura.Matricula == external_matriculas_subquery.c.matricula
             )
             .outerjoin(
-                models.Lector, models.Lectura.ID_Lector == models.Lector.ID_Lector
+                models.Lector, Lectura.ID_Lector == models.Lector.ID_Lector
             )
             .filter(
                 models.ArchivoExcel.ID_Caso == filters.caso_id
             )
-            .order_by(models.Lectura.Fecha_y_Hora.asc())
+            .order_by(Lectura.Fecha_y_Hora.asc())
         )
 
         # Aplicar filtros adicionales a lecturas LPR
         if filters.matricula:
             lpr_query = lpr_query.filter(
-                models.Lectura.Matricula.ilike(f"%{filters.matricula}%")
+                Lectura.Matricula.ilike(f"%{filters.matricula}%")
             )
 
         if filters.fecha_desde:
             lpr_query = lpr_query.filter(
-                models.Lectura.Fecha_y_Hora >= filters.fecha_desde
+                Lectura.Fecha_y_Hora >= filters.fecha_desde
             )
 
         if filters.fecha_hasta:
             lpr_query = lpr_query.filter(
-                models.Lectura.Fecha_y_Hora <= filters.fecha_hasta
+                Lectura.Fecha_y_Hora <= filters.fecha_hasta
             )
 
         # Ejecutar consulta de lecturas LPR
@@ -373,26 +397,26 @@ async def cross_with_lpr(
             # Obtener UNA lectura LPR para esta matrícula
             lpr_reading = (
                 db.query(
-                    models.Lectura.ID_Lectura,
-                    models.Lectura.Matricula,
-                    models.Lectura.Fecha_y_Hora,
-                    models.Lectura.ID_Lector,
+                    Lectura.ID_Lectura,
+                    Lectura.Matricula,
+                    Lectura.Fecha_y_Hora,
+                    Lectura.ID_Lector,
                     models.Lector.Nombre.label("lector_nombre"),
                 )
                 .join(
                     models.ArchivoExcel,
-                    models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+                    Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
                 )
                 .outerjoin(
-                    models.Lector, models.Lectura.ID_Lector == models.Lector.ID_Lector
+                    models.Lector, Lectura.ID_Lector == models.Lector.ID_Lector
                 )
                 .filter(
                     and_(
                         models.ArchivoExcel.ID_Caso == filters.caso_id,
-                        models.Lectura.Matricula == matricula,
+                        Lectura.Matricula == matricula,
                     )
                 )
-                .order_by(models.Lectura.Fecha_y_Hora.asc())
+                .order_by(Lectura.Fecha_y_Hora.asc())
                 .first()
             )
 
@@ -429,7 +453,6 @@ async def cross_with_lpr(
     status_code=status.HTTP_202_ACCEPTED,
 )
 async def cross_with_lpr_async(
-    background_tasks: BackgroundTasks,
     filters: schemas.ExternalDataSearchFilters,
     db: Session = Depends(get_db),
     current_user: models.Usuario = Depends(get_current_active_user_required),
@@ -457,8 +480,14 @@ async def cross_with_lpr_async(
         }
 
         # Iniciar procesamiento en segundo plano
-        background_tasks.add_task(
-            process_cross_data_in_background, task_id, filters.dict(), current_user.User
+        job_queue.submit(
+            KIND_CROSS,
+            process_cross_data_in_background,
+            task_id,
+            filters.dict(),
+            current_user.User,
+            task_id=task_id,
+            priority=PRIORITY_LOW,
         )
 
         logger.info(
@@ -488,6 +517,10 @@ async def get_external_sources(
     current_user: models.Usuario = Depends(get_current_active_user),
 ):
     """Obtener fuentes de datos externos disponibles para un caso"""
+    return await run_db(_query_external_sources, caso_id, db)
+
+
+def _query_external_sources(caso_id: int, db: Session):
     # Solo mostrar fuentes que tienen datos activos (no solo nombres históricos)
     sources = (
         db.query(models.ExternalData.source_name)
@@ -524,6 +557,10 @@ async def get_available_fields(
     current_user: models.Usuario = Depends(get_current_active_user),
 ):
     """Obtener campos disponibles en los datos externos"""
+    return await run_db(_query_available_fields, caso_id, source_name, db)
+
+
+def _query_available_fields(caso_id: int, source_name: Optional[str], db: Session):
     query = db.query(models.ExternalData.data_json).filter(
         models.ExternalData.caso_id == caso_id
     )
@@ -648,6 +685,8 @@ def process_external_data_in_background(
         errors = []
 
         for index, row in df.iterrows():
+            if index % 100 == 0:
+                check_cancelled(task_id)
             try:
                 # Actualizar progreso cada 100 filas
                 if index % 100 == 0:
@@ -689,6 +728,9 @@ def process_external_data_in_background(
 
                 db.add(db_external_data)
                 imported_count += 1
+                # Commit por bloques para no retener el escritor toda la importación
+                if imported_count % WRITE_CHUNK_SIZE == 0:
+                    db.commit()
 
             except Exception as e:
                 errors.append(f"Fila {index + 1}: {str(e)}")
@@ -896,6 +938,9 @@ def process_cross_data_in_background(task_id: str, filters_dict: dict, user_id:
         )
 
         from sqlalchemy import select, distinct
+
+        # Lecturas del caso: la tabla compartida o su shard
+        Lectura = lectura_entity(filters.caso_id)
         
         # Crear subconsulta con las matrículas externas para hacer JOIN
         external_matriculas_list = list(external_matriculas)
@@ -931,43 +976,43 @@ def process_cross_data_in_background(task_id: str, filters_dict: dict, user_id:
         # Query para obtener lecturas LPR que coincidan (ordenadas por fecha) usando JOIN
         lpr_query = (
             db.query(
-                models.Lectura.ID_Lectura,
-                models.Lectura.Matricula,
-                models.Lectura.Fecha_y_Hora,
-                models.Lectura.ID_Lector,
+                Lectura.ID_Lectura,
+                Lectura.Matricula,
+                Lectura.Fecha_y_Hora,
+                Lectura.ID_Lector,
                 models.Lector.Nombre.label("lector_nombre"),
             )
             .join(
                 models.ArchivoExcel,
-                models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+                Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
             )
             .join(
                 external_matriculas_subquery,
-                models.Lectura.Matricula == external_matriculas_subquery.c.matricula
+                Lectura.Matricula == external_matriculas_subquery.c.matricula
             )
             .outerjoin(
-                models.Lector, models.Lectura.ID_Lector == models.Lector.ID_Lector
+                models.Lector, Lectura.ID_Lector == models.Lector.ID_Lector
             )
             .filter(
                 models.ArchivoExcel.ID_Caso == filters.caso_id
             )
-            .order_by(models.Lectura.Fecha_y_Hora.asc())
+            .order_by(Lectura.Fecha_y_Hora.asc())
         )
 
         # Aplicar filtros adicionales a lecturas LPR
         if filters.matricula:
             lpr_query = lpr_query.filter(
-                models.Lectura.Matricula.ilike(f"%{filters.matricula}%")
+                Lectura.Matricula.ilike(f"%{filters.matricula}%")
             )
 
         if filters.fecha_desde:
             lpr_query = lpr_query.filter(
-                models.Lectura.Fecha_y_Hora >= filters.fecha_desde
+                Lectura.Fecha_y_Hora >= filters.fecha_desde
             )
 
         if filters.fecha_hasta:
             lpr_query = lpr_query.filter(
-                models.Lectura.Fecha_y_Hora <= filters.fecha_hasta
+                Lectura.Fecha_y_Hora <= filters.fecha_hasta
             )
 
         # Ejecutar consulta de lecturas LPR
@@ -1028,6 +1073,8 @@ def process_cross_data_in_background(task_id: str, filters_dict: dict, user_id:
 
         # Crear UNA coincidencia por matrícula (sin bucles complejos)
         for i, matricula in enumerate(coincident_matriculas):
+            if i % 50 == 0:
+                check_cancelled(task_id)
             # Obtener UN registro de datos externos para esta matrícula (con filtros)
             external_data_query = db.query(models.ExternalData).filter(
                 and_(
@@ -1058,26 +1105,26 @@ def process_cross_data_in_background(task_id: str, filters_dict: dict, user_id:
             # Obtener UNA lectura LPR para esta matrícula
             lpr_reading = (
                 db.query(
-                    models.Lectura.ID_Lectura,
-                    models.Lectura.Matricula,
-                    models.Lectura.Fecha_y_Hora,
-                    models.Lectura.ID_Lector,
+                    Lectura.ID_Lectura,
+                    Lectura.Matricula,
+                    Lectura.Fecha_y_Hora,
+                    Lectura.ID_Lector,
                     models.Lector.Nombre.label("lector_nombre"),
                 )
                 .join(
                     models.ArchivoExcel,
-                    models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+                    Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
                 )
                 .outerjoin(
-                    models.Lector, models.Lectura.ID_Lector == models.Lector.ID_Lector
+                    models.Lector, Lectura.ID_Lector == models.Lector.ID_Lector
                 )
                 .filter(
                     and_(
                         models.ArchivoExcel.ID_Caso == filters.caso_id,
-                        models.Lectura.Matricula == matricula,
+                        Lectura.Matricula == matricula,
                     )
                 )
-                .order_by(models.Lectura.Fecha_y_Hora.asc())
+                .order_by(Lectura.Fecha_y_Hora.asc())
                 .first()
             )
 
@@ -1,13 +1,34 @@
-import pandas as pd
+# Las anotaciones con pd.DataFrame no deben cargar pandas al importar
+from __future__ import annotations
+
 import numpy as np
-from sklearn.cluster import DBSCAN
 from datetime import datetime, timedelta
 from fastapi import APIRouter, HTTPException
-from typing import List, Dict, Any
+from typing import TYPE_CHECKING, List, Dict, Any
 from pydantic import BaseModel
 
+from lazy_imports import lazy_import
+
+if TYPE_CHECKING:
+    import pandas as pd
+else:
+    # pandas y scikit-learn sólo se cargan con el primer análisis
+    pd = lazy_import("pandas")
+
 router = APIRouter(tags=["GPS Analysis"])
 
+# Radio medio de la Tierra en metros (para la métrica haversine)
+RADIO_TIERRA_M = 6371008.8
+METROS_POR_GRADO = 111320.0
+
+# Radios de agrupación en metros (antes 0.0005 y 0.0018 grados)
+EPS_PARADAS_M = 55.0
+EPS_ZONAS_M = 200.0
+
+# Tamaño de celda del pre-agrupado en rejilla, como fracción del eps.
+# Con eps/4 el error introducido por la celda es muy inferior al radio.
+FRACCION_CELDA_EPS = 0.25
+
 
 class GpsLectura(BaseModel):
     ID_Lectura: int
@@ -23,216 +44,270 @@ class AnalisisRequest(BaseModel):
     lecturas: List[GpsLectura]
 
 
-def encontrar_lugares_frecuentes(
-    df: pd.DataFrame, min_tiempo_parada: int = 5
-) -> List[Dict[str, Any]]:
-    """
-    Encuentra lugares donde el vehículo se detiene frecuentemente.
-    min_tiempo_parada: tiempo mínimo en minutos para considerar una parada
+def haversine_m(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Distancia haversine vectorizada en metros entre arrays de coordenadas."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2.0) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    )
+    distancias: np.ndarray = (
+        2.0 * RADIO_TIERRA_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    )
+    return distancias
+
+
+def _prebucketizar(
+    lat: np.ndarray, lon: np.ndarray, celda_m: float
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """
-    # Convertir a datetime si no lo está
-    df["Fecha_y_Hora"] = pd.to_datetime(df["Fecha_y_Hora"])
+    Agrupa los puntos en celdas de ~celda_m metros antes del clustering.
 
-    # Ordenar por fecha
-    df = df.sort_values("Fecha_y_Hora")
+    Devuelve los centroides de cada celda (lat, lon), el número de puntos
+    por celda y, para cada punto original, el índice de su celda.
+    """
+    dlat = celda_m / METROS_POR_GRADO
+    fila = np.floor(lat / dlat).astype(np.int64)
+    # El ancho en longitud depende de la latitud de la fila de la rejilla
+    cos_fila = np.maximum(np.cos(np.radians((fila + 0.5) * dlat)), 1e-6)
+    columna = np.floor(lon * cos_fila * METROS_POR_GRADO / celda_m).astype(np.int64)
+
+    # Clave entera única por celda: np.unique 1-D es mucho más rápido que axis=0
+    celdas = (fila << 32) + columna
+    _, inversa, pesos = np.unique(celdas, return_inverse=True, return_counts=True)
+    inversa = inversa.ravel()
+    centro_lat = np.bincount(inversa, weights=lat) / pesos
+    centro_lon = np.bincount(inversa, weights=lon) / pesos
+    return centro_lat, centro_lon, pesos, inversa
+
+
+def agrupar_puntos(
+    lat: np.ndarray, lon: np.ndarray, eps_m: float, min_samples: int
+) -> np.ndarray:
+    """
+    Ejecuta DBSCAN con métrica haversine sobre un BallTree.
 
-    # Calcular tiempo entre lecturas consecutivas
-    df["tiempo_detenido"] = df["Fecha_y_Hora"].diff().dt.total_seconds() / 60
+    Los puntos se pre-agrupan en una rejilla métrica y cada celda entra en
+    DBSCAN con su número de puntos como peso, de modo que el coste depende
+    del número de celdas ocupadas y no del número de lecturas.
+    Devuelve la etiqueta de cluster de cada punto original (-1 = ruido).
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    if len(lat) == 0:
+        return np.empty(0, dtype=np.int64)
 
-    # Identificar paradas (velocidad baja y tiempo significativo)
-    velocidad = df["Velocidad"].fillna(0).astype(float)
-    paradas = df[
-        (velocidad < 5) & (df["tiempo_detenido"] >= min_tiempo_parada)
-    ].copy()  # Usar .copy() para evitar SettingWithCopyWarning
-
-    # Agrupar paradas cercanas usando DBSCAN
-    coords = paradas[["Coordenada_Y", "Coordenada_X"]].values
-    if len(coords) < 2:
+    centro_lat, centro_lon, pesos, inversa = _prebucketizar(
+        lat, lon, eps_m * FRACCION_CELDA_EPS
+    )
+    from sklearn.cluster import DBSCAN
+
+    coords = np.radians(np.column_stack([centro_lat, centro_lon]))
+    clustering = DBSCAN(
+        eps=eps_m / RADIO_TIERRA_M,
+        min_samples=min_samples,
+        metric="haversine",
+        algorithm="ball_tree",
+        n_jobs=-1,
+    ).fit(coords, sample_weight=pesos)
+    etiquetas: np.ndarray = clustering.labels_[inversa]
+    return etiquetas
+
+
+def resumir_clusters(
+    lat: np.ndarray, lon: np.ndarray, etiquetas: np.ndarray, limite: int = 5
+) -> List[Dict[str, Any]]:
+    """Centro y frecuencia de cada cluster, ordenados por frecuencia."""
+    validos = etiquetas >= 0
+    if not validos.any():
         return []
+    etiquetas = etiquetas[validos]
+    frecuencia = np.bincount(etiquetas)
+    presentes = np.nonzero(frecuencia)[0]
+    suma_lat = np.bincount(etiquetas, weights=np.asarray(lat)[validos])
+    suma_lon = np.bincount(etiquetas, weights=np.asarray(lon)[validos])
+
+    resultados = [
+        {
+            "lat": float(suma_lat[c] / frecuencia[c]),
+            "lon": float(suma_lon[c] / frecuencia[c]),
+            "frecuencia": int(frecuencia[c]),
+        }
+        for c in presentes
+    ]
+    return sorted(resultados, key=lambda x: x["frecuencia"], reverse=True)[:limite]
 
-    clustering = DBSCAN(eps=0.0005, min_samples=2).fit(coords)
-    paradas.loc[:, "cluster"] = clustering.labels_  # Usar .loc para asignación segura
 
-    # Analizar cada cluster
-    lugares_frecuentes = []
-    for cluster in sorted(paradas[paradas["cluster"] >= 0]["cluster"].unique()):
-        cluster_points = paradas[paradas["cluster"] == cluster]
-        center_lat = cluster_points["Coordenada_Y"].mean()
-        center_lon = cluster_points["Coordenada_X"].mean()
+def preparar_traza(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Preprocesado común a todos los análisis, ejecutado una sola vez.
 
-        lugares_frecuentes.append(
-            {
-                "lat": float(center_lat),
-                "lon": float(center_lon),
-                "frecuencia": len(cluster_points),
-            }
-        )
+    Convierte tipos, descarta coordenadas inválidas, ordena por fecha y
+    calcula los intervalos de tiempo, la velocidad normalizada, la marca de
+    parada y la hora/día de la semana de cada lectura. Los análisis leen
+    estas columnas directamente, sin copiar ni reordenar el DataFrame.
+    """
+    traza = pd.DataFrame(
+        {
+            "Fecha_y_Hora": pd.to_datetime(df["Fecha_y_Hora"]),
+            "Coordenada_X": pd.to_numeric(df["Coordenada_X"], errors="coerce"),
+            "Coordenada_Y": pd.to_numeric(df["Coordenada_Y"], errors="coerce"),
+            "Velocidad": pd.to_numeric(df["Velocidad"], errors="coerce"),
+        }
+    )
+    traza = traza.dropna(subset=["Fecha_y_Hora", "Coordenada_X", "Coordenada_Y"])
+    traza = traza.sort_values("Fecha_y_Hora", kind="stable", ignore_index=True)
+
+    # Intervalos con la lectura anterior y la siguiente, en segundos
+    delta = traza["Fecha_y_Hora"].diff().dt.total_seconds().to_numpy()
+    traza["segundos_desde_anterior"] = delta
+    traza["segundos_hasta_siguiente"] = (
+        np.append(delta[1:], np.nan) if len(delta) else delta
+    )
+
+    # Velocidad desconocida se trata como parado (criterio histórico)
+    traza["Velocidad"] = traza["Velocidad"].fillna(0).astype(np.float64)
+    traza["es_parada"] = traza["Velocidad"].to_numpy() < 5
 
-    return sorted(lugares_frecuentes, key=lambda x: x["frecuencia"], reverse=True)[:5]
+    fechas = traza["Fecha_y_Hora"].dt
+    traza["hora"] = fechas.hour.astype(np.int8)
+    traza["dia_semana"] = fechas.dayofweek.astype(np.int8)
+    return traza
 
 
-def analizar_actividad_horaria(df: pd.DataFrame) -> List[Dict[str, Any]]:
+def encontrar_lugares_frecuentes(
+    traza: pd.DataFrame, min_tiempo_parada: int = 5
+) -> List[Dict[str, Any]]:
+    """
+    Encuentra lugares donde el vehículo se detiene frecuentemente.
+    min_tiempo_parada: tiempo mínimo en minutos para considerar una parada
+    """
+    # Identificar paradas (velocidad baja y tiempo significativo)
+    minutos_detenido = traza["segundos_desde_anterior"].to_numpy() / 60
+    mascara = traza["es_parada"].to_numpy() & (minutos_detenido >= min_tiempo_parada)
+
+    # Agrupar paradas cercanas (≈55 m) con DBSCAN métrico
+    if mascara.sum() < 2:
+        return []
+
+    lat = traza["Coordenada_Y"].to_numpy()[mascara]
+    lon = traza["Coordenada_X"].to_numpy()[mascara]
+    etiquetas = agrupar_puntos(lat, lon, EPS_PARADAS_M, min_samples=2)
+    return resumir_clusters(lat, lon, etiquetas)
+
+
+def analizar_actividad_horaria(traza: pd.DataFrame) -> List[Dict[str, Any]]:
     """Analiza la actividad por hora del día"""
-    df_copy = df.copy()
-    df_copy["hora"] = pd.to_datetime(df_copy["Fecha_y_Hora"]).dt.hour
-    actividad = df_copy.groupby("hora").size().reset_index(name="frecuencia")
+    frecuencias = np.bincount(traza["hora"].to_numpy(), minlength=24)
     return [
-        {"hora": int(row["hora"]), "frecuencia": int(row["frecuencia"])}
-        for _, row in actividad.iterrows()
+        {"hora": hora, "frecuencia": int(frecuencias[hora])}
+        for hora in np.nonzero(frecuencias)[0].tolist()
     ]
 
 
-def analizar_actividad_semanal(df: pd.DataFrame) -> List[Dict[str, Any]]:
-    """Analiza la actividad por día de la semana"""
-    df_copy = df.copy()
-    df_copy["dia"] = pd.to_datetime(df_copy["Fecha_y_Hora"]).dt.day_name()
-    dias_orden = [
-        "Monday",
-        "Tuesday",
-        "Wednesday",
-        "Thursday",
-        "Friday",
-        "Saturday",
-        "Sunday",
-    ]
-    dias_esp = [
-        "Lunes",
-        "Martes",
-        "Miércoles",
-        "Jueves",
-        "Viernes",
-        "Sábado",
-        "Domingo",
-    ]
-    mapping = dict(zip(dias_orden, dias_esp))
+DIAS_SEMANA = [
+    "Lunes",
+    "Martes",
+    "Miércoles",
+    "Jueves",
+    "Viernes",
+    "Sábado",
+    "Domingo",
+]
+
 
-    actividad = df_copy.groupby("dia").size().reindex(dias_orden).fillna(0)
+def analizar_actividad_semanal(traza: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Analiza la actividad por día de la semana"""
+    frecuencias = np.bincount(traza["dia_semana"].to_numpy(), minlength=7)
     return [
-        {"dia": mapping[dia], "frecuencia": int(freq)}
-        for dia, freq in actividad.items()
+        {"dia": dia, "frecuencia": int(freq)}
+        for dia, freq in zip(DIAS_SEMANA, frecuencias)
     ]
 
 
 def encontrar_puntos_inicio_fin(
-    df: pd.DataFrame,
+    traza: pd.DataFrame,
 ) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
     """Identifica puntos comunes de inicio y fin de trayectos"""
-    df_copy = df.copy()
-    df_copy = df_copy.sort_values("Fecha_y_Hora")
+    lat = traza["Coordenada_Y"].to_numpy()
+    lon = traza["Coordenada_X"].to_numpy()
 
-    # Detectar inicios de trayecto (después de parada prolongada)
-    df_copy["tiempo_desde_anterior"] = (
-        df_copy["Fecha_y_Hora"].diff().dt.total_seconds() / 60
-    )
-    inicios = df_copy[df_copy["tiempo_desde_anterior"] > 30].copy()
-
-    # Detectar fines de trayecto (antes de parada prolongada)
-    df_copy["tiempo_hasta_siguiente"] = (
-        df_copy["Fecha_y_Hora"].diff(-1).dt.total_seconds() / -60
-    )
-    fines = df_copy[df_copy["tiempo_hasta_siguiente"] > 30].copy()
+    # Inicios de trayecto (después de parada prolongada) y fines de
+    # trayecto (antes de parada prolongada)
+    inicios = traza["segundos_desde_anterior"].to_numpy() > 30 * 60
+    fines = traza["segundos_hasta_siguiente"].to_numpy() > 30 * 60
 
     # Agrupar puntos cercanos
-    def procesar_puntos(points_df):
-        if len(points_df) < 2:
+    def procesar_puntos(mascara):
+        if mascara.sum() < 2:
             return []
 
-        coords = points_df[["Coordenada_Y", "Coordenada_X"]].values
-        clustering = DBSCAN(eps=0.0005, min_samples=1).fit(coords)
-        points_df.loc[:, "cluster"] = clustering.labels_
-
-        resultados = []
-        for cluster in sorted(points_df[points_df["cluster"] >= 0]["cluster"].unique()):
-            cluster_points = points_df[points_df["cluster"] == cluster]
-            resultados.append(
-                {
-                    "lat": float(cluster_points["Coordenada_Y"].mean()),
-                    "lon": float(cluster_points["Coordenada_X"].mean()),
-                    "frecuencia": len(cluster_points),
-                }
-            )
-
-        return sorted(resultados, key=lambda x: x["frecuencia"], reverse=True)[:5]
+        etiquetas = agrupar_puntos(
+            lat[mascara], lon[mascara], EPS_PARADAS_M, min_samples=1
+        )
+        return resumir_clusters(lat[mascara], lon[mascara], etiquetas)
 
     return procesar_puntos(inicios), procesar_puntos(fines)
 
 
-def detectar_zonas_frecuentes(df: pd.DataFrame) -> List[Dict[str, Any]]:
+def detectar_zonas_frecuentes(traza: pd.DataFrame) -> List[Dict[str, Any]]:
     """
     Detecta zonas de actividad frecuente de menos de 200m de radio
     con un porcentaje significativo de paradas o tiempo detenido
     """
-    if len(df) < 10:
+    if len(traza) < 10:
         return []
 
-    df_copy = df.copy()
-
-    # Identificar paradas (velocidad < 5 km/h)
-    df_copy["es_parada"] = df_copy["Velocidad"].fillna(0) < 5
-    df_copy["Fecha_y_Hora"] = pd.to_datetime(df_copy["Fecha_y_Hora"])
-    df_copy = df_copy.sort_values("Fecha_y_Hora")
+    # Agrupar con DBSCAN métrico (≈200 m)
+    lat = traza["Coordenada_Y"].to_numpy(dtype=np.float64)
+    lon = traza["Coordenada_X"].to_numpy(dtype=np.float64)
+    etiquetas = agrupar_puntos(lat, lon, EPS_ZONAS_M, min_samples=3)
 
-    # Calcular tiempo entre lecturas consecutivas
-    df_copy["tiempo_siguiente"] = (
-        df_copy["Fecha_y_Hora"].shift(-1) - df_copy["Fecha_y_Hora"]
+    validos = etiquetas >= 0
+    if not validos.any():
+        return []
+    etiquetas_v = etiquetas[validos]
+    lat_v, lon_v = lat[validos], lon[validos]
+    es_parada = traza["es_parada"].to_numpy()[validos]
+    segundos = np.nan_to_num(traza["segundos_hasta_siguiente"].to_numpy())[validos]
+
+    # Agregados por cluster en una sola pasada
+    total_puntos = np.bincount(etiquetas_v)
+    centro_lat = np.bincount(etiquetas_v, weights=lat_v) / np.maximum(total_puntos, 1)
+    centro_lon = np.bincount(etiquetas_v, weights=lon_v) / np.maximum(total_puntos, 1)
+    paradas_en_zona = np.bincount(etiquetas_v, weights=es_parada)
+    tiempo_parado = np.bincount(etiquetas_v, weights=segundos * es_parada) / 60
+
+    # Radio del cluster: distancia máxima (en metros) al centro
+    distancias = haversine_m(
+        lat_v, lon_v, centro_lat[etiquetas_v], centro_lon[etiquetas_v]
     )
-    df_copy["tiempo_siguiente_segundos"] = df_copy[
-        "tiempo_siguiente"
-    ].dt.total_seconds()
-
-    # Preparar datos para clustering
-    coords = df_copy[["Coordenada_Y", "Coordenada_X"]].values
-
-    # Aplicar DBSCAN con eps más restrictivo (≈200m)
-    # 0.0018 grados ≈ 200 metros (1 grado ≈ 111,000 metros)
-    clustering = DBSCAN(eps=0.0018, min_samples=3).fit(coords)
-    df_copy.loc[:, "cluster"] = clustering.labels_
+    radios = np.zeros(len(total_puntos))
+    np.maximum.at(radios, etiquetas_v, distancias)
 
     zonas = []
-    for cluster in sorted(df_copy[df_copy["cluster"] >= 0]["cluster"].unique()):
-        cluster_points = df_copy[df_copy["cluster"] == cluster]
-        center_lat = cluster_points["Coordenada_Y"].mean()
-        center_lon = cluster_points["Coordenada_X"].mean()
-
-        # Calcular radio aproximado del cluster
-        distances = np.sqrt(
-            (cluster_points["Coordenada_Y"] - center_lat) ** 2
-            + (cluster_points["Coordenada_X"] - center_lon) ** 2
-        )
-        radio = float(distances.max() * 111000)  # Convertir a metros (aprox)
+    for cluster in np.nonzero(total_puntos)[0]:
+        radio = float(radios[cluster])
 
         # Filtrar solo zonas de menos de 200 metros
         if radio > 200:
             continue
 
-        # Calcular porcentaje de tiempo parado y número de paradas
-        paradas_en_zona = cluster_points["es_parada"].sum()
-        total_puntos = len(cluster_points)
-        porcentaje_paradas = (
-            (paradas_en_zona / total_puntos * 100) if total_puntos > 0 else 0
-        )
-
-        # Calcular tiempo total parado (aproximado)
-        tiempo_parado = (
-            cluster_points[cluster_points["es_parada"]]["tiempo_siguiente_segundos"]
-            .fillna(0)
-            .sum()
-            / 60
-        )  # en minutos
+        porcentaje_paradas = paradas_en_zona[cluster] / total_puntos[cluster] * 100
 
         # Solo incluir zonas con al menos 20% de paradas O tiempo significativo
-        if porcentaje_paradas < 20 and tiempo_parado < 10:
+        if porcentaje_paradas < 20 and tiempo_parado[cluster] < 10:
             continue
 
         zonas.append(
             {
                 "cluster_id": int(cluster),
-                "lat": float(center_lat),
-                "lon": float(center_lon),
-                "frecuencia": len(cluster_points),
+                "lat": float(centro_lat[cluster]),
+                "lon": float(centro_lon[cluster]),
+                "frecuencia": int(total_puntos[cluster]),
                 "radio": radio,
-                "porcentaje_paradas": round(porcentaje_paradas, 1),
-                "tiempo_parado_minutos": round(tiempo_parado, 1),
+                "porcentaje_paradas": round(float(porcentaje_paradas), 1),
+                "tiempo_parado_minutos": round(float(tiempo_parado[cluster]), 1),
             }
         )
 
@@ -253,35 +328,36 @@ async def realizar_analisis_inteligente(request: AnalisisRequest):
     Realiza un análisis inteligente de los datos GPS proporcionados.
     """
     try:
-        # Convertir datos a DataFrame
-        df = pd.DataFrame([lectura.model_dump() for lectura in request.lecturas])
-        if df.empty:
+        if not request.lecturas:
             raise HTTPException(
                 status_code=400, detail="No se proporcionaron lecturas para analizar"
             )
 
-        df["Fecha_y_Hora"] = pd.to_datetime(df["Fecha_y_Hora"])
-
-        # Asegurarnos de que las columnas numéricas sean del tipo correcto
-        df["Coordenada_X"] = pd.to_numeric(df["Coordenada_X"], errors="coerce")
-        df["Coordenada_Y"] = pd.to_numeric(df["Coordenada_Y"], errors="coerce")
-        df["Velocidad"] = pd.to_numeric(df["Velocidad"], errors="coerce")
-
-        # Eliminar filas con coordenadas inválidas
-        df = df.dropna(subset=["Coordenada_X", "Coordenada_Y"])
+        # Construir el DataFrame por columnas y preprocesarlo una sola vez
+        lecturas = request.lecturas
+        traza = preparar_traza(
+            pd.DataFrame(
+                {
+                    "Fecha_y_Hora": [l.Fecha_y_Hora for l in lecturas],
+                    "Coordenada_X": [l.Coordenada_X for l in lecturas],
+                    "Coordenada_Y": [l.Coordenada_Y for l in lecturas],
+                    "Velocidad": [l.Velocidad for l in lecturas],
+                }
+            )
+        )
 
-        if len(df) < 2:
+        if len(traza) < 2:
             raise HTTPException(
                 status_code=400,
                 detail="No hay suficientes lecturas válidas para analizar",
             )
 
-        # Realizar análisis
-        lugares_frecuentes = encontrar_lugares_frecuentes(df)
-        actividad_horaria = analizar_actividad_horaria(df)
-        actividad_semanal = analizar_actividad_semanal(df)
-        puntos_inicio, puntos_fin = encontrar_puntos_inicio_fin(df)
-        zonas_frecuentes = detectar_zonas_frecuentes(df)
+        # Realizar análisis sobre la traza compartida
+        lugares_frecuentes = encontrar_lugares_frecuentes(traza)
+        actividad_horaria = analizar_actividad_horaria(traza)
+        actividad_semanal = analizar_actividad_semanal(traza)
+        puntos_inicio, puntos_fin = encontrar_puntos_inicio_fin(traza)
+        zonas_frecuentes = detectar_zonas_frecuentes(traza)
 
         return {
             "lugares_frecuentes": lugares_frecuentes,
@@ -0,0 +1,358 @@
+"""
+Segmentación de trazas GPS en estancias y trayectos.
+
+El motor recorre las lecturas GPS de cada vehículo una sola vez, en orden
+cronológico y con memoria constante: mantiene un punto ancla y acumula las
+lecturas que quedan dentro de un radio del ancla. Si el vehículo permanece
+en ese radio el tiempo mínimo, el grupo se emite como estancia; si no, sus
+lecturas pasan a formar parte del trayecto en curso. Los segmentos se
+guardan por caso y matrícula en la tabla gps_segmentos, de modo que mapas
+y análisis pueden consultarlos sin reprocesar las lecturas en cada petición.
+"""
+
+import logging
+from datetime import datetime
+from itertools import groupby
+from math import asin, cos, radians, sin, sqrt
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+import models
+import schemas
+from case_shards import attach, lectura_entity
+from database_config import SessionLocal, get_db
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["GPS Trayectos"])
+
+RADIO_TIERRA_M = 6371008.8
+
+# Parámetros por defecto de la segmentación
+DISTANCIA_ESTANCIA_M = 200.0  # Radio máximo alrededor del ancla
+DURACION_ESTANCIA_S = 10 * 60  # Tiempo mínimo dentro del radio
+HUECO_MAXIMO_S = 30 * 60  # Un hueco mayor con desplazamiento corta el trayecto
+
+INSERT_BATCH_SIZE = 1000
+
+# (ID_Lectura, Fecha_y_Hora, latitud, longitud)
+PuntoGps = Tuple[Optional[int], datetime, float, float]
+
+
+def _haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distancia haversine en metros entre dos puntos"""
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    a = (
+        sin((lat2 - lat1) / 2) ** 2
+        + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * RADIO_TIERRA_M * asin(sqrt(min(a, 1.0)))
+
+
+class _Acumulador:
+    """Estadísticas agregadas de un grupo de puntos consecutivos"""
+
+    __slots__ = (
+        "primero",
+        "ultimo",
+        "num_puntos",
+        "distancia",
+        "suma_lat",
+        "suma_lon",
+        "lat_min",
+        "lat_max",
+        "lon_min",
+        "lon_max",
+    )
+
+    def __init__(self, punto: PuntoGps):
+        _, _, lat, lon = punto
+        self.primero = punto
+        self.ultimo = punto
+        self.num_puntos = 1
+        self.distancia = 0.0
+        self.suma_lat = lat
+        self.suma_lon = lon
+        self.lat_min = self.lat_max = lat
+        self.lon_min = self.lon_max = lon
+
+    def anadir(self, punto: PuntoGps, paso: float):
+        _, _, lat, lon = punto
+        self.ultimo = punto
+        self.num_puntos += 1
+        self.distancia += paso
+        self.suma_lat += lat
+        self.suma_lon += lon
+        self.lat_min = min(self.lat_min, lat)
+        self.lat_max = max(self.lat_max, lat)
+        self.lon_min = min(self.lon_min, lon)
+        self.lon_max = max(self.lon_max, lon)
+
+    def fusionar(self, otro: "_Acumulador", paso: float):
+        """Añade al final los puntos de otro acumulador"""
+        self.ultimo = otro.ultimo
+        self.num_puntos += otro.num_puntos
+        self.distancia += paso + otro.distancia
+        self.suma_lat += otro.suma_lat
+        self.suma_lon += otro.suma_lon
+        self.lat_min = min(self.lat_min, otro.lat_min)
+        self.lat_max = max(self.lat_max, otro.lat_max)
+        self.lon_min = min(self.lon_min, otro.lon_min)
+        self.lon_max = max(self.lon_max, otro.lon_max)
+
+    @property
+    def duracion(self) -> float:
+        return (self.ultimo[1] - self.primero[1]).total_seconds()
+
+    def como_segmento(self, tipo: str) -> Dict[str, Any]:
+        estancia = tipo == "estancia"
+        return {
+            "tipo": tipo,
+            "inicio": self.primero[1],
+            "fin": self.ultimo[1],
+            "duracion_segundos": self.duracion,
+            "distancia_metros": self.distancia,
+            "num_puntos": self.num_puntos,
+            "lat_centro": self.suma_lat / self.num_puntos if estancia else None,
+            "lon_centro": self.suma_lon / self.num_puntos if estancia else None,
+            "lat_inicio": self.primero[2],
+            "lon_inicio": self.primero[3],
+            "lat_fin": self.ultimo[2],
+            "lon_fin": self.ultimo[3],
+            "lat_min": self.lat_min,
+            "lat_max": self.lat_max,
+            "lon_min": self.lon_min,
+            "lon_max": self.lon_max,
+            "id_lectura_inicio": self.primero[0],
+            "id_lectura_fin": self.ultimo[0],
+        }
+
+
+def segmentar_traza(
+    puntos: Iterable[PuntoGps],
+    distancia_m: float = DISTANCIA_ESTANCIA_M,
+    duracion_s: float = DURACION_ESTANCIA_S,
+    hueco_s: float = HUECO_MAXIMO_S,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Divide la traza de un vehículo en estancias y trayectos en una sola pasada.
+
+    Los puntos deben llegar ordenados por fecha. Un trayecto termina en el
+    primer punto de la estancia siguiente y el siguiente trayecto empieza en
+    su último punto, así que los extremos son compartidos. Si entre dos
+    lecturas hay un hueco mayor que hueco_s y el vehículo aparece fuera del
+    radio, el trayecto se corta sin contar la distancia del hueco.
+    """
+    trayecto: Optional[_Acumulador] = None
+    candidato: Optional[_Acumulador] = None
+    paso_entrada = 0.0  # Distancia desde el punto previo al primer punto del candidato
+    anterior: Optional[PuntoGps] = None
+
+    def cerrar_trayecto():
+        nonlocal trayecto
+        segmento = None
+        if trayecto is not None and trayecto.num_puntos >= 2:
+            segmento = trayecto.como_segmento("trayecto")
+        trayecto = None
+        return segmento
+
+    def resolver_candidato():
+        """Emite el candidato como estancia o lo incorpora al trayecto"""
+        nonlocal trayecto
+        if candidato.duracion >= duracion_s:
+            if trayecto is not None:
+                # El trayecto llega hasta el primer punto de la estancia
+                trayecto.anadir(candidato.primero, paso_entrada)
+            segmento_trayecto = cerrar_trayecto()
+            if segmento_trayecto:
+                yield segmento_trayecto
+            yield candidato.como_segmento("estancia")
+            # El siguiente trayecto sale desde el último punto de la estancia
+            trayecto = _Acumulador(candidato.ultimo)
+        elif trayecto is None:
+            trayecto = candidato
+        else:
+            trayecto.fusionar(candidato, paso_entrada)
+
+    for punto in puntos:
+        if candidato is None or anterior is None:
+            candidato = _Acumulador(punto)
+            anterior = punto
+            continue
+
+        _, fecha, lat, lon = punto
+        _, _, lat_ancla, lon_ancla = candidato.primero
+        _, fecha_ant, lat_ant, lon_ant = anterior
+        paso = _haversine(lat_ant, lon_ant, lat, lon)
+
+        if _haversine(lat_ancla, lon_ancla, lat, lon) <= distancia_m:
+            candidato.anadir(punto, paso)
+        else:
+            yield from resolver_candidato()
+            if (fecha - fecha_ant).total_seconds() > hueco_s:
+                # Desplazamiento no observado: no se une a través del hueco
+                segmento_trayecto = cerrar_trayecto()
+                if segmento_trayecto:
+                    yield segmento_trayecto
+                paso = 0.0
+            candidato = _Acumulador(punto)
+            paso_entrada = paso
+        anterior = punto
+
+    if candidato is not None:
+        yield from resolver_candidato()
+        segmento_trayecto = cerrar_trayecto()
+        if segmento_trayecto:
+            yield segmento_trayecto
+
+
+def recalcular_segmentos(
+    db: Session,
+    caso_id: int,
+    matriculas: Optional[Iterable[str]] = None,
+    distancia_m: float = DISTANCIA_ESTANCIA_M,
+    duracion_s: float = DURACION_ESTANCIA_S,
+    hueco_s: float = HUECO_MAXIMO_S,
+) -> Dict[str, int]:
+    """
+    Recalcula y guarda los segmentos GPS de un caso.
+
+    Si se indican matrículas, sólo se recalculan esos vehículos. Las lecturas
+    se leen en streaming ordenadas por matrícula y fecha, y los segmentos se
+    insertan por lotes sustituyendo a los anteriores en una única transacción.
+    """
+    filtro_matriculas = sorted(set(matriculas)) if matriculas is not None else None
+
+    # Lecturas de la tabla compartida o del shard del caso
+    Lectura = lectura_entity(caso_id)
+    consulta = (
+        select(
+            Lectura.Matricula,
+            Lectura.ID_Lectura,
+            Lectura.Fecha_y_Hora,
+            Lectura.Coordenada_Y,
+            Lectura.Coordenada_X,
+        )
+        .join(models.ArchivoExcel, Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo)
+        .where(
+            models.ArchivoExcel.ID_Caso == caso_id,
+            Lectura.Tipo_Fuente == "GPS",
+            Lectura.Coordenada_X.isnot(None),
+            Lectura.Coordenada_Y.isnot(None),
+        )
+        .order_by(Lectura.Matricula, Lectura.Fecha_y_Hora)
+    )
+    borrado = delete(models.GpsSegmento).where(models.GpsSegmento.caso_id == caso_id)
+    if filtro_matriculas is not None:
+        consulta = consulta.where(Lectura.Matricula.in_(filtro_matriculas))
+        borrado = borrado.where(models.GpsSegmento.matricula.in_(filtro_matriculas))
+
+    resumen = {"vehiculos": 0, "lecturas_procesadas": 0, "estancias": 0, "trayectos": 0}
+    try:
+        # El shard se adjunta antes de que el borrado abra la transacción
+        attach(db, caso_id)
+        db.execute(borrado)
+        filas = db.execute(consulta.execution_options(yield_per=5000))
+        lote: List[Dict[str, Any]] = []
+
+        for matricula, filas_vehiculo in groupby(filas, key=lambda fila: fila[0]):
+            resumen["vehiculos"] += 1
+
+            def puntos_vehiculo():
+                for _, id_lectura, fecha, lat, lon in filas_vehiculo:
+                    resumen["lecturas_procesadas"] += 1
+                    yield id_lectura, fecha, lat, lon
+
+            for segmento in segmentar_traza(
+                puntos_vehiculo(), distancia_m, duracion_s, hueco_s
+            ):
+                resumen[
+                    "estancias" if segmento["tipo"] == "estancia" else "trayectos"
+                ] += 1
+                lote.append({**segmento, "caso_id": caso_id, "matricula": matricula})
+                if len(lote) >= INSERT_BATCH_SIZE:
+                    db.execute(insert(models.GpsSegmento), lote)
+                    lote = []
+
+        if lote:
+            db.execute(insert(models.GpsSegmento), lote)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    logger.info(
+        f"[Segmentación GPS] Caso {caso_id}: {resumen['vehiculos']} vehículos, "
+        f"{resumen['estancias']} estancias, {resumen['trayectos']} trayectos"
+    )
+    return resumen
+
+
+def recalcular_segmentos_en_segundo_plano(
+    caso_id: int, matriculas: Optional[Iterable[str]] = None
+):
+    """Versión para tareas en segundo plano: abre y cierra su propia sesión"""
+    db = SessionLocal()
+    try:
+        recalcular_segmentos(db, caso_id, matriculas)
+    except Exception as e:
+        logger.error(
+            f"[Segmentación GPS] Error recalculando segmentos del caso {caso_id}: {e}",
+            exc_info=True,
+        )
+    finally:
+        db.close()
+
+
+@router.post(
+    "/casos/{caso_id}/segmentos/recalcular",
+    response_model=schemas.GpsSegmentacionResponse,
+)
+def recalcular_segmentos_caso(
+    caso_id: int,
+    matricula: Optional[str] = Query(None),
+    distancia_m: float = Query(DISTANCIA_ESTANCIA_M, gt=0),
+    duracion_min: float = Query(DURACION_ESTANCIA_S / 60, gt=0),
+    hueco_min: float = Query(HUECO_MAXIMO_S / 60, gt=0),
+    db: Session = Depends(get_db),
+):
+    """Recalcula las estancias y trayectos GPS de un caso (o de una matrícula)"""
+    caso = db.query(models.Caso).filter(models.Caso.ID_Caso == caso_id).first()
+    if not caso:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Caso con ID {caso_id} no encontrado",
+        )
+    return recalcular_segmentos(
+        db,
+        caso_id,
+        matriculas=[matricula] if matricula else None,
+        distancia_m=distancia_m,
+        duracion_s=duracion_min * 60,
+        hueco_s=hueco_min * 60,
+    )
+
+
+@router.get("/casos/{caso_id}/segmentos", response_model=List[schemas.GpsSegmentoOut])
+def get_segmentos_caso(
+    caso_id: int,
+    matricula: Optional[str] = Query(None),
+    tipo: Optional[str] = Query(None, pattern="^(estancia|trayecto)$"),
+    fecha_inicio: Optional[datetime] = Query(None),
+    fecha_fin: Optional[datetime] = Query(None),
+    db: Session = Depends(get_db),
+):
+    """Devuelve las estancias y trayectos GPS ya calculados de un caso"""
+    query = db.query(models.GpsSegmento).filter(models.GpsSegmento.caso_id == caso_id)
+    if matricula:
+        query = query.filter(models.GpsSegmento.matricula == matricula)
+    if tipo:
+        query = query.filter(models.GpsSegmento.tipo == tipo)
+    if fecha_inicio:
+        query = query.filter(models.GpsSegmento.fin >= fecha_inicio)
+    if fecha_fin:
+        query = query.filter(models.GpsSegmento.inicio <= fecha_fin)
+    return query.order_by(models.GpsSegmento.matricula, models.GpsSegmento.inicio).all()
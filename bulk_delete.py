@@ -0,0 +1,493 @@
+"""
+Borrado masivo de casos y archivos
+
+Eliminar un caso grande con el ORM cargaba cada lectura para aplicar la
+cascada y, con `PRAGMA secure_delete=ON`, SQLite sobrescribía con ceros cada
+página liberada: el borrado tardaba mucho y retenía el escritor todo el
+tiempo. Aquí se borra con sentencias DELETE de Core en lotes de
+DELETE_BATCH_SIZE lecturas, cada uno en su propia transacción, desde la cola
+de trabajos y con el progreso en `task_statuses`.
+
+El borrado seguro tiene su propia política (ATRIO_SECURE_DELETE):
+
+- "vacuum" (por defecto): los lotes se borran sin sobrescribir páginas y al
+  terminar se encola un mantenimiento con VACUUM, que reescribe el archivo
+  sin las páginas liberadas;
+- "fast": `secure_delete=FAST`, sobrescribe sólo lo que no cuesta E/S extra;
+- "on": sobrescribe todas las páginas, como el resto de conexiones.
+
+Cada lote incrementa la versión de datos del caso, así que el cache nunca
+sirve agregados con lecturas ya borradas. Al borrar un archivo GPS se
+recalculan las estancias y trayectos de sus vehículos.
+
+Si el caso guarda sus lecturas en un shard (case_shards), borrar el caso es
+borrar su archivo; con la política "on" antes se borran sus filas para que
+SQLite sobrescriba las páginas.
+"""
+
+import datetime
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, Union, cast
+
+from sqlalchemy import and_, delete, func, select
+from sqlalchemy.orm import Session
+
+import analytics
+import models
+from backend.routers.gps_trayectos import recalcular_segmentos
+from cache_manager import cache_manager
+from case_shards import drop_shard, is_sharded, shard_table
+from database_config import SessionLocal
+from job_queue import (
+    KIND_DELETE,
+    JobCancelled,
+    check_cancelled,
+    in_api_process,
+    job_queue,
+)
+from optimizations import request_vacuum
+from shared_state import mark_task_completed, task_statuses
+from version_datos import incrementar_version_caso, olvidar_version_caso
+
+logger = logging.getLogger("atrio.bulk_delete")
+
+DELETE_BATCH_SIZE = int(os.environ.get("ATRIO_DELETE_BATCH_SIZE", 5000))
+
+SECURE_DELETE_VACUUM = "vacuum"
+SECURE_DELETE_FAST = "fast"
+SECURE_DELETE_ON = "on"
+SECURE_DELETE_POLICY = os.environ.get("ATRIO_SECURE_DELETE", SECURE_DELETE_VACUUM)
+
+# Valor de PRAGMA secure_delete durante los lotes según la política
+_SECURE_DELETE_PRAGMA = {
+    SECURE_DELETE_VACUUM: "OFF",
+    SECURE_DELETE_FAST: "FAST",
+    SECURE_DELETE_ON: "ON",
+}
+# El que fija set_sqlite_pragma en todas las conexiones del escritor
+_SECURE_DELETE_DEFAULT = "ON"
+
+DELETE_STAGE = "bulk_delete"
+
+UPLOADS_DIR = Path(__file__).resolve().parent / "uploads"
+
+# Tablas del caso que no dependen de sus archivos
+_CASO_TABLES: Tuple[
+    Type[
+        Union[
+            models.SavedSearch,
+            models.GpsCapa,
+            models.LocalizacionInteres,
+            models.MapaGuardado,
+        ]
+    ],
+    ...,
+] = (
+    models.SavedSearch,
+    models.GpsCapa,
+    models.LocalizacionInteres,
+    models.MapaGuardado,
+)
+
+
+def new_delete_task(objeto: str, objeto_id: int) -> str:
+    """Crea la entrada de la tarea de borrado en `task_statuses`"""
+    task_id = f"delete-{objeto}-{objeto_id}-{uuid.uuid4().hex[:12]}"
+    task_statuses[task_id] = {
+        "status": "pending",
+        "message": "Borrado en cola",
+        "progress": 0,
+        "stage": DELETE_STAGE,
+    }
+    return task_id
+
+
+@contextmanager
+def _secure_delete(db: Session, policy: str):
+    """Aplica la política de borrado seguro a la transacción en curso"""
+    modo = _SECURE_DELETE_PRAGMA[policy]
+    if modo == _SECURE_DELETE_DEFAULT:
+        yield
+        return
+    # Es un ajuste de la conexión: se restaura antes de devolverla al pool
+    conexion = db.connection()
+    conexion.exec_driver_sql(f"PRAGMA secure_delete={modo}")
+    try:
+        yield
+    finally:
+        conexion.exec_driver_sql(f"PRAGMA secure_delete={_SECURE_DELETE_DEFAULT}")
+
+
+def _delete_in_batches(
+    db: Session,
+    model,
+    id_column,
+    where,
+    caso_id: int,
+    policy: str,
+    on_batch: Callable[[int], None],
+) -> int:
+    """
+    Borra las filas de `model` que cumplen `where` en lotes de
+    DELETE_BATCH_SIZE, con un commit y una nueva versión del caso por lote.
+    """
+    borradas = 0
+    while True:
+        lote = select(id_column).where(where).limit(DELETE_BATCH_SIZE)
+        with _secure_delete(db, policy):
+            resultado = db.execute(
+                delete(model)
+                .where(id_column.in_(lote))
+                .execution_options(synchronize_session=False)
+            )
+            if resultado.rowcount:
+                incrementar_version_caso(db, caso_id)
+        db.commit()
+        if not resultado.rowcount:
+            return borradas
+        borradas += resultado.rowcount
+        on_batch(resultado.rowcount)
+
+
+def _lecturas_table(caso_id: int):
+    """Tabla con las lecturas del caso: la compartida o la de su shard"""
+    return shard_table(caso_id) if is_sharded(caso_id) else models.Lectura.__table__
+
+
+def _delete_relevantes(db: Session, archivos_ids: List[int], caso_id: int, policy: str):
+    """Borra las marcas de relevancia de las lecturas de los archivos"""
+    lecturas = _lecturas_table(caso_id)
+    with _secure_delete(db, policy):
+        db.execute(
+            delete(models.LecturaRelevante)
+            .where(
+                models.LecturaRelevante.ID_Lectura.in_(
+                    select(lecturas.c.ID_Lectura).where(
+                        lecturas.c.ID_Archivo.in_(archivos_ids)
+                    )
+                )
+            )
+            .execution_options(synchronize_session=False)
+        )
+    db.commit()
+
+
+def _delete_lecturas(
+    db: Session,
+    archivos_ids: List[int],
+    caso_id: int,
+    policy: str,
+    on_batch: Callable[[int], None],
+) -> int:
+    """Borra las lecturas de los archivos y sus marcas de relevancia"""
+    if not archivos_ids:
+        return 0
+    lecturas = _lecturas_table(caso_id)
+    de_los_archivos = lecturas.c.ID_Archivo.in_(archivos_ids)
+    _delete_relevantes(db, archivos_ids, caso_id, policy)
+    return _delete_in_batches(
+        db,
+        lecturas,
+        lecturas.c.ID_Lectura,
+        de_los_archivos,
+        caso_id,
+        policy,
+        on_batch,
+    )
+
+
+def _delete_lecturas_caso(
+    db: Session,
+    archivos_ids: List[int],
+    caso_id: int,
+    policy: str,
+    progreso: "_Progress",
+) -> int:
+    """Borra las lecturas de un caso; con shard, borrando su archivo"""
+    if not is_sharded(caso_id):
+        return _delete_lecturas(db, archivos_ids, caso_id, policy, progreso)
+    borradas = 0
+    if policy == SECURE_DELETE_ON:
+        borradas = _delete_lecturas(db, archivos_ids, caso_id, policy, progreso)
+    else:
+        # Las marcas de relevancia están en atrio.db, no en el shard
+        _delete_relevantes(db, archivos_ids, caso_id, policy)
+    if not drop_shard(caso_id):
+        # Otra conexión lo tiene abierto y el sistema no deja borrarlo
+        return borradas + _delete_lecturas(db, archivos_ids, caso_id, policy, progreso)
+    restantes = progreso.total - borradas
+    if restantes:
+        incrementar_version_caso(db, caso_id)
+        db.commit()
+        progreso(restantes)
+    return borradas + restantes
+
+
+def _remove_file(caso_id: int, nombre: Optional[str]):
+    """Elimina el archivo subido de la carpeta del caso, si existe"""
+    if not nombre:
+        return
+    ruta = UPLOADS_DIR / f"Caso{caso_id}" / nombre
+    try:
+        if ruta.is_file():
+            ruta.unlink()
+            logger.info(f"Archivo físico eliminado: {ruta}")
+    except OSError as e:
+        logger.error(f"Error eliminando el archivo físico {ruta}: {e}")
+
+
+class _Progress:
+    """Progreso de un borrado en `task_statuses`"""
+
+    def __init__(self, task_id: str, total: int):
+        self.task_id = task_id
+        self.total = total
+        self.borradas = 0
+        self.estado = task_statuses.setdefault(task_id, {})
+        self.estado.update(
+            status="processing",
+            message="Borrando lecturas...",
+            progress=0,
+            total=total,
+            stage=DELETE_STAGE,
+        )
+
+    def __call__(self, filas: int):
+        self.borradas += filas
+        self.estado["message"] = f"Borradas {self.borradas} de {self.total} lecturas"
+        if self.total:
+            self.estado["progress"] = min(self.borradas / self.total, 1) * 95
+        check_cancelled(self.task_id)
+
+    def completed(self, message: str, result: Dict[str, Any]):
+        self.estado.update(
+            status="completed",
+            message=message,
+            progress=100,
+            result=result,
+            stage=None,
+        )
+        mark_task_completed(self.task_id)
+
+    def failed(self, message: str):
+        self.estado.update(status="failed", message=message, stage=None)
+
+
+def _count_lecturas(db: Session, caso_id: int, archivos_ids: List[int]) -> int:
+    if not archivos_ids:
+        return 0
+    lecturas = _lecturas_table(caso_id)
+    return (
+        db.scalar(
+            select(func.count())
+            .select_from(lecturas)
+            .where(lecturas.c.ID_Archivo.in_(archivos_ids))
+        )
+        or 0
+    )
+
+
+def run_delete_caso(
+    task_id: str,
+    caso_id: int,
+    policy: str = SECURE_DELETE_POLICY,
+    session_factory: Callable[[], Session] = SessionLocal,
+) -> Dict[str, Any]:
+    """
+    Borra un caso con sus archivos, lecturas, datos externos, segmentos GPS
+    y demás datos asociados. Se ejecuta en la cola de trabajos y se puede
+    cancelar entre lotes; lo ya borrado no se restaura.
+    """
+    inicio = time.perf_counter()
+    db = session_factory()
+    progreso = None
+    try:
+        archivos = db.execute(
+            select(
+                models.ArchivoExcel.ID_Archivo, models.ArchivoExcel.Nombre_del_Archivo
+            ).where(models.ArchivoExcel.ID_Caso == caso_id)
+        ).all()
+        archivos_ids = [a.ID_Archivo for a in archivos]
+        progreso = _Progress(task_id, _count_lecturas(db, caso_id, archivos_ids))
+
+        resumen: Dict[str, Any] = {
+            "lecturas": _delete_lecturas_caso(
+                db, archivos_ids, caso_id, policy, progreso
+            )
+        }
+        progreso.estado["message"] = "Borrando datos externos..."
+        resumen["external_data"] = _delete_in_batches(
+            db,
+            models.ExternalData,
+            models.ExternalData.id,
+            models.ExternalData.caso_id == caso_id,
+            caso_id,
+            policy,
+            lambda filas: check_cancelled(task_id),
+        )
+
+        # El resto son pocas filas: una única transacción con el caso
+        check_cancelled(task_id)
+        with _secure_delete(db, policy):
+            db.execute(
+                delete(models.GpsSegmento).where(models.GpsSegmento.caso_id == caso_id)
+            )
+            for modelo in _CASO_TABLES:
+                db.execute(delete(modelo).where(modelo.caso_id == caso_id))
+            db.execute(
+                delete(models.ArchivoExcel).where(
+                    models.ArchivoExcel.ID_Caso == caso_id
+                )
+            )
+            db.execute(delete(models.Caso).where(models.Caso.ID_Caso == caso_id))
+        db.commit()
+        olvidar_version_caso(caso_id)
+        in_api_process(cache_manager.invalidate_caso, caso_id)
+        analytics.drop_snapshots(caso_id)
+        for archivo in archivos:
+            _remove_file(caso_id, archivo.Nombre_del_Archivo)
+    except JobCancelled:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.error(
+            f"[Task {task_id}] Error borrando el caso {caso_id}: {e}", exc_info=True
+        )
+        if progreso is not None:
+            progreso.failed(f"Error borrando el caso: {e}")
+        raise
+    finally:
+        db.close()
+
+    resumen["archivos"] = len(archivos)
+    resumen["seconds"] = round(time.perf_counter() - inicio, 3)
+    logger.info(f"[Task {task_id}] Caso {caso_id} borrado: {resumen}")
+    progreso.completed(f"Caso {caso_id} eliminado", resumen)
+    return resumen
+
+
+def run_delete_archivo(
+    task_id: str,
+    id_archivo: int,
+    policy: str = SECURE_DELETE_POLICY,
+    session_factory: Callable[[], Session] = SessionLocal,
+) -> Dict[str, Any]:
+    """
+    Borra un archivo importado con sus lecturas (y, si es EXTERNO, los datos
+    externos importados ese día) y recalcula los segmentos GPS afectados.
+    """
+    inicio = time.perf_counter()
+    db = session_factory()
+    progreso = None
+    try:
+        archivo = db.get(models.ArchivoExcel, id_archivo)
+        if archivo is None:
+            progreso = _Progress(task_id, 0)
+            progreso.completed(f"Archivo {id_archivo} ya eliminado", {"lecturas": 0})
+            return {"lecturas": 0}
+        caso_id = cast(int, archivo.ID_Caso)
+        nombre = cast(str, archivo.Nombre_del_Archivo)
+        progreso = _Progress(task_id, _count_lecturas(db, caso_id, [id_archivo]))
+
+        # Vehículos GPS afectados, para recalcular sus estancias y trayectos
+        matriculas_gps = []
+        if archivo.Tipo_de_Archivo == "GPS":
+            lecturas = _lecturas_table(caso_id)
+            matriculas_gps = list(
+                db.scalars(
+                    select(lecturas.c.Matricula)
+                    .where(lecturas.c.ID_Archivo == id_archivo)
+                    .distinct()
+                )
+            )
+
+        resumen: Dict[str, Any] = {
+            "lecturas": _delete_lecturas(db, [id_archivo], caso_id, policy, progreso)
+        }
+        resumen["external_data"] = 0
+        if archivo.Tipo_de_Archivo == "EXTERNO":
+            # No hay relación directa: los datos externos del caso importados
+            # el mismo día que el archivo
+            dia = cast(datetime.date, archivo.Fecha_de_Importacion)
+            resumen["external_data"] = _delete_in_batches(
+                db,
+                models.ExternalData,
+                models.ExternalData.id,
+                and_(
+                    models.ExternalData.caso_id == caso_id,
+                    models.ExternalData.import_date
+                    >= datetime.datetime.combine(dia, datetime.time.min),
+                    models.ExternalData.import_date
+                    <= datetime.datetime.combine(dia, datetime.time.max),
+                ),
+                caso_id,
+                policy,
+                lambda filas: check_cancelled(task_id),
+            )
+
+        check_cancelled(task_id)
+        db.execute(
+            delete(models.ArchivoExcel).where(
+                models.ArchivoExcel.ID_Archivo == id_archivo
+            )
+        )
+        incrementar_version_caso(db, caso_id)
+        db.commit()
+        in_api_process(cache_manager.invalidate_archivo, id_archivo, caso_id)
+        _remove_file(caso_id, nombre)
+
+        if matriculas_gps:
+            progreso.estado["message"] = "Recalculando estancias y trayectos..."
+            recalcular_segmentos(db, caso_id, matriculas_gps)
+    except JobCancelled:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.error(
+            f"[Task {task_id}] Error borrando el archivo {id_archivo}: {e}",
+            exc_info=True,
+        )
+        if progreso is not None:
+            progreso.failed(f"Error borrando el archivo: {e}")
+        raise
+    finally:
+        db.close()
+
+    resumen["seconds"] = round(time.perf_counter() - inicio, 3)
+    logger.info(f"[Task {task_id}] Archivo {id_archivo} borrado: {resumen}")
+    progreso.completed(f"Archivo {id_archivo} eliminado", resumen)
+    return resumen
+
+
+def _vacuum_after(future: Future):
+    """Con la política "vacuum", encola el VACUUM cuando termina el borrado"""
+    if not future.cancelled() and future.exception() is None:
+        request_vacuum()
+
+
+def _submit(run: Callable, objeto: str, objeto_id: int, policy: str) -> str:
+    task_id = new_delete_task(objeto, objeto_id)
+    future = job_queue.submit(
+        KIND_DELETE, run, task_id, objeto_id, policy, task_id=task_id
+    )
+    if policy == SECURE_DELETE_VACUUM:
+        future.add_done_callback(_vacuum_after)
+    return task_id
+
+
+def submit_delete_caso(caso_id: int, policy: str = SECURE_DELETE_POLICY) -> str:
+    """Encola el borrado de un caso y devuelve el ID de la tarea"""
+    return _submit(run_delete_caso, "caso", caso_id, policy)
+
+
+def submit_delete_archivo(id_archivo: int, policy: str = SECURE_DELETE_POLICY) -> str:
+    """Encola el borrado de un archivo y devuelve el ID de la tarea"""
+    return _submit(run_delete_archivo, "archivo", id_archivo, policy)
@@ -7,21 +7,210 @@ import redis
 import json
 import logging
 import hashlib
-from typing import Any, Optional, Dict, List, Union
-from datetime import datetime, timedelta
+from typing import Any, Callable, Optional, Dict, List, Sequence, Tuple, Union, cast
+from datetime import date, datetime, timedelta
+from enum import Enum
+import inspect
+import os
 import pickle
+from collections import OrderedDict
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
 from functools import wraps
+import threading
 import time
+import uuid
+
+from fastapi import params as fastapi_params
+from pydantic import BaseModel
+
+from cache_serializers import (
+    COMPRESS_MIN_BYTES,
+    COMPRESSION_NAMES,
+    FORMAT_PICKLE,
+    SerializationStats,
+    best_compression,
+    decode,
+    default_serializer,
+    encode,
+    key_prefix,
+)
 
 logger = logging.getLogger(__name__)
 
+# Presupuesto por defecto del cache en proceso
+MEMORY_CACHE_MAX_BYTES = 128 * 1024 * 1024
+# Vida máxima de una entrada en L1 cuando Redis está disponible: acota lo
+# desactualizada que puede quedar respecto a invalidaciones de otros procesos
+L1_TTL = 30
+# Procesos de la API que atienden peticiones (perfil de producción de
+# uvicorn_config); sin Redis cada uno tiene su propio cache
+WEB_WORKERS = int(os.environ.get("ATRIO_WEB_WORKERS", "1"))
+# Coste aproximado de cada entrada además de su clave y su valor
+_ENTRY_OVERHEAD = 96
+# Prefijo de los sets de Redis que agrupan las claves de cada etiqueta
+TAG_PREFIX = "atrio:tag:"
+# Etiqueta de resultados que dependen de todos los casos (totales globales)
+GLOBAL_TAG = "global"
+# Vida mínima de un set de etiqueta: debe superar el TTL de sus claves
+TAG_SET_TTL = 24 * 3600
+# Claves borradas por llamada al recorrer Redis con SCAN/SSCAN
+SCAN_BATCH = 500
+# Cerrojos de cálculo único (single-flight) entre procesos
+LOCK_PREFIX = "atrio:lock:"
+# Vida del cerrojo: si quien calcula muere, otro proceso toma el relevo
+SINGLE_FLIGHT_LOCK_TTL = 120
+# Espera máxima por el resultado de otro cálculo antes de calcular en paralelo
+SINGLE_FLIGHT_WAIT = 60
+# Marca de las entradas guardadas con stale-while-revalidate
+FRESH_UNTIL = "__fresh_until__"
+# Libera el cerrojo sólo si sigue siendo de quien lo tomó
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class MemoryLRUCache:
+    """
+    Cache en proceso acotado por tamaño en bytes, con expiración y LRU
+
+    Guarda los valores ya serializados, de modo que el tamaño es exacto y
+    quien lee recibe siempre una copia, igual que con Redis.
+    """
+
+    def __init__(self, max_bytes: int = MEMORY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        # clave -> (datos, caducidad, tamaño, etiquetas)
+        self._entries: "OrderedDict[str, Tuple[bytes, float, int, Tuple[str, ...]]]" = (
+            OrderedDict()
+        )
+        self._tags: Dict[str, set] = {}
+        self._size = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _entry_size(key: str, data: bytes) -> int:
+        return len(key) + len(data) + _ENTRY_OVERHEAD
+
+    def _remove(self, key: str):
+        _, _, size, tags = self._entries.pop(key)
+        self._size -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            data, expires_at, _, _ = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def set(self, key: str, data: bytes, ttl: float, tags: Sequence[str] = ()) -> bool:
+        size = self._entry_size(key, data)
+        if size > self.max_bytes or ttl <= 0:
+            self.delete(key)
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            tags = tuple(tags)
+            self._entries[key] = (data, time.monotonic() + ttl, size, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            self._size += size
+            if self._size > self.max_bytes:
+                self._make_room()
+            return True
+
+    def _make_room(self):
+        """Descarta primero lo expirado y después lo menos usado"""
+        now = time.monotonic()
+        for key in [k for k, entry in self._entries.items() if entry[1] <= now]:
+            self._remove(key)
+            self.expirations += 1
+        while self._size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            return True
+
+    def clear_pattern(self, pattern: str) -> int:
+        """Elimina las claves que coinciden con un patrón estilo Redis (glob)"""
+        with self._lock:
+            keys = [k for k in self._entries if fnmatchcase(k, pattern)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def invalidate_tag(self, tag: str) -> int:
+        """Elimina las entradas registradas bajo una etiqueta"""
+        with self._lock:
+            keys = list(self._tags.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
 
 class CacheManager:
     """
     Gestor de cache distribuido usando Redis para optimizar el rendimiento de ATRiO
     """
 
-    def __init__(self, host="localhost", port=6379, db=0, password=None):
+    def __init__(
+        self,
+        host="localhost",
+        port=6379,
+        db=0,
+        password=None,
+        memory_max_bytes: int = MEMORY_CACHE_MAX_BYTES,
+        l1_ttl: Optional[int] = L1_TTL,
+        serializer=None,
+        compression: Optional[bytes] = None,
+        compress_min_bytes: int = COMPRESS_MIN_BYTES,
+        web_workers: int = WEB_WORKERS,
+    ):
         """
         Inicializa el gestor de cache
 
@@ -30,14 +219,41 @@ class CacheManager:
             port: Puerto de Redis
             db: Base de datos de Redis
             password: Contraseña de Redis (opcional)
+            memory_max_bytes: Presupuesto en bytes del cache en proceso
+            l1_ttl: Vida máxima en L1 delante de Redis (None o 0 lo desactiva)
+            serializer: Serializador de valores (por defecto orjson si está
+                instalado, o pickle)
+            compression: Compresor para valores grandes (b"s" zstd, b"l" lz4,
+                b"z" zlib, b"-" ninguno; por defecto el mejor disponible)
+            compress_min_bytes: Tamaño a partir del cual se comprime
+            web_workers: Procesos de la API; con más de uno y sin Redis las
+                entradas viven como mucho `l1_ttl` segundos, porque las
+                invalidaciones de un proceso no llegan a los demás
         """
+        self.memory_cache = MemoryLRUCache(memory_max_bytes)
+        self.l1_ttl = l1_ttl or 0
+        self.web_workers = web_workers
+        self._fallback_max_ttl = None
+        self.serializer = serializer or default_serializer()
+        self.compression = compression or best_compression()
+        self.compress_min_bytes = compress_min_bytes
+        self.serialization_stats = SerializationStats()
+        # Cerrojos en proceso por clave para el cálculo único
+        self._flights: Dict[str, List] = {}
+        self._flights_guard = threading.Lock()
+        self.flight_stats = {
+            "computations": 0,
+            "coalesced": 0,
+            "stale_served": 0,
+            "wait_timeouts": 0,
+        }
         try:
             self.redis_client = redis.Redis(
                 host=host,
                 port=port,
                 db=db,
                 password=password,
-                decode_responses=False,  # Mantener bytes para pickle
+                decode_responses=False,  # Los valores se guardan ya serializados
                 socket_connect_timeout=5,
                 socket_timeout=5,
                 retry_on_timeout=True,
@@ -50,9 +266,25 @@ class CacheManager:
             logger.warning(
                 f"No se pudo conectar a Redis: {e}. Usando cache en memoria."
             )
-            self.redis_client = None
+            # El cliente queda sin usar: todo acceso a Redis mira `connected`
             self.connected = False
-            self._fallback_cache = {}
+            # Sin Redis el cache en proceso es el único nivel
+            self._fallback_cache = self.memory_cache
+            if web_workers > 1 and l1_ttl:
+                logger.warning(
+                    f"Sin Redis con {web_workers} workers: cada proceso tiene su "
+                    f"cache y las entradas caducan en {l1_ttl}s"
+                )
+                self._fallback_max_ttl = l1_ttl
+
+    def __reduce__(self):
+        # Con pickle viaja como referencia a la instancia del proceso que lo
+        # recibe, p. ej. en las llamadas que un worker aplaza a la API
+        return (_process_instance, ())
+
+    @property
+    def _l1_enabled(self) -> bool:
+        return self.connected and bool(self.l1_ttl)
 
     def _generate_key(self, prefix: str, *args, **kwargs) -> str:
         """
@@ -77,6 +309,41 @@ class CacheManager:
         # Generar hash MD5 para clave más corta
         return f"atrio:{hashlib.md5(key_string.encode()).hexdigest()}"
 
+    def _serialize(self, key: str, value: Any) -> bytes:
+        """Serializa y comprime un valor, anotando tamaño y tiempo por prefijo"""
+        prefix = key_prefix(key)
+        baseline = None
+        if self.serialization_stats.should_sample(prefix):
+            try:
+                baseline = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+            except Exception:
+                baseline = None
+
+        start = time.perf_counter()
+        payload_format, payload = self.serializer.dumps(value)
+        data = encode(
+            payload_format, payload, self.compression, self.compress_min_bytes
+        )
+        self.serialization_stats.record_set(
+            prefix,
+            payload_bytes=len(payload),
+            stored_bytes=len(data),
+            seconds=time.perf_counter() - start,
+            pickle_fallback=(
+                payload_format == FORMAT_PICKLE and self.serializer.name != "pickle"
+            ),
+            baseline_pickle_bytes=baseline,
+        )
+        return data
+
+    def _deserialize(self, key: str, data: bytes) -> Any:
+        start = time.perf_counter()
+        value = decode(data)
+        self.serialization_stats.record_load(
+            key_prefix(key), time.perf_counter() - start
+        )
+        return value
+
     def get(self, key: str) -> Optional[Any]:
         """
         Obtiene un valor del cache
@@ -87,19 +354,33 @@ class CacheManager:
         Returns:
             Valor almacenado o None si no existe
         """
-        if not self.connected:
-            return self._fallback_cache.get(key)
+        if not self.connected or self._l1_enabled:
+            data = self.memory_cache.get(key)
+            if data is not None:
+                try:
+                    return self._deserialize(key, data)
+                except Exception as e:
+                    logger.error(f"Error deserializando cache key {key}: {e}")
+                    self.memory_cache.delete(key)
+                    return None
+            if not self.connected:
+                return None
 
         try:
-            value = self.redis_client.get(key)
+            value = cast(Optional[bytes], self.redis_client.get(key))
             if value is not None:
-                return pickle.loads(value)
+                result = self._deserialize(key, value)
+                if self._l1_enabled:
+                    self.memory_cache.set(key, value, self.l1_ttl)
+                return result
             return None
         except Exception as e:
             logger.error(f"Error obteniendo cache key {key}: {e}")
             return None
 
-    def set(self, key: str, value: Any, ttl: int = 300) -> bool:
+    def set(
+        self, key: str, value: Any, ttl: int = 300, tags: Sequence[str] = ()
+    ) -> bool:
         """
         Almacena un valor en el cache
 
@@ -107,17 +388,33 @@ class CacheManager:
             key: Clave del cache
             value: Valor a almacenar
             ttl: Tiempo de vida en segundos (default: 5 minutos)
+            tags: Etiquetas para invalidar la entrada (ej: "caso:3")
 
         Returns:
             True si se almacenó correctamente
         """
+        try:
+            serialized_value = self._serialize(key, value)
+        except Exception as e:
+            logger.error(f"Error serializando cache key {key}: {e}")
+            return False
+
         if not self.connected:
-            self._fallback_cache[key] = value
-            return True
+            if self._fallback_max_ttl:
+                ttl = min(ttl, self._fallback_max_ttl)
+            return self.memory_cache.set(key, serialized_value, ttl, tags)
 
         try:
-            serialized_value = pickle.dumps(value)
-            return self.redis_client.setex(key, ttl, serialized_value)
+            if self._l1_enabled:
+                self.memory_cache.set(
+                    key, serialized_value, min(ttl, self.l1_ttl), tags
+                )
+            pipe = self.redis_client.pipeline()
+            pipe.setex(key, ttl, serialized_value)
+            for tag in tags:
+                pipe.sadd(TAG_PREFIX + tag, key)
+                pipe.expire(TAG_PREFIX + tag, max(ttl, TAG_SET_TTL))
+            return bool(pipe.execute()[0])
         except Exception as e:
             logger.error(f"Error estableciendo cache key {key}: {e}")
             return False
@@ -132,8 +429,8 @@ class CacheManager:
         Returns:
             True si se eliminó correctamente
         """
+        self.memory_cache.delete(key)
         if not self.connected:
-            self._fallback_cache.pop(key, None)
             return True
 
         try:
@@ -152,24 +449,63 @@ class CacheManager:
         Returns:
             Número de claves eliminadas
         """
+        deleted_memory = self.memory_cache.clear_pattern(pattern)
         if not self.connected:
-            # Fallback simple para cache en memoria
-            keys_to_delete = [
-                k for k in self._fallback_cache.keys() if pattern.replace("*", "") in k
-            ]
-            for key in keys_to_delete:
-                del self._fallback_cache[key]
-            return len(keys_to_delete)
+            return deleted_memory
 
         try:
-            keys = self.redis_client.keys(pattern)
-            if keys:
-                return self.redis_client.delete(*keys)
-            return 0
+            # SCAN en lugar de KEYS para no bloquear Redis
+            return self._delete_keys(
+                self.redis_client.scan_iter(match=pattern, count=SCAN_BATCH)
+            )
         except Exception as e:
             logger.error(f"Error eliminando cache pattern {pattern}: {e}")
             return 0
 
+    def _delete_keys(self, keys) -> int:
+        """Borra de Redis (y de L1) las claves de un iterador, por lotes"""
+        deleted = 0
+        batch = []
+        for key in keys:
+            batch.append(key)
+            if len(batch) >= SCAN_BATCH:
+                deleted += self._delete_batch(batch)
+                batch = []
+        if batch:
+            deleted += self._delete_batch(batch)
+        return deleted
+
+    def _delete_batch(self, keys: List[Union[bytes, str]]) -> int:
+        for key in keys:
+            self.memory_cache.delete(key.decode() if isinstance(key, bytes) else key)
+        return cast(int, self.redis_client.delete(*keys))
+
+    def invalidate_tags(self, *tags: str) -> int:
+        """
+        Elimina todas las entradas registradas bajo alguna de las etiquetas
+
+        Args:
+            tags: Etiquetas a invalidar (ej: "caso:3", "archivo:12")
+
+        Returns:
+            Número de claves eliminadas
+        """
+        deleted = sum(self.memory_cache.invalidate_tag(tag) for tag in tags)
+        if not self.connected:
+            return deleted
+
+        deleted = 0
+        for tag in tags:
+            tag_key = TAG_PREFIX + tag
+            try:
+                deleted += self._delete_keys(
+                    self.redis_client.sscan_iter(tag_key, count=SCAN_BATCH)
+                )
+                self.redis_client.delete(tag_key)
+            except Exception as e:
+                logger.error(f"Error invalidando etiqueta de cache {tag}: {e}")
+        return deleted
+
     def get_or_set(self, key: str, callback, ttl: int = 300) -> Any:
         """
         Obtiene un valor del cache o lo calcula si no existe
@@ -182,15 +518,167 @@ class CacheManager:
         Returns:
             Valor del cache o calculado
         """
-        value = self.get(key)
-        if value is not None:
-            return value
+        return self.get_or_compute(key, callback, ttl)
+
+    def _count(self, stat: str):
+        with self._flights_guard:
+            self.flight_stats[stat] += 1
+
+    @contextmanager
+    def _local_flight(self, key: str, blocking: bool = True, timeout: float = -1):
+        """Cerrojo en proceso por clave; produce True si se ha obtenido"""
+        with self._flights_guard:
+            flight = self._flights.setdefault(key, [threading.Lock(), 0])
+            flight[1] += 1
+        acquired = flight[0].acquire(blocking, timeout if blocking else -1)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                flight[0].release()
+            with self._flights_guard:
+                flight[1] -= 1
+                if flight[1] == 0:
+                    del self._flights[key]
+
+    def _acquire_lock(self, key: str, lock_ttl: int) -> Optional[str]:
+        """Cerrojo entre procesos con SET NX; sin Redis basta el de proceso"""
+        token = uuid.uuid4().hex
+        if not self.connected:
+            return token
+        try:
+            if self.redis_client.set(
+                LOCK_PREFIX + key, token, nx=True, px=int(lock_ttl * 1000)
+            ):
+                return token
+            return None
+        except Exception as e:
+            logger.error(f"Error tomando cerrojo de cache {key}: {e}")
+            # Sin cerrojo distribuido se calcula igualmente
+            return token
+
+    def _release_lock(self, key: str, token: str):
+        if not self.connected:
+            return
+        try:
+            argumentos: List[Any] = [LOCK_PREFIX + key, token]
+            self.redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, *argumentos)
+        except Exception as e:
+            logger.error(f"Error liberando cerrojo de cache {key}: {e}")
 
-        # Calcular valor
-        value = callback()
-        self.set(key, value, ttl)
+    def _get_entry(self, key: str):
+        """(valor, fresco) de una entrada, o None si no existe"""
+        value = self.get(key)
+        if value is None:
+            return None
+        if isinstance(value, dict) and FRESH_UNTIL in value:
+            return value["value"], time.time() < value[FRESH_UNTIL]
+        return value, True
+
+    def _store(self, key, value, ttl, tags, stale_ttl):
+        if value is None:
+            return
+        if stale_ttl:
+            envelope = {FRESH_UNTIL: time.time() + ttl, "value": value}
+            self.set(key, envelope, ttl + stale_ttl, tags)
+        else:
+            self.set(key, value, ttl, tags)
+
+    def _compute(self, key, compute, ttl, tags, stale_ttl):
+        self._count("computations")
+        value = compute()
+        self._store(key, value, ttl, tags, stale_ttl)
         return value
 
+    def _wait_for(self, key: str, deadline: float):
+        """Espera a que otro proceso publique el valor de la clave"""
+        delay = 0.02
+        while time.monotonic() < deadline:
+            time.sleep(delay)
+            entry = self._get_entry(key)
+            if entry is not None:
+                return entry
+            if self.connected and not self.redis_client.exists(LOCK_PREFIX + key):
+                # Quien calculaba terminó sin guardar nada (error o None)
+                return None
+            delay = min(delay * 2, 0.5)
+        self._count("wait_timeouts")
+        return None
+
+    def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Any],
+        ttl: int = 300,
+        tags: Sequence[str] = (),
+        stale_ttl: int = 0,
+        wait_timeout: float = SINGLE_FLIGHT_WAIT,
+        lock_ttl: int = SINGLE_FLIGHT_LOCK_TTL,
+    ) -> Any:
+        """
+        Obtiene un valor del cache o lo calcula una sola vez
+
+        Ante fallos simultáneos de la misma clave sólo un llamante ejecuta
+        `compute` (un cerrojo por clave en el proceso y SET NX en Redis entre
+        procesos); el resto espera y recibe su resultado. Si la espera supera
+        `wait_timeout` se calcula igualmente.
+
+        Con `stale_ttl` la entrada se conserva ese tiempo extra tras caducar:
+        mientras un llamante la recalcula, los demás reciben el valor antiguo
+        sin esperar.
+
+        Args:
+            key: Clave del cache
+            compute: Función que calcula el valor si no está en cache
+            ttl: Tiempo de vida en segundos
+            tags: Etiquetas de invalidación
+            stale_ttl: Segundos durante los que se sirve un valor caducado
+            wait_timeout: Espera máxima por el cálculo de otro llamante
+            lock_ttl: Vida del cerrojo entre procesos
+
+        Returns:
+            Valor del cache o calculado
+        """
+        entry = self._get_entry(key)
+        if entry is not None:
+            value, fresh = entry
+            if fresh:
+                return value
+            # Caducado: lo recalcula quien consiga el cerrojo, sin esperas
+            with self._local_flight(key, blocking=False) as acquired:
+                token = self._acquire_lock(key, lock_ttl) if acquired else None
+                if token is None:
+                    self._count("stale_served")
+                    return value
+                try:
+                    return self._compute(key, compute, ttl, tags, stale_ttl)
+                finally:
+                    self._release_lock(key, token)
+
+        deadline = time.monotonic() + wait_timeout
+        with self._local_flight(key, timeout=wait_timeout) as acquired:
+            if acquired:
+                # Otro hilo de este proceso pudo calcularlo mientras esperábamos
+                entry = self._get_entry(key)
+                if entry is not None:
+                    self._count("coalesced")
+                    return entry[0]
+            else:
+                self._count("wait_timeouts")
+                return self._compute(key, compute, ttl, tags, stale_ttl)
+
+            token = self._acquire_lock(key, lock_ttl)
+            if token is None:
+                entry = self._wait_for(key, deadline)
+                if entry is not None:
+                    self._count("coalesced")
+                    return entry[0]
+                return self._compute(key, compute, ttl, tags, stale_ttl)
+            try:
+                return self._compute(key, compute, ttl, tags, stale_ttl)
+            finally:
+                self._release_lock(key, token)
+
     def invalidate_caso(self, caso_id: int):
         """
         Invalida todo el cache relacionado con un caso específico
@@ -198,23 +686,41 @@ class CacheManager:
         Args:
             caso_id: ID del caso
         """
-        patterns = [
-            f"atrio:caso:{caso_id}:*",
-            f"atrio:lecturas:caso:{caso_id}:*",
-            f"atrio:vehiculos:caso:{caso_id}:*",
-            f"atrio:estadisticas:caso:{caso_id}:*",
-            f"atrio:mapa:caso:{caso_id}:*",
-        ]
-
-        total_deleted = 0
-        for pattern in patterns:
-            deleted = self.clear_pattern(pattern)
-            total_deleted += deleted
+        total_deleted = self.invalidate_tags(f"caso:{caso_id}", GLOBAL_TAG)
+        # Claves escritas a mano con el caso en el nombre
+        total_deleted += self.clear_pattern(f"atrio:caso:{caso_id}:*")
 
         logger.info(
             f"Cache invalidado para caso {caso_id}: {total_deleted} claves eliminadas"
         )
 
+    def invalidate_archivo(self, archivo_id: int, caso_id: Optional[int] = None):
+        """
+        Invalida el cache que depende de un archivo importado
+
+        Un archivo cambia las lecturas de su caso, así que se invalida también
+        el caso si se conoce.
+
+        Args:
+            archivo_id: ID del archivo
+            caso_id: ID del caso al que pertenece
+        """
+        tags = [f"archivo:{archivo_id}", GLOBAL_TAG]
+        if caso_id is not None:
+            tags.append(f"caso:{caso_id}")
+        total_deleted = self.invalidate_tags(*tags)
+        logger.info(
+            f"Cache invalidado para archivo {archivo_id}: {total_deleted} claves eliminadas"
+        )
+
+    def _serialization_info(self) -> Dict[str, Any]:
+        return {
+            "serializer": self.serializer.name,
+            "compression": COMPRESSION_NAMES.get(self.compression, "none"),
+            "serialization": self.serialization_stats.snapshot(),
+            "single_flight": dict(self.flight_stats),
+        }
+
     def get_stats(self) -> Dict[str, Any]:
         """
         Obtiene estadísticas del cache
@@ -226,17 +732,21 @@ class CacheManager:
             return {
                 "connected": False,
                 "cache_type": "memory",
-                "keys_count": len(self._fallback_cache),
+                "keys_count": len(self.memory_cache),
+                "memory": self.memory_cache.get_stats(),
+                **self._serialization_info(),
             }
 
         try:
-            info = self.redis_client.info()
+            info = cast(Dict[str, Any], self.redis_client.info())
             return {
                 "connected": True,
                 "cache_type": "redis",
                 "keys_count": info.get("db0", {}).get("keys", 0),
                 "memory_usage": info.get("used_memory_human", "N/A"),
                 "uptime": info.get("uptime_in_seconds", 0),
+                "l1": self.memory_cache.get_stats() if self._l1_enabled else None,
+                **self._serialization_info(),
             }
         except Exception as e:
             logger.error(f"Error obteniendo stats de Redis: {e}")
@@ -247,23 +757,158 @@ class CacheManager:
 cache_manager = CacheManager()
 
 
-def cached(prefix: str, ttl: int = 300):
+def _process_instance() -> CacheManager:
+    return cache_manager
+
+
+def _canonical(value: Any) -> Any:
+    """Representación estable y serializable a JSON de un argumento"""
+    if isinstance(value, BaseModel):
+        return _canonical(value.model_dump(mode="json"))
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in sorted(value.items(), key=str)}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((_canonical(v) for v in value), key=str)
+    if isinstance(value, Enum):
+        return _canonical(value.value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def auth_scope(arguments: Dict[str, Any]) -> str:
+    """
+    Ámbito de autorización de la petición para particionar las claves
+
+    Los superadmin comparten ámbito; el resto se agrupa por rol y grupo, que
+    es lo que decide a qué casos pueden acceder.
+    """
+    for value in arguments.values():
+        if hasattr(value, "Rol") and hasattr(value, "ID_Grupo"):
+            rol = getattr(value.Rol, "value", value.Rol)
+            if rol == "superadmin":
+                return "superadmin"
+            return f"{rol}:{value.ID_Grupo}"
+    return "public"
+
+
+def default_tags(arguments: Dict[str, Any]) -> List[str]:
+    """Etiquetas de invalidación deducidas de los parámetros de la llamada"""
+    tags = []
+    if arguments.get("caso_id") is not None:
+        tags.append(f"caso:{arguments['caso_id']}")
+    for name in ("archivo_id", "id_archivo"):
+        if arguments.get(name) is not None:
+            tags.append(f"archivo:{arguments[name]}")
+    return tags
+
+
+def _is_dependency(parameter: inspect.Parameter) -> bool:
+    return isinstance(parameter.default, fastapi_params.Depends)
+
+
+def _bind_arguments(signature: inspect.Signature, args: tuple, kwargs: dict):
+    bound = signature.bind_partial(*args, **kwargs)
+    bound.apply_defaults()
+    return bound.arguments
+
+
+def build_cache_key(
+    prefix: str,
+    func: Callable,
+    args: tuple,
+    kwargs: dict,
+    key_params: Optional[Sequence[str]] = None,
+    scope: Optional[Callable[[Dict[str, Any]], str]] = auth_scope,
+    version: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None,
+) -> str:
+    """
+    Genera la clave de cache de una llamada a partir de sus parámetros
+
+    Sólo cuentan los parámetros de `key_params` (por defecto todos los que no
+    son dependencias de FastAPI, como la sesión o el usuario), canonicalizados
+    a JSON. La clave incluye el ámbito de autorización devuelto por `scope` y,
+    si se indica, la versión de los datos devuelta por `version`.
+    """
+    signature = inspect.signature(func)
+    arguments = _bind_arguments(signature, args, kwargs)
+
+    if key_params is None:
+        key_params = [
+            name
+            for name, parameter in signature.parameters.items()
+            if not _is_dependency(parameter)
+        ]
+    key_data = {name: _canonical(arguments.get(name)) for name in key_params}
+    digest = hashlib.md5(
+        json.dumps(key_data, sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()
+
+    scope_name = scope(arguments) if scope else "all"
+    data_version = version(arguments) if version else None
+    if data_version is not None:
+        return f"atrio:{prefix}:{scope_name}:{data_version}:{digest}"
+    return f"atrio:{prefix}:{scope_name}:{digest}"
+
+
+def cached(
+    prefix: str,
+    ttl: int = 300,
+    key_params: Optional[Sequence[str]] = None,
+    scope: Optional[Callable[[Dict[str, Any]], str]] = auth_scope,
+    tags: Callable[[Dict[str, Any]], Sequence[str]] = default_tags,
+    version: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None,
+    single_flight: bool = True,
+    stale_ttl: int = 0,
+):
     """
     Decorador para cachear resultados de funciones
 
     Args:
         prefix: Prefijo para las claves de cache
         ttl: Tiempo de vida en segundos
+        key_params: Parámetros que identifican el resultado (por defecto,
+            todos salvo las dependencias inyectadas con Depends)
+        scope: Función que devuelve el ámbito de autorización; None para
+            compartir el resultado entre todos los usuarios
+        tags: Función que devuelve las etiquetas de invalidación (por
+            defecto caso:{caso_id} y archivo:{id} si están en la llamada)
+        version: Función que devuelve la versión de los datos de la llamada;
+            al incluirla en la clave, un cambio en los datos deja de servir
+            las entradas anteriores sin esperar a su TTL
+        single_flight: Si varias llamadas fallan a la vez, calcular una sola
+            vez y que el resto espere el resultado
+        stale_ttl: Segundos durante los que se sirve el valor caducado
+            mientras una sola llamada lo recalcula
 
     Returns:
         Decorador que cachea el resultado de la función
     """
 
     def decorator(func):
+        signature = inspect.signature(func)
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             # Generar clave única
-            key = cache_manager._generate_key(prefix, *args, **kwargs)
+            key = build_cache_key(
+                prefix, func, args, kwargs, key_params, scope, version
+            )
+
+            arguments = _bind_arguments(signature, args, kwargs)
+
+            def compute():
+                logger.debug(f"Cache miss para {func.__name__}, ejecutando...")
+                return func(*args, **kwargs)
+
+            if single_flight or stale_ttl:
+                return cache_manager.get_or_compute(
+                    key, compute, ttl, tags=tags(arguments), stale_ttl=stale_ttl
+                )
 
             # Intentar obtener del cache
             cached_result = cache_manager.get(key)
@@ -272,9 +917,8 @@ def cached(prefix: str, ttl: int = 300):
                 return cached_result
 
             # Ejecutar función y cachear resultado
-            logger.debug(f"Cache miss para {func.__name__}, ejecutando...")
-            result = func(*args, **kwargs)
-            cache_manager.set(key, result, ttl)
+            result = compute()
+            cache_manager.set(key, result, ttl, tags=tags(arguments))
 
             return result
 
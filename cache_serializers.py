@@ -0,0 +1,255 @@
+"""
+Serialización de los valores del cache de ATRiO
+
+Cada valor se guarda como una trama `[formato][compresión][datos]`, de modo
+que cualquier proceso puede leer entradas escritas con otro serializador o
+sin comprimir. Las entradas antiguas, pickle sin cabecera, se siguen leyendo.
+
+El serializador por defecto es orjson sobre datos planos: los modelos de
+pydantic se guardan como dicts (FastAPI los valida igual con el
+response_model) y lo que orjson no sabe representar se guarda con pickle.
+Por encima de un umbral de tamaño se comprime con zstd, lz4 o zlib, según
+lo que esté instalado.
+"""
+
+import logging
+import pickle
+import threading
+import zlib
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import pydantic_core
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependencia opcional
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+logger = logging.getLogger(__name__)
+
+# Valores serializados a partir de este tamaño se intentan comprimir
+COMPRESS_MIN_BYTES = 16 * 1024
+# Cada cuántas escrituras por prefijo se mide también el tamaño con pickle
+BASELINE_SAMPLE_EVERY = 100
+
+FORMAT_PICKLE = b"P"
+FORMAT_JSON = b"J"
+_PICKLE_PROTOCOL_MARK = 0x80  # primer byte de pickle sin cabecera
+
+COMPRESSION_NONE = b"-"
+
+
+class PickleSerializer:
+    """Serializador genérico: conserva los tipos de Python"""
+
+    name = "pickle"
+
+    def dumps(self, value: Any) -> Tuple[bytes, bytes]:
+        return FORMAT_PICKLE, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError
+
+
+def _holds_models(value: Any) -> bool:
+    if isinstance(value, BaseModel):
+        return True
+    return (
+        isinstance(value, (list, tuple))
+        and len(value) > 0
+        and isinstance(value[0], BaseModel)
+    )
+
+
+class OrjsonSerializer:
+    """
+    JSON con orjson sobre datos planos
+
+    Más compacto y rápido que pickle para listas de modelos, a cambio de
+    devolver dicts y listas en lugar de los objetos originales. Los modelos
+    de pydantic se vuelcan con su propio serializador (en Rust), sin pasar
+    por model_dump objeto a objeto.
+    """
+
+    name = "orjson"
+
+    def __init__(self) -> None:
+        if orjson is None:
+            raise RuntimeError("orjson no está instalado")
+        self._fallback = PickleSerializer()
+        self._options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(self, value: Any) -> Tuple[bytes, bytes]:
+        try:
+            if _holds_models(value):
+                return FORMAT_JSON, pydantic_core.to_json(value)
+            return FORMAT_JSON, orjson.dumps(
+                value, default=_json_default, option=self._options
+            )
+        except (TypeError, pydantic_core.PydanticSerializationError):
+            return self._fallback.dumps(value)
+
+
+def default_serializer():
+    """orjson si está disponible; si no, pickle"""
+    return OrjsonSerializer() if orjson is not None else PickleSerializer()
+
+
+def _codecs() -> Dict[bytes, Tuple[str, Callable, Callable]]:
+    codecs = {b"z": ("zlib", lambda d: zlib.compress(d, 1), zlib.decompress)}
+    if lz4_frame is not None:
+        codecs[b"l"] = ("lz4", lz4_frame.compress, lz4_frame.decompress)
+    if zstandard is not None:
+        codecs[b"s"] = (
+            "zstd",
+            zstandard.ZstdCompressor(level=3).compress,
+            zstandard.ZstdDecompressor().decompress,
+        )
+    return codecs
+
+
+COMPRESSION_CODECS = _codecs()
+COMPRESSION_NAMES = {codec: spec[0] for codec, spec in COMPRESSION_CODECS.items()}
+COMPRESSION_NAMES[COMPRESSION_NONE] = "none"
+
+
+def best_compression() -> bytes:
+    """Compresor preferido entre los disponibles (zstd > lz4 > zlib)"""
+    for codec in (b"s", b"l", b"z"):
+        if codec in COMPRESSION_CODECS:
+            return codec
+    return COMPRESSION_NONE
+
+
+def encode(
+    payload_format: bytes,
+    payload: bytes,
+    compression: Optional[bytes] = None,
+    min_bytes: int = COMPRESS_MIN_BYTES,
+) -> bytes:
+    """Construye la trama, comprimiendo si el valor es grande y compensa"""
+    codec = COMPRESSION_NONE
+    if compression and compression != COMPRESSION_NONE and len(payload) >= min_bytes:
+        compressed = COMPRESSION_CODECS[compression][1](payload)
+        if len(compressed) < len(payload):
+            codec, payload = compression, compressed
+    return payload_format + codec + payload
+
+
+def decode(data: bytes) -> Any:
+    """Recupera el valor de una trama (o de un pickle sin cabecera)"""
+    if data[0] == _PICKLE_PROTOCOL_MARK:
+        return pickle.loads(data)
+    payload_format, codec, payload = data[:1], data[1:2], data[2:]
+    if codec != COMPRESSION_NONE:
+        try:
+            payload = COMPRESSION_CODECS[codec][2](payload)
+        except KeyError:
+            raise ValueError(f"Compresión de cache no disponible: {codec!r}")
+    if payload_format == FORMAT_JSON:
+        return orjson.loads(payload)
+    if payload_format == FORMAT_PICKLE:
+        return pickle.loads(payload)
+    raise ValueError(f"Formato de cache desconocido: {payload_format!r}")
+
+
+def key_prefix(key: str) -> str:
+    """Prefijo lógico de una clave `atrio:{prefix}:...`"""
+    parts = key.split(":", 2)
+    if len(parts) >= 2 and parts[0] == "atrio":
+        return parts[1]
+    return "other"
+
+
+class SerializationStats:
+    """Tamaños y tiempos de serialización acumulados por prefijo de clave"""
+
+    def __init__(self, baseline_every: int = BASELINE_SAMPLE_EVERY):
+        self.baseline_every = baseline_every
+        self._lock = threading.Lock()
+        self._prefixes: Dict[str, Dict[str, float]] = {}
+
+    def _entry(self, prefix: str) -> Dict[str, float]:
+        entry = self._prefixes.get(prefix)
+        if entry is None:
+            entry = self._prefixes[prefix] = {
+                "sets": 0,
+                "payload_bytes": 0,
+                "stored_bytes": 0,
+                "serialize_s": 0.0,
+                "loads": 0,
+                "deserialize_s": 0.0,
+                "pickle_fallbacks": 0,
+                "baseline_samples": 0,
+                "baseline_pickle_bytes": 0,
+                "baseline_stored_bytes": 0,
+            }
+        return entry
+
+    def should_sample(self, prefix: str) -> bool:
+        with self._lock:
+            sets = self._prefixes.get(prefix, {}).get("sets", 0)
+        return bool(self.baseline_every) and sets % self.baseline_every == 0
+
+    def record_set(
+        self,
+        prefix: str,
+        payload_bytes: int,
+        stored_bytes: int,
+        seconds: float,
+        pickle_fallback: bool = False,
+        baseline_pickle_bytes: Optional[int] = None,
+    ):
+        with self._lock:
+            entry = self._entry(prefix)
+            entry["sets"] += 1
+            entry["payload_bytes"] += payload_bytes
+            entry["stored_bytes"] += stored_bytes
+            entry["serialize_s"] += seconds
+            entry["pickle_fallbacks"] += int(pickle_fallback)
+            if baseline_pickle_bytes is not None:
+                entry["baseline_samples"] += 1
+                entry["baseline_pickle_bytes"] += baseline_pickle_bytes
+                entry["baseline_stored_bytes"] += stored_bytes
+
+    def record_load(self, prefix: str, seconds: float):
+        with self._lock:
+            entry = self._entry(prefix)
+            entry["loads"] += 1
+            entry["deserialize_s"] += seconds
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            result = {}
+            for prefix, entry in self._prefixes.items():
+                stats = dict(entry)
+                stats["serialize_s"] = round(stats["serialize_s"], 6)
+                stats["deserialize_s"] = round(stats["deserialize_s"], 6)
+                if entry["sets"]:
+                    stats["avg_stored_bytes"] = round(
+                        entry["stored_bytes"] / entry["sets"]
+                    )
+                if entry["baseline_pickle_bytes"]:
+                    # < 1: se ocupa menos que guardando el pickle del valor
+                    stats["size_ratio_vs_pickle"] = round(
+                        entry["baseline_stored_bytes"] / entry["baseline_pickle_bytes"],
+                        4,
+                    )
+                result[prefix] = stats
+            return result
@@ -0,0 +1,116 @@
+"""
+Precalentamiento del cache de un caso
+
+Tras una importación, la primera persona que abre el caso pagaba el cálculo
+en frío de sus agregados (vehículos, rango de fechas, matrículas, lectores
+en el mapa). El precalentamiento los calcula en segundo plano y los deja en
+cache con la versión de datos vigente, así que la primera petición ya es un
+acierto.
+
+Cada agregado es un paso registrado con `paso_precalentamiento` sobre la
+función cacheada que lo calcula. Los pasos reciben sólo los argumentos que
+declaran (`db`, `caso_id`) y el progreso se publica en `task_statuses` como
+cualquier otra tarea en segundo plano.
+"""
+
+import inspect
+import logging
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from database_config import SessionLocal
+from shared_state import mark_task_completed, task_statuses
+
+logger = logging.getLogger(__name__)
+
+STAGE = "cache_warmup"
+
+# Pasos en orden de registro: nombre -> función cacheada
+PASOS: Dict[str, Callable[..., Any]] = {}
+
+
+def paso_precalentamiento(nombre: str):
+    """Registra una función cacheada como paso del precalentamiento de un caso"""
+
+    def decorator(func):
+        PASOS[nombre] = func
+        return func
+
+    return decorator
+
+
+def nueva_tarea_precalentamiento(caso_id: int) -> str:
+    """Crea la entrada de la tarea en `task_statuses` y devuelve su ID"""
+    task_id = f"warmup-{caso_id}-{uuid.uuid4().hex[:12]}"
+    task_statuses[task_id] = {
+        "status": "pending",
+        "message": "Precalentamiento del cache pendiente",
+        "progress": 0,
+        "total": len(PASOS),
+        "stage": STAGE,
+    }
+    return task_id
+
+
+def _argumentos(func: Callable, disponibles: Dict[str, Any]) -> Dict[str, Any]:
+    parametros = inspect.signature(func).parameters
+    return {k: v for k, v in disponibles.items() if k in parametros}
+
+
+def precalentar_caso(
+    caso_id: int,
+    task_id: Optional[str] = None,
+    session_factory: Callable = SessionLocal,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Calcula y guarda en cache los agregados del caso.
+
+    Usa su propia sesión, así que puede ejecutarse en una BackgroundTask o
+    al final de otra tarea. Un paso que falla no detiene a los demás; el
+    resumen por paso queda en `result` de la tarea.
+    """
+    task_id = task_id or nueva_tarea_precalentamiento(caso_id)
+    estado = task_statuses.setdefault(task_id, {})
+    estado.update(
+        status="processing",
+        message="Precalentando cache del caso...",
+        progress=0,
+        total=len(PASOS),
+        stage=STAGE,
+    )
+
+    resumen: Dict[str, Dict[str, Any]] = {}
+    db = session_factory()
+    try:
+        for numero, (nombre, func) in enumerate(PASOS.items(), start=1):
+            estado["message"] = f"Precalentando {nombre}..."
+            inicio = time.perf_counter()
+            try:
+                func(**_argumentos(func, {"db": db, "caso_id": caso_id}))
+                resumen[nombre] = {"status": "ok"}
+            except Exception as e:
+                logger.error(
+                    f"[Task {task_id}] Error precalentando {nombre} del caso {caso_id}: {e}",
+                    exc_info=True,
+                )
+                db.rollback()
+                resumen[nombre] = {"status": "error", "error": str(e)}
+            resumen[nombre]["seconds"] = round(time.perf_counter() - inicio, 3)
+            estado["progress"] = numero / len(PASOS) * 100
+    finally:
+        db.close()
+
+    fallidos = [n for n, r in resumen.items() if r["status"] != "ok"]
+    estado.update(
+        status="failed" if fallidos and len(fallidos) == len(resumen) else "completed",
+        message=(
+            f"Cache precalentado ({len(resumen) - len(fallidos)}/{len(resumen)} pasos)"
+        ),
+        progress=100,
+        result={"caso_id": caso_id, "pasos": resumen},
+        stage=None,
+    )
+    mark_task_completed(task_id)
+    logger.info(f"[Task {task_id}] {estado['message']} para el caso {caso_id}")
+    return resumen
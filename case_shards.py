@@ -0,0 +1,366 @@
+"""
+Lecturas de cada caso en su propio archivo SQLite (shards por caso)
+
+Con todos los casos en la tabla `lectura` de atrio.db, cada índice crece con
+el histórico completo y borrar un caso deja el archivo fragmentado. En el
+modo por casos (ATRIO_CASE_SHARDS=1) las lecturas de los casos nuevos se
+guardan en `SHARDS_DIR/caso_<id>.db`, con la misma tabla `lectura` y sus
+índices. Cada conexión adjunta (ATTACH) bajo demanda los shards que nombra
+una sentencia, como esquema `caso_<id>`, y suelta los menos usados al pasar
+de MAX_ATTACHED.
+
+- `lectura_entity(caso_id)` devuelve la entidad con la que consultar las
+  lecturas de un caso: `models.Lectura` o un alias sobre su shard.
+- Borrar un caso es borrar su archivo (`drop_shard`).
+- Los casos que ya tienen lecturas en la tabla compartida siguen en ella:
+  la variable sólo decide dónde se crean las lecturas de los casos nuevos.
+
+Los IDs de lectura de un shard empiezan en `caso_id << 32`, así que no se
+repiten entre shards ni con la tabla compartida y el propio ID dice dónde
+está la lectura (`lectura_entity_for_id`). Por eso las marcas de relevancia
+(LecturasRelevantes), en atrio.db, guardan el ID sin clave foránea y sirven
+para las lecturas de la tabla compartida y de los shards.
+"""
+
+import glob
+import logging
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import (
+    Column,
+    Index,
+    MetaData,
+    NullPool,
+    Table,
+    create_engine,
+    event,
+    select,
+    text,
+)
+from sqlalchemy.orm import Session, aliased
+
+import models
+from database_config import engine, read_engine
+
+logger = logging.getLogger(__name__)
+
+# Crear las lecturas de los casos nuevos en su propio archivo
+CASE_SHARDS = os.getenv("ATRIO_CASE_SHARDS", "0") == "1"
+
+SHARDS_DIR = "./database/secure/casos"
+
+# Shards adjuntos a la vez por conexión. SQLite admite 10 bases adjuntas
+# por defecto; con 8 queda margen para la principal y las temporales
+MAX_ATTACHED = 8
+
+# Clave en el info de cada conexión: {caso_id: inodo del archivo adjunto}
+_ATTACHED_KEY = "atrio_shards"
+
+# Esquemas de shard nombrados en una sentencia
+_SCHEMA_RE = re.compile(r"\bcaso_(\d+)\.")
+
+_metadata = MetaData()
+_entities: Dict[int, Any] = {}
+_lock = threading.Lock()
+
+
+def shard_schema(caso_id: int) -> str:
+    return f"caso_{int(caso_id)}"
+
+
+def shard_path(caso_id: int) -> str:
+    return os.path.join(SHARDS_DIR, f"{shard_schema(caso_id)}.db")
+
+
+def is_sharded(caso_id: int) -> bool:
+    """El caso guarda sus lecturas en un shard"""
+    return os.path.exists(shard_path(caso_id))
+
+
+def sharded_casos() -> List[int]:
+    """Casos que guardan sus lecturas en un shard"""
+    casos = []
+    for ruta in glob.glob(os.path.join(SHARDS_DIR, "caso_*.db")):
+        nombre = os.path.basename(ruta)[len("caso_") : -len(".db")]
+        if nombre.isdigit():
+            casos.append(int(nombre))
+    return sorted(casos)
+
+
+def casos_con_matricula(matricula: str) -> List[int]:
+    """
+    Casos con shard que tienen lecturas de la matrícula. Cada shard se
+    consulta con su propia conexión, así que sirve también dentro de una
+    transacción de escritura, en la que no se pueden adjuntar shards.
+    """
+    casos = []
+    for caso_id in sharded_casos():
+        try:
+            conexion = sqlite3.connect(shard_path(caso_id))
+        except sqlite3.Error:
+            continue
+        try:
+            if conexion.execute(
+                'SELECT 1 FROM lectura WHERE "Matricula" = ? LIMIT 1', (matricula,)
+            ).fetchone():
+                casos.append(caso_id)
+        except sqlite3.Error as e:
+            logger.warning(f"No se pudo consultar el shard del caso {caso_id}: {e}")
+        finally:
+            conexion.close()
+    return casos
+
+
+def shard_table(caso_id: int) -> Table:
+    """Tabla `lectura` del shard de un caso, sin claves foráneas"""
+    esquema = shard_schema(caso_id)
+    with _lock:
+        tabla = _metadata.tables.get(f"{esquema}.lectura")
+        if tabla is not None:
+            return tabla
+        # Las claves foráneas no pueden cruzar archivos en SQLite
+        columnas: List[Column] = [
+            Column(
+                c.name,
+                c.type,
+                primary_key=c.primary_key,
+                nullable=c.nullable,
+            )
+            for c in models.Lectura.__table__.columns
+        ]
+        return Table(
+            "lectura",
+            _metadata,
+            *columnas,
+            Index("ix_lectura_matricula_fecha", "Matricula", "Fecha_y_Hora"),
+            Index("ix_lectura_id_archivo", "ID_Archivo"),
+            Index("ix_lectura_id_lector", "ID_Lector"),
+            Index("ix_lectura_tipo_fuente", "Tipo_Fuente"),
+            schema=esquema,
+            sqlite_autoincrement=True,
+        )
+
+
+def lectura_entity(caso_id: int) -> Any:
+    """
+    Entidad para consultar las lecturas de un caso: `models.Lectura` o un
+    alias sobre la tabla de su shard. Las relaciones no se pueden usar en
+    joins ni joinedload sobre el alias (se cargan al acceder al atributo) y
+    los joins con ArchivosExcel necesitan la condición explícita.
+    """
+    if not is_sharded(caso_id):
+        return models.Lectura
+    entidad = _entities.get(caso_id)
+    if entidad is None:
+        entidad = aliased(
+            models.Lectura,
+            shard_table(caso_id),
+            adapt_on_names=True,
+            name=f"lectura_{shard_schema(caso_id)}",
+        )
+        _entities[caso_id] = entidad
+    return entidad
+
+
+def lectura_entity_for_id(id_lectura: int) -> Any:
+    """Entidad con la que consultar una lectura por su ID (ver `lectura_entity`)"""
+    caso_id = int(id_lectura) >> 32
+    return lectura_entity(caso_id) if caso_id else models.Lectura
+
+
+def lectura_sources(
+    casos: Optional[List[int]] = None,
+) -> List[Tuple[Any, Optional[List[int]]]]:
+    """
+    Entidades de lectura para una consulta sobre varios casos, cada una con
+    los casos que contiene: la tabla compartida y un alias por shard. Sin
+    casos, las de todas las lecturas: la tabla compartida entera (con casos
+    None, sin filtrar por caso) y cada shard.
+    """
+    fuentes: List[Tuple[Any, Optional[List[int]]]] = []
+    if casos is None:
+        fuentes.append((models.Lectura, None))
+        fuentes.extend((lectura_entity(c), [c]) for c in sharded_casos())
+        return fuentes
+    compartidos = [c for c in casos if not is_sharded(c)]
+    if compartidos:
+        fuentes.append((models.Lectura, compartidos))
+    fuentes.extend(
+        (lectura_entity(c), [c]) for c in dict.fromkeys(casos) if is_sharded(c)
+    )
+    return fuentes
+
+
+def create_shard(caso_id: int):
+    """
+    Crea el archivo del shard con su tabla, índices y secuencia de IDs. Se
+    construye en un archivo temporal y se enlaza al definitivo, de modo que
+    nunca sustituye a un shard existente.
+    """
+    ruta = shard_path(caso_id)
+    os.makedirs(SHARDS_DIR, exist_ok=True)
+    temporal = f"{ruta}.{uuid.uuid4().hex}.tmp"
+    motor = create_engine(f"sqlite:///{temporal}", poolclass=NullPool)
+    try:
+        with motor.connect() as conexion:
+            conexion.exec_driver_sql("PRAGMA journal_mode=WAL")
+        with motor.begin() as conexion:
+            conexion = conexion.execution_options(
+                schema_translate_map={shard_schema(caso_id): None}
+            )
+            shard_table(caso_id).create(conexion)
+            conexion.execute(
+                text(
+                    "INSERT INTO sqlite_sequence (name, seq) VALUES ('lectura', :seq)"
+                ),
+                {"seq": int(caso_id) << 32},
+            )
+    finally:
+        motor.dispose()
+    try:
+        if not os.path.exists(ruta):
+            # Restos de un shard borrado que SQLite aplicaría al nuevo archivo
+            _remove_sidecars(ruta)
+        os.link(temporal, ruta)
+        logger.info(f"Shard del caso {caso_id} creado en {ruta}")
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(temporal)
+
+
+def ensure_shard(db: Session, caso_id: int) -> bool:
+    """
+    Con CASE_SHARDS, crea el shard de un caso que aún no tiene lecturas en la
+    tabla compartida. Devuelve si las lecturas del caso van a su shard.
+    """
+    if is_sharded(caso_id):
+        return True
+    if not CASE_SHARDS:
+        return False
+    compartida = db.scalar(
+        select(models.Lectura.ID_Lectura)
+        .join(
+            models.ArchivoExcel,
+            models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+        )
+        .where(models.ArchivoExcel.ID_Caso == caso_id)
+        .limit(1)
+    )
+    if compartida is not None:
+        return False
+    create_shard(caso_id)
+    return True
+
+
+def drop_shard(caso_id: int) -> bool:
+    """
+    Borra el archivo del shard. Devuelve False si el sistema no lo permite
+    (en Windows, mientras otra conexión lo tenga abierto).
+    """
+    ruta = shard_path(caso_id)
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        return True
+    except OSError as e:
+        logger.warning(f"No se pudo borrar el shard del caso {caso_id}: {e}")
+        return False
+    _remove_sidecars(ruta)
+    logger.info(f"Shard del caso {caso_id} eliminado")
+    return True
+
+
+def _remove_sidecars(ruta: str):
+    for sufijo in ("-wal", "-shm"):
+        try:
+            os.remove(ruta + sufijo)
+        except OSError:
+            pass
+
+
+def attach(db: Session, caso_id: int):
+    """
+    Adjunta el shard del caso a la conexión de escritura de la sesión. SQLite
+    no admite ATTACH dentro de una transacción: hay que llamarla antes de la
+    primera escritura si la transacción va a usar el shard.
+    """
+    if is_sharded(caso_id):
+        db.connection().exec_driver_sql(
+            f"SELECT 1 FROM {shard_schema(caso_id)}.lectura LIMIT 0"
+        )
+
+
+def add_lecturas(db: Session, caso_id: int, lecturas: List[models.Lectura]):
+    """Añade lecturas nuevas del caso a la sesión o, si tiene shard, a su tabla"""
+    if not is_sharded(caso_id):
+        db.add_all(lecturas)
+        return
+    tabla = shard_table(caso_id)
+    columnas = [c.name for c in tabla.columns if c.name != "ID_Lectura"]
+    db.execute(
+        tabla.insert(),
+        [{c: getattr(lectura, c) for c in columnas} for lectura in lecturas],
+    )
+
+
+def _detach(dbapi_connection, adjuntos: OrderedDict, caso_id: int) -> bool:
+    try:
+        dbapi_connection.execute(f"DETACH DATABASE {shard_schema(caso_id)}")
+    except sqlite3.OperationalError:
+        # Con sentencias abiertas sobre el shard se reintenta en otra ocasión
+        return False
+    del adjuntos[caso_id]
+    return True
+
+
+def _attach_shards(conn, cursor, statement, parameters, context, executemany):
+    """Adjunta a la conexión los shards que nombra la sentencia"""
+    casos = {int(c) for c in _SCHEMA_RE.findall(statement)}
+    if not casos:
+        return
+    dbapi_connection = cursor.connection
+    adjuntos = conn.info.setdefault(_ATTACHED_KEY, OrderedDict())
+    libre = not dbapi_connection.in_transaction
+    for caso_id in casos:
+        ruta = shard_path(caso_id)
+        try:
+            inodo = os.stat(ruta).st_ino
+        except FileNotFoundError:
+            inodo = None
+        if caso_id in adjuntos:
+            if adjuntos[caso_id] == inodo:
+                adjuntos.move_to_end(caso_id)
+                continue
+            # El archivo se borró o se volvió a crear desde que se adjuntó
+            if not libre or not _detach(dbapi_connection, adjuntos, caso_id):
+                continue
+        if inodo is None or not libre:
+            # SQLite responderá "no such table" con el motivo
+            continue
+        dbapi_connection.execute(
+            f"ATTACH DATABASE ? AS {shard_schema(caso_id)}", (ruta,)
+        )
+        adjuntos[caso_id] = inodo
+
+    if libre:
+        for caso_id in [c for c in adjuntos if c not in casos]:
+            if len(adjuntos) <= MAX_ATTACHED:
+                break
+            _detach(dbapi_connection, adjuntos, caso_id)
+
+
+def install(bind):
+    """Activa el ATTACH bajo demanda de los shards en un engine"""
+    if not event.contains(bind, "before_cursor_execute", _attach_shards):
+        event.listen(bind, "before_cursor_execute", _attach_shards)
+
+
+install(engine)
+install(read_engine)
@@ -1,6 +1,11 @@
-from sqlalchemy import create_engine, event, NullPool
+from functools import partial
+from typing import Any, Callable
+
+import anyio.to_thread
+from anyio.lowlevel import RunVar
+from sqlalchemy import create_engine, event, NullPool, TextClause
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 import psutil
 import logging
 import os
@@ -12,6 +17,22 @@ logger = logging.getLogger(__name__)
 # Define la URL de la base de datos (archivo SQLite en directorio seguro)
 DATABASE_URL = "sqlite:///./database/secure/atrio.db"
 
+# El mismo archivo abierto en sólo lectura para el pool de lectores
+READ_DATABASE_URL = "sqlite:///file:./database/secure/atrio.db?mode=ro&uri=true"
+
+# SQLite admite un único escritor: con más conexiones de escritura éstas sólo
+# esperan el bloqueo dentro de SQLite (busy_timeout). Con una, las escrituras
+# esperan su turno en el pool, que hace de cola de escritura
+WRITER_CONNECTIONS = int(os.getenv("ATRIO_DB_WRITERS", "1"))
+READER_CONNECTIONS = int(os.getenv("ATRIO_DB_READERS", "10"))
+
+# Filas por transacción en las importaciones: cada commit libera el escritor
+WRITE_CHUNK_SIZE = int(os.getenv("ATRIO_WRITE_CHUNK_SIZE", "500"))
+
+# Hilos para las consultas de los endpoints async: tantos como lectores, para
+# que los hilos no esperen conexión
+DB_THREADS = int(os.getenv("ATRIO_DB_THREADS", str(READER_CONNECTIONS)))
+
 # Crea la clase base para los modelos
 Base = declarative_base()
 
@@ -32,7 +53,7 @@ def _log_cache_config():
 
 _log_cache_config()
 
-# Configuración segura del motor con límites de conexión
+# Configuración segura del motor de escritura con límites de conexión
 engine = create_engine(
     DATABASE_URL,
     connect_args={
@@ -40,8 +61,8 @@ engine = create_engine(
         "timeout": 30,  # Reducido a 30 segundos para mayor seguridad
     },
     # Configuración de pool segura con límites
-    pool_size=10,  # Máximo 10 conexiones simultáneas
-    max_overflow=5,  # Máximo 5 conexiones adicionales
+    pool_size=WRITER_CONNECTIONS,  # Un único escritor por defecto
+    max_overflow=0,  # Sin conexiones adicionales: las escrituras hacen cola
     pool_timeout=30,  # Timeout de 30 segundos para obtener conexión
     pool_recycle=1800,  # Reciclar conexiones cada 30 minutos
     pool_pre_ping=True,  # Verificar conexiones antes de usar
@@ -72,11 +93,84 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor.close()
 
 
+# Motor de sólo lectura: con WAL los lectores no bloquean al escritor ni
+# esperan por él, así que pueden ser varios
+read_engine = create_engine(
+    READ_DATABASE_URL,
+    connect_args={"check_same_thread": False, "timeout": 30},
+    pool_size=READER_CONNECTIONS,
+    max_overflow=5,
+    pool_timeout=30,
+    pool_recycle=1800,
+    pool_pre_ping=True,
+    echo=False,
+)
+
+
+@event.listens_for(read_engine, "connect")
+def set_sqlite_read_pragma(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # Rechazar cualquier escritura aunque llegue por error a este pool
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.execute(f"PRAGMA cache_size={CACHE_SIZE}")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA case_sensitive_like=ON")
+    cursor.close()
+
+
+# Clave en Session.info: la transacción actual ya usa el escritor
+_WRITER_KEY = "atrio_writer"
+
+
+def _is_read(clause) -> bool:
+    """Si la sentencia sólo lee"""
+    if clause is None:
+        return False
+    if getattr(clause, "is_select", False):
+        return True
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip().upper().startswith("SELECT")
+    return False
+
+
+class RoutingSession(Session):
+    """
+    Sesión que envía las lecturas al pool de lectores y el resto al escritor.
+
+    En cuanto una transacción escribe (flush, DML, `connection()` sin
+    sentencia) sus lecturas siguientes van también al escritor, para que vean
+    sus propios cambios sin confirmar. Al terminar la transacción vuelve a
+    leer de los lectores. Sin `read_bind` se comporta como una sesión normal.
+    """
+
+    def __init__(self, *args, read_bind=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read_bind = read_bind
+
+    def get_bind(self, mapper=None, *, clause=None, **kw):
+        if self.read_bind is not None and not (
+            self.info.get(_WRITER_KEY) or self._flushing or not _is_read(clause)
+        ):
+            return self.read_bind
+        self.info[_WRITER_KEY] = True
+        return super().get_bind(mapper, clause=clause, **kw)
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _release_writer(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_WRITER_KEY, None)
+
+
 # Crea una fábrica de sesiones con optimizaciones
 SessionLocal = sessionmaker(
+    class_=RoutingSession,
     autocommit=False,
     autoflush=False,
     bind=engine,
+    read_bind=read_engine,
     # Configuraciones de seguridad
     expire_on_commit=False,  # Mejora rendimiento en aplicaciones con muchas sesiones
 )
@@ -84,6 +178,28 @@ SessionLocal = sessionmaker(
 # Contador de conexiones activas para monitoreo
 active_connections = 0
 
+# Un limitador por bucle de eventos, como el del threadpool de anyio
+_db_threads: RunVar[anyio.CapacityLimiter] = RunVar("atrio_db_threads")
+
+
+async def run_db(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Ejecuta `func`, que usa una sesión síncrona, en el pool de hilos de base
+    de datos (DB_THREADS) sin bloquear el bucle de eventos.
+
+    Los endpoints `async def` que consultan con SQLAlchemy deben pasar por
+    aquí: una consulta lenta ejecutada en el bucle congela todas las demás
+    peticiones del worker.
+    """
+    try:
+        limiter = _db_threads.get()
+    except LookupError:
+        limiter = anyio.CapacityLimiter(DB_THREADS)
+        _db_threads.set(limiter)
+    return await anyio.to_thread.run_sync(
+        partial(func, *args, **kwargs), limiter=limiter
+    )
+
 
 # Función para obtener una sesión de base de datos (dependencia de FastAPI)
 def get_db():
@@ -118,6 +234,7 @@ def get_connection_stats():
     """Obtiene estadísticas de las conexiones de base de datos"""
     try:
         pool = engine.pool
+        read_pool = read_engine.pool
         return {
             "active_connections": active_connections,
             "pool_size": pool.size(),
@@ -125,6 +242,12 @@ def get_connection_stats():
             "checked_out": pool.checkedout(),
             "overflow": pool.overflow(),
             "total_connections": pool.size() + pool.overflow(),
+            "readers": {
+                "pool_size": read_pool.size(),
+                "checked_in": read_pool.checkedin(),
+                "checked_out": read_pool.checkedout(),
+                "overflow": read_pool.overflow(),
+            },
         }
     except Exception as e:
         logger.error(f"Error obteniendo estadísticas de conexión: {e}")
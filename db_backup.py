@@ -0,0 +1,634 @@
+"""
+Copias de seguridad y restauración en caliente de la base de datos
+
+Las copias se hacían con un `PRAGMA wal_checkpoint(TRUNCATE)`, que espera a
+que no haya escrituras, y copiando el archivo con `shutil.copy2` mientras la
+aplicación podía estar escribiendo en él. La restauración sobrescribía el
+archivo abierto por el pool. Aquí se usa la API de backup de SQLite
+(`sqlite3.Connection.backup`) desde la cola de trabajos, con el progreso en
+`task_statuses`:
+
+- la copia lee una instantánea de la base de datos dentro de una transacción
+  de lectura: con WAL no bloquea a los escritores y no vuelve a empezar si
+  escriben mientras tanto;
+- se copia en pasos de BACKUP_PAGES páginas con una pausa de BACKUP_SLEEP
+  segundos entre pasos, para repartir la E/S con las peticiones, y se puede
+  cancelar entre pasos;
+- con compresión "zstd" (ATRIO_BACKUP_COMPRESSION o el parámetro del
+  endpoint) el resultado se comprime por bloques a `.db.zst`;
+- la restauración copia el backup sobre la base de datos con la misma API,
+  en una única transacción de escritura: los lectores ven los datos
+  anteriores hasta que termina y los escritores esperan su turno. Después
+  las versiones de datos (version_datos) se suben por encima de las que
+  había, para que ningún ETag anterior valga para los datos restaurados.
+
+Si hay casos con shard propio (case_shards), sus lecturas no están en
+atrio.db: el backup es entonces un `.tar` (o `.tar.zst`) con la copia de
+atrio.db y la de cada shard, hechas igual que la anterior, una tras otra.
+Restaurar un backup deja exactamente sus shards: se copian sobre los
+actuales y se borran los de casos que el backup no tiene. Un backup `.db`
+no admite shards: crearlo con shards presentes es un error.
+"""
+
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import tarfile
+import time
+import uuid
+from datetime import datetime
+from typing import IO, Any, Callable, Dict, List, Optional, Tuple, cast
+
+import analytics
+from cache_manager import cache_manager
+from case_shards import drop_shard, shard_path, shard_schema, sharded_casos
+from database_config import engine
+from job_queue import (
+    KIND_BACKUP,
+    JobCancelled,
+    check_cancelled,
+    in_api_process,
+    job_queue,
+)
+from shared_state import mark_task_completed, task_statuses
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - dependencia opcional
+    zstandard = None
+
+logger = logging.getLogger("atrio.db_backup")
+
+# Páginas por paso de la copia y pausa entre pasos
+BACKUP_PAGES = int(os.environ.get("ATRIO_BACKUP_PAGES", 1024))
+BACKUP_SLEEP = float(os.environ.get("ATRIO_BACKUP_SLEEP", 0.01))
+
+COMPRESSION_NONE = "none"
+COMPRESSION_ZSTD = "zstd"
+BACKUP_COMPRESSION = os.environ.get("ATRIO_BACKUP_COMPRESSION", COMPRESSION_NONE)
+ZSTD_LEVEL = 3
+# Bloque de lectura al comprimir, descomprimir y recibir un backup
+CHUNK_SIZE = 1024 * 1024
+
+# Una URL sqlite:/// de archivo siempre tiene la ruta
+DATABASE_PATH = cast(str, engine.url.database)
+BACKUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backups")
+BACKUP_PREFIX = "atrio_backup_"
+BACKUP_SUFFIXES = (".db", ".db.zst", ".tar", ".tar.zst")
+# Backups con shards: archivos dentro del .tar
+SET_SUFFIXES = (".tar", ".tar.zst")
+SET_DATABASE = "atrio.db"
+SET_SHARDS_DIR = "casos"
+# Archivos a medio escribir: no aparecen en la lista de backups
+PARTIAL_SUFFIX = ".part"
+
+BACKUP_STAGE = "backup"
+RESTORE_STAGE = "restore"
+
+# Tablas cuyo número de filas se informa tras restaurar
+RESTORE_CHECK_TABLES = ("usuarios", "Grupos", "Casos")
+# Contadores de version_datos (tabla, columna)
+VERSION_COLUMNS = (("Casos", "Version_Datos"), ("versiones_datos", "Version"))
+
+# Cabeceras para reconocer un archivo antes de encolar la restauración
+SQLITE_HEADER = b"SQLite format 3\x00"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# Cabecera ustar (y pax) de tarfile: en la posición 257 del primer bloque
+TAR_MAGIC = b"ustar"
+TAR_MAGIC_OFFSET = 257
+
+
+def compression_available(compression: str) -> bool:
+    if compression == COMPRESSION_NONE:
+        return True
+    return compression == COMPRESSION_ZSTD and zstandard is not None
+
+
+def backup_timestamp(filename: str) -> Optional[str]:
+    """Marca de tiempo de un archivo de backup, o None si no lo es"""
+    if not filename.startswith(BACKUP_PREFIX):
+        return None
+    for sufijo in BACKUP_SUFFIXES:
+        if filename.endswith(sufijo):
+            return filename[len(BACKUP_PREFIX) : -len(sufijo)]
+    return None
+
+
+def backup_suffix(compression: str) -> str:
+    """`.db` o, si hay casos con shard, `.tar`; con `.zst` si se comprime"""
+    sufijo = ".tar" if sharded_casos() else ".db"
+    return f"{sufijo}.zst" if compression == COMPRESSION_ZSTD else sufijo
+
+
+def backup_filename(compression: str) -> str:
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{BACKUP_PREFIX}{timestamp}{backup_suffix(compression)}"
+
+
+def file_kind(path: str) -> Optional[str]:
+    """Tipo del archivo según su cabecera: "sqlite", "zstd", "tar" o None"""
+    with open(path, "rb") as f:
+        cabecera = f.read(TAR_MAGIC_OFFSET + len(TAR_MAGIC))
+    if cabecera.startswith(SQLITE_HEADER):
+        return "sqlite"
+    if cabecera.startswith(ZSTD_MAGIC):
+        return "zstd"
+    if cabecera[TAR_MAGIC_OFFSET:] == TAR_MAGIC:
+        return "tar"
+    return None
+
+
+def _copy_pages(
+    source: sqlite3.Connection,
+    target: sqlite3.Connection,
+    on_step: Optional[Callable[[int, int], None]],
+    sleep: float,
+):
+    """Copia `source` sobre `target` por pasos de BACKUP_PAGES páginas"""
+
+    def progreso(status, remaining, total):
+        if on_step is not None:
+            on_step(total - remaining, total)
+        if remaining and sleep:
+            time.sleep(sleep)
+
+    source.backup(target, pages=BACKUP_PAGES, progress=progreso)
+
+
+def online_backup(
+    target_path: str,
+    source_path: Optional[str] = None,
+    on_step: Optional[Callable[[int, int], None]] = None,
+    sleep: Optional[float] = None,
+):
+    """
+    Copia la base de datos en `target_path`, que no debe existir. La copia es
+    la instantánea del inicio: se lee dentro de una transacción de lectura.
+    """
+    source = sqlite3.connect(source_path or DATABASE_PATH, isolation_level=None)
+    target = sqlite3.connect(target_path)
+    try:
+        source.execute("BEGIN")
+        # La transacción de lectura empieza con la primera lectura
+        source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        _copy_pages(source, target, on_step, BACKUP_SLEEP if sleep is None else sleep)
+        source.execute("COMMIT")
+        # La copia hereda el modo WAL: en modo rollback es un único archivo,
+        # sin -wal ni -shm al abrirlo
+        target.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        target.close()
+        source.close()
+
+
+def _compress(path: str, target_path: str):
+    compresor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    with open(path, "rb") as origen, open(target_path, "wb") as destino:
+        compresor.copy_stream(origen, destino, read_size=CHUNK_SIZE)
+
+
+def _decompress(path: str, target_path: str):
+    if zstandard is None:
+        raise RuntimeError(
+            "El backup está comprimido con zstd y zstandard no está instalado"
+        )
+    descompresor = zstandard.ZstdDecompressor()
+    with open(path, "rb") as origen, open(target_path, "wb") as destino:
+        descompresor.copy_stream(origen, destino, read_size=CHUNK_SIZE)
+
+
+def _page_count(path: str) -> int:
+    conexion = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        (paginas,) = conexion.execute("PRAGMA page_count").fetchone()
+        return int(paginas)
+    finally:
+        conexion.close()
+
+
+def _backup_set(
+    target_path: str,
+    casos: List[int],
+    on_step: Optional[Callable[[int, int], None]],
+    sleep: Optional[float],
+):
+    """
+    Escribe en `target_path` un .tar con la copia de atrio.db y la del shard
+    de cada caso. El progreso cuenta las páginas de todas las copias.
+    """
+    archivos = [(SET_DATABASE, DATABASE_PATH)] + [
+        (f"{SET_SHARDS_DIR}/{shard_schema(c)}.db", shard_path(c)) for c in casos
+    ]
+    paginas = [_page_count(origen) for _, origen in archivos]
+    total = sum(paginas)
+    hechas = 0
+    with tarfile.open(target_path, "w") as tar:
+        for (nombre, origen), estimadas in zip(archivos, paginas):
+
+            def paso(copiadas: int, _total: int, base: int = hechas):
+                if on_step is not None:
+                    on_step(min(base + copiadas, total), total)
+
+            copia = f"{target_path}.{uuid.uuid4().hex}{PARTIAL_SUFFIX}"
+            try:
+                online_backup(copia, source_path=origen, on_step=paso, sleep=sleep)
+                tar.add(copia, arcname=nombre)
+            finally:
+                if os.path.exists(copia):
+                    os.remove(copia)
+            hechas += estimadas
+
+
+def backup_database(
+    target_path: str,
+    compression: str = COMPRESSION_NONE,
+    on_step: Optional[Callable[[int, int], None]] = None,
+    sleep: Optional[float] = None,
+) -> str:
+    """
+    Crea el backup en `target_path`, comprimido con zstd si se pide: un .tar
+    con los shards si el nombre acaba en .tar o .tar.zst. Se escribe en un
+    archivo `.part` que sólo se renombra al terminar.
+    """
+    if not compression_available(compression):
+        raise ValueError(f"Compresión no disponible: {compression}")
+    casos = sharded_casos()
+    es_conjunto = target_path.endswith(SET_SUFFIXES)
+    if casos and not es_conjunto:
+        raise ValueError(
+            f"Hay casos con shard ({', '.join(map(str, casos))}): el backup "
+            "debe ser un .tar que los incluya"
+        )
+    os.makedirs(os.path.dirname(os.path.abspath(target_path)), exist_ok=True)
+    copia = f"{target_path}.{uuid.uuid4().hex}{PARTIAL_SUFFIX}"
+    comprimida = f"{copia}.zst"
+    try:
+        if es_conjunto:
+            _backup_set(copia, casos, on_step, sleep)
+        else:
+            online_backup(copia, on_step=on_step, sleep=sleep)
+        if compression == COMPRESSION_ZSTD:
+            _compress(copia, comprimida)
+            os.replace(comprimida, target_path)
+        else:
+            os.replace(copia, target_path)
+    finally:
+        for ruta in (copia, comprimida):
+            if os.path.exists(ruta):
+                os.remove(ruta)
+    return target_path
+
+
+def _extract_set(path: str, directorio: str) -> Tuple[str, Dict[int, str]]:
+    """
+    Extrae un backup .tar en `directorio`. Devuelve la ruta de atrio.db y la
+    del shard de cada caso; cualquier otro miembro hace el backup inválido.
+    """
+    base = None
+    shards = {}
+    with tarfile.open(path, "r") as tar:
+        for miembro in tar:
+            carpeta, _, nombre = miembro.name.rpartition("/")
+            caso = nombre[len("caso_") : -len(".db")]
+            if miembro.isfile() and miembro.name == SET_DATABASE:
+                destino = os.path.join(directorio, SET_DATABASE)
+                base = destino
+            elif (
+                miembro.isfile()
+                and carpeta == SET_SHARDS_DIR
+                and nombre.startswith("caso_")
+                and nombre.endswith(".db")
+                and caso.isdigit()
+            ):
+                destino = os.path.join(directorio, nombre)
+                shards[int(caso)] = destino
+            else:
+                raise ValueError(f"Miembro inesperado en el backup: {miembro.name}")
+            # Se escribe en una ruta propia, nunca en la del miembro
+            # Sólo hay miembros regulares, que siempre tienen contenido
+            origen = cast(IO[bytes], tar.extractfile(miembro))
+            with origen, open(destino, "wb") as copia:
+                while bloque := origen.read(CHUNK_SIZE):
+                    copia.write(bloque)
+    if base is None:
+        raise ValueError(f"El backup no contiene {SET_DATABASE}")
+    return base, shards
+
+
+def restore_database(
+    backup_path: str,
+    on_step: Optional[Callable[[int, int], None]] = None,
+    sleep: Optional[float] = None,
+):
+    """
+    Sustituye el contenido de la base de datos por el del backup (SQLite o
+    .tar con shards, comprimidos o no con zstd) en una única transacción, y
+    después los shards por los del backup.
+    """
+    tipo = file_kind(backup_path)
+    if tipo is None:
+        raise ValueError("El archivo no es una base de datos SQLite válida")
+    pausa = BACKUP_SLEEP if sleep is None else sleep
+    origen_path = backup_path
+    temporal = f"{backup_path}.{uuid.uuid4().hex}{PARTIAL_SUFFIX}"
+    descomprimido = f"{temporal}.db"
+    shards: Dict[int, str] = {}
+    try:
+        if tipo == "zstd":
+            _decompress(backup_path, descomprimido)
+            origen_path = descomprimido
+            tipo = file_kind(descomprimido)
+            if tipo not in ("sqlite", "tar"):
+                raise ValueError("El archivo no es una base de datos SQLite válida")
+        if tipo == "tar":
+            os.makedirs(temporal)
+            origen_path, shards = _extract_set(origen_path, temporal)
+            # Un miembro que no es SQLite falla aquí, antes de tocar nada
+            for ruta in [origen_path, *shards.values()]:
+                if file_kind(ruta) != "sqlite":
+                    raise ValueError(f"{os.path.basename(ruta)} no es SQLite")
+        source = sqlite3.connect(f"file:{origen_path}?mode=ro", uri=True)
+        target = sqlite3.connect(DATABASE_PATH, timeout=30)
+        try:
+            # Falla aquí, y no a mitad de la restauración, si no es SQLite
+            source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+            maximos = _max_versions(target)
+            _copy_pages(source, target, on_step, pausa)
+            _advance_versions(target, maximos)
+        finally:
+            target.close()
+            source.close()
+            _remove_sidecars(origen_path)
+        _restore_shards(shards, pausa)
+    finally:
+        if os.path.isdir(temporal):
+            shutil.rmtree(temporal)
+        if os.path.exists(descomprimido):
+            os.remove(descomprimido)
+    # Los datos cacheados y las instantáneas analíticas son de la base anterior
+    in_api_process(cache_manager.clear_pattern, "atrio:*")
+    analytics.drop_snapshots()
+
+
+def _restore_shards(shards: Dict[int, str], sleep: float):
+    """
+    Deja los shards del backup: copia cada uno sobre el actual (o lo crea) y
+    borra los de los casos que el backup no tiene.
+    """
+    for caso_id, origen_path in sorted(shards.items()):
+        destino = shard_path(caso_id)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        source = sqlite3.connect(f"file:{origen_path}?mode=ro", uri=True)
+        target = sqlite3.connect(destino, timeout=30)
+        try:
+            _copy_pages(source, target, None, sleep)
+            target.execute("PRAGMA journal_mode=WAL")
+        finally:
+            target.close()
+            source.close()
+            _remove_sidecars(origen_path)
+    sobrantes = [c for c in sharded_casos() if c not in shards]
+    no_borrados = [c for c in sobrantes if not drop_shard(c)]
+    if no_borrados:
+        raise RuntimeError(
+            "No se pudieron borrar los shards de los casos "
+            f"{', '.join(map(str, no_borrados))}, que no están en el backup"
+        )
+
+
+def _max_versions(conexion: sqlite3.Connection) -> Dict[str, int]:
+    """Versión de datos más alta de cada tabla de versiones (0 si no existe)"""
+    maximos = {}
+    for tabla, columna in VERSION_COLUMNS:
+        try:
+            fila = conexion.execute(f'SELECT max("{columna}") FROM "{tabla}"')
+            maximos[tabla] = fila.fetchone()[0] or 0
+        except sqlite3.OperationalError:
+            maximos[tabla] = 0
+    return maximos
+
+
+def _advance_versions(conexion: sqlite3.Connection, maximos: Dict[str, int]):
+    """
+    Deja las versiones restauradas por encima de las anteriores: si no, un
+    ETag o una clave de cache de antes de restaurar valdría para otros datos
+    """
+    for tabla, columna in VERSION_COLUMNS:
+        try:
+            conexion.execute(
+                f'UPDATE "{tabla}" SET "{columna}" = "{columna}" + ?',
+                (maximos[tabla] + 1,),
+            )
+        except sqlite3.OperationalError:
+            # Backup sin esa tabla
+            pass
+    conexion.commit()
+
+
+def _remove_sidecars(path: str):
+    """Archivos -wal y -shm que deja abrir en sólo lectura un backup en modo WAL"""
+    for sufijo in ("-wal", "-shm"):
+        try:
+            os.remove(path + sufijo)
+        except OSError:
+            pass
+
+
+def _counts() -> Dict[str, int]:
+    """Filas de las tablas principales, para comprobar la restauración"""
+    conexion = sqlite3.connect(f"file:{DATABASE_PATH}?mode=ro", uri=True)
+    try:
+        return {
+            tabla: conexion.execute(f'SELECT COUNT(*) FROM "{tabla}"').fetchone()[0]
+            for tabla in RESTORE_CHECK_TABLES
+        }
+    except sqlite3.Error as e:
+        logger.warning(f"No se pudieron contar las filas restauradas: {e}")
+        return {}
+    finally:
+        conexion.close()
+
+
+def _md5(path: str) -> str:
+    hasher = hashlib.md5()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(CHUNK_SIZE), b""):
+            hasher.update(bloque)
+    return hasher.hexdigest()
+
+
+# --- Trabajos de la cola ---
+
+
+def new_backup_task(stage: str, message: str) -> str:
+    """Crea la entrada de la tarea de backup o restauración en `task_statuses`"""
+    task_id = f"{stage}-{uuid.uuid4().hex[:12]}"
+    task_statuses[task_id] = {
+        "status": "pending",
+        "message": message,
+        "progress": 0,
+        "stage": stage,
+    }
+    return task_id
+
+
+class _Progress:
+    """Progreso de una copia en `task_statuses`"""
+
+    def __init__(self, task_id: str, stage: str):
+        self.task_id = task_id
+        self.estado = task_statuses.setdefault(task_id, {})
+        self.estado.update(status="processing", progress=0, stage=stage)
+        self.phase("", 0, 100)
+
+    def phase(self, message: str, desde: float, hasta: float):
+        """La copia siguiente ocupa de `desde` a `hasta` por ciento"""
+        self.message = message
+        self.desde = desde
+        self.hasta = hasta
+        self.estado.update(message=message, progress=desde)
+
+    def __call__(self, copiadas: int, total: int):
+        self.estado["message"] = f"{self.message} ({copiadas} de {total} páginas)"
+        if total:
+            avance = copiadas / total * (self.hasta - self.desde)
+            self.estado["progress"] = self.desde + avance
+        check_cancelled(self.task_id)
+
+    def completed(self, message: str, result: Dict[str, Any]):
+        self.estado.update(
+            status="completed",
+            message=message,
+            progress=100,
+            result=result,
+            stage=None,
+        )
+        mark_task_completed(self.task_id)
+
+    def failed(self, message: str):
+        self.estado.update(status="failed", message=message, stage=None)
+
+
+def run_backup(task_id: str, filename: str, compression: str) -> Dict[str, Any]:
+    """Crea el backup `filename` en BACKUP_DIR con progreso en `task_statuses`"""
+    inicio = time.perf_counter()
+    progreso = _Progress(task_id, BACKUP_STAGE)
+    # Con compresión, el último 10 % es comprimir la copia
+    hasta = 90 if compression == COMPRESSION_ZSTD else 100
+    progreso.phase("Copiando la base de datos", 0, hasta)
+    ruta = os.path.join(BACKUP_DIR, filename)
+    try:
+        backup_database(ruta, compression, on_step=progreso)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        logger.error(f"[Task {task_id}] Error creando el backup: {e}", exc_info=True)
+        progreso.failed(f"Error creando el backup: {e}")
+        raise
+    resumen = {
+        "backup_path": ruta,
+        "filename": filename,
+        "size_bytes": os.path.getsize(ruta),
+        "compression": compression,
+        "seconds": round(time.perf_counter() - inicio, 3),
+    }
+    logger.info(f"[Task {task_id}] Backup creado: {resumen}")
+    progreso.completed("Backup creado exitosamente", resumen)
+    return resumen
+
+
+def run_restore(
+    task_id: str, backup_path: str, remove_source: bool = False
+) -> Dict[str, Any]:
+    """
+    Restaura la base de datos desde `backup_path` tras hacer un backup del
+    estado actual (pre_restore_backup_*). Con `remove_source` se borra el
+    archivo de origen al terminar (backups subidos).
+    """
+    inicio = time.perf_counter()
+    progreso = _Progress(task_id, RESTORE_STAGE)
+    try:
+        logger.info(f"[Task {task_id}] MD5 de {backup_path}: {_md5(backup_path)}")
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        previo = os.path.join(
+            os.path.dirname(BACKUP_DIR),
+            f"pre_restore_backup_{timestamp}{backup_suffix(COMPRESSION_NONE)}",
+        )
+        progreso.phase("Copiando el estado actual", 0, 40)
+        backup_database(previo, on_step=progreso)
+        logger.info(f"[Task {task_id}] Backup pre-restauración creado: {previo}")
+
+        progreso.phase("Restaurando la base de datos", 40, 100)
+        restore_database(backup_path, on_step=progreso)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        logger.error(
+            f"[Task {task_id}] Error restaurando la base de datos: {e}", exc_info=True
+        )
+        progreso.failed(f"Error restaurando la base de datos: {e}")
+        raise
+    finally:
+        if remove_source and os.path.exists(backup_path):
+            os.remove(backup_path)
+
+    resumen = {
+        "pre_restore_backup": previo,
+        "final_counts": _counts(),
+        "seconds": round(time.perf_counter() - inicio, 3),
+    }
+    logger.info(f"[Task {task_id}] Base de datos restaurada: {resumen}")
+    progreso.completed("Base de datos restaurada exitosamente", resumen)
+    return resumen
+
+
+def submit_backup(compression: str = BACKUP_COMPRESSION) -> str:
+    """Encola un backup y devuelve el ID de la tarea"""
+    task_id = new_backup_task(BACKUP_STAGE, "Backup en cola")
+    job_queue.submit(
+        KIND_BACKUP,
+        run_backup,
+        task_id,
+        backup_filename(compression),
+        compression,
+        task_id=task_id,
+    )
+    return task_id
+
+
+def submit_restore(backup_path: str, remove_source: bool = False) -> str:
+    """Encola la restauración desde un backup y devuelve el ID de la tarea"""
+    task_id = new_backup_task(RESTORE_STAGE, "Restauración en cola")
+    job_queue.submit(
+        KIND_BACKUP,
+        run_restore,
+        task_id,
+        backup_path,
+        remove_source,
+        task_id=task_id,
+    )
+    return task_id
+
+
+def list_backups():
+    """Backups de BACKUP_DIR, del más reciente al más antiguo"""
+    backups = []
+    for ruta in glob.glob(os.path.join(BACKUP_DIR, f"{BACKUP_PREFIX}*")):
+        filename = os.path.basename(ruta)
+        timestamp = backup_timestamp(filename)
+        if timestamp is None:
+            continue
+        backups.append(
+            {
+                "filename": filename,
+                "path": ruta,
+                "timestamp": timestamp,
+                "size_bytes": os.path.getsize(ruta),
+                "created_at": datetime.strptime(timestamp, "%Y%m%d_%H%M%S").isoformat(),
+                "compressed": filename.endswith(".zst"),
+            }
+        )
+    return sorted(backups, key=lambda x: x["timestamp"], reverse=True)
@@ -1,54 +1,248 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
-from models import GpsCapa
+import zlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple, cast
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session, defer
+from case_shards import lectura_entity
+from models import ArchivoExcel, GpsCapa
 from schemas import GpsCapaCreate, GpsCapaUpdate, GpsCapaOut
 from database_config import get_db
+from gps_simplificacion import (
+    ZOOM_MAXIMO,
+    filtrar_por_nivel,
+    niveles_detalle_lecturas,
+    simplificar_lecturas,
+)
 
 router = APIRouter()
 
+# Límite de parámetros por consulta IN en SQLite
+LOTE_IDS = 900
+
+# Columnas de `lectura` con las que se reconstruyen los puntos de una capa
+COLUMNAS_LECTURA = (
+    "ID_Lectura",
+    "ID_Archivo",
+    "Matricula",
+    "Fecha_y_Hora",
+    "Velocidad",
+    "Coordenada_X",
+    "Coordenada_Y",
+    "Tipo_Fuente",
+)
+
+# Columnas con los puntos, que no hacen falta para listar las capas
+COLUMNAS_PUNTOS: Tuple[Any, ...] = (
+    GpsCapa.lecturas,
+    GpsCapa.ids_lectura,
+    GpsCapa.niveles_detalle,
+)
+
+
+def codificar_ids(ids: Sequence[int]) -> bytes:
+    """IDs en orden como diferencias int64 comprimidas (unos pocos bytes por punto)"""
+    valores = np.asarray(ids, dtype=np.int64)
+    return zlib.compress(np.diff(valores, prepend=0).astype("<i8").tobytes())
+
+
+def decodificar_ids(datos: bytes) -> List[int]:
+    ids: List[int] = np.cumsum(
+        np.frombuffer(zlib.decompress(datos), dtype="<i8")
+    ).tolist()
+    return ids
+
+
+def _campo_dict(lectura: dict, clave: str):
+    return lectura.get(clave)
+
+
+def _cargar_lecturas(
+    db: Session, caso_id: int, ids: Sequence[int]
+) -> Dict[int, Dict[str, Any]]:
+    """Lecturas del caso con esos IDs, por lotes, indexadas por ID_Lectura"""
+    # La tabla compartida o la del shard del caso
+    Lectura = lectura_entity(caso_id)
+    columnas = [getattr(Lectura, nombre) for nombre in COLUMNAS_LECTURA]
+    encontradas = {}
+    for inicio in range(0, len(ids), LOTE_IDS):
+        filas = (
+            db.query(*columnas)
+            .join(ArchivoExcel, Lectura.ID_Archivo == ArchivoExcel.ID_Archivo)
+            .filter(
+                ArchivoExcel.ID_Caso == caso_id,
+                Lectura.ID_Lectura.in_(ids[inicio : inicio + LOTE_IDS]),
+            )
+            .all()
+        )
+        for fila in filas:
+            encontradas[fila.ID_Lectura] = fila._asdict()
+    return encontradas
+
+
+def _resolver_puntos(
+    db: Session, db_capa: GpsCapa
+) -> Tuple[List[dict], Optional[List[int]]]:
+    """Lecturas de la capa y sus niveles de detalle, resolviendo las referencias"""
+    niveles = cast(Optional[List[int]], db_capa.niveles_detalle)
+    if db_capa.ids_lectura is None:
+        lecturas = cast(Optional[List[dict]], db_capa.lecturas) or []
+        if niveles and len(niveles) != len(lecturas):
+            niveles = None
+        return lecturas, niveles
+
+    ids = decodificar_ids(cast(bytes, db_capa.ids_lectura))
+    encontradas = _cargar_lecturas(db, cast(int, db_capa.caso_id), ids)
+    if niveles and len(niveles) != len(ids):
+        niveles = None
+    lecturas, niveles_vigentes = [], []
+    for posicion, id_lectura in enumerate(ids):
+        # Las lecturas borradas con su archivo desaparecen de la capa
+        lectura = encontradas.get(id_lectura)
+        if lectura is None:
+            continue
+        lecturas.append(lectura)
+        if niveles:
+            niveles_vigentes.append(niveles[posicion])
+    return lecturas, niveles_vigentes if niveles else None
+
+
+def _guardar_puntos(db: Session, db_capa: GpsCapa, capa: GpsCapaCreate):
+    """Guarda los puntos de la capa como referencias a `lectura` si es posible"""
+    ids = capa.ids_lectura
+    if ids is None and capa.lecturas is not None:
+        if all(isinstance(l.get("ID_Lectura"), int) for l in capa.lecturas):
+            ids = [l["ID_Lectura"] for l in capa.lecturas]
+
+    puntos: Dict[str, Any]
+    if ids is not None:
+        encontradas = _cargar_lecturas(db, cast(int, db_capa.caso_id), ids)
+        ids = [i for i in ids if i in encontradas]
+        lecturas = [encontradas[i] for i in ids]
+        puntos = {"ids_lectura": codificar_ids(ids), "lecturas": None}
+    else:
+        # Puntos sin ID_Lectura: no hay a qué referenciar, se guardan tal cual
+        lecturas = capa.lecturas or []
+        puntos = {"ids_lectura": None, "lecturas": lecturas}
+    puntos["num_lecturas"] = len(lecturas)
+    puntos["niveles_detalle"] = niveles_detalle_lecturas(lecturas, campo=_campo_dict)
+    for key, value in puntos.items():
+        setattr(db_capa, key, value)
+
+
+def _capa_out(db_capa: GpsCapa, lecturas: Optional[List[dict]] = None) -> GpsCapaOut:
+    return GpsCapaOut(
+        id=cast(int, db_capa.id),
+        caso_id=cast(int, db_capa.caso_id),
+        nombre=cast(str, db_capa.nombre),
+        color=cast(str, db_capa.color),
+        activa=cast(bool, db_capa.activa),
+        filtros=cast(dict, db_capa.filtros),
+        descripcion=cast(Optional[str], db_capa.descripcion),
+        num_lecturas=cast(Optional[int], db_capa.num_lecturas) or 0,
+        lecturas=lecturas,
+    )
+
+
+def _capa_con_puntos(
+    db: Session,
+    db_capa: GpsCapa,
+    zoom: Optional[int],
+    tolerancia_m: Optional[float],
+) -> GpsCapaOut:
+    """Capa con sus lecturas, simplificadas si se indica zoom o tolerancia"""
+    lecturas, niveles = _resolver_puntos(db, db_capa)
+    if tolerancia_m is not None:
+        lecturas = simplificar_lecturas(
+            lecturas, tolerancia_m=tolerancia_m, campo=_campo_dict
+        )
+    elif zoom is not None and niveles is not None:
+        lecturas = filtrar_por_nivel(lecturas, niveles, zoom)
+    elif zoom is not None:
+        # Capas guardadas antes de precalcular los niveles de detalle
+        lecturas = simplificar_lecturas(lecturas, zoom=zoom, campo=_campo_dict)
+    return _capa_out(db_capa, lecturas)
+
+
+def _get_capa_or_404(db: Session, caso_id: int, capa_id: int) -> GpsCapa:
+    db_capa = (
+        db.query(GpsCapa)
+        .filter(GpsCapa.id == capa_id, GpsCapa.caso_id == caso_id)
+        .first()
+    )
+    if not db_capa:
+        raise HTTPException(status_code=404, detail="Capa no encontrada")
+    return db_capa
+
 
 @router.get("/casos/{caso_id}/gps-capas", response_model=List[GpsCapaOut])
-def get_gps_capas(caso_id: int, db: Session = Depends(get_db)):
-    return db.query(GpsCapa).filter(GpsCapa.caso_id == caso_id).all()
+def get_gps_capas(
+    caso_id: int,
+    incluir_lecturas: bool = Query(
+        False, description="Devolver también los puntos de cada capa"
+    ),
+    zoom: Optional[int] = Query(
+        None, ge=0, le=ZOOM_MAXIMO, description="Simplificar las trazas para este zoom"
+    ),
+    tolerancia_m: Optional[float] = Query(
+        None, gt=0, description="Tolerancia de simplificación en metros"
+    ),
+    db: Session = Depends(get_db),
+):
+    """Capas GPS del caso; por defecto sólo sus metadatos"""
+    query = db.query(GpsCapa).filter(GpsCapa.caso_id == caso_id)
+    if not incluir_lecturas:
+        query = query.options(*(defer(columna) for columna in COLUMNAS_PUNTOS))
+        return [_capa_out(capa) for capa in query.all()]
+    return [_capa_con_puntos(db, capa, zoom, tolerancia_m) for capa in query.all()]
+
+
+@router.get("/casos/{caso_id}/gps-capas/{capa_id}", response_model=GpsCapaOut)
+def get_gps_capa(
+    caso_id: int,
+    capa_id: int,
+    zoom: Optional[int] = Query(
+        None, ge=0, le=ZOOM_MAXIMO, description="Simplificar la traza para este zoom"
+    ),
+    tolerancia_m: Optional[float] = Query(
+        None, gt=0, description="Tolerancia de simplificación en metros"
+    ),
+    db: Session = Depends(get_db),
+):
+    """Capa GPS con sus puntos resueltos a partir de las lecturas del caso"""
+    db_capa = _get_capa_or_404(db, caso_id, capa_id)
+    return _capa_con_puntos(db, db_capa, zoom, tolerancia_m)
 
 
 @router.post("/casos/{caso_id}/gps-capas", response_model=GpsCapaOut, status_code=201)
 def create_gps_capa(caso_id: int, capa: GpsCapaCreate, db: Session = Depends(get_db)):
-    db_capa = GpsCapa(**capa.model_dump(), caso_id=caso_id)
+    db_capa = GpsCapa(
+        **capa.model_dump(exclude={"ids_lectura", "lecturas"}), caso_id=caso_id
+    )
+    _guardar_puntos(db, db_capa, capa)
     db.add(db_capa)
     db.commit()
     db.refresh(db_capa)
-    return db_capa
+    return _capa_out(db_capa)
 
 
 @router.put("/casos/{caso_id}/gps-capas/{capa_id}", response_model=GpsCapaOut)
 def update_gps_capa(
     caso_id: int, capa_id: int, capa: GpsCapaUpdate, db: Session = Depends(get_db)
 ):
-    db_capa = (
-        db.query(GpsCapa)
-        .filter(GpsCapa.id == capa_id, GpsCapa.caso_id == caso_id)
-        .first()
-    )
-    if not db_capa:
-        raise HTTPException(status_code=404, detail="Capa no encontrada")
-    for key, value in capa.model_dump().items():
+    db_capa = _get_capa_or_404(db, caso_id, capa_id)
+    for key, value in capa.model_dump(exclude={"ids_lectura", "lecturas"}).items():
         setattr(db_capa, key, value)
+    if capa.ids_lectura is not None or capa.lecturas is not None:
+        _guardar_puntos(db, db_capa, capa)
     db.commit()
     db.refresh(db_capa)
-    return db_capa
+    return _capa_out(db_capa)
 
 
 @router.delete("/casos/{caso_id}/gps-capas/{capa_id}", status_code=204)
 def delete_gps_capa(caso_id: int, capa_id: int, db: Session = Depends(get_db)):
-    db_capa = (
-        db.query(GpsCapa)
-        .filter(GpsCapa.id == capa_id, GpsCapa.caso_id == caso_id)
-        .first()
-    )
-    if not db_capa:
-        raise HTTPException(status_code=404, detail="Capa no encontrada")
+    db_capa = _get_capa_or_404(db, caso_id, capa_id)
     db.delete(db_capa)
     db.commit()
     return
@@ -0,0 +1,134 @@
+"""
+Detección de inicios de parada en las lecturas de un caso.
+
+Una lectura es inicio de parada si la siguiente lectura de la misma
+matrícula llega al menos `duracion_min` minutos después y a no más de
+DISTANCIA_PARADA_M metros. En lugar de cargar objetos ORM y recorrer los
+pares en Python, se leen sólo las columnas necesarias, se calculan las
+distancias y los tiempos entre lecturas consecutivas sobre arrays
+desplazados y se cortan los pares en los cambios de matrícula. Después se
+cargan completas únicamente las lecturas que resultan ser inicio de parada.
+"""
+
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Query
+
+import models
+from gps_simplificacion import RADIO_TIERRA_M
+from lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
+
+# Distancia máxima entre dos lecturas para considerar que el vehículo no se movió
+DISTANCIA_PARADA_M = 300.0
+
+# Límite de parámetros por consulta IN en SQLite
+LOTE_IDS = 900
+
+
+def distancias_consecutivas(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Distancia haversine en metros entre cada punto y el siguiente (n-1 valores)"""
+    lat, lon = np.radians(lat), np.radians(lon)
+    a = (
+        np.sin(np.diff(lat) / 2.0) ** 2
+        + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2.0) ** 2
+    )
+    distancias: np.ndarray = (
+        2.0 * RADIO_TIERRA_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    )
+    return distancias
+
+
+def inicios_parada(
+    matriculas: np.ndarray,
+    fechas: np.ndarray,
+    lat: np.ndarray,
+    lon: np.ndarray,
+    duracion_min: float,
+    distancia_max_m: float = DISTANCIA_PARADA_M,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Posiciones de las lecturas que inician una parada y su duración en minutos.
+
+    Las lecturas deben venir ordenadas por matrícula y fecha. Los pares sin
+    coordenadas, de matrículas distintas o sin avance en el tiempo no cuentan.
+    """
+    n = len(matriculas)
+    if n < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=float)
+
+    fechas = np.asarray(fechas, dtype="datetime64[us]")
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    matriculas = np.asarray(matriculas, dtype=object)
+
+    minutos = np.diff(fechas).astype(np.int64) / 60e6
+    validos = (
+        (matriculas[:-1] == matriculas[1:])
+        & ~np.isnat(fechas[:-1])
+        & ~np.isnat(fechas[1:])
+        & np.isfinite(lat[:-1])
+        & np.isfinite(lat[1:])
+        & np.isfinite(lon[:-1])
+        & np.isfinite(lon[1:])
+        & (minutos > 0)
+    )
+    with np.errstate(invalid="ignore"):
+        validos &= distancias_consecutivas(lat, lon) <= distancia_max_m
+    validos &= minutos >= duracion_min
+    posiciones = np.flatnonzero(validos)
+    return posiciones, minutos[posiciones]
+
+
+def lecturas_inicio_parada(
+    query: Query, duracion_min: float, lectura: Any = models.Lectura
+) -> List[Dict[str, Any]]:
+    """
+    Lecturas de `query` que inician una parada de al menos `duracion_min`
+    minutos, con `duracion_parada_min`, en orden de matrícula y fecha.
+    `lectura` es la entidad de la consulta (la de un shard, si el caso tiene).
+    """
+    columnas = query.with_entities(
+        lectura.ID_Lectura,
+        lectura.Matricula,
+        lectura.Fecha_y_Hora,
+        lectura.Coordenada_Y,
+        lectura.Coordenada_X,
+    ).order_by(
+        lectura.Matricula,
+        lectura.Fecha_y_Hora,
+        lectura.ID_Lectura,
+    )
+    # Con la sentencia la sesión puede usar una conexión de lectura
+    conexion = query.session.connection(bind_arguments={"clause": columnas.statement})
+    df = pd.read_sql(columnas.statement, conexion)
+    posiciones, minutos = inicios_parada(
+        df["Matricula"].to_numpy(dtype=object),
+        pd.to_datetime(df["Fecha_y_Hora"]).to_numpy(),
+        pd.to_numeric(df["Coordenada_Y"]).to_numpy(dtype=float),
+        pd.to_numeric(df["Coordenada_X"]).to_numpy(dtype=float),
+        duracion_min,
+    )
+    if len(posiciones) == 0:
+        return []
+
+    ids = df["ID_Lectura"].to_numpy(dtype=np.int64)[posiciones].tolist()
+    duraciones = dict(zip(ids, minutos.tolist()))
+    # Sólo se cargan completas las lecturas que se devuelven
+    campos = [c.key for c in models.Lectura.__table__.columns]
+    columnas_lectura = [getattr(lectura, campo) for campo in campos]
+    filas = {}
+    session = query.session
+    for inicio in range(0, len(ids), LOTE_IDS):
+        lote = ids[inicio : inicio + LOTE_IDS]
+        for fila in session.query(*columnas_lectura).filter(
+            lectura.ID_Lectura.in_(lote)
+        ):
+            filas[fila.ID_Lectura] = dict(zip(campos, fila))
+    return [
+        {**filas[id_lectura], "duracion_parada_min": duraciones[id_lectura]}
+        for id_lectura in ids
+        if id_lectura in filas
+    ]
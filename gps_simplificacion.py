@@ -0,0 +1,252 @@
+"""
+Simplificación de trazas GPS para su representación en mapas.
+
+Implementa Ramer-Douglas-Peucker vectorizado con NumPy. En lugar de ejecutar
+el algoritmo una vez por tolerancia, se recorre la traza una sola vez y se
+calcula la "importancia" de cada punto: la mayor tolerancia (en metros) con
+la que RDP todavía lo conservaría. Simplificar para un nivel de zoom es
+entonces una comparación con un umbral, y el zoom mínimo al que aparece cada
+punto puede precalcularse y guardarse como nivel de detalle.
+
+Si se proporcionan las fechas, la distancia usada es la sincronizada en el
+tiempo (SED): se compara cada punto con la posición interpolada en su mismo
+instante, de modo que se conservan también paradas y cambios de velocidad.
+"""
+
+import math
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
+
+RADIO_TIERRA_M = 6371008.8
+
+# Metros por píxel en el ecuador para el zoom 0 de Web Mercator (teselas 256px)
+METROS_PIXEL_ZOOM_0 = 156543.03392
+ZOOM_MAXIMO = 20
+# Nivel asignado a los puntos que sólo aparecen con el detalle completo
+NIVEL_DETALLE_COMPLETO = ZOOM_MAXIMO + 1
+
+# Tolerancia en píxeles con la que se simplifica para cada zoom
+PIXELES_TOLERANCIA = 1.0
+# Por debajo de esta desviación no merece la pena seguir subdividiendo
+TOLERANCIA_MINIMA_M = 0.25
+# Un hueco mayor entre lecturas parte la traza en tramos independientes
+HUECO_MAXIMO_S = 30 * 60
+
+
+def tolerancia_zoom(
+    zoom: float, lat_ref: float = 40.0, pixeles: float = PIXELES_TOLERANCIA
+) -> float:
+    """Tolerancia en metros equivalente a `pixeles` píxeles en el zoom dado"""
+    metros_pixel = METROS_PIXEL_ZOOM_0 * math.cos(math.radians(lat_ref)) / 2**zoom
+    return metros_pixel * pixeles
+
+
+def _proyectar(lat: np.ndarray, lon: np.ndarray):
+    """Proyección equirectangular local a metros centrada en la traza"""
+    lat0 = np.radians(np.mean(lat))
+    x = RADIO_TIERRA_M * np.radians(lon) * np.cos(lat0)
+    y = RADIO_TIERRA_M * np.radians(lat)
+    return x, y
+
+
+def _segundos(tiempos: Sequence[Any]) -> Optional[np.ndarray]:
+    """Segundos desde epoch, o None si alguna fecha no es interpretable"""
+    fechas = pd.to_datetime(pd.Series(tiempos), errors="coerce", format="mixed")
+    if fechas.isna().any():
+        return None
+    segundos: np.ndarray = fechas.to_numpy(dtype="datetime64[ms]").astype(np.int64)
+    return segundos / 1000.0
+
+
+def _desviaciones(x, y, t, i: int, j: int) -> np.ndarray:
+    """Desviación de los puntos interiores de [i, j] respecto al segmento i-j"""
+    xs, ys = x[i + 1 : j], y[i + 1 : j]
+    dx, dy = x[j] - x[i], y[j] - y[i]
+
+    if t is not None:
+        # Distancia sincronizada en el tiempo
+        duracion = t[j] - t[i]
+        if duracion > 0:
+            r = (t[i + 1 : j] - t[i]) / duracion
+        else:
+            r = np.zeros(j - i - 1)
+    else:
+        # Distancia al segmento (proyección acotada a sus extremos)
+        longitud2 = dx * dx + dy * dy
+        if longitud2 > 0:
+            r = np.clip(((xs - x[i]) * dx + (ys - y[i]) * dy) / longitud2, 0.0, 1.0)
+        else:
+            r = np.zeros(j - i - 1)
+
+    desviaciones: np.ndarray = np.hypot(xs - (x[i] + r * dx), ys - (y[i] + r * dy))
+    return desviaciones
+
+
+def _importancia_tramo(x, y, t, importancia, inicio: int, fin: int, minima: float):
+    """RDP iterativo sobre un tramo, anotando la importancia de cada punto"""
+    importancia[inicio] = importancia[fin] = np.inf
+    pila = [(inicio, fin, np.inf)]
+    while pila:
+        i, j, techo = pila.pop()
+        if j - i < 2:
+            continue
+        d = _desviaciones(x, y, t, i, j)
+        k = int(np.argmax(d))
+        dmax = float(d[k])
+        if dmax <= minima:
+            continue
+        k += i + 1
+        # Un punto sólo se conserva si también se conservan sus ancestros
+        valor = min(dmax, techo)
+        importancia[k] = valor
+        pila.append((i, k, valor))
+        pila.append((k, j, valor))
+
+
+def importancia_puntos(
+    lat: Sequence[float],
+    lon: Sequence[float],
+    tiempos: Optional[Sequence[Any]] = None,
+    hueco_s: float = HUECO_MAXIMO_S,
+    tolerancia_minima_m: float = TOLERANCIA_MINIMA_M,
+) -> np.ndarray:
+    """
+    Importancia RDP de cada punto en metros (inf en los extremos de tramo).
+
+    Conservar los puntos con importancia > ε equivale a aplicar RDP con
+    tolerancia ε. Los puntos deben llegar en orden cronológico; si hay
+    tiempos, la traza se parte en los huecos mayores que hueco_s.
+    """
+    lats = np.asarray(lat, dtype=np.float64)
+    lons = np.asarray(lon, dtype=np.float64)
+    n = len(lats)
+    importancia = np.zeros(n)
+    if n == 0:
+        return importancia
+
+    x, y = _proyectar(lats, lons)
+    t = None
+    cortes = np.array([], dtype=np.int64)
+    if tiempos is not None:
+        t = _segundos(tiempos)
+        if t is not None:
+            cortes = np.nonzero(np.diff(t) > hueco_s)[0] + 1
+
+    limites = np.concatenate((np.array([0]), cortes, np.array([n])))
+    for inicio, fin in zip(limites[:-1], limites[1:]):
+        _importancia_tramo(x, y, t, importancia, inicio, fin - 1, tolerancia_minima_m)
+    return importancia
+
+
+def zoom_minimo(
+    importancia: np.ndarray,
+    lat_ref: float = 40.0,
+    pixeles: float = PIXELES_TOLERANCIA,
+) -> np.ndarray:
+    """Zoom a partir del cual se muestra cada punto (nivel de detalle)"""
+    with np.errstate(divide="ignore"):
+        zoom = np.ceil(np.log2(tolerancia_zoom(0, lat_ref, pixeles) / importancia))
+    zoom = np.nan_to_num(zoom, nan=0, posinf=NIVEL_DETALLE_COMPLETO, neginf=0)
+    niveles: np.ndarray = np.clip(zoom, 0, NIVEL_DETALLE_COMPLETO).astype(np.int8)
+    return niveles
+
+
+def simplificar(
+    lat: Sequence[float],
+    lon: Sequence[float],
+    tiempos: Optional[Sequence[Any]] = None,
+    zoom: Optional[float] = None,
+    tolerancia_m: Optional[float] = None,
+) -> np.ndarray:
+    """
+    Máscara booleana con los puntos a conservar para un zoom o tolerancia.
+
+    Sin zoom ni tolerancia se conservan todos los puntos.
+    """
+    lats = np.asarray(lat, dtype=np.float64)
+    if tolerancia_m is None:
+        if zoom is None:
+            return np.ones(len(lats), dtype=bool)
+        tolerancia_m = tolerancia_zoom(
+            zoom, float(np.mean(lats)) if len(lats) else 40.0
+        )
+    return importancia_puntos(lat, lon, tiempos) > tolerancia_m
+
+
+def _importancia_lecturas(
+    lecturas: List[Any], campo: Callable[[Any, str], Any]
+) -> List[float]:
+    """Importancia de cada lectura, simplificando cada matrícula por separado"""
+    importancia = [math.inf] * len(lecturas)
+    por_matricula: Dict[Any, List[int]] = {}
+    for idx, lectura in enumerate(lecturas):
+        if (
+            campo(lectura, "Coordenada_X") is None
+            or campo(lectura, "Coordenada_Y") is None
+            or campo(lectura, "Fecha_y_Hora") is None
+        ):
+            continue
+        por_matricula.setdefault(campo(lectura, "Matricula"), []).append(idx)
+
+    for indices in por_matricula.values():
+        indices.sort(key=lambda i: campo(lecturas[i], "Fecha_y_Hora"))
+        valores = importancia_puntos(
+            [float(campo(lecturas[i], "Coordenada_Y")) for i in indices],
+            [float(campo(lecturas[i], "Coordenada_X")) for i in indices],
+            [campo(lecturas[i], "Fecha_y_Hora") for i in indices],
+        )
+        for i, valor in zip(indices, valores):
+            importancia[i] = float(valor)
+    return importancia
+
+
+def _latitud_media(lecturas: List[Any], campo: Callable[[Any, str], Any]) -> float:
+    valores = [campo(l, "Coordenada_Y") for l in lecturas]
+    lat = [float(v) for v in valores if v is not None]
+    return sum(lat) / len(lat) if lat else 40.0
+
+
+def simplificar_lecturas(
+    lecturas: Iterable[Any],
+    zoom: Optional[float] = None,
+    tolerancia_m: Optional[float] = None,
+    campo: Callable[[Any, str], Any] = getattr,
+) -> List[Any]:
+    """
+    Simplifica una lista de lecturas (ORM o dict) por matrícula.
+
+    Las lecturas sin coordenadas o sin fecha se devuelven sin cambios y se
+    respeta el orden de entrada. `campo` permite leer dicts con
+    `lambda d, k: d.get(k)`.
+    """
+    lecturas = list(lecturas)
+    if tolerancia_m is None:
+        if zoom is None:
+            return lecturas
+        tolerancia_m = tolerancia_zoom(zoom, _latitud_media(lecturas, campo))
+    importancia = _importancia_lecturas(lecturas, campo)
+    return [l for l, valor in zip(lecturas, importancia) if valor > tolerancia_m]
+
+
+def niveles_detalle_lecturas(
+    lecturas: Iterable[Any], campo: Callable[[Any, str], Any] = getattr
+) -> List[int]:
+    """Zoom mínimo de cada lectura, alineado con la lista de entrada"""
+    lecturas = list(lecturas)
+    importancia = np.asarray(_importancia_lecturas(lecturas, campo))
+    niveles: List[int] = zoom_minimo(
+        importancia, _latitud_media(lecturas, campo)
+    ).tolist()
+    return niveles
+
+
+def filtrar_por_nivel(
+    lecturas: List[Any], niveles: List[int], zoom: float
+) -> List[Any]:
+    """Lecturas visibles en un zoom a partir de sus niveles precalculados"""
+    return [l for l, nivel in zip(lecturas, niveles) if nivel <= zoom]
@@ -0,0 +1,493 @@
+"""
+Cola de trabajos pesados ejecutados en procesos aparte
+
+Las importaciones, los cruces de datos externos y los análisis de
+lanzaderas se ejecutaban con BackgroundTasks, en el mismo proceso y en el
+mismo pool de hilos que atiende la API: una importación grande ralentizaba
+todas las peticiones y no podía usar otros núcleos. La cola los reparte en
+un pool de procesos con:
+
+- prioridades: se despacha siempre el trabajo pendiente más prioritario, y
+  los de prioridad normal o baja dejan libres RESERVED_WORKERS workers para
+  los interactivos (el usuario espera la respuesta);
+- límites de concurrencia por tipo de trabajo (JOB_LIMITS), que valen para
+  todos los procesos de la API: cada trabajo con límite reserva una plaza
+  de su tipo en `task_statuses` mientras se ejecuta;
+- cancelación: un trabajo pendiente se descarta y uno en curso se detiene
+  en el siguiente punto de control (`check_cancelled`).
+
+Los workers se crean con fork al arrancar la aplicación, antes de atender
+peticiones, y comparten con la API el estado de las tareas a través de
+`task_statuses`, que ya es persistente entre procesos. Con
+ATRIO_JOB_WORKERS=0 los trabajos se ejecutan en hilos del propio proceso,
+como antes.
+
+Lo que sólo afecta a la memoria de la API (el cache en proceso cuando no
+hay Redis) se perdería en un worker: los trabajos lo piden con
+`in_api_process` y la cola lo ejecuta en la API cuando el trabajo termina.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from shared_state import task_statuses
+
+logger = logging.getLogger(__name__)
+
+KIND_IMPORT = "import"
+KIND_EXTERNAL_IMPORT = "external_import"
+KIND_CROSS = "cross"
+KIND_LANZADERA = "lanzadera"
+KIND_MAINTENANCE = "maintenance"
+KIND_DELETE = "delete"
+KIND_BACKUP = "backup"
+
+# Menor valor, mayor prioridad
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
+JOB_WORKERS = int(
+    os.environ.get("ATRIO_JOB_WORKERS", max(1, min(4, (os.cpu_count() or 2) - 1)))
+)
+# Workers que los trabajos de prioridad normal o baja no pueden ocupar
+RESERVED_WORKERS = 1
+# Trabajos simultáneos por tipo; los tipos sin límite sólo están limitados
+# por el número de workers
+JOB_LIMITS: Dict[str, int] = {
+    KIND_IMPORT: 2,
+    KIND_EXTERNAL_IMPORT: 1,
+    KIND_CROSS: 1,
+    KIND_LANZADERA: 2,
+    KIND_MAINTENANCE: 1,
+    # Los borrados escriben sin pausa: uno cada vez
+    KIND_DELETE: 1,
+    # Backups y restauraciones, de uno en uno
+    KIND_BACKUP: 1,
+}
+
+CANCELLED_MESSAGE = "Tarea cancelada"
+
+# Las plazas de los trabajos en curso se renuevan cada CLAIM_POLL segundos y
+# caducan a los CLAIM_TTL si su proceso desaparece; con trabajos esperando
+# una plaza de otro proceso se vuelve a intentar con la misma frecuencia
+CLAIM_TTL = 60.0
+CLAIM_POLL = 5.0
+
+# Llamadas que el trabajo en curso deja para el proceso de la API; sólo es
+# una lista en los workers
+_deferred: Optional[List[tuple]] = None
+
+
+class JobCancelled(Exception):
+    """Se ha pedido cancelar el trabajo en curso"""
+
+
+class JobHTTPException(HTTPException):
+    """HTTPException que se puede devolver desde un worker (admite pickle)"""
+
+    def __reduce__(self):
+        return (type(self), (self.status_code, self.detail, self.headers))
+
+
+@dataclass
+class _DeferredResult:
+    """Resultado de un trabajo con las llamadas aplazadas al proceso de la API"""
+
+    value: Any
+    calls: List[tuple]
+
+
+def in_api_process(func: Callable, *args, **kwargs):
+    """
+    Ejecuta `func(*args, **kwargs)` en el proceso de la API.
+
+    Desde un worker la llamada se aplaza: la cola la ejecuta en la API al
+    terminar el trabajo, antes de dar su resultado, y `func` y sus argumentos
+    deben poderse serializar con pickle. En cualquier otro caso se ejecuta en
+    el momento.
+    """
+    if _deferred is None:
+        return func(*args, **kwargs)
+    _deferred.append((func, args, kwargs))
+
+
+def cancel_requested(task_id: str) -> bool:
+    status = task_statuses.get(task_id)
+    return bool(status and status.get("cancel_requested"))
+
+
+def check_cancelled(task_id: str):
+    """Punto de control: lanza JobCancelled si se ha pedido cancelar la tarea"""
+    if cancel_requested(task_id):
+        raise JobCancelled(task_id)
+
+
+def _mark_cancelled(task_id: str):
+    status = task_statuses.get(task_id)
+    # Un trabajo que llegó a terminar conserva su resultado
+    if status is not None and status.get("status") != "completed":
+        status.update(
+            {
+                "status": "failed",
+                "message": CANCELLED_MESSAGE,
+                "stage": None,
+                "cancelled": True,
+            }
+        )
+
+
+def _init_worker():
+    """Prepara un proceso hijo creado con fork"""
+    global _deferred
+    _deferred = []
+    # Las señales las gestiona el proceso principal, que cierra el pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Las conexiones del pool heredado pertenecen al padre
+    from database_config import engine, read_engine
+
+    engine.dispose(close=False)
+    read_engine.dispose(close=False)
+
+
+def _run_job(task_id: str, func: Callable, args: tuple, kwargs: dict) -> Any:
+    """Ejecuta un trabajo en el worker"""
+    if cancel_requested(task_id):
+        _mark_cancelled(task_id)
+        return None
+    if _deferred is not None:
+        _deferred.clear()
+    try:
+        result = func(*args, **kwargs)
+        if _deferred:
+            return _DeferredResult(result, list(_deferred))
+        return result
+    except HTTPException as e:
+        headers = None if e.headers is None else dict(e.headers)
+        raise JobHTTPException(e.status_code, e.detail, headers)
+    finally:
+        task_statuses.flush(task_id)
+        if cancel_requested(task_id):
+            _mark_cancelled(task_id)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    sequence: int
+    task_id: str = field(compare=False)
+    kind: str = field(compare=False)
+    func: Callable = field(compare=False)
+    args: tuple = field(compare=False)
+    kwargs: dict = field(compare=False)
+    future: Future = field(compare=False, default_factory=Future)
+    slot: Optional[str] = field(compare=False, default=None)
+
+
+class JobQueue:
+    """Cola con prioridades sobre un pool de procesos (o de hilos)"""
+
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        limits: Optional[Dict[str, int]] = None,
+        reserved: int = RESERVED_WORKERS,
+        claims=task_statuses,
+    ):
+        self.workers = workers
+        self.limits = dict(JOB_LIMITS if limits is None else limits)
+        self.reserved = reserved
+        # Registro de las plazas compartidas (None: límites sólo del proceso)
+        self.claims = claims
+        self._claims_timer: Optional[threading.Timer] = None
+        self._waiting_slot = False
+        # Reentrante: un trabajo que termina al instante avisa durante el envío
+        self._lock = threading.RLock()
+        self._executor = None
+        self._pending: List[_Job] = []
+        self._running: Dict[str, _Job] = {}
+        self._sequence = itertools.count()
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0}
+
+    @property
+    def mode(self) -> str:
+        return "process" if self.workers > 0 else "thread"
+
+    @property
+    def max_workers(self) -> int:
+        return self.workers if self.workers > 0 else 2
+
+    def start(self):
+        """Crea el pool; conviene llamarlo al arrancar, antes de atender peticiones"""
+        with self._lock:
+            self._start_locked()
+
+    def _start_locked(self):
+        if self._executor is not None:
+            return
+        if self.workers > 0:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=_init_worker,
+            )
+            # Con fork los workers se crean todos con el primer envío
+            self._executor.submit(_ping).result()
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="atrio-job"
+            )
+        logger.info(
+            f"Cola de trabajos iniciada: {self.max_workers} workers ({self.mode})"
+        )
+
+    def shutdown(self, wait: bool = False):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            pending, self._pending = self._pending, []
+            if self._claims_timer is not None:
+                self._claims_timer.cancel()
+                self._claims_timer = None
+        for job in pending:
+            job.future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def submit(
+        self,
+        kind: str,
+        func: Callable,
+        *args,
+        task_id: Optional[str] = None,
+        priority: int = PRIORITY_NORMAL,
+        **kwargs,
+    ) -> Future:
+        """
+        Encola `func(*args, **kwargs)` para ejecutarla en un worker.
+
+        `func` y sus argumentos deben poderse serializar con pickle (funciones
+        de módulo y datos simples). Devuelve un Future con el resultado; el
+        progreso de las tareas con `task_id` se sigue en `task_statuses`.
+        """
+        job = _Job(
+            priority=priority,
+            sequence=next(self._sequence),
+            task_id=task_id or uuid.uuid4().hex,
+            kind=kind,
+            func=func,
+            args=args,
+            kwargs=kwargs,
+        )
+        if job.task_id in task_statuses:
+            # A partir de aquí escribe el worker; este proceso sólo lee
+            task_statuses.forget(job.task_id)
+        with self._lock:
+            heapq.heappush(self._pending, job)
+            self.stats["submitted"] += 1
+            self._dispatch_locked()
+        return job.future
+
+    async def run(self, kind: str, func: Callable, *args, **kwargs) -> Any:
+        """Encola un trabajo y espera su resultado sin bloquear el event loop"""
+        return await asyncio.wrap_future(self.submit(kind, func, *args, **kwargs))
+
+    def cancel(self, task_id: str) -> bool:
+        """
+        Cancela un trabajo: si está pendiente se descarta y si está en curso
+        se detiene en su siguiente punto de control, aunque se ejecute desde
+        otro proceso de la API. Devuelve False si ya había terminado.
+        """
+        with self._lock:
+            for job in self._pending:
+                if job.task_id == task_id:
+                    self._pending.remove(job)
+                    heapq.heapify(self._pending)
+                    self.stats["cancelled"] += 1
+                    job.future.cancel()
+                    _mark_cancelled(task_id)
+                    return True
+        status = task_statuses.get(task_id)
+        if not status or status.get("status") in ("completed", "failed"):
+            return False
+        status["cancel_requested"] = True
+        return True
+
+    def _can_run(self, job: _Job, running_kinds: Dict[str, int]) -> bool:
+        limit = self.limits.get(job.kind)
+        if limit is not None and running_kinds.get(job.kind, 0) >= limit:
+            return False
+        if job.priority > PRIORITY_HIGH:
+            reserved = min(self.reserved, self.max_workers - 1)
+            return len(self._running) < self.max_workers - reserved
+        return True
+
+    def _claim_slot(self, job: _Job) -> bool:
+        """Reserva una plaza del tipo del trabajo, compartida entre procesos"""
+        limit = self.limits.get(job.kind)
+        if limit is None or self.claims is None:
+            return True
+        try:
+            for plaza in range(limit):
+                nombre = f"job:{job.kind}:{plaza}"
+                if self.claims.claim(nombre, job.task_id, CLAIM_TTL):
+                    job.slot = nombre
+                    return True
+        except Exception as e:
+            # Sin registro se mantiene al menos el límite de este proceso
+            logger.error(f"Error reservando plaza para {job.task_id}: {e}")
+            return True
+        return False
+
+    def _release_slot(self, job: _Job):
+        if job.slot is None:
+            return
+        try:
+            self.claims.release(job.slot, job.task_id)
+        except Exception as e:
+            logger.error(f"Error liberando la plaza de {job.task_id}: {e}")
+
+    def _schedule_claims_locked(self):
+        """Programa la renovación de plazas y el reintento de los que esperan"""
+        necesario = self._waiting_slot or any(
+            job.slot for job in self._running.values()
+        )
+        if not necesario or self._claims_timer is not None or self._executor is None:
+            return
+        self._claims_timer = threading.Timer(CLAIM_POLL, self._claims_tick)
+        self._claims_timer.daemon = True
+        self._claims_timer.start()
+
+    def _claims_tick(self):
+        with self._lock:
+            self._claims_timer = None
+            if self._executor is None:
+                return
+            for job in self._running.values():
+                if job.slot is not None:
+                    try:
+                        self.claims.claim(job.slot, job.task_id, CLAIM_TTL)
+                    except Exception as e:
+                        logger.error(f"Error renovando la plaza de {job.task_id}: {e}")
+            self._dispatch_locked()
+
+    def _dispatch_locked(self):
+        self._start_locked()
+        running_kinds: Dict[str, int] = {}
+        for job in self._running.values():
+            running_kinds[job.kind] = running_kinds.get(job.kind, 0) + 1
+
+        skipped = []
+        self._waiting_slot = False
+        while self._pending and len(self._running) < self.max_workers:
+            job = heapq.heappop(self._pending)
+            if not self._can_run(job, running_kinds):
+                skipped.append(job)
+                continue
+            if not self._claim_slot(job):
+                # La plaza la tiene otro proceso de la API
+                skipped.append(job)
+                self._waiting_slot = True
+                continue
+            try:
+                future = self._executor.submit(
+                    _run_job, job.task_id, job.func, job.args, job.kwargs
+                )
+            except BrokenProcessPool:
+                logger.error("Pool de trabajos roto; se vuelve a crear")
+                self._executor = None
+                self._start_locked()
+                future = self._executor.submit(
+                    _run_job, job.task_id, job.func, job.args, job.kwargs
+                )
+            self._running[job.task_id] = job
+            running_kinds[job.kind] = running_kinds.get(job.kind, 0) + 1
+            future.add_done_callback(lambda f, job=job: self._finished(job, f))
+        for job in skipped:
+            heapq.heappush(self._pending, job)
+        self._schedule_claims_locked()
+
+    def _finished(self, job: _Job, future: Future):
+        self._release_slot(job)
+        with self._lock:
+            self._running.pop(job.task_id, None)
+            error = None if future.cancelled() else future.exception()
+            self.stats["failed" if error else "completed"] += 1
+            if self._executor is not None:
+                self._dispatch_locked()
+
+        if future.cancelled():
+            job.future.cancel()
+        elif error is not None:
+            if not isinstance(error, HTTPException):
+                logger.error(
+                    f"[Job {job.task_id}] Error en el trabajo {job.kind}: {error}"
+                )
+                # El trabajo no llegó a registrar el fallo (p. ej. worker caído)
+                status = task_statuses.get(job.task_id)
+                if status and status.get("status") not in ("completed", "failed"):
+                    task_statuses[job.task_id].update(
+                        {"status": "failed", "message": f"Error interno: {error}"}
+                    )
+            job.future.set_exception(error)
+        else:
+            result = future.result()
+            if isinstance(result, _DeferredResult):
+                # En otro hilo: este avisa al resto de la cola
+                threading.Thread(
+                    target=self._run_deferred,
+                    args=(job, result),
+                    name=f"atrio-job-{job.task_id}",
+                    daemon=True,
+                ).start()
+            else:
+                job.future.set_result(result)
+
+    def _run_deferred(self, job: _Job, result: _DeferredResult):
+        for func, args, kwargs in result.calls:
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                logger.error(
+                    f"[Job {job.task_id}] Error en {getattr(func, '__name__', func)}: {e}",
+                    exc_info=True,
+                )
+        job.future.set_result(result.value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "workers": self.max_workers,
+                "reserved": self.reserved,
+                "limits": dict(self.limits),
+                "running": [
+                    {"task_id": j.task_id, "kind": j.kind, "priority": j.priority}
+                    for j in self._running.values()
+                ],
+                "pending": [
+                    {"task_id": j.task_id, "kind": j.kind, "priority": j.priority}
+                    for j in sorted(self._pending)
+                ],
+                **self.stats,
+            }
+
+
+job_queue = JobQueue()
@@ -0,0 +1,54 @@
+"""
+Importación diferida de dependencias pesadas
+
+pandas y scikit-learn tardan en importarse casi un segundo y ocupan decenas
+de MB en cada worker, aunque la mayoría de peticiones no leen Excel ni
+agrupan puntos. `lazy_import` devuelve un módulo sustituto que importa el
+real con el primer acceso a un atributo (`pd.DataFrame`), así que el código
+que lo usa no cambia. Las anotaciones de tipo con el módulo se evalúan al
+definir la función y lo cargarían; los módulos que lo usan en anotaciones
+necesitan `from __future__ import annotations`.
+
+La carga pasa por `importlib.import_module`, cuyo bloqueo por módulo hace
+esperar a los demás hilos hasta que el primero termina de ejecutarlo.
+`importlib.util.LazyLoader` no es seguro con hilos: dos peticiones que usan
+pandas a la vez pueden ejecutarlo dos veces o ver el módulo a medio
+inicializar.
+
+El presupuesto de tiempo de importación se comprueba con
+`python -m monitoring.benchmark_importtime`.
+"""
+
+import importlib
+import importlib.util
+import sys
+from types import ModuleType
+from typing import Any
+
+# Dependencias que no deben cargarse al importar la aplicación
+HEAVY_MODULES = ("pandas", "sklearn", "scipy", "openpyxl")
+
+
+class _LazyModule(ModuleType):
+    """Sustituto del módulo que lo importa con el primer atributo pedido"""
+
+    def __getattr__(self, attr: str) -> Any:
+        # Sólo llegan aquí los atributos que aún no se han copiado
+        value = getattr(importlib.import_module(self.__name__), attr)
+        setattr(self, attr, value)
+        return value
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Módulo `name` que se importa al usar por primera vez uno de sus atributos"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    if importlib.util.find_spec(name) is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    return _LazyModule(name)
+
+
+def is_loaded(name: str) -> bool:
+    """Si el módulo se ha ejecutado ya (no basta con que sea un import diferido)"""
+    return name in sys.modules
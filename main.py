@@ -10,6 +10,7 @@ from fastapi import (
     Query,
     Body,
     BackgroundTasks,
+    Response,
 )
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.responses import JSONResponse, FileResponse
@@ -20,10 +21,20 @@ from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session, joinedload, contains_eager, relationship
 from sqlalchemy.sql import func, extract, select, label, text
 import models, schemas
-from database_config import SessionLocal, engine, get_db, DATABASE_URL, Base
-import pandas as pd
+from database_config import (
+    SessionLocal,
+    engine,
+    get_db,
+    run_db,
+    DATABASE_URL,
+    Base,
+    WRITE_CHUNK_SIZE,
+)
+from lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
 from io import BytesIO
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, cast
 import json
 from urllib.parse import unquote
 import logging
@@ -46,12 +57,42 @@ from sqlalchemy.orm import aliased
 from sqlalchemy import over
 import hashlib
 import time as time_module
+import psutil
 import math
 import sys
 import re
-from math import radians, sin, cos, sqrt, asin
 from schemas import Lectura as LecturaSchema
 from gps_capas import router as gps_capas_router
+from gps_paradas import lecturas_inicio_parada
+from gps_simplificacion import ZOOM_MAXIMO, simplificar_lecturas
+from version_datos import (
+    AMBITO_LECTORES,
+    etag_caso,
+    etag_version,
+    incrementar_version_ambito,
+    incrementar_version_caso,
+    incrementar_version_matricula,
+    iniciar_version_caso,
+    respuesta_condicional,
+    version_ambito,
+    version_caso,
+    version_de_ambito,
+    version_de_llamada,
+)
+from cache_warmup import (
+    nueva_tarea_precalentamiento,
+    paso_precalentamiento,
+    precalentar_caso,
+)
+import analytics
+from job_queue import (
+    KIND_IMPORT,
+    KIND_LANZADERA,
+    PRIORITY_HIGH,
+    check_cancelled,
+    in_api_process,
+    job_queue,
+)
 from models import LocalizacionInteres
 from schemas import (
     LocalizacionInteresCreate,
@@ -60,6 +101,10 @@ from schemas import (
 )
 from admin.database_manager import router as admin_database_router
 from backend.routers.gps_analysis import router as gps_analysis_router
+from backend.routers.gps_trayectos import (
+    router as gps_trayectos_router,
+    recalcular_segmentos,
+)
 from backend.routers.external_data import router as external_data_router
 from backend.routers.mapas_guardados import router as mapas_guardados_router
 
@@ -95,6 +140,8 @@ from shared_state import task_statuses
 
 # === SISTEMA DE CACHE AVANZADO CON REDIS ===
 from cache_manager import (
+    GLOBAL_TAG,
+    WEB_WORKERS,
     cache_manager,
     cached,
     cache_lecturas_caso,
@@ -317,9 +364,21 @@ logger = logging.getLogger(__name__)
 
 # Importar las funciones de optimización
 from optimizations import (
-    create_optimized_indices,
-    optimize_common_queries,
-    vacuum_database,
+    prepare_database,
+    start_maintenance_scheduler,
+    stop_maintenance_scheduler,
+    submit_maintenance,
+)
+from bulk_delete import submit_delete_archivo, submit_delete_caso
+from case_shards import (
+    MAX_ATTACHED,
+    add_lecturas,
+    attach,
+    ensure_shard,
+    lectura_entity,
+    lectura_entity_for_id,
+    lectura_sources,
+    sharded_casos,
 )
 
 # --- START JWT/OAuth2 Core Setup ---
@@ -482,35 +541,44 @@ async def check_superadmin_status(
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Iniciando aplicación ATRIO v1...")
+    inicio = time_module.perf_counter()
 
-    # Verificar tablas de base de datos
-    models.create_db_and_tables()
-    logger.info("Tablas de base de datos verificadas")
-
-    # Aplicar optimizaciones de base de datos
-    create_optimized_indices()
-
-    # Optimizar consultas comunes (necesita una sesión)
-    db = SessionLocal()
-    try:
-        optimize_common_queries(db)
-    except Exception as e:
-        logger.error(f"Error al optimizar consultas: {e}")
-    finally:
-        db.close()
-
-    # Ejecutar vacío de base de datos (optimización de almacenamiento)
+    # Sólo comprobaciones baratas: revisión del esquema y versión de las
+    # optimizaciones. VACUUM y ANALYZE van en el mantenimiento programado.
     try:
-        vacuum_database()
+        resumen_bd = prepare_database()
     except Exception as e:
-        logger.error(f"Error al ejecutar VACUUM: {e}")
-
-    logger.info("Optimizaciones de base de datos aplicadas")
+        logger.error(f"Error al comprobar la base de datos: {e}", exc_info=True)
+        models.create_db_and_tables()
+        resumen_bd = {"schema": "create_all", "error": str(e)}
+    logger.info(f"Base de datos preparada: {resumen_bd}")
+
+    # Los workers se crean ahora, antes de atender peticiones
+    inicio_workers = time_module.perf_counter()
+    job_queue.start()
+    start_maintenance_scheduler()
+
+    app.state.startup = {
+        "ready_at": datetime.now().isoformat(),
+        "database": resumen_bd,
+        "workers_seconds": round(time_module.perf_counter() - inicio_workers, 3),
+        "lifespan_seconds": round(time_module.perf_counter() - inicio, 3),
+        # Desde que arrancó el proceso, incluidas las importaciones
+        "time_to_ready_seconds": round(
+            time_module.time() - psutil.Process().create_time(), 3
+        ),
+    }
+    logger.info(
+        f"Aplicación lista en {app.state.startup['time_to_ready_seconds']}s "
+        f"(arranque {app.state.startup['lifespan_seconds']}s)"
+    )
 
     yield
 
     # Shutdown
     logger.info("Cerrando aplicación ATRIO v1...")
+    stop_maintenance_scheduler()
+    job_queue.shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -519,6 +587,7 @@ app = FastAPI(lifespan=lifespan)
 app.include_router(gps_capas_router)
 app.include_router(admin_database_router)
 app.include_router(gps_analysis_router, prefix="/api/gps")
+app.include_router(gps_trayectos_router, prefix="/api/gps")
 app.include_router(external_data_router)
 app.include_router(mapas_guardados_router)
 
@@ -948,6 +1017,8 @@ def create_caso(
             ID_Grupo=assigned_id_grupo,
         )
         db.add(db_caso)
+        db.flush()
+        iniciar_version_caso(db, db_caso)
         db.commit()
         db.refresh(db_caso)
         logger.info(
@@ -1098,6 +1169,33 @@ def read_caso(
     return db_caso
 
 
+@app.get("/casos/{caso_id}/version", response_model=schemas.CasoVersion)
+def read_caso_version(
+    caso_id: int,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: models.Usuario = Depends(get_current_active_user),
+):
+    """Versión de datos del caso; cambia con cada importación o modificación"""
+    db_caso = db.query(models.Caso).filter(models.Caso.ID_Caso == caso_id).first()
+    if db_caso is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Caso no encontrado"
+        )
+    user_rol_value = getattr(current_user.Rol, "value", current_user.Rol)
+    if user_rol_value != "superadmin" and (
+        current_user.ID_Grupo is None or db_caso.ID_Grupo != current_user.ID_Grupo
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="No tiene permiso para acceder a este caso.",
+        )
+
+    version = version_caso(db, caso_id)
+    response.headers["ETag"] = etag_caso(caso_id, version)
+    return schemas.CasoVersion(ID_Caso=caso_id, Version_Datos=version)
+
+
 @app.put("/casos/{caso_id}/estado", response_model=schemas.Caso)
 def update_caso_estado(
     caso_id: int,
@@ -1150,12 +1248,16 @@ def update_caso_estado(
         )
 
 
-@app.delete("/casos/{caso_id}", status_code=status.HTTP_204_NO_CONTENT)
+@app.delete("/casos/{caso_id}", status_code=status.HTTP_202_ACCEPTED)
 async def delete_caso(
     caso_id: int,
     db: Session = Depends(get_db),
     current_user: models.Usuario = Depends(get_current_active_user),  # MODIFICADO
 ):
+    return await run_db(_delete_caso, caso_id, db, current_user)
+
+
+def _delete_caso(caso_id: int, db: Session, current_user: models.Usuario):
     logger.info(
         f"Intento de eliminación del caso ID {caso_id} por usuario {current_user.User} (Rol: {current_user.Rol.value})"
     )
@@ -1206,73 +1308,15 @@ async def delete_caso(
             detail="No tiene permisos para eliminar casos.",
         )
 
-    # Proceder con la eliminación
-    # Eliminar lecturas asociadas primero (LPR y GPS)
-    try:
-        archivos_a_eliminar = (
-            db.query(models.ArchivoExcel)
-            .filter(models.ArchivoExcel.ID_Caso == caso_id)
-            .all()
-        )
-        logger.info(
-            f"[Delete Caso Casc] Se encontraron {len(archivos_a_eliminar)} archivos asociados al caso {caso_id} (solicitud por {current_user.User})."
-        )
-        for db_archivo in archivos_a_eliminar:
-            archivo_id_actual = db_archivo.ID_Archivo
-            nombre_archivo_actual = db_archivo.Nombre_del_Archivo
-            logger.info(
-                f"[Delete Caso Casc] Procesando archivo ID: {archivo_id_actual} ({nombre_archivo_actual}) para caso {caso_id} (solicitud por {current_user.User})."
-            )
-            lecturas_eliminadas = (
-                db.query(models.Lectura)
-                .filter(models.Lectura.ID_Archivo == archivo_id_actual)
-                .delete(synchronize_session=False)
-            )
-            logger.info(
-                f"[Delete Caso Casc] {lecturas_eliminadas} lecturas asociadas al archivo {archivo_id_actual} marcadas para eliminar (caso {caso_id}, usuario {current_user.User})."
-            )
-            if nombre_archivo_actual:
-                file_path_to_delete = UPLOADS_DIR / nombre_archivo_actual
-                if os.path.isfile(file_path_to_delete):
-                    try:
-                        os.remove(file_path_to_delete)
-                        logger.info(
-                            f"[Delete Caso Casc] Archivo físico eliminado: {file_path_to_delete} (caso {caso_id}, usuario {current_user.User})."
-                        )
-                    except OSError as e:
-                        logger.error(
-                            f"[Delete Caso Casc] Error al eliminar archivo físico {file_path_to_delete}: {e}. Continuando... (caso {caso_id}, usuario {current_user.User}).",
-                            exc_info=True,
-                        )
-                else:
-                    logger.warning(
-                        f"[Delete Caso Casc] Archivo físico no encontrado en {file_path_to_delete}, no se elimina (caso {caso_id}, usuario {current_user.User})."
-                    )
-            else:
-                logger.warning(
-                    f"[Delete Caso Casc] Registro ArchivoExcel ID {archivo_id_actual} no tiene nombre, no se puede eliminar archivo físico."
-                )
-            db.delete(db_archivo)
-            logger.info(
-                f"[Delete Caso Casc] Registro ArchivoExcel ID {archivo_id_actual} marcado para eliminar."
-            )
-        db.delete(db_caso)
-        logger.info(f"[Delete Caso Casc] Caso ID {caso_id} marcado para eliminar.")
-        db.commit()
-        logger.info(
-            f"[Delete Caso Casc] Commit realizado. Eliminación completada para caso ID {caso_id} y sus asociados."
-        )
-        return None
-    except Exception as e:
-        db.rollback()
-        logger.error(
-            f"[Delete Caso Casc] Error durante la eliminación del caso ID {caso_id}. Rollback realizado: {e}",
-            exc_info=True,
-        )
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error interno al intentar eliminar el caso y sus asociados: {e}",
-        )
+    # Las lecturas se borran por lotes en la cola de trabajos
+    task_id = submit_delete_caso(caso_id)
+    logger.info(
+        f"[Delete Caso] Borrado del caso ID {caso_id} encolado como tarea {task_id} (solicitud por {current_user.User})."
+    )
+    return {
+        "task_id": task_id,
+        "message": "El borrado del caso ha comenzado en segundo plano. Consulte el estado para ver el progreso.",
+    }
 
 
 # === ARCHIVOS EXCEL (Importación, Descarga, Eliminación) ===
@@ -1409,7 +1453,6 @@ async def validate_lectores_preview(
 )
 async def upload_excel_submission(
     caso_id: int,
-    background_tasks: BackgroundTasks,
     tipo_archivo: str = Form(..., pattern="^(GPS|LPR)$"),
     excel_file: UploadFile = File(...),
     column_mapping: str = Form(...),
@@ -1499,7 +1542,8 @@ async def upload_excel_submission(
         "total": None,
         "stage": "reading_file",
     }
-    background_tasks.add_task(
+    job_queue.submit(
+        KIND_IMPORT,
         process_file_in_background,
         task_id,
         temp_file_path,
@@ -1508,6 +1552,7 @@ async def upload_excel_submission(
         tipo_archivo,
         column_mapping,
         current_user.User,
+        task_id=task_id,
     )
     logger.info(
         f"[Task {task_id}] File '{original_filename}' for caso {caso_id} enqueued for background processing."
@@ -1562,27 +1607,10 @@ def read_archivos_por_caso(
             )
 
     try:
-        # Subconsulta para contar lecturas por ID_Archivo
-        subquery = (
-            select(
-                models.Lectura.ID_Archivo,
-                func.count(models.Lectura.ID_Lectura).label("total_lecturas"),
-            )
-            .group_by(models.Lectura.ID_Archivo)
-            .subquery()
-        )
-
-        # Consulta principal uniendo ArchivoExcel con la subconsulta de conteo
-        # Usamos un left outer join por si un archivo no tiene lecturas (aunque no debería pasar)
-        archivos_con_conteo = (
-            db.query(
-                models.ArchivoExcel,
-                # Seleccionar la columna 'total_lecturas' de la subconsulta, usando 0 si es NULL
-                func.coalesce(subquery.c.total_lecturas, 0).label("num_registros"),
-            )
-            .outerjoin(
-                subquery, models.ArchivoExcel.ID_Archivo == subquery.c.ID_Archivo
-            )
+        # Lecturas por archivo, agregadas sólo sobre las lecturas del caso
+        conteos = analytics.counts_by_file(db, caso_id)
+        archivos_caso = (
+            db.query(models.ArchivoExcel)
             .filter(models.ArchivoExcel.ID_Caso == caso_id)
             .order_by(models.ArchivoExcel.Fecha_de_Importacion.desc())
             .all()
@@ -1590,13 +1618,16 @@ def read_archivos_por_caso(
 
         # Formatear la respuesta para que coincida con el schema
         respuesta = []
-        for archivo_db, num_registros in archivos_con_conteo:
+        for archivo_db in archivos_caso:
+            # 0 si un archivo no tiene lecturas (aunque no debería pasar)
+            archivo_id = cast(int, archivo_db.ID_Archivo)
+            num_registros = conteos.get(archivo_id, 0)
             archivo_schema = schemas.ArchivoExcel(
-                ID_Archivo=archivo_db.ID_Archivo,
-                ID_Caso=archivo_db.ID_Caso,
-                Nombre_del_Archivo=archivo_db.Nombre_del_Archivo,
-                Tipo_de_Archivo=archivo_db.Tipo_de_Archivo,
-                Fecha_de_Importacion=archivo_db.Fecha_de_Importacion,
+                ID_Archivo=archivo_id,
+                ID_Caso=cast(int, archivo_db.ID_Caso),
+                Nombre_del_Archivo=cast(str, archivo_db.Nombre_del_Archivo),
+                Tipo_de_Archivo=cast(str, archivo_db.Tipo_de_Archivo),
+                Fecha_de_Importacion=cast(date, archivo_db.Fecha_de_Importacion),
                 Total_Registros=num_registros,  # Asignar el conteo calculado
             )
             respuesta.append(archivo_schema)
@@ -1614,12 +1645,16 @@ def read_archivos_por_caso(
         )
 
 
-@app.delete("/archivos/{id_archivo}", status_code=status.HTTP_204_NO_CONTENT)
+@app.delete("/archivos/{id_archivo}", status_code=status.HTTP_202_ACCEPTED)
 async def delete_archivo(
     id_archivo: int,
     db: Session = Depends(get_db),
     current_user: models.Usuario = Depends(get_current_active_user),
 ):
+    return await run_db(_delete_archivo, id_archivo, db, current_user)
+
+
+def _delete_archivo(id_archivo: int, db: Session, current_user: models.Usuario):
     logger.info(
         f"Solicitud DELETE para archivo ID: {id_archivo} por usuario {current_user.User}"
     )
@@ -1678,109 +1713,14 @@ async def delete_archivo(
             detail="Permiso denegado para eliminar archivos.",
         )
 
-    file_path_to_delete = None
-    if archivo_db.Nombre_del_Archivo and archivo_db.caso:
-        # Corregir: usar la carpeta del caso
-        caso_id = archivo_db.ID_Caso
-        carpeta_caso = UPLOADS_DIR / f"Caso{caso_id}"
-        file_path_to_delete = carpeta_caso / archivo_db.Nombre_del_Archivo
-        logger.info(f"[Delete] Ruta física: {file_path_to_delete}")
-    else:
-        logger.warning(
-            f"[Delete] Registro ID {id_archivo} sin nombre o sin caso, no se borra archivo físico."
-        )
-    try:
-        # Eliminar lecturas LPR/GPS asociadas
-        lecturas_eliminadas = (
-            db.query(models.Lectura)
-            .filter(models.Lectura.ID_Archivo == id_archivo)
-            .delete()
-        )
-        logger.info(
-            f"[Delete] {lecturas_eliminadas} lecturas asociadas marcadas para eliminar."
-        )
-
-        # Si es un archivo EXTERNO, eliminar también los datos externos asociados
-        external_data_eliminados = 0
-        if archivo_db.Tipo_de_Archivo == "EXTERNO":
-            # Buscar datos externos que puedan estar asociados a este archivo
-            # usando el caso_id y el nombre del archivo para inferir el source_name
-            archivo_nombre = archivo_db.Nombre_del_Archivo
-            caso_id = archivo_db.ID_Caso
-
-            # Buscar registros externos que puedan corresponder a este archivo
-            # (esto es una heurística ya que no hay relación directa)
-            external_entries = (
-                db.query(models.ExternalData)
-                .filter(models.ExternalData.caso_id == caso_id)
-                .all()
-            )
-
-            # Verificar cuáles podrían corresponder a este archivo basándose en fechas de importación cercanas
-            import datetime
-
-            archivo_fecha = archivo_db.Fecha_de_Importacion
-            fecha_inicio = datetime.datetime.combine(archivo_fecha, datetime.time.min)
-            fecha_fin = datetime.datetime.combine(archivo_fecha, datetime.time.max)
-
-            external_data_eliminados = (
-                db.query(models.ExternalData)
-                .filter(
-                    models.ExternalData.caso_id == caso_id,
-                    models.ExternalData.import_date >= fecha_inicio,
-                    models.ExternalData.import_date <= fecha_fin,
-                )
-                .delete()
-            )
-
-            logger.info(
-                f"[Delete] {external_data_eliminados} registros de datos externos eliminados para archivo EXTERNO {archivo_nombre}."
-            )
-
-        # Eliminar archivo físico
-        if file_path_to_delete and os.path.isfile(file_path_to_delete):
-            try:
-                os.remove(file_path_to_delete)
-                logger.info(f"[Delete] Archivo físico eliminado: {file_path_to_delete}")
-            except OSError as e:
-                logger.error(
-                    f"[Delete] Error eliminando {file_path_to_delete}: {e}. Continuando... (caso {caso_id}, usuario {current_user.User}).",
-                    exc_info=True,
-                )
-        elif file_path_to_delete:
-            logger.warning(
-                f"[Delete] Archivo físico no existía: {file_path_to_delete}."
-            )
-
-        # Eliminar registro ArchivoExcel
-        db.delete(archivo_db)
-        logger.info(
-            f"[Delete] Registro ArchivoExcel ID {id_archivo} marcado para eliminar."
-        )
-
-        # Confirmar cambios
-        db.commit()
-
-        if external_data_eliminados > 0:
-            logger.info(
-                f"[Delete] Commit realizado. Eliminación completa archivo ID {id_archivo} y {external_data_eliminados} datos externos asociados."
-            )
-        else:
-            logger.info(
-                f"[Delete] Commit realizado. Eliminación completa archivo ID {id_archivo}."
-            )
-
-        return
-    except Exception as e:
-        db.rollback()
-        logger.error(
-            f"[Delete] Error durante eliminación archivo ID {id_archivo}. Rollback: {e}",
-            exc_info=True,
-        )
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error interno eliminando archivo: {e}",
-        )
+    task_id = submit_delete_archivo(id_archivo)
+    logger.info(
+        f"[Delete] Borrado del archivo ID {id_archivo} encolado como tarea {task_id} (solicitud por {current_user.User})."
+    )
+    return {
+        "task_id": task_id,
+        "message": "El borrado del archivo ha comenzado en segundo plano. Consulte el estado para ver el progreso.",
+    }
 
 
 # === LECTORES ===
@@ -1805,6 +1745,7 @@ def create_lector(
     # Aquí usamos model_dump() de Pydantic V2 en lugar de dict()
     db_lector = models.Lector(**lector.model_dump())
     db.add(db_lector)
+    incrementar_version_ambito(db, AMBITO_LECTORES)
     db.commit()
     db.refresh(db_lector)
     return db_lector
@@ -1892,12 +1833,33 @@ def read_lectores(
 
 @app.get("/lectores/coordenadas", response_model=List[schemas.LectorCoordenadas])
 def read_lectores_coordenadas(
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: models.Usuario = Depends(get_current_active_user),
 ):
     """Devuelve una lista de lectores con coordenadas válidas para el mapa."""
     logger.info(f"Solicitud GET /lectores/coordenadas por usuario {current_user.User}")
-
+    etag = etag_version(
+        AMBITO_LECTORES, version_ambito(db, AMBITO_LECTORES), "coordenadas"
+    )
+    no_modificado = respuesta_condicional(request, response, etag)
+    if no_modificado is not None:
+        return no_modificado
+    return _lectores_coordenadas(db)
+
+
+@paso_precalentamiento("lectores_coordenadas")
+@cached(
+    "lectores_coordenadas",
+    ttl=86400,
+    key_params=(),
+    scope=None,
+    tags=lambda _: [AMBITO_LECTORES],
+    version=version_de_ambito(AMBITO_LECTORES),
+)
+def _lectores_coordenadas(db: Session):
+    """Lectores con coordenadas para el mapa, compartidos por todos los usuarios"""
     # Consultar todos los lectores que tengan Coordenada_X Y Coordenada_Y no nulas
     lectores_con_coords = (
         db.query(models.Lector)
@@ -1931,11 +1893,19 @@ def read_lectores_coordenadas(
 
 @app.get("/lectores/sugerencias", response_model=schemas.LectorSugerenciasResponse)
 def get_lector_sugerencias(
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: models.Usuario = Depends(get_current_active_user),
 ):
     """Obtiene listas de valores únicos existentes para campos de Lector."""
     logger.info(f"Solicitud GET /lectores/sugerencias por usuario {current_user.User}")
+    etag = etag_version(
+        AMBITO_LECTORES, version_ambito(db, AMBITO_LECTORES), "sugerencias"
+    )
+    no_modificado = respuesta_condicional(request, response, etag)
+    if no_modificado is not None:
+        return no_modificado
     sugerencias = {
         "provincias": [],
         "localidades": [],
@@ -2105,6 +2075,7 @@ def update_lector(
 
     try:
         # --- Indent this block ---
+        incrementar_version_ambito(db, AMBITO_LECTORES)
         db.commit()
         db.refresh(db_lector)
         logger.info(f"[Update Lector {lector_id}] Lector actualizado correctamente.")
@@ -2132,8 +2103,9 @@ def delete_lector(
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Lector no encontrado"
         )
-    lecturas_asociadas = (
-        db.query(models.Lectura).filter(models.Lectura.ID_Lector == lector_id).count()
+    lecturas_asociadas = sum(
+        db.query(Lectura).filter(Lectura.ID_Lector == lector_id).count()
+        for Lectura, _ in lectura_sources()
     )
     if lecturas_asociadas > 0:
         raise HTTPException(
@@ -2141,6 +2113,7 @@ def delete_lector(
             detail=f"No se puede eliminar '{lector_id}', tiene {lecturas_asociadas} lecturas asociadas.",
         )
     db.delete(db_lector)
+    incrementar_version_ambito(db, AMBITO_LECTORES)
     db.commit()
     return None
 
@@ -2173,6 +2146,7 @@ def create_vehiculo(
     try:
         # --- Indent this block ---
         db.add(db_vehiculo)
+        incrementar_version_matricula(db, cast(str, db_vehiculo.Matricula))
         db.commit()
         db.refresh(db_vehiculo)
         logger.info(f"Vehículo creado con matrícula: {db_vehiculo.Matricula}")
@@ -2235,16 +2209,17 @@ def update_vehiculo(
                 detail="Admingrupo no tiene un grupo asignado.",
             )
         # Verificar si el vehículo está en algún caso del grupo del admingrupo
-        vehiculo_en_grupo = (
-            db.query(models.Lectura)
+        vehiculo_en_grupo = any(
+            db.query(Lectura.ID_Lectura)
             .join(
                 models.ArchivoExcel,
-                models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+                Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
             )
             .join(models.Caso, models.ArchivoExcel.ID_Caso == models.Caso.ID_Caso)
-            .filter(models.Lectura.Matricula == db_vehiculo.Matricula)
+            .filter(Lectura.Matricula == db_vehiculo.Matricula)
             .filter(models.Caso.ID_Grupo == current_user.ID_Grupo)
             .first()
+            for Lectura, _ in lectura_sources()
         )
         if not vehiculo_en_grupo:
             raise HTTPException(
@@ -2257,10 +2232,13 @@ def update_vehiculo(
         )
 
     update_data = vehiculo_update.model_dump(exclude_unset=True)
+    matricula_anterior = cast(str, db_vehiculo.Matricula)
     for key, value in update_data.items():
         setattr(db_vehiculo, key, value)
 
     try:
+        for matricula in {matricula_anterior, cast(str, db_vehiculo.Matricula)}:
+            incrementar_version_matricula(db, matricula)
         db.commit()
         db.refresh(db_vehiculo)
         logger.info(
@@ -2277,9 +2255,10 @@ def update_vehiculo(
 
 
 @app.get("/casos/{caso_id}/vehiculos", response_model=List[schemas.VehiculoWithStats])
-@cached("vehiculos_caso", ttl=1800)  # Cache por 30 minutos
 def get_vehiculos_by_caso(
     caso_id: int,
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: models.Usuario = Depends(get_current_active_user),
 ):  # MODIFIED
@@ -2319,6 +2298,23 @@ def get_vehiculos_by_caso(
             detail="No tiene permiso para acceder a los vehículos de este caso",
         )
 
+    etag = etag_caso(caso_id, version_caso(db, caso_id), "vehiculos")
+    no_modificado = respuesta_condicional(request, response, etag)
+    if no_modificado is not None:
+        return no_modificado
+    return _vehiculos_caso(caso_id, db)
+
+
+@paso_precalentamiento("vehiculos")
+@cached(
+    "vehiculos_caso",
+    ttl=86400,
+    key_params=("caso_id",),
+    scope=None,
+    version=version_de_llamada,
+)  # Versionado por caso: la entrada deja de usarse en cuanto cambian los datos
+def _vehiculos_caso(caso_id: int, db: Session):
+    """Vehículos del caso con sus lecturas LPR/GPS (permisos ya comprobados)"""
     try:
         # Intentar usar la vista optimizada si existe
         try:
@@ -2332,7 +2328,9 @@ def get_vehiculos_by_caso(
                 is not None
             )
 
-            if vista_exists:
+            # Con el motor analítico los conteos por tipo de fuente salen de
+            # una sola agregación columnar, más rápida que la vista
+            if vista_exists and not analytics.enabled():
                 logger.info(
                     f"Usando vista optimizada para vehículos del caso {caso_id}"
                 )
@@ -2392,11 +2390,12 @@ def get_vehiculos_by_caso(
 
         # Consulta estándar si la vista no existe o hay error
         # Subconsulta para obtener las matrículas únicas de las lecturas de este caso
+        Lectura = lectura_entity(caso_id)
         matriculas_en_caso_query = (
-            db.query(models.Lectura.Matricula)
+            db.query(Lectura.Matricula)
             .join(
                 models.ArchivoExcel,
-                models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+                Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
             )
             .filter(models.ArchivoExcel.ID_Caso == caso_id)
             .distinct()
@@ -2410,47 +2409,17 @@ def get_vehiculos_by_caso(
             .all()
         )
 
-        # --- NUEVO: Calcular conteo de lecturas LPR por vehículo DENTRO del caso ---
+        # --- Conteo de lecturas LPR y GPS por vehículo DENTRO del caso ---
+        # Una sola agregación por matrícula y tipo en lugar de dos por vehículo
+        conteos = analytics.counts_by_plate(db, caso_id)
         vehiculos_with_stats = []
         for vehiculo in vehiculos_db:
-            # Contar lecturas LPR para este vehículo en este caso
-            count_lpr = (
-                db.query(func.count(models.Lectura.ID_Lectura))
-                .join(
-                    models.ArchivoExcel,
-                    models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
-                )
-                .filter(
-                    models.ArchivoExcel.ID_Caso == caso_id,
-                    models.Lectura.Matricula == vehiculo.Matricula,
-                    models.Lectura.Tipo_Fuente == "LPR",  # Solo contar LPR
-                )
-                .scalar()
-                or 0
-            )
-
-            # Contar lecturas GPS (si aplica)
-            count_gps = (
-                db.query(func.count(models.Lectura.ID_Lectura))
-                .join(
-                    models.ArchivoExcel,
-                    models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
-                )
-                .filter(
-                    models.ArchivoExcel.ID_Caso == caso_id,
-                    models.Lectura.Matricula == vehiculo.Matricula,
-                    models.Lectura.Tipo_Fuente == "GPS",  # Solo contar GPS
-                )
-                .scalar()
-                or 0
-            )
-
-            # Crear VehiculoWithStats
+            conteo = conteos.get(cast(str, vehiculo.Matricula), {})
             vehiculos_with_stats.append(
                 schemas.VehiculoWithStats(
                     **vehiculo.__dict__,
-                    num_lecturas_lpr=count_lpr,
-                    num_lecturas_gps=count_gps,
+                    num_lecturas_lpr=conteo.get("LPR", 0),  # Solo contar LPR
+                    num_lecturas_gps=conteo.get("GPS", 0),  # Solo contar GPS
                 )
             )
 
@@ -2500,15 +2469,13 @@ def get_lecturas_por_vehiculo(
             detail=f"Vehículo con ID {vehiculo_id} no encontrado",
         )
 
-    query = db.query(models.Lectura).filter(
-        models.Lectura.Matricula == db_vehiculo.Matricula
-    )
     user_rol = (
         current_user.Rol.value
         if hasattr(current_user.Rol, "value")
         else current_user.Rol
     )
 
+    grupo_id = None
     if (
         user_rol != RolUsuarioEnum.superadmin.value
     ):  # Si no es superadmin, aplicar filtro de grupo
@@ -2531,30 +2498,28 @@ def get_lecturas_por_vehiculo(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="No tiene permiso para acceder a las lecturas de este caso.",
                 )
-            # Filtrar por el caso_id ya verificado
-            query = query.join(
-                models.ArchivoExcel,
-                models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
-            ).filter(models.ArchivoExcel.ID_Caso == caso_id)
         else:
             # No se dio caso_id, filtrar todas las lecturas del vehículo que estén en casos del grupo del usuario
-            query = (
-                query.join(
-                    models.ArchivoExcel,
-                    models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
-                )
-                .join(models.Caso, models.ArchivoExcel.ID_Caso == models.Caso.ID_Caso)
-                .filter(models.Caso.ID_Grupo == current_user.ID_Grupo)
-            )
-    elif (
-        caso_id is not None
-    ):  # Superadmin, pero se proveyó caso_id, así que filtramos por él
-        query = query.join(
-            models.ArchivoExcel,
-            models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
-        ).filter(models.ArchivoExcel.ID_Caso == caso_id)
+            grupo_id = current_user.ID_Grupo
 
-    lecturas = query.order_by(models.Lectura.Fecha_y_Hora.asc()).all()
+    # Una consulta por fuente: la tabla compartida y el shard de cada caso
+    lecturas = []
+    for Lectura, _ in lectura_sources(None if caso_id is None else [caso_id]):
+        query = db.query(Lectura).filter(Lectura.Matricula == db_vehiculo.Matricula)
+        if caso_id is not None or grupo_id is not None:
+            query = query.join(
+                models.ArchivoExcel,
+                Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+            )
+        if caso_id is not None:
+            # Filtrar por el caso_id ya verificado
+            query = query.filter(models.ArchivoExcel.ID_Caso == caso_id)
+        if grupo_id is not None:
+            query = query.join(
+                models.Caso, models.ArchivoExcel.ID_Caso == models.Caso.ID_Caso
+            ).filter(models.Caso.ID_Grupo == grupo_id)
+        lecturas.extend(query.all())
+    lecturas.sort(key=lambda lectura: lectura.Fecha_y_Hora)
 
     logger.info(
         f"Encontradas {len(lecturas)} lecturas para el vehículo ID {vehiculo_id} (Matrícula: {db_vehiculo.Matricula})"
@@ -2591,10 +2556,12 @@ def delete_vehiculo(
             detail=f"Vehículo con ID {vehiculo_id} no encontrado",
         )
 
-    matricula_log = db_vehiculo.Matricula  # Guardar matrícula para log antes de borrar
+    # Guardar matrícula para log antes de borrar
+    matricula_log = cast(str, db_vehiculo.Matricula)
     try:
         # --- Indent this block ---
         db.delete(db_vehiculo)
+        incrementar_version_matricula(db, matricula_log)
         db.commit()
         logger.info(
             f"[DELETE /vehiculos] Vehículo ID {vehiculo_id} (Matrícula: {matricula_log}) eliminado exitosamente."
@@ -2613,6 +2580,60 @@ def delete_vehiculo(
         )
 
 
+def _patron_matricula(m: str) -> str:
+    """Patrón LIKE de una matrícula con comodines * y ?"""
+    return (
+        m.replace("\\", "\\\\")
+        .replace("%", "\\%")
+        .replace("_", "\\_")
+        .replace("?", "_")
+        .replace("*", "%")
+    )
+
+
+def _filtrar_lecturas(
+    query,
+    Lectura,
+    casos: Optional[List[int]],
+    lector_ids: Optional[List[str]] = None,
+    carretera_ids: Optional[List[str]] = None,
+    sentido: Optional[List[str]] = None,
+    tipo_fuente: Optional[str] = None,
+    solo_relevantes: Optional[bool] = False,
+    organismos: Optional[List[str]] = None,
+    provincias: Optional[List[str]] = None,
+):
+    """
+    Filtros comunes de las búsquedas de lecturas sobre una fuente de
+    `lectura_sources` (tabla compartida o shard). Los filtros de lector
+    necesitan que la consulta ya tenga el JOIN con Lector.
+    """
+    if casos:
+        # JOIN optimizado con ArchivosExcel usando el índice creado
+        query = query.join(
+            models.ArchivoExcel,
+            Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+        ).filter(models.ArchivoExcel.ID_Caso.in_(casos))
+    if lector_ids:
+        query = query.filter(Lectura.ID_Lector.in_(lector_ids))
+    if carretera_ids:
+        query = query.filter(models.Lector.Carretera.in_(carretera_ids))
+    if sentido:
+        query = query.filter(models.Lector.Sentido.in_(sentido))
+    if tipo_fuente:
+        query = query.filter(Lectura.Tipo_Fuente == tipo_fuente)
+    if solo_relevantes:
+        query = query.join(
+            models.LecturaRelevante,
+            Lectura.ID_Lectura == models.LecturaRelevante.ID_Lectura,
+        )
+    if organismos:
+        query = query.filter(models.Lector.Organismo_Regulador.in_(organismos))
+    if provincias:
+        query = query.filter(models.Lector.Provincia.in_(provincias))
+    return query
+
+
 # === LECTURAS ===
 @app.get("/lecturas", response_model=List[schemas.Lectura])
 def read_lecturas(
@@ -2641,42 +2662,26 @@ def read_lecturas(
         f"GET /lecturas - Filtros: min_pasos={min_pasos} max_pasos={max_pasos} carreteras={carretera_ids}"
     )
 
-    # Base query optimizada - usar JOIN explícito más eficiente
-    base_query = db.query(models.Lectura)
-
-    # JOIN condicional optimizado - solo hacer JOIN con Lector si es necesario
-    join_lector_needed = any(
-        [lector_ids, carretera_ids, sentido, organismos, provincias]
-    )
-    if join_lector_needed:
-        base_query = base_query.join(
-            models.Lector, models.Lectura.ID_Lector == models.Lector.ID_Lector
+    # Una consulta por fuente: la tabla compartida y el shard de cada caso
+    # (sin filtro de caso, la tabla compartida entera y todos los shards)
+    fuentes = lectura_sources(caso_ids or None)
+
+    def _filtros_comunes(query, Lectura, casos):
+        # JOIN con Lector (también para cargar el lector de cada lectura)
+        query = query.join(models.Lector, Lectura.ID_Lector == models.Lector.ID_Lector)
+        return _filtrar_lecturas(
+            query,
+            Lectura,
+            casos,
+            lector_ids=lector_ids,
+            carretera_ids=carretera_ids,
+            sentido=sentido,
+            tipo_fuente=tipo_fuente,
+            solo_relevantes=solo_relevantes,
+            organismos=organismos,
+            provincias=provincias,
         )
 
-    # --- Aplicar filtros comunes ---
-    if caso_ids:
-        # JOIN optimizado con ArchivosExcel usando el índice creado
-        base_query = base_query.join(
-            models.ArchivoExcel,
-            models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
-        ).filter(models.ArchivoExcel.ID_Caso.in_(caso_ids))
-    if lector_ids:
-        base_query = base_query.filter(models.Lectura.ID_Lector.in_(lector_ids))
-    if carretera_ids:
-        base_query = base_query.filter(models.Lector.Carretera.in_(carretera_ids))
-    if sentido:
-        base_query = base_query.filter(models.Lector.Sentido.in_(sentido))
-    if tipo_fuente:
-        base_query = base_query.filter(models.Lectura.Tipo_Fuente == tipo_fuente)
-    if solo_relevantes:
-        base_query = base_query.join(models.LecturaRelevante)
-    if organismos:
-        base_query = base_query.filter(
-            models.Lector.Organismo_Regulador.in_(organismos)
-        )
-    if provincias:
-        base_query = base_query.filter(models.Lector.Provincia.in_(provincias))
-
     # --- Combinar fecha y hora para crear datetimes ---
     start_datetime = None
     if fecha_inicio:
@@ -2713,96 +2718,26 @@ def read_lecturas(
             )
             pass
 
-    # Aplicar filtro de fecha/hora
-    if start_datetime:
-        base_query = base_query.filter(models.Lectura.Fecha_y_Hora >= start_datetime)
-    if end_datetime:
-        base_query = base_query.filter(models.Lectura.Fecha_y_Hora <= end_datetime)
-
-    # --- Manejo de matrículas ---
-    if matricula:
-        # Usar or_ para buscar en múltiples patrones de matrícula
-        condiciones = []
-        for m in matricula:
-            sql_pattern = (
-                m.replace("\\", "\\\\")
-                .replace("%", "\\%")
-                .replace("_", "\\_")
-                .replace("?", "_")
-                .replace("*", "%")
-            )
-            if "*" in m or "%" in m or "?" in m or "_" in m:
-                condiciones.append(models.Lectura.Matricula.ilike(sql_pattern))
-            else:
-                condiciones.append(models.Lectura.Matricula.ilike(sql_pattern))
-        if condiciones:
-            base_query = base_query.filter(or_(*condiciones))
-
     # Filtro por número de pasos (lecturas por matrícula)
-    if min_pasos is not None or max_pasos is not None:
-        # Crear una subconsulta con los mismos filtros para contar pasos
-        pasos_subquery = db.query(
-            models.Lectura.Matricula, func.count("*").label("num_pasos")
-        ).join(models.Lector)
-
-        # Aplicar los mismos filtros a la subconsulta
-        if caso_ids:
-            pasos_subquery = pasos_subquery.join(models.ArchivoExcel).filter(
-                models.ArchivoExcel.ID_Caso.in_(caso_ids)
-            )
-        if lector_ids:
-            pasos_subquery = pasos_subquery.filter(
-                models.Lectura.ID_Lector.in_(lector_ids)
-            )
-        if carretera_ids:
-            pasos_subquery = pasos_subquery.filter(
-                models.Lector.Carretera.in_(carretera_ids)
+    filtrar_pasos = min_pasos is not None or max_pasos is not None
+    if filtrar_pasos:
+        try:
+            pasos_desde = (
+                datetime.strptime(fecha_inicio, "%Y-%m-%d").date()
+                if fecha_inicio
+                else None
             )
-        if sentido:
-            pasos_subquery = pasos_subquery.filter(models.Lector.Sentido.in_(sentido))
-        if tipo_fuente:
-            pasos_subquery = pasos_subquery.filter(
-                models.Lectura.Tipo_Fuente == tipo_fuente
+            pasos_hasta = (
+                datetime.strptime(fecha_fin, "%Y-%m-%d").date() + timedelta(days=1)
+                if fecha_fin
+                else None
             )
-        if solo_relevantes:
-            pasos_subquery = pasos_subquery.join(models.LecturaRelevante)
-        if organismos:
-            pasos_subquery = pasos_subquery.filter(
-                models.Lector.Organismo_Regulador.in_(organismos)
+            pasos_hora_desde = (
+                datetime.strptime(hora_inicio, "%H:%M") if hora_inicio else None
             )
-        if provincias:
-            pasos_subquery = pasos_subquery.filter(
-                models.Lector.Provincia.in_(provincias)
+            pasos_hora_hasta = (
+                datetime.strptime(hora_fin, "%H:%M") if hora_fin else None
             )
-
-        # Aplicar los mismos filtros de fecha/hora
-        try:
-            if fecha_inicio:
-                fecha_inicio_dt = datetime.strptime(fecha_inicio, "%Y-%m-%d").date()
-                pasos_subquery = pasos_subquery.filter(
-                    models.Lectura.Fecha_y_Hora >= fecha_inicio_dt
-                )
-            if fecha_fin:
-                fecha_fin_dt = datetime.strptime(
-                    fecha_fin, "%Y-%m-%d"
-                ).date() + timedelta(days=1)
-                pasos_subquery = pasos_subquery.filter(
-                    models.Lectura.Fecha_y_Hora < fecha_fin_dt
-                )
-            if hora_inicio:
-                hora_inicio_dt = datetime.strptime(hora_inicio, "%H:%M")
-                pasos_subquery = pasos_subquery.filter(
-                    extract("hour", models.Lectura.Fecha_y_Hora) * 100
-                    + extract("minute", models.Lectura.Fecha_y_Hora)
-                    >= hora_inicio_dt.hour * 100 + hora_inicio_dt.minute
-                )
-            if hora_fin:
-                hora_fin_dt = datetime.strptime(hora_fin, "%H:%M")
-                pasos_subquery = pasos_subquery.filter(
-                    extract("hour", models.Lectura.Fecha_y_Hora) * 100
-                    + extract("minute", models.Lectura.Fecha_y_Hora)
-                    <= hora_fin_dt.hour * 100 + hora_fin_dt.minute
-                )
         except ValueError:
             logger.warning(
                 "Formato de fecha/hora inválido recibido en subconsulta de pasos."
@@ -2812,35 +2747,102 @@ def read_lecturas(
                 detail="Formato de fecha/hora inválido.",
             )
 
-        # Agrupar y filtrar por número de pasos
-        pasos_subquery = pasos_subquery.group_by(models.Lectura.Matricula).having(
-            and_(
-                func.count("*") >= min_pasos if min_pasos is not None else True,
-                func.count("*") <= max_pasos if max_pasos is not None else True,
-            )
+    def _pasos(Lectura, casos):
+        # Pasos por matrícula con los mismos filtros que la consulta principal
+        pasos_subquery = _filtros_comunes(
+            db.query(Lectura.Matricula, func.count("*").label("num_pasos")),
+            Lectura,
+            casos,
         )
-
-        # Filtrar la consulta principal para incluir solo las matrículas que cumplen con los criterios de pasos
-        base_query = base_query.filter(
-            models.Lectura.Matricula.in_(
-                pasos_subquery.with_entities(models.Lectura.Matricula)
+        if pasos_desde:
+            pasos_subquery = pasos_subquery.filter(Lectura.Fecha_y_Hora >= pasos_desde)
+        if pasos_hasta:
+            pasos_subquery = pasos_subquery.filter(Lectura.Fecha_y_Hora < pasos_hasta)
+        if pasos_hora_desde:
+            pasos_subquery = pasos_subquery.filter(
+                extract("hour", Lectura.Fecha_y_Hora) * 100
+                + extract("minute", Lectura.Fecha_y_Hora)
+                >= pasos_hora_desde.hour * 100 + pasos_hora_desde.minute
             )
-        )
+        if pasos_hora_hasta:
+            pasos_subquery = pasos_subquery.filter(
+                extract("hour", Lectura.Fecha_y_Hora) * 100
+                + extract("minute", Lectura.Fecha_y_Hora)
+                <= pasos_hora_hasta.hour * 100 + pasos_hora_hasta.minute
+            )
+        return pasos_subquery.group_by(Lectura.Matricula)
 
-    # Asegurar JOIN con Lector para el eager loading (si no se hizo antes)
-    if not join_lector_needed:
-        base_query = base_query.join(
-            models.Lector, models.Lectura.ID_Lector == models.Lector.ID_Lector
+    def _pasos_validos(num_pasos):
+        return (min_pasos is None or num_pasos >= min_pasos) and (
+            max_pasos is None or num_pasos <= max_pasos
         )
 
-    # Ordenar y aplicar paginación - usar índice optimizado para ordenamiento
-    query = base_query.order_by(models.Lectura.Fecha_y_Hora.desc())
-    query = query.options(joinedload(models.Lectura.lector))
+    # Con varias fuentes, los pasos de una matrícula se suman entre todas
+    matriculas_validas = None
+    if filtrar_pasos and len(fuentes) > 1:
+        pasos_totales: Dict[str, int] = defaultdict(int)
+        for Lectura, casos in fuentes:
+            for m, num_pasos in _pasos(Lectura, casos).all():
+                pasos_totales[m] += num_pasos
+        matriculas_validas = {m for m, n in pasos_totales.items() if _pasos_validos(n)}
+
+    def _consulta(Lectura, casos):
+        base_query = _filtros_comunes(db.query(Lectura), Lectura, casos)
+
+        # Aplicar filtro de fecha/hora
+        if start_datetime:
+            base_query = base_query.filter(Lectura.Fecha_y_Hora >= start_datetime)
+        if end_datetime:
+            base_query = base_query.filter(Lectura.Fecha_y_Hora <= end_datetime)
+
+        # --- Manejo de matrículas ---
+        if matricula:
+            # Usar or_ para buscar en múltiples patrones de matrícula
+            condiciones = [
+                Lectura.Matricula.ilike(_patron_matricula(m)) for m in matricula
+            ]
+            base_query = base_query.filter(or_(*condiciones))
+
+        if filtrar_pasos and matriculas_validas is None:
+            # Filtrar la consulta principal para incluir solo las matrículas que cumplen con los criterios de pasos
+            pasos_subquery = _pasos(Lectura, casos).having(
+                and_(
+                    func.count("*") >= min_pasos if min_pasos is not None else True,
+                    func.count("*") <= max_pasos if max_pasos is not None else True,
+                )
+            )
+            base_query = base_query.filter(
+                Lectura.Matricula.in_(pasos_subquery.with_entities(Lectura.Matricula))
+            )
+
+        # Ordenar - usar índice optimizado para ordenamiento
+        query = base_query.order_by(Lectura.Fecha_y_Hora.desc())
+        if Lectura is models.Lectura:
+            # En los shards el lector se carga al acceder al atributo
+            query = query.options(joinedload(models.Lectura.lector))
+        return query
 
     # Ejecutar consulta optimizada (gracias a los índices creados)
     try:
         start_time = time_module.time()
-        lecturas = query.offset(skip).limit(limit).all()
+        if len(fuentes) == 1:
+            lecturas = _consulta(*fuentes[0]).offset(skip).limit(limit).all()
+        else:
+            # Las primeras skip + limit de cada fuente bastan para la página
+            lecturas = []
+            for Lectura, casos in fuentes:
+                query = _consulta(Lectura, casos)
+                if matriculas_validas is None:
+                    query = query.limit(skip + limit)
+                    lecturas.extend(query.all())
+                else:
+                    lecturas.extend(
+                        lectura
+                        for lectura in query.all()
+                        if lectura.Matricula in matriculas_validas
+                    )
+            lecturas.sort(key=lambda lectura: lectura.Fecha_y_Hora, reverse=True)
+            lecturas = lecturas[skip : skip + limit]
         elapsed_time = time_module.time() - start_time
 
         # Log de rendimiento solo informativo
@@ -2865,6 +2867,18 @@ def read_lecturas(
 # === NUEVO: Endpoints para Lecturas Relevantes ===
 
 
+def _lectura_con_caso(db: Session, id_lectura: int):
+    """Lectura por su ID (de la tabla compartida o de un shard) con archivo y caso"""
+    Lectura = lectura_entity_for_id(id_lectura)
+    query = db.query(Lectura).filter(Lectura.ID_Lectura == id_lectura)
+    if Lectura is models.Lectura:
+        # En los shards el archivo y su caso se cargan al acceder
+        query = query.options(
+            joinedload(models.Lectura.archivo).joinedload(models.ArchivoExcel.caso)
+        )
+    return query.first()
+
+
 @app.post(
     "/lecturas/{id_lectura}/marcar_relevante",
     response_model=schemas.LecturaRelevante,
@@ -2885,14 +2899,7 @@ def marcar_lectura_relevante(
     )  # NUEVO log
 
     # Obtener la lectura y su caso asociado para verificar permisos
-    db_lectura = (
-        db.query(models.Lectura)
-        .options(
-            joinedload(models.Lectura.archivo).joinedload(models.ArchivoExcel.caso)
-        )
-        .filter(models.Lectura.ID_Lectura == id_lectura)
-        .first()
-    )
+    db_lectura = _lectura_con_caso(db, id_lectura)
 
     if not db_lectura:
         raise HTTPException(
@@ -2945,8 +2952,10 @@ def marcar_lectura_relevante(
             db_relevante_existente.Fecha_Modificacion = datetime.now(
                 timezone.utc
             )  # NUEVO: Actualizar fecha modificación
+            incrementar_version_caso(db, caso_de_lectura.ID_Caso)
             db.commit()
             db.refresh(db_relevante_existente)
+            cache_manager.invalidate_caso(caso_de_lectura.ID_Caso)
             return db_relevante_existente
         else:
             return db_relevante_existente
@@ -2962,8 +2971,10 @@ def marcar_lectura_relevante(
     )  # MODIFICADO: Usar dict
     db.add(nueva_relevante)
     try:
+        incrementar_version_caso(db, caso_de_lectura.ID_Caso)
         db.commit()
         db.refresh(nueva_relevante)
+        cache_manager.invalidate_caso(caso_de_lectura.ID_Caso)
         logger.info(
             f"Lectura {id_lectura} marcada como relevante por usuario {current_user.User}."
         )  # MODIFICADO: log
@@ -3005,14 +3016,7 @@ def desmarcar_lectura_relevante(
         )
 
     # BLOQUE DE AUTORIZACIÓN
-    db_lectura = (
-        db.query(models.Lectura)
-        .options(
-            joinedload(models.Lectura.archivo).joinedload(models.ArchivoExcel.caso)
-        )
-        .filter(models.Lectura.ID_Lectura == db_relevante.ID_Lectura)
-        .first()
-    )
+    db_lectura = _lectura_con_caso(db, cast(int, db_relevante.ID_Lectura))
 
     if not db_lectura:
         logger.error(
@@ -3055,7 +3059,9 @@ def desmarcar_lectura_relevante(
 
     db.delete(db_relevante)
     try:
+        incrementar_version_caso(db, caso_de_lectura.ID_Caso)
         db.commit()
+        cache_manager.invalidate_caso(caso_de_lectura.ID_Caso)
         logger.info(
             f"Marca de relevante eliminada para lectura {id_lectura} por usuario {current_user.User}."
         )
@@ -3169,15 +3175,16 @@ def get_lectores_por_caso(caso_id: int, db: Session = Depends(get_db)):
     )
     try:
         # Obtener IDs de lectores únicos que tienen lecturas LPR en este caso
+        Lectura = lectura_entity(caso_id)
         lectores_ids = (
-            db.query(models.Lectura.ID_Lector)
+            db.query(Lectura.ID_Lector)
             .join(
                 models.ArchivoExcel,
-                models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+                Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
             )
             .filter(models.ArchivoExcel.ID_Caso == caso_id)
-            .filter(models.Lectura.Tipo_Fuente == "LPR")
-            .filter(models.Lectura.ID_Lector != None)
+            .filter(Lectura.Tipo_Fuente == "LPR")
+            .filter(Lectura.ID_Lector != None)
             .distinct()
             .all()
         )
@@ -3207,6 +3214,8 @@ def get_lectores_por_caso(caso_id: int, db: Session = Depends(get_db)):
 @app.get("/casos/{caso_id}/lecturas", response_model=List[schemas.Lectura])
 def get_lecturas_por_caso(
     caso_id: int,
+    request: Request,
+    response: Response,
     matricula: Optional[str] = None,
     fecha_inicio: Optional[str] = None,
     fecha_fin: Optional[str] = None,
@@ -3221,26 +3230,50 @@ def get_lecturas_por_caso(
     dia_semana: Optional[int] = Query(
         None, description="Día de la semana (1=Lunes, 7=Domingo)", ge=1, le=7
     ),
+    zoom: Optional[int] = Query(
+        None,
+        ge=0,
+        le=ZOOM_MAXIMO,
+        description="Simplificar las trazas de cada matrícula para este zoom",
+    ),
+    tolerancia_m: Optional[float] = Query(
+        None, gt=0, description="Tolerancia de simplificación en metros"
+    ),
     db: Session = Depends(get_db),
 ):
     """
     Obtiene las lecturas de un caso con filtros opcionales.
+
+    Con `zoom` o `tolerancia_m` las trazas se simplifican por matrícula
+    (Douglas-Peucker sincronizado en el tiempo) antes de devolverlas.
     """
     logger.info(f"GET /casos/{caso_id}/lecturas - Obteniendo lecturas filtradas.")
+    # Las lecturas incluyen su lector, así que cuenta también su versión
+    etag = etag_caso(
+        caso_id,
+        version_caso(db, caso_id),
+        "lecturas",
+        version_ambito(db, AMBITO_LECTORES),
+        sorted(request.query_params.multi_items()),
+    )
+    no_modificado = respuesta_condicional(request, response, etag)
+    if no_modificado is not None:
+        return no_modificado
     try:
-        # Construir la consulta base
+        # Construir la consulta base sobre la tabla o el shard del caso
+        Lectura = lectura_entity(caso_id)
         query = (
-            db.query(models.Lectura)
+            db.query(Lectura)
             .join(
                 models.ArchivoExcel,
-                models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+                Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
             )
             .filter(models.ArchivoExcel.ID_Caso == caso_id)
         )
 
         # Aplicar filtros si se proporcionan
         if matricula:
-            query = query.filter(models.Lectura.Matricula.like(matricula))
+            query = query.filter(Lectura.Matricula.like(matricula))
 
         # --- NUEVO FILTRO: DÍA DE LA SEMANA ---
         if dia_semana is not None:
@@ -3248,7 +3281,7 @@ def get_lecturas_por_caso(
             # Convertimos nuestro 1-7 (Lun-Dom) al formato de SQLite (0-6, Dom-Sab)
             sqlite_dia = dia_semana % 7  # Convierte 7(Domingo) a 0
             query = query.filter(
-                func.strftime("%w", models.Lectura.Fecha_y_Hora) == str(sqlite_dia)
+                func.strftime("%w", Lectura.Fecha_y_Hora) == str(sqlite_dia)
             )
 
         # --- NUEVO FILTRO: RANGO ABSOLUTO DE FECHA Y HORA ---
@@ -3259,8 +3292,8 @@ def get_lecturas_por_caso(
                 )
                 dt_fin = datetime.strptime(f"{fecha_fin} {hora_fin}", "%Y-%m-%d %H:%M")
                 query = query.filter(
-                    models.Lectura.Fecha_y_Hora >= dt_inicio,
-                    models.Lectura.Fecha_y_Hora <= dt_fin,
+                    Lectura.Fecha_y_Hora >= dt_inicio,
+                    Lectura.Fecha_y_Hora <= dt_fin,
                 )
             except ValueError as e:
                 logger.error(f"Error al parsear fecha/hora: {e}")
@@ -3272,7 +3305,7 @@ def get_lecturas_por_caso(
             if fecha_inicio:
                 try:
                     fecha_inicio_dt = datetime.strptime(fecha_inicio, "%Y-%m-%d").date()
-                    query = query.filter(models.Lectura.Fecha_y_Hora >= fecha_inicio_dt)
+                    query = query.filter(Lectura.Fecha_y_Hora >= fecha_inicio_dt)
                 except ValueError as e:
                     logger.error(f"Error al parsear fecha_inicio: {e}")
                     raise HTTPException(
@@ -3285,7 +3318,7 @@ def get_lecturas_por_caso(
                     fecha_fin_dt = datetime.strptime(
                         fecha_fin, "%Y-%m-%d"
                     ).date() + timedelta(days=1)
-                    query = query.filter(models.Lectura.Fecha_y_Hora < fecha_fin_dt)
+                    query = query.filter(Lectura.Fecha_y_Hora < fecha_fin_dt)
                 except ValueError as e:
                     logger.error(f"Error al parsear fecha_fin: {e}")
                     raise HTTPException(
@@ -3298,8 +3331,8 @@ def get_lecturas_por_caso(
                 try:
                     hora_dt = datetime.strptime(hora_inicio, "%H:%M")
                     query = query.filter(
-                        extract("hour", models.Lectura.Fecha_y_Hora) * 100
-                        + extract("minute", models.Lectura.Fecha_y_Hora)
+                        extract("hour", Lectura.Fecha_y_Hora) * 100
+                        + extract("minute", Lectura.Fecha_y_Hora)
                         >= hora_dt.hour * 100 + hora_dt.minute
                     )
                 except ValueError as e:
@@ -3313,8 +3346,8 @@ def get_lecturas_por_caso(
                 try:
                     hora_dt = datetime.strptime(hora_fin, "%H:%M")
                     query = query.filter(
-                        extract("hour", models.Lectura.Fecha_y_Hora) * 100
-                        + extract("minute", models.Lectura.Fecha_y_Hora)
+                        extract("hour", Lectura.Fecha_y_Hora) * 100
+                        + extract("minute", Lectura.Fecha_y_Hora)
                         <= hora_dt.hour * 100 + hora_dt.minute
                     )
                 except ValueError as e:
@@ -3325,136 +3358,30 @@ def get_lecturas_por_caso(
                     )
 
         if lector_id:
-            query = query.filter(models.Lectura.ID_Lector == lector_id)
+            query = query.filter(Lectura.ID_Lector == lector_id)
 
         if tipo_fuente:
-            query = query.filter(models.Lectura.Tipo_Fuente == tipo_fuente)
+            query = query.filter(Lectura.Tipo_Fuente == tipo_fuente)
 
         if solo_relevantes:
             query = query.join(
                 models.LecturaRelevante,
-                models.Lectura.ID_Lectura == models.LecturaRelevante.ID_Lectura,
+                Lectura.ID_Lectura == models.LecturaRelevante.ID_Lectura,
                 isouter=False,
             )
 
         # Nuevos filtros de velocidad
         if velocidad_min is not None:
-            query = query.filter(models.Lectura.Velocidad >= velocidad_min)
+            query = query.filter(Lectura.Velocidad >= velocidad_min)
         if velocidad_max is not None:
-            query = query.filter(models.Lectura.Velocidad <= velocidad_max)
+            query = query.filter(Lectura.Velocidad <= velocidad_max)
 
-        # Filtro de duración de parada
+        # Filtro de duración de parada: sólo las lecturas que inician una parada
         if duracion_parada is not None:
-            # Obtener todas las lecturas ordenadas por matrícula y fecha/hora
-            lecturas_all = query.order_by(
-                models.Lectura.Matricula, models.Lectura.Fecha_y_Hora
-            ).all()
-
-            def haversine(lat1, lon1, lat2, lon2):
-                R = 6371000  # metros
-                dlat = radians(lat2 - lat1)
-                dlon = radians(lon2 - lon1)
-                a = (
-                    sin(dlat / 2) ** 2
-                    + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
-                )
-                c = 2 * asin(sqrt(a))
-                return R * c
-
-            # Calcular duracion_parada_min para todas las lecturas que sean inicio de parada
-            duraciones_parada = {}
-            for i in range(len(lecturas_all) - 1):
-                l1 = lecturas_all[i]
-                l2 = lecturas_all[i + 1]
-
-                # --- LOG DE DEPURACIÓN --- START
-                # Solo loguear para el vehículo específico si se proporciona en los parámetros
-                if matricula and l1.Matricula == matricula:
-                    log_msg = f"[DEBUG Parada] Matricula: {l1.Matricula}, Index: {i}"
-                    log_msg += f"\n  L1: Fecha={l1.Fecha_y_Hora}, Coords=({l1.Coordenada_Y}, {l1.Coordenada_X}), Velocidad={l1.Velocidad}"
-                    log_msg += f"\n  L2: Fecha={l2.Fecha_y_Hora}, Coords=({l2.Coordenada_Y}, {l2.Coordenada_X}), Velocidad={l2.Velocidad}"
-
-                    if l1.Matricula != l2.Matricula:
-                        log_msg += "\n  -> SKIPPED: Different Matricula"
-                    elif not (
-                        l1.Fecha_y_Hora
-                        and l2.Fecha_y_Hora
-                        and l1.Coordenada_X is not None
-                        and l1.Coordenada_Y is not None
-                        and l2.Coordenada_X is not None
-                        and l2.Coordenada_Y is not None
-                    ):
-                        log_msg += "\n  -> SKIPPED: Missing Date/Time or Coords"
-                    else:
-                        diff_min_calc = (
-                            l2.Fecha_y_Hora - l1.Fecha_y_Hora
-                        ).total_seconds() / 60
-                        log_msg += f"\n  Diff Min: {diff_min_calc:.2f}"
-                        if diff_min_calc <= 0:
-                            log_msg += "\n  -> SKIPPED: Time diff <= 0"
-                        else:
-                            dist_calc = haversine(
-                                l1.Coordenada_Y,
-                                l1.Coordenada_X,
-                                l2.Coordenada_Y,
-                                l2.Coordenada_X,
-                            )
-                            log_msg += f"\n  Distance (m): {dist_calc:.2f}"
-                            if dist_calc > 300:
-                                log_msg += "\n  -> SKIPPED: Distance > 300m"
-                            elif (
-                                duracion_parada is not None
-                                and diff_min_calc < duracion_parada
-                            ):
-                                log_msg += f"\n  -> SKIPPED: Duration ({diff_min_calc:.2f}min) < Filtered Duration ({duracion_parada}min)"
-                            else:
-                                log_msg += "\n  -> PASSED ALL CHECKS"
-                    logger.info(log_msg)
-                # --- LOG DE DEPURACIÓN --- END
-
-                if l1.Matricula != l2.Matricula:
-                    continue
-                if not (
-                    l1.Fecha_y_Hora
-                    and l2.Fecha_y_Hora
-                    and l1.Coordenada_X is not None
-                    and l1.Coordenada_Y is not None
-                    and l2.Coordenada_X is not None
-                    and l2.Coordenada_Y is not None
-                ):
-                    continue
-                diff_min = (l2.Fecha_y_Hora - l1.Fecha_y_Hora).total_seconds() / 60
-                if diff_min <= 0:
-                    continue
-                # Eliminar filtro de velocidad
-                # if l1.Velocidad is None or l1.Velocidad > 12:
-                #     continue
-                dist = haversine(
-                    l1.Coordenada_Y, l1.Coordenada_X, l2.Coordenada_Y, l2.Coordenada_X
-                )
-                if dist > 300:
-                    continue
-                # Si hay filtro de duracion_parada, solo considerar si cumple
-                if duracion_parada is not None and diff_min < duracion_parada:
-                    continue
-                duraciones_parada[l1.ID_Lectura] = diff_min
-            # Construir la respuesta
-            lecturas_respuesta = []
-            for l in lecturas_all:
-                l_dict = l.__dict__.copy()
-                if l.ID_Lectura in duraciones_parada:
-                    l_dict["duracion_parada_min"] = duraciones_parada[l.ID_Lectura]
-                else:
-                    l_dict["duracion_parada_min"] = None
-                lecturas_respuesta.append(schemas.Lectura(**l_dict))
-            # Si hay filtro de duracion_parada, solo devolver las que sean inicio de parada y cumplen el mínimo
-            if duracion_parada is not None:
-                lecturas_respuesta = [
-                    l
-                    for l in lecturas_respuesta
-                    if l.duracion_parada_min is not None
-                    and l.duracion_parada_min >= duracion_parada
-                ]
+            lecturas_respuesta = [
+                schemas.Lectura(**lectura)
+                for lectura in lecturas_inicio_parada(query, duracion_parada, Lectura)
+            ]
             logger.info(
                 f"Encontradas {len(lecturas_respuesta)} lecturas para el caso {caso_id}"
             )
@@ -3462,6 +3389,10 @@ def get_lecturas_por_caso(
 
         # Si no hay filtro de duración de parada, ejecutar la consulta normal
         lecturas = query.all()
+        if zoom is not None or tolerancia_m is not None:
+            lecturas = simplificar_lecturas(
+                lecturas, zoom=zoom, tolerancia_m=tolerancia_m
+            )
         return lecturas if lecturas else []
 
     except Exception as e:
@@ -3604,6 +3535,12 @@ def get_sugerencias_matriculas(
             status_code=status.HTTP_400_BAD_REQUEST, detail=mensaje_error
         )
 
+    # Con el modo por casos, las lecturas de un caso nuevo van a su shard,
+    # que se adjunta al escritor antes de abrir la transacción
+    ensure_shard(db, caso_id)
+    attach(db, caso_id)
+    Lectura = lectura_entity(caso_id)
+
     # --- Crear Registro ArchivoExcel ---
     db_archivo = models.ArchivoExcel(
         ID_Caso=caso_id,
@@ -3753,16 +3690,16 @@ def get_sugerencias_matriculas(
 
             # Verificar si ya existe una lectura duplicada
             lectura_duplicada = (
-                db.query(models.Lectura)
+                db.query(Lectura)
                 .join(
                     models.ArchivoExcel,
-                    models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+                    Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
                 )
                 .filter(
                     models.ArchivoExcel.ID_Caso == caso_id,
-                    models.Lectura.Matricula == matricula,
-                    models.Lectura.Fecha_y_Hora == fecha_hora_final,
-                    models.Lectura.ID_Lector == id_lector,
+                    Lectura.Matricula == matricula,
+                    Lectura.Fecha_y_Hora == fecha_hora_final,
+                    Lectura.ID_Lector == id_lector,
                 )
                 .first()
             )
@@ -3783,7 +3720,10 @@ def get_sugerencias_matriculas(
 
     # Insertar todas las lecturas válidas
     if lecturas_a_insertar:
-        db.add_all(lecturas_a_insertar)
+        add_lecturas(db, caso_id, lecturas_a_insertar)
+        incrementar_version_caso(db, caso_id)
+        if nuevos_lectores_en_sesion:
+            incrementar_version_ambito(db, AMBITO_LECTORES)
         db.commit()
 
     # Preparar respuesta con información sobre duplicados
@@ -4072,8 +4012,9 @@ def process_file_in_background(
             Total_Registros=0,  # Inicializar con 0, se actualizará al final
         )
         db.add(db_archivo)
-        db.flush()
-        db.refresh(db_archivo)
+        # Confirmar ya el registro: no retener el escritor mientras se
+        # prepara el primer lote (si la importación falla se elimina abajo)
+        db.commit()
         id_archivo_db = db_archivo.ID_Archivo
         logger.info(f"[Task {task_id}] ArchivoExcel ID: {id_archivo_db} creado.")
         logger.info(f"[Task {task_id}] Procesando {len(df)} filas para lecturas.")
@@ -4088,12 +4029,19 @@ def process_file_in_background(
         lectores_no_hallados = set()
         lectores_creados_bg = set()
         duplicados_omitidos_bg = set()
+        matriculas_importadas_bg = set()
         task_statuses[task_id]["total"] = len(df)
-        BATCH_SIZE = 500
+        BATCH_SIZE = WRITE_CHUNK_SIZE
+        # Con el modo por casos, las lecturas de un caso nuevo van a su shard
+        ensure_shard(db, caso_id)
+        Lectura = lectura_entity(caso_id)
         # Actualizar a siguiente etapa
         task_statuses[task_id]["stage"] = "processing"
         task_statuses[task_id]["message"] = "Procesando registros..."
         for i in range(0, len(df), BATCH_SIZE):
+            check_cancelled(task_id)
+            # El shard se adjunta al escritor antes de abrir la transacción del lote
+            attach(db, caso_id)
             batch_df = df[i : i + BATCH_SIZE]
             batch_lecturas_obj = []
             logger.info(
@@ -4244,13 +4192,16 @@ def process_file_in_background(
                                 coord_y = db_lector_existente.Coordenada_Y
 
                     duplicado_existente = (
-                        db.query(models.Lectura.ID_Lectura)
-                        .join(models.ArchivoExcel)
+                        db.query(Lectura.ID_Lectura)
+                        .join(
+                            models.ArchivoExcel,
+                            Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+                        )
                         .filter(
                             models.ArchivoExcel.ID_Caso == caso_id,
-                            models.Lectura.Matricula == matricula,
-                            models.Lectura.Fecha_y_Hora == fecha_hora_final,
-                            models.Lectura.ID_Lector == id_lector_val,
+                            Lectura.Matricula == matricula,
+                            Lectura.Fecha_y_Hora == fecha_hora_final,
+                            Lectura.ID_Lector == id_lector_val,
                         )
                         .first()
                     )
@@ -4276,6 +4227,7 @@ def process_file_in_background(
                         Tipo_Fuente=tipo_archivo,
                     )
                     batch_lecturas_obj.append(lectura_obj)
+                    matriculas_importadas_bg.add(matricula)
                     logger.info(
                         f"[Task {task_id}] Fila {excel_row_num} - Lectura creada exitosamente: {matricula} - {fecha_hora_final}"
                     )
@@ -4296,11 +4248,16 @@ def process_file_in_background(
                 f"[Task {task_id}] Lote completado. Lecturas a insertar: {len(batch_lecturas_obj)}"
             )
             if batch_lecturas_obj:
-                db.add_all(batch_lecturas_obj)
+                add_lecturas(db, caso_id, batch_lecturas_obj)
                 lecturas_insertadas_count += len(batch_lecturas_obj)
                 logger.info(
                     f"[Task {task_id}] {len(batch_lecturas_obj)} lecturas añadidas al lote. Total acumulado: {lecturas_insertadas_count}"
                 )
+                # Cada lote confirmado es visible: si la importación falla a
+                # medias, la versión ya refleja lo insertado
+                incrementar_version_caso(db, caso_id)
+                if lectores_creados_bg:
+                    incrementar_version_ambito(db, AMBITO_LECTORES)
             db.commit()  # Commit por lote (lecturas y nuevos lectores del lote)
             logger.info(f"[Task {task_id}] Commit del lote realizado exitosamente")
 
@@ -4322,7 +4279,23 @@ def process_file_in_background(
 
         # Actualizar el campo Total_Registros en el ArchivoExcel
         db_archivo.Total_Registros = lecturas_insertadas_count
+        incrementar_version_caso(db, caso_id)
+        if lectores_creados_bg:
+            incrementar_version_ambito(db, AMBITO_LECTORES)
         db.commit()
+        in_api_process(cache_manager.invalidate_archivo, db_archivo.ID_Archivo, caso_id)
+
+        # Recalcular estancias y trayectos de los vehículos GPS importados
+        if tipo_archivo == "GPS" and matriculas_importadas_bg:
+            task_statuses[task_id]["stage"] = "segmenting"
+            task_statuses[task_id]["message"] = "Calculando estancias y trayectos..."
+            try:
+                recalcular_segmentos(db, caso_id, matriculas_importadas_bg)
+            except Exception as e_seg:
+                logger.error(
+                    f"[Task {task_id}] Error calculando segmentos GPS: {e_seg}",
+                    exc_info=True,
+                )
 
         result_data = schemas.UploadResponse(
             archivo=schemas.ArchivoExcel.model_validate(
@@ -4367,6 +4340,23 @@ def process_file_in_background(
             raise ValueError(
                 f"No se pudo guardar el archivo definitivo '{original_filename}' en la carpeta del caso."
             )
+
+        # Precalentar los agregados del caso con los datos ya importados; la
+        # importación ya figura como completada y su progreso va en otra tarea
+        warmup_task_id = nueva_tarea_precalentamiento(caso_id)
+        task_statuses[task_id]["warmup_task_id"] = warmup_task_id
+        try:
+            if cache_manager.connected:
+                precalentar_caso(caso_id, warmup_task_id)
+            else:
+                # Sin Redis el cache que hay que llenar es el de la API
+                in_api_process(precalentar_caso, caso_id, warmup_task_id)
+        except Exception as e_warmup:
+            # Un fallo del cache no invalida una importación ya confirmada
+            logger.error(
+                f"[Task {task_id}] Error precalentando el cache del caso {caso_id}: {e_warmup}",
+                exc_info=True,
+            )
     except ValueError as ve_proc:
         logger.error(f"[Task {task_id}] Error de validación: {ve_proc}", exc_info=True)
         task_statuses[task_id] = {
@@ -4428,7 +4418,13 @@ def process_file_in_background(
     response_model=schemas.EstadisticasGlobales,
     tags=["Estadísticas"],
 )
-@cached("estadisticas_globales", ttl=3600)  # Cache por 1 hora
+@cached(
+    "estadisticas_globales",
+    ttl=3600,
+    key_params=(),
+    tags=lambda _: [GLOBAL_TAG],
+    stale_ttl=600,
+)  # Cache por 1 hora; al caducar se sirve la anterior mientras se recalcula
 def get_global_statistics(db: Session = Depends(get_db)):
     """
     Obtiene estadísticas globales del sistema (total casos, lecturas, vehículos, tamaño BD).
@@ -4437,6 +4433,9 @@ def get_global_statistics(db: Session = Depends(get_db)):
     try:
         total_casos = db.query(models.Caso).count()
         total_lecturas = db.query(models.Lectura).count()
+        # Las lecturas de los casos con shard están en sus propios archivos
+        for Lectura, _ in lectura_sources(sharded_casos()):
+            total_lecturas += db.scalar(select(func.count(Lectura.ID_Lectura))) or 0
         total_vehiculos = db.query(models.Vehiculo).count()
 
         # Obtener tamaño del archivo de la base de datos usando la ruta real de SQLAlchemy
@@ -4548,6 +4547,14 @@ def get_recent_files(
         # Formatear la respuesta para que coincida con el schema
         respuesta = []
         for archivo_db, num_registros in archivos_recientes:
+            Lectura = lectura_entity(archivo_db.ID_Caso)
+            if Lectura is not models.Lectura:
+                # Las lecturas de un caso con shard no están en la subconsulta
+                num_registros = (
+                    db.query(func.count(Lectura.ID_Lectura))
+                    .filter(Lectura.ID_Archivo == archivo_db.ID_Archivo)
+                    .scalar()
+                )
             archivo_schema = schemas.ArchivoExcel(
                 ID_Archivo=archivo_db.ID_Archivo,
                 ID_Caso=archivo_db.ID_Caso,
@@ -4598,14 +4605,28 @@ def get_matriculas_gps_por_caso(
             status_code=403,
             detail="No tiene permiso para acceder a las matrículas de este caso",
         )
+    return _matriculas_gps_caso(caso_id, db)
+
+
+@paso_precalentamiento("matriculas_gps")
+@cached(
+    "matriculas_gps_caso",
+    ttl=86400,
+    key_params=("caso_id",),
+    scope=None,
+    version=version_de_llamada,
+)
+def _matriculas_gps_caso(caso_id: int, db: Session):
+    """Matrículas con lecturas GPS en el caso (permisos ya comprobados)"""
+    Lectura = lectura_entity(caso_id)
     matriculas = (
-        db.query(models.Lectura.Matricula)
+        db.query(Lectura.Matricula)
         .join(
             models.ArchivoExcel,
-            models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+            Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
         )
         .filter(models.ArchivoExcel.ID_Caso == caso_id)
-        .filter(models.Lectura.Tipo_Fuente == "GPS")
+        .filter(Lectura.Tipo_Fuente == "GPS")
         .distinct()
         .all()
     )
@@ -4640,18 +4661,19 @@ def get_fechas_matricula_gps(
         )
 
     # Obtener la fecha mínima y máxima para la matrícula
+    Lectura = lectura_entity(caso_id)
     fechas = (
         db.query(
-            func.min(models.Lectura.Fecha_y_Hora).label("fecha_inicio"),
-            func.max(models.Lectura.Fecha_y_Hora).label("fecha_fin"),
+            func.min(Lectura.Fecha_y_Hora).label("fecha_inicio"),
+            func.max(Lectura.Fecha_y_Hora).label("fecha_fin"),
         )
         .join(
             models.ArchivoExcel,
-            models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+            Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
         )
         .filter(models.ArchivoExcel.ID_Caso == caso_id)
-        .filter(models.Lectura.Tipo_Fuente == "GPS")
-        .filter(models.Lectura.Matricula == matricula)
+        .filter(Lectura.Tipo_Fuente == "GPS")
+        .filter(Lectura.Matricula == matricula)
         .first()
     )
 
@@ -4690,24 +4712,42 @@ def get_fechas_caso(
             detail="No tiene permiso para acceder a los datos de este caso",
         )
 
+    fechas = _fechas_caso(caso_id, db)
+    if not fechas:
+        raise HTTPException(
+            status_code=404, detail="No se encontraron lecturas para este caso"
+        )
+    return fechas
+
+
+@paso_precalentamiento("fechas")
+@cached(
+    "fechas_caso",
+    ttl=86400,
+    key_params=("caso_id",),
+    scope=None,
+    version=version_de_llamada,
+)
+def _fechas_caso(caso_id: int, db: Session) -> Dict[str, str]:
+    """Rango de fechas de las lecturas del caso; vacío si no tiene lecturas"""
+    Lectura = lectura_entity(caso_id)
     # Obtener la fecha mínima y máxima para todas las lecturas del caso
     fechas = (
         db.query(
-            func.min(models.Lectura.Fecha_y_Hora).label("fecha_inicio"),
-            func.max(models.Lectura.Fecha_y_Hora).label("fecha_fin"),
+            func.min(Lectura.Fecha_y_Hora).label("fecha_inicio"),
+            func.max(Lectura.Fecha_y_Hora).label("fecha_fin"),
         )
         .join(
             models.ArchivoExcel,
-            models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+            Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
         )
         .filter(models.ArchivoExcel.ID_Caso == caso_id)
         .first()
     )
 
     if not fechas or not fechas.fecha_inicio or not fechas.fecha_fin:
-        raise HTTPException(
-            status_code=404, detail="No se encontraron lecturas para este caso"
-        )
+        # Se cachea también el caso sin lecturas (None no se guardaría)
+        return {}
 
     return {
         "fecha_inicio": fechas.fecha_inicio.strftime("%Y-%m-%d"),
@@ -4715,6 +4755,53 @@ def get_fechas_caso(
     }
 
 
+@app.get("/casos/{caso_id}/estadisticas", response_model=Dict[str, Any])
+def get_estadisticas_caso(
+    caso_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.Usuario = Depends(get_current_active_user),
+):
+    """
+    Totales del caso (como la vista estadisticas_casos) e histogramas de sus
+    lecturas por hora del día y día de la semana.
+    """
+    caso = db.query(models.Caso).filter(models.Caso.ID_Caso == caso_id).first()
+    if not caso:
+        raise HTTPException(status_code=404, detail="Caso no encontrado")
+    user_rol_value = (
+        current_user.Rol.value
+        if hasattr(current_user.Rol, "value")
+        else current_user.Rol
+    )
+    is_superadmin = user_rol_value == "superadmin"
+    if not is_superadmin and caso.ID_Grupo != current_user.ID_Grupo:
+        raise HTTPException(
+            status_code=403,
+            detail="No tiene permiso para acceder a los datos de este caso",
+        )
+    return _estadisticas_caso(caso_id, db)
+
+
+@paso_precalentamiento("estadisticas")
+@cached(
+    "estadisticas_caso",
+    ttl=86400,
+    key_params=("caso_id",),
+    scope=None,
+    version=version_de_llamada,
+)
+def _estadisticas_caso(caso_id: int, db: Session) -> Dict[str, Any]:
+    """Resumen e histogramas del caso, con el motor analítico si está activo"""
+    estadisticas: Dict[str, Any] = jsonable_encoder(
+        {
+            "caso_id": caso_id,
+            **analytics.case_summary(db, caso_id),
+            **analytics.histograms(db, caso_id),
+        }
+    )
+    return estadisticas
+
+
 # --- ENDPOINTS ADMIN: USUARIOS Y GRUPOS ---
 from sqlalchemy.orm import joinedload
 
@@ -5210,6 +5297,26 @@ def invalidate_caso_cache(
         raise HTTPException(status_code=500, detail=f"Error invalidando cache: {e}")
 
 
+@app.post("/api/admin/cache/warmup-caso/{caso_id}", status_code=202)
+def warmup_caso_cache(
+    caso_id: int,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: models.Usuario = Depends(get_current_active_superadmin),
+):
+    """Precalienta en segundo plano el cache de los agregados de un caso"""
+    if not db.query(models.Caso.ID_Caso).filter(models.Caso.ID_Caso == caso_id).first():
+        raise HTTPException(status_code=404, detail="Caso no encontrado")
+    task_id = nueva_tarea_precalentamiento(caso_id)
+    background_tasks.add_task(precalentar_caso, caso_id, task_id)
+    return {
+        "message": f"Precalentamiento del cache iniciado para caso {caso_id}",
+        "caso_id": caso_id,
+        "task_id": task_id,
+        "timestamp": datetime.now().isoformat(),
+    }
+
+
 @app.post("/api/admin/cache/clear-lanzadera")
 def clear_lanzadera_cache(
     current_user: models.Usuario = Depends(get_current_active_superadmin),
@@ -5217,7 +5324,7 @@ def clear_lanzadera_cache(
     """Limpia específicamente el caché del análisis de lanzaderas"""
     try:
         # Limpiar el patrón específico del caché de lanzaderas
-        cache_manager.clear_pattern("lanzadera_analisis*")
+        cache_manager.clear_pattern("atrio:lanzadera_analisis:*")
         return {
             "message": "Cache de análisis de lanzaderas limpiado",
             "timestamp": datetime.now().isoformat(),
@@ -5259,29 +5366,6 @@ def read_lecturas_por_filtros(
         f"POST /lecturas/por_filtros - Filtros: matricula={matricula} matriculas={matriculas} min_pasos={min_pasos} max_pasos={max_pasos} carreteras={carretera_ids}"
     )
 
-    # Base query
-    base_query = db.query(models.Lectura).join(models.Lector).join(models.ArchivoExcel)
-
-    # --- Aplicar filtros comunes ---
-    if caso_ids:
-        base_query = base_query.filter(models.ArchivoExcel.ID_Caso.in_(caso_ids))
-    if lector_ids:
-        base_query = base_query.filter(models.Lectura.ID_Lector.in_(lector_ids))
-    if carretera_ids:
-        base_query = base_query.filter(models.Lector.Carretera.in_(carretera_ids))
-    if sentido:
-        base_query = base_query.filter(models.Lector.Sentido.in_(sentido))
-    if tipo_fuente:
-        base_query = base_query.filter(models.Lectura.Tipo_Fuente == tipo_fuente)
-    if solo_relevantes:
-        base_query = base_query.join(models.LecturaRelevante)
-    if organismos:
-        base_query = base_query.filter(
-            models.Lector.Organismo_Regulador.in_(organismos)
-        )
-    if provincias:
-        base_query = base_query.filter(models.Lector.Provincia.in_(provincias))
-
     # --- Combinar fecha y hora para crear datetimes ---
     start_datetime = None
     if fecha_inicio:
@@ -5318,53 +5402,50 @@ def read_lecturas_por_filtros(
             )
             pass
 
-    # Aplicar filtro de fecha/hora
-    if start_datetime:
-        base_query = base_query.filter(models.Lectura.Fecha_y_Hora >= start_datetime)
-    if end_datetime:
-        base_query = base_query.filter(models.Lectura.Fecha_y_Hora <= end_datetime)
-
     # --- Manejo de matrículas ---
-    if matricula:
-        # Usar or_ para buscar en múltiples patrones de matrícula
-        condiciones = []
-        for m in matricula:
-            sql_pattern = (
-                m.replace("\\", "\\\\")
-                .replace("%", "\\%")
-                .replace("_", "\\_")
-                .replace("?", "_")
-                .replace("*", "%")
-            )
-            if "*" in m or "%" in m or "?" in m or "_" in m:
-                condiciones.append(models.Lectura.Matricula.ilike(sql_pattern))
-            else:
-                condiciones.append(models.Lectura.Matricula.ilike(sql_pattern))
-        if condiciones:
-            base_query = base_query.filter(or_(*condiciones))
-    if matriculas:
-        for m in matriculas:
-            sql_pattern = (
-                m.replace("\\", "\\\\")
-                .replace("%", "\\%")
-                .replace("_", "\\_")
-                .replace("?", "_")
-                .replace("*", "%")
-            )
-            if "*" in m or "%" in m or "?" in m or "_" in m:
-                condiciones.append(models.Lectura.Matricula.ilike(sql_pattern))
-            else:
-                condiciones.append(models.Lectura.Matricula.ilike(sql_pattern))
-    if condiciones:
-        base_query = base_query.filter(or_(*condiciones))
-
-    # Ordenar y aplicar paginación
-    query = base_query.order_by(models.Lectura.Fecha_y_Hora.desc())
-    query = query.options(
-        joinedload(models.Lectura.lector),
-        joinedload(models.Lectura.archivo).joinedload(models.ArchivoExcel.caso),
-    )
-    lecturas = query.all()
+    # Usar or_ para buscar en múltiples patrones de matrícula
+    patrones = [_patron_matricula(m) for m in [matricula] if m]
+    patrones.extend(_patron_matricula(m) for m in matriculas or [])
+
+    # Una consulta por fuente: la tabla compartida y el shard de cada caso
+    lecturas = []
+    for Lectura, casos in lectura_sources(caso_ids or None):
+        base_query = db.query(Lectura).join(
+            models.Lector, Lectura.ID_Lector == models.Lector.ID_Lector
+        )
+        base_query = _filtrar_lecturas(
+            base_query,
+            Lectura,
+            casos,
+            lector_ids=lector_ids,
+            carretera_ids=carretera_ids,
+            sentido=sentido,
+            tipo_fuente=tipo_fuente,
+            solo_relevantes=solo_relevantes,
+            organismos=organismos,
+            provincias=provincias,
+        )
+
+        # Aplicar filtro de fecha/hora
+        if start_datetime:
+            base_query = base_query.filter(Lectura.Fecha_y_Hora >= start_datetime)
+        if end_datetime:
+            base_query = base_query.filter(Lectura.Fecha_y_Hora <= end_datetime)
+        if patrones:
+            base_query = base_query.filter(
+                or_(*[Lectura.Matricula.ilike(p) for p in patrones])
+            )
+
+        if Lectura is models.Lectura:
+            # En los shards el lector y el archivo se cargan al acceder
+            base_query = base_query.options(
+                joinedload(models.Lectura.lector),
+                joinedload(models.Lectura.archivo).joinedload(models.ArchivoExcel.caso),
+            )
+        lecturas.extend(base_query.all())
+
+    # Ordenar
+    lecturas.sort(key=lambda lectura: lectura.Fecha_y_Hora, reverse=True)
 
     logger.info(
         f"POST /lecturas/por_filtros - Encontradas {len(lecturas)} lecturas tras aplicar filtros."
@@ -5382,23 +5463,10 @@ def buscar_vehiculos_multicaso(
 ):
     logger.info(f"POST /busqueda/multicaso - Buscando vehículos en casos: {casos}")
 
-    # Base query para obtener lecturas, cargando archivo y caso
-    # SOLO LECTURAS LPR - Filtrar por tipo de fuente
-    base_query = (
-        db.query(models.Lectura)
-        .join(models.ArchivoExcel)
-        .filter(
-            models.ArchivoExcel.ID_Caso.in_(casos), models.Lectura.Tipo_Fuente == "LPR"
-        )  # Solo lecturas LPR
-        .options(
-            joinedload(models.Lectura.archivo).joinedload(models.ArchivoExcel.caso)
-        )
-    )
-
     # Aplicar filtros de matrícula
-    from sqlalchemy import or_
+    from sqlalchemy import or_, union_all
 
-    condiciones = []
+    patrones = []
     if matricula:
         sql_pattern = (
             matricula.replace("\\", "\\\\")
@@ -5407,10 +5475,7 @@ def buscar_vehiculos_multicaso(
             .replace("?", "_")
             .replace("*", "%")
         )
-        if "*" in matricula or "%" in matricula or "?" in matricula or "_" in matricula:
-            condiciones.append(models.Lectura.Matricula.ilike(sql_pattern))
-        else:
-            condiciones.append(models.Lectura.Matricula.ilike(sql_pattern))
+        patrones.append(sql_pattern)
     if matriculas:
         for m in matriculas:
             sql_pattern = (
@@ -5420,19 +5485,63 @@ def buscar_vehiculos_multicaso(
                 .replace("?", "_")
                 .replace("*", "%")
             )
-            if "*" in m or "%" in m or "?" in m or "_" in m:
-                condiciones.append(models.Lectura.Matricula.ilike(sql_pattern))
-            else:
-                condiciones.append(models.Lectura.Matricula.ilike(sql_pattern))
-    if condiciones:
-        base_query = base_query.filter(or_(*condiciones))
+            patrones.append(sql_pattern)
 
-    lecturas = base_query.all()
+    # Una SELECT de lecturas LPR por fuente (tabla compartida o shard de un
+    # caso), unidas con UNION ALL en grupos que caben adjuntos a la conexión
+    consultas = []
+    for Lectura, casos_fuente in lectura_sources(casos):
+        consulta = (
+            select(
+                Lectura.ID_Lectura,
+                Lectura.Matricula,
+                Lectura.Fecha_y_Hora,
+                Lectura.ID_Lector,
+                models.ArchivoExcel.ID_Caso,
+            )
+            .join_from(
+                Lectura,
+                models.ArchivoExcel,
+                Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+            )
+            .where(
+                # Con `casos` cada fuente trae la lista de los suyos
+                models.ArchivoExcel.ID_Caso.in_(cast(List[int], casos_fuente)),
+                Lectura.Tipo_Fuente == "LPR",  # Solo lecturas LPR
+            )
+        )
+        if patrones:
+            consulta = consulta.where(
+                or_(*[Lectura.Matricula.ilike(patron) for patron in patrones])
+            )
+        consultas.append(consulta)
+    lecturas: List[Any] = []
+    for inicio in range(0, len(consultas), MAX_ATTACHED):
+        grupo = consultas[inicio : inicio + MAX_ATTACHED]
+        if len(grupo) > 1:
+            lecturas.extend(db.execute(union_all(*grupo)).all())
+        else:
+            lecturas.extend(db.execute(grupo[0]).all())
+
+    casos_por_id = {
+        caso.ID_Caso: caso
+        for caso in db.query(models.Caso).filter(
+            models.Caso.ID_Caso.in_({l.ID_Caso for l in lecturas})
+        )
+    }
+    lectores = {
+        lector.ID_Lector: lector
+        for lector in db.query(models.Lector).filter(
+            models.Lector.ID_Lector.in_({l.ID_Lector for l in lecturas})
+        )
+    }
 
-    # Agrupar por matrícula y caso
+    # Agrupar por matrícula y caso, cada lectura con su lector
     resultados = defaultdict(lambda: defaultdict(list))
     for lectura in lecturas:
-        resultados[lectura.Matricula][lectura.archivo.ID_Caso].append(lectura)
+        resultados[lectura.Matricula][lectura.ID_Caso].append(
+            (lectura, lectores.get(lectura.ID_Lector))
+        )
 
     vehiculos_coincidentes = []
     for matricula, casos_lecturas in resultados.items():
@@ -5440,7 +5549,7 @@ def buscar_vehiculos_multicaso(
             continue  # Solo incluir vehículos que aparecen en 2 o más casos
         vehiculo_info = {"matricula": matricula, "casos": []}
         for caso_id, lecturas_caso in casos_lecturas.items():
-            caso = lecturas_caso[0].archivo.caso
+            caso = casos_por_id[caso_id]
             caso_info = {
                 "id": caso.ID_Caso,
                 "nombre": caso.Nombre_del_Caso + f" ({caso.Año})",
@@ -5452,13 +5561,13 @@ def buscar_vehiculos_multicaso(
                         "ID_Caso": caso.ID_Caso,
                         "Nombre_del_Caso": caso.Nombre_del_Caso,
                         "ID_Lector": l.ID_Lector,
-                        "Carretera": getattr(l.lector, "Carretera", ""),
-                        "Provincia": getattr(l.lector, "Provincia", ""),
-                        "Localidad": getattr(l.lector, "Localidad", ""),
-                        "Coordenada_X": getattr(l.lector, "Coordenada_X", ""),
-                        "Coordenada_Y": getattr(l.lector, "Coordenada_Y", ""),
+                        "Carretera": getattr(lector, "Carretera", ""),
+                        "Provincia": getattr(lector, "Provincia", ""),
+                        "Localidad": getattr(lector, "Localidad", ""),
+                        "Coordenada_X": getattr(lector, "Coordenada_X", ""),
+                        "Coordenada_Y": getattr(lector, "Coordenada_Y", ""),
                     }
-                    for l in lecturas_caso
+                    for l, lector in lecturas_caso
                 ],
             }
             vehiculo_info["casos"].append(caso_info)
@@ -5475,26 +5584,55 @@ from fastapi import HTTPException, status
 @app.post(
     "/casos/{caso_id}/detectar-lanzaderas", response_model=schemas.LanzaderaResponse
 )
-@cached("lanzadera_analisis", ttl=7200)  # Cache por 2 horas (análisis costoso)
-def detectar_vehiculos_lanzadera(
+async def detectar_vehiculos_lanzadera(
     caso_id: int,
     request: schemas.LanzaderaRequest,  # Debe incluir: matricula, ventana_minutos, diferencia_minima_lecturas_min, min_coincidencias (opcional), fecha_inicio/fin opcionales
-    db: Session = Depends(get_db),
 ):
+    # El análisis se calcula en la cola de trabajos, fuera del proceso de la API
+    return await job_queue.run(
+        KIND_LANZADERA,
+        calcular_lanzaderas,
+        caso_id,
+        request.model_dump(mode="json"),
+        priority=PRIORITY_HIGH,
+    )
+
+
+def calcular_lanzaderas(caso_id: int, request: Dict[str, Any]) -> Dict[str, Any]:
+    """Análisis de lanzaderas en un worker, con su propia sesión"""
+    db = SessionLocal()
+    try:
+        resultado = _detectar_lanzaderas(
+            caso_id, schemas.LanzaderaRequest(**request), db
+        )
+        resumen: Dict[str, Any] = jsonable_encoder(resultado)
+        return resumen
+    finally:
+        db.close()
+
+
+@cached(
+    "lanzadera_analisis",
+    ttl=86400,
+    key_params=("caso_id", "request"),
+    version=version_de_llamada,
+)  # Análisis costoso, versionado por caso
+def _detectar_lanzaderas(caso_id: int, request: schemas.LanzaderaRequest, db: Session):
     logger.info(
         f"[Lanzadera] Params: matricula={request.matricula}, fecha_inicio={getattr(request, 'fecha_inicio', None)}, fecha_fin={getattr(request, 'fecha_fin', None)}, ventana_minutos={getattr(request, 'ventana_minutos', 10)}, diferencia_minima={getattr(request, 'diferencia_minima', 5)}, direccion_acompanamiento={getattr(request, 'direccion_acompanamiento', 'ambas')}"
     )
     # 1. Obtener todas las lecturas del vehículo objetivo en el rango de fechas (si se especifican)
-    query = db.query(models.Lectura).filter(
-        models.Lectura.ID_Archivo.in_(
+    Lectura = lectura_entity(caso_id)
+    query = db.query(Lectura).filter(
+        Lectura.ID_Archivo.in_(
             db.query(models.ArchivoExcel.ID_Archivo).filter(
                 models.ArchivoExcel.ID_Caso == caso_id
             )
         ),
-        models.Lectura.Matricula == request.matricula,
+        Lectura.Matricula == request.matricula,
     )
     if getattr(request, "fecha_inicio", None):
-        query = query.filter(models.Lectura.Fecha_y_Hora >= request.fecha_inicio)
+        query = query.filter(Lectura.Fecha_y_Hora >= request.fecha_inicio)
     if getattr(request, "fecha_fin", None):
         fecha_fin_val = request.fecha_fin
         if isinstance(fecha_fin_val, str):
@@ -5502,8 +5640,8 @@ def detectar_vehiculos_lanzadera(
             fecha_fin_dt = datetime.combine(fecha_fin_dt, datetime.max.time())
         else:
             fecha_fin_dt = fecha_fin_val
-        query = query.filter(models.Lectura.Fecha_y_Hora <= fecha_fin_dt)
-    lecturas_objetivo = query.order_by(models.Lectura.Fecha_y_Hora).all()
+        query = query.filter(Lectura.Fecha_y_Hora <= fecha_fin_dt)
+    lecturas_objetivo = query.order_by(Lectura.Fecha_y_Hora).all()
     logger.info(f"[Lanzadera] Lecturas objetivo encontradas: {len(lecturas_objetivo)}")
     if not lecturas_objetivo:
         logger.info("[Lanzadera] No se encontraron lecturas objetivo.")
@@ -5541,17 +5679,17 @@ def detectar_vehiculos_lanzadera(
 
         # Buscar lecturas en la misma ventana temporal y lector
         lecturas_acompanantes = (
-            db.query(models.Lectura)
+            db.query(Lectura)
             .filter(
-                models.Lectura.ID_Archivo.in_(
+                Lectura.ID_Archivo.in_(
                     db.query(models.ArchivoExcel.ID_Archivo).filter(
                         models.ArchivoExcel.ID_Caso == caso_id
                     )
                 ),
-                models.Lectura.ID_Lector == lectura_objetivo.ID_Lector,
-                models.Lectura.Fecha_y_Hora >= ventana_inicio,
-                models.Lectura.Fecha_y_Hora <= ventana_fin,
-                models.Lectura.Matricula != request.matricula,
+                Lectura.ID_Lector == lectura_objetivo.ID_Lector,
+                Lectura.Fecha_y_Hora >= ventana_inicio,
+                Lectura.Fecha_y_Hora <= ventana_fin,
+                Lectura.Matricula != request.matricula,
             )
             .all()
         )
@@ -5737,19 +5875,9 @@ def get_caso_performance_warning(caso_id: int, db: Session = Depends(get_db)):
     """
     try:
         # Obtener estadísticas del caso
-        total_lecturas = (
-            db.query(models.Lectura)
-            .join(models.ArchivoExcel)
-            .filter(models.ArchivoExcel.ID_Caso == caso_id)
-            .count()
-        )
-
-        total_matriculas = (
-            db.query(func.count(func.distinct(models.Lectura.Matricula)))
-            .join(models.ArchivoExcel)
-            .filter(models.ArchivoExcel.ID_Caso == caso_id)
-            .scalar()
-        )
+        resumen = analytics.case_summary(db, caso_id)
+        total_lecturas = resumen["total_lecturas"]
+        total_matriculas = resumen["total_matriculas_unicas"]
 
         # Definir umbrales de advertencia
         THRESHOLDS = {
@@ -5838,6 +5966,62 @@ async def get_task_status(task_id: str):
     return TaskStatus(**status_info)
 
 
+@app.post("/api/tasks/{task_id}/cancel")
+def cancel_task(
+    task_id: str,
+    current_user: models.Usuario = Depends(get_current_active_user),
+):
+    """
+    Cancela una tarea en segundo plano: si aún está en cola se descarta y si
+    está en curso se detiene en su siguiente punto de control.
+    """
+    if task_id not in task_statuses:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No se encontró información para la tarea {task_id}",
+        )
+    if not job_queue.cancel(task_id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="La tarea ya ha terminado",
+        )
+    return {"task_id": task_id, "cancel_requested": True}
+
+
+@app.get("/api/admin/jobs")
+def get_job_queue_status(
+    current_user: models.Usuario = Depends(get_current_active_superadmin),
+):
+    """Trabajos en curso y en cola del pool de workers de este proceso"""
+    return {"jobs": job_queue.snapshot(), "timestamp": datetime.now().isoformat()}
+
+
+@app.get("/api/admin/startup")
+def get_startup_status(
+    request: Request,
+    current_user: models.Usuario = Depends(get_current_active_superadmin),
+):
+    """Tiempo hasta estar listo y resultado de las comprobaciones de arranque"""
+    return getattr(request.app.state, "startup", None) or {}
+
+
+@app.post("/api/admin/database/maintenance", status_code=202)
+def start_database_maintenance(
+    vacuum: bool = Query(
+        False, description="Incluir VACUUM (bloquea las escrituras mientras dura)"
+    ),
+    current_user: models.Usuario = Depends(get_current_active_superadmin),
+):
+    """Encola el mantenimiento de la base de datos (ANALYZE, PRAGMA optimize)"""
+    task_id = submit_maintenance(vacuum=vacuum)
+    return {
+        "message": "Mantenimiento de la base de datos en cola",
+        "task_id": task_id,
+        "vacuum": vacuum,
+        "timestamp": datetime.now().isoformat(),
+    }
+
+
 # Mejorar el logging de tareas
 def update_task_status(
     task_id: str,
@@ -5942,23 +6126,26 @@ def get_lecturas_relevantes_por_caso(caso_id: int, db: Session = Depends(get_db)
     Devuelve todas las lecturas marcadas como relevantes para un caso específico.
     """
     try:
-        lecturas_relevantes = (
-            db.query(models.Lectura)
-            .options(
-                joinedload(models.Lectura.lector), joinedload(models.Lectura.relevancia)
-            )
+        Lectura = lectura_entity(caso_id)
+        query = (
+            db.query(Lectura)
             .join(
                 models.LecturaRelevante,
-                models.Lectura.ID_Lectura == models.LecturaRelevante.ID_Lectura,
+                Lectura.ID_Lectura == models.LecturaRelevante.ID_Lectura,
             )
             .join(
                 models.ArchivoExcel,
-                models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+                Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
             )
             .filter(models.ArchivoExcel.ID_Caso == caso_id)
-            .order_by(models.Lectura.Fecha_y_Hora)
-            .all()
+            .order_by(Lectura.Fecha_y_Hora)
         )
+        if Lectura is models.Lectura:
+            # En los shards el lector y la relevancia se cargan al acceder
+            query = query.options(
+                joinedload(models.Lectura.lector), joinedload(models.Lectura.relevancia)
+            )
+        lecturas_relevantes = query.all()
         return lecturas_relevantes
     except Exception as e:
         logger.error(
@@ -6153,15 +6340,13 @@ def get_lecturas_por_vehiculo(
             detail=f"Vehículo con ID {vehiculo_id} no encontrado",
         )
 
-    query = db.query(models.Lectura).filter(
-        models.Lectura.Matricula == db_vehiculo.Matricula
-    )
     user_rol = (
         current_user.Rol.value
         if hasattr(current_user.Rol, "value")
         else current_user.Rol
     )
 
+    grupo_id = None
     if (
         user_rol != RolUsuarioEnum.superadmin.value
     ):  # Si no es superadmin, aplicar filtro de grupo
@@ -6184,30 +6369,28 @@ def get_lecturas_por_vehiculo(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="No tiene permiso para acceder a las lecturas de este caso.",
                 )
-            # Filtrar por el caso_id ya verificado
-            query = query.join(
-                models.ArchivoExcel,
-                models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
-            ).filter(models.ArchivoExcel.ID_Caso == caso_id)
         else:
             # No se dio caso_id, filtrar todas las lecturas del vehículo que estén en casos del grupo del usuario
-            query = (
-                query.join(
-                    models.ArchivoExcel,
-                    models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
-                )
-                .join(models.Caso, models.ArchivoExcel.ID_Caso == models.Caso.ID_Caso)
-                .filter(models.Caso.ID_Grupo == current_user.ID_Grupo)
-            )
-    elif (
-        caso_id is not None
-    ):  # Superadmin, pero se proveyó caso_id, así que filtramos por él
-        query = query.join(
-            models.ArchivoExcel,
-            models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
-        ).filter(models.ArchivoExcel.ID_Caso == caso_id)
+            grupo_id = current_user.ID_Grupo
 
-    lecturas = query.order_by(models.Lectura.Fecha_y_Hora.asc()).all()
+    # Una consulta por fuente: la tabla compartida y el shard de cada caso
+    lecturas = []
+    for Lectura, _ in lectura_sources(None if caso_id is None else [caso_id]):
+        query = db.query(Lectura).filter(Lectura.Matricula == db_vehiculo.Matricula)
+        if caso_id is not None or grupo_id is not None:
+            query = query.join(
+                models.ArchivoExcel,
+                Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+            )
+        if caso_id is not None:
+            # Filtrar por el caso_id ya verificado
+            query = query.filter(models.ArchivoExcel.ID_Caso == caso_id)
+        if grupo_id is not None:
+            query = query.join(
+                models.Caso, models.ArchivoExcel.ID_Caso == models.Caso.ID_Caso
+            ).filter(models.Caso.ID_Grupo == grupo_id)
+        lecturas.extend(query.all())
+    lecturas.sort(key=lambda lectura: lectura.Fecha_y_Hora)
 
     logger.info(
         f"Encontradas {len(lecturas)} lecturas para el vehículo ID {vehiculo_id} (Matrícula: {db_vehiculo.Matricula})"
@@ -6315,16 +6498,21 @@ def cleanup_resources():
 
     # Cerrar conexiones de base de datos
     try:
-        from database_config import engine
+        from database_config import engine, read_engine
 
         engine.dispose()
+        read_engine.dispose()
         logger.info("Conexiones de base de datos cerradas")
     except Exception as e:
         logger.warning(f"Error cerrando conexiones de BD: {e}")
 
     # Limpiar cache
     try:
-        cache_manager.clear_pattern("atrio:*")
+        if WEB_WORKERS > 1:
+            # Redis lo comparten los demás workers: sólo el cache del proceso
+            cache_manager.memory_cache.clear_pattern("atrio:*")
+        else:
+            cache_manager.clear_pattern("atrio:*")
         logger.info("Cache de consultas limpiado")
     except Exception as e:
         logger.warning(f"Error limpiando cache: {e}")
@@ -13,6 +13,7 @@ from sqlalchemy import (
     Enum as SQLAlchemyEnum,
     Boolean,
     JSON,
+    LargeBinary,
 )
 from sqlalchemy.orm import relationship, Session
 from sqlalchemy.sql import func
@@ -59,6 +60,8 @@ class Caso(Base):
     ID_Grupo = Column(
         Integer, ForeignKey("Grupos.ID_Grupo"), nullable=False, index=True
     )
+    # Se incrementa con cada cambio en los datos del caso (ver version_datos)
+    Version_Datos = Column(Integer, nullable=False, default=0, server_default="0")
 
     archivos = relationship(
         "ArchivoExcel", back_populates="caso", cascade="all, delete-orphan"
@@ -69,6 +72,9 @@ class Caso(Base):
     external_data = relationship(
         "ExternalData", back_populates="caso", cascade="all, delete-orphan"
     )
+    gps_segmentos = relationship(
+        "GpsSegmento", cascade="all, delete-orphan", passive_deletes=True
+    )
     grupo = relationship("Grupo", back_populates="casos")
 
 
@@ -138,6 +144,7 @@ class Lectura(Base):
     # Relación con LecturaRelevante (uno a uno o cero)
     relevancia = relationship(
         "LecturaRelevante",
+        primaryjoin="Lectura.ID_Lectura == foreign(LecturaRelevante.ID_Lectura)",
         back_populates="lectura",
         uselist=False,
         cascade="all, delete-orphan",
@@ -148,14 +155,18 @@ class Lectura(Base):
 class LecturaRelevante(Base):
     __tablename__ = "LecturasRelevantes"
     ID_Relevante = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    ID_Lectura = Column(
-        Integer, ForeignKey("lectura.ID_Lectura"), unique=True, nullable=False
-    )
+    # Sin clave foránea: la lectura puede estar en la tabla compartida o en el
+    # shard de su caso (case_shards), y las claves no cruzan archivos
+    ID_Lectura = Column(Integer, unique=True, nullable=False)
     Fecha_Marcada = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     Nota = Column(Text, nullable=True)
 
-    # Relación inversa
-    lectura = relationship("Lectura", back_populates="relevancia")
+    # Relación inversa (sólo con las lecturas de la tabla compartida)
+    lectura = relationship(
+        "Lectura",
+        primaryjoin="foreign(LecturaRelevante.ID_Lectura) == Lectura.ID_Lectura",
+        back_populates="relevancia",
+    )
 
 
 class Vehiculo(Base):
@@ -214,13 +225,62 @@ class GpsCapa(Base):
     nombre = Column(String, nullable=False)
     color = Column(String, nullable=False)
     activa = Column(Boolean, default=True)
-    lecturas = Column(JSON, nullable=False)  # Array de lecturas GPS serializado
+    # Lecturas de la capa como referencias a `lectura.ID_Lectura`, en orden
+    # cronológico y codificadas en binario (ver gps_capas.codificar_ids)
+    ids_lectura = Column(LargeBinary, nullable=True)
+    num_lecturas = Column(Integer, nullable=False, default=0)
+    # Sólo para puntos que no existen en `lectura` (p. ej. capas antiguas)
+    lecturas = Column(JSON, nullable=True)
     filtros = Column(JSON, nullable=False)  # Filtros usados para crear la capa
+    # Zoom mínimo al que se muestra cada lectura (alineado con las lecturas)
+    niveles_detalle = Column(JSON, nullable=True)
     descripcion = Column(String, nullable=True)
     # usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=True)  # Si tienes usuarios
     caso_id = Column(Integer, ForeignKey("Casos.ID_Caso"), nullable=False)
 
 
+class GpsSegmento(Base):
+    """Estancia o trayecto de un vehículo calculado a partir de sus lecturas GPS"""
+
+    __tablename__ = "gps_segmentos"
+    __table_args__ = (
+        Index(
+            "ix_gps_segmentos_caso_matricula_inicio", "caso_id", "matricula", "inicio"
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    caso_id = Column(
+        Integer, ForeignKey("Casos.ID_Caso", ondelete="CASCADE"), nullable=False
+    )
+    matricula = Column(String(20), nullable=False)
+    tipo = Column(
+        String(10),
+        CheckConstraint("tipo IN ('estancia', 'trayecto')"),
+        nullable=False,
+    )
+    inicio = Column(DateTime, nullable=False)
+    fin = Column(DateTime, nullable=False)
+    duracion_segundos = Column(Float, nullable=False)
+    distancia_metros = Column(Float, nullable=False, default=0)
+    num_puntos = Column(Integer, nullable=False)
+    # Centro de la estancia (nulo en trayectos)
+    lat_centro = Column(Float, nullable=True)
+    lon_centro = Column(Float, nullable=True)
+    # Extremos del segmento
+    lat_inicio = Column(Float, nullable=False)
+    lon_inicio = Column(Float, nullable=False)
+    lat_fin = Column(Float, nullable=False)
+    lon_fin = Column(Float, nullable=False)
+    # Caja envolvente
+    lat_min = Column(Float, nullable=False)
+    lat_max = Column(Float, nullable=False)
+    lon_min = Column(Float, nullable=False)
+    lon_max = Column(Float, nullable=False)
+    id_lectura_inicio = Column(Integer, nullable=True)
+    id_lectura_fin = Column(Integer, nullable=True)
+
+
 class ExternalData(Base):
     __tablename__ = "external_data"
 
@@ -280,6 +340,14 @@ class MapaGuardado(Base):
     caso = relationship("Caso")
 
 
+class VersionDatos(Base):
+    """Versión de datos de los catálogos que no pertenecen a un caso (lectores)"""
+
+    __tablename__ = "versiones_datos"
+    Ambito = Column(String(50), primary_key=True)
+    Version = Column(Integer, nullable=False, default=0, server_default="0")
+
+
 class RolUsuarioEnum(enum.Enum):
     superadmin = "superadmin"
     admingrupo = "admingrupo"
@@ -0,0 +1 @@
+"""Monitoring and benchmark scripts for ATRiO 1.0."""
@@ -0,0 +1,159 @@
+"""
+Benchmark de los agregados de un caso: SQLite frente a DuckDB.
+
+Genera una base SQLite temporal con un caso de N lecturas sintéticas y mide
+el resumen, los conteos por vehículo y por archivo y los histogramas con
+cada camino de `analytics`:
+
+- sqlite: la consulta sobre la tabla `lectura` (el camino por defecto)
+- duckdb-scan: DuckDB leyendo el archivo SQLite con sqlite_scan
+- duckdb-parquet: DuckDB sobre la instantánea Parquet del caso (se mide
+  también la exportación)
+
+Sin el paquete `duckdb` sólo se mide SQLite (ver requirements-analytics.txt). Uso:
+
+    python -m monitoring.benchmark_analytics --lecturas 10000000
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import analytics
+import models
+from database_config import Base
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger("atrio.benchmark")
+
+AGREGADOS = (
+    ("case_summary", analytics.case_summary),
+    ("counts_by_plate", analytics.counts_by_plate),
+    ("counts_by_file", analytics.counts_by_file),
+    ("histograms", analytics.histograms),
+)
+
+
+def generar_base(ruta: str, lecturas: int, archivos: int = 20, seed: int = 0) -> int:
+    """Crea la base con un caso de `lecturas` lecturas y devuelve su ID"""
+    engine = create_engine(f"sqlite:///{ruta}")
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        grupo = models.Grupo(Nombre="Benchmark")
+        db.add(grupo)
+        db.flush()
+        caso = models.Caso(
+            Nombre_del_Caso="Benchmark", Año=2024, ID_Grupo=grupo.ID_Grupo
+        )
+        db.add(caso)
+        db.flush()
+        db.add_all(
+            models.ArchivoExcel(
+                ID_Caso=caso.ID_Caso,
+                Nombre_del_Archivo=f"archivo_{i}.xlsx",
+                Tipo_de_Archivo="LPR",
+            )
+            for i in range(archivos)
+        )
+        db.commit()
+        caso_id = int(caso.ID_Caso)
+    engine.dispose()
+
+    rng = np.random.default_rng(seed)
+    conexion = sqlite3.connect(ruta)
+    bloque = 1_000_000
+    for desde in range(0, lecturas, bloque):
+        n = min(bloque, lecturas - desde)
+        segundos = rng.integers(0, 365 * 86400, n)
+        fechas = pd.Timestamp("2024-01-01") + pd.to_timedelta(segundos, "s")
+        conexion.executemany(
+            'INSERT INTO lectura ("ID_Archivo", "Matricula", "Fecha_y_Hora", '
+            '"ID_Lector", "Tipo_Fuente") VALUES (?, ?, ?, ?, ?)',
+            zip(
+                (rng.integers(1, archivos + 1, n)).tolist(),
+                [f"{m:04d}BCD" for m in rng.integers(0, 50_000, n)],
+                fechas.strftime("%Y-%m-%d %H:%M:%S.%f").tolist(),
+                [f"L{l}" for l in rng.integers(0, 500, n)],
+                rng.choice(["LPR", "GPS"], n, p=[0.8, 0.2]).tolist(),
+            ),
+        )
+        conexion.commit()
+        logger.info(f"{desde + n} lecturas generadas")
+    conexion.close()
+    return caso_id
+
+
+def medir(nombre: str, funcion, *args) -> float:
+    inicio = time.perf_counter()
+    funcion(*args)
+    duracion = time.perf_counter() - inicio
+    logger.info(f"{nombre:<40} {duracion:8.3f} s")
+    return duracion
+
+
+def medir_agregados(camino: str, db, caso_id: int) -> float:
+    return sum(
+        medir(f"{camino}: {nombre}", funcion, db, caso_id)
+        for nombre, funcion in AGREGADOS
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lecturas", type=int, default=10_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, "atrio.db")
+        logger.info(f"Generando un caso de {args.lecturas} lecturas en {ruta}...")
+        caso_id = generar_base(ruta, args.lecturas)
+        analytics.DATABASE_PATH = ruta
+        analytics.SNAPSHOTS_DIR = os.path.join(directorio, "analytics")
+
+        engine = create_engine(f"sqlite:///{ruta}")
+        totales = {}
+        try:
+            with sessionmaker(bind=engine)() as db:
+                analytics.ANALYTICS_BACKEND = analytics.BACKEND_SQLITE
+                totales["sqlite"] = medir_agregados("sqlite", db, caso_id)
+
+                if analytics.duckdb is None:
+                    logger.warning("duckdb no está instalado: sólo se mide SQLite")
+                else:
+                    analytics.ANALYTICS_BACKEND = analytics.BACKEND_DUCKDB
+                    totales["duckdb-scan"] = medir_agregados("duckdb-scan", db, caso_id)
+                    exportacion = medir(
+                        "duckdb: export_snapshot",
+                        analytics.export_snapshot,
+                        db,
+                        caso_id,
+                    )
+                    totales["duckdb-parquet"] = medir_agregados(
+                        "duckdb-parquet", db, caso_id
+                    )
+                    logger.info(
+                        f"Exportación a Parquet: {exportacion:.3f} s "
+                        f"(se amortiza en las consultas siguientes)"
+                    )
+        finally:
+            engine.dispose()
+
+        for camino, total in totales.items():
+            logger.info(
+                f"Total {camino:<16} {total:8.3f} s  "
+                f"(x{totales['sqlite'] / total:.1f} frente a SQLite)"
+            )
+
+
+if __name__ == "__main__":
+    main()
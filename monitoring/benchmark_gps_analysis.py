@@ -0,0 +1,90 @@
+"""
+Benchmark del análisis inteligente GPS sobre una traza sintética.
+
+Mide latencia y memoria pico (tracemalloc) del preprocesado común y de
+cada análisis por separado. Uso:
+
+    python -m monitoring.benchmark_gps_analysis --puntos 1000000
+"""
+
+import argparse
+import logging
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from backend.routers.gps_analysis import (
+    analizar_actividad_horaria,
+    analizar_actividad_semanal,
+    detectar_zonas_frecuentes,
+    encontrar_lugares_frecuentes,
+    encontrar_puntos_inicio_fin,
+    preparar_traza,
+)
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger("atrio.benchmark")
+
+
+def generar_traza(puntos: int, seed: int = 0) -> pd.DataFrame:
+    """Genera una traza con paradas en unos pocos lugares y trayectos entre ellos"""
+    rng = np.random.default_rng(seed)
+    lugares = np.column_stack(
+        [rng.uniform(40.3, 40.6, 20), rng.uniform(-3.9, -3.5, 20)]
+    )
+    idx = rng.integers(0, len(lugares), puntos)
+    en_ruta = rng.random(puntos) < 0.4
+    lat = lugares[idx, 0] + np.where(
+        en_ruta, rng.normal(0, 0.02, puntos), rng.normal(0, 0.0002, puntos)
+    )
+    lon = lugares[idx, 1] + np.where(
+        en_ruta, rng.normal(0, 0.02, puntos), rng.normal(0, 0.0002, puntos)
+    )
+    saltos = rng.choice([10, 30, 600, 3600], size=puntos, p=[0.6, 0.3, 0.08, 0.02])
+    fechas = pd.Timestamp("2024-01-01") + pd.to_timedelta(np.cumsum(saltos), "s")
+    return pd.DataFrame(
+        {
+            "Fecha_y_Hora": fechas.astype(str),
+            "Coordenada_X": lon,
+            "Coordenada_Y": lat,
+            "Velocidad": np.where(en_ruta, rng.uniform(20, 120, puntos), 0.0),
+        }
+    )
+
+
+def medir(nombre: str, funcion, *args):
+    """Ejecuta una función midiendo tiempo y memoria pico"""
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    resultado = funcion(*args)
+    duracion = time.perf_counter() - inicio
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    logger.info(f"{nombre:<32} {duracion:8.3f} s  pico {pico / 2**20:8.1f} MB")
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--puntos", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    logger.info(f"Generando traza sintética de {args.puntos} puntos...")
+    df = generar_traza(args.puntos)
+
+    inicio = time.perf_counter()
+    traza = medir("preparar_traza", preparar_traza, df)
+    medir("encontrar_lugares_frecuentes", encontrar_lugares_frecuentes, traza)
+    medir("analizar_actividad_horaria", analizar_actividad_horaria, traza)
+    medir("analizar_actividad_semanal", analizar_actividad_semanal, traza)
+    medir("encontrar_puntos_inicio_fin", encontrar_puntos_inicio_fin, traza)
+    medir("detectar_zonas_frecuentes", detectar_zonas_frecuentes, traza)
+    logger.info(f"Total: {time.perf_counter() - inicio:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
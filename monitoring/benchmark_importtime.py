@@ -0,0 +1,107 @@
+"""
+Benchmark del tiempo de importación de la aplicación.
+
+Importa `main` en un proceso nuevo con `python -X importtime`, resume los
+módulos que más tardan y comprueba el presupuesto: el tiempo total no debe
+superar `--presupuesto-ms` y las dependencias pesadas (pandas, scikit-learn,
+scipy, openpyxl) no deben cargarse al arrancar, sólo al usarlas. Sale con
+código 1 si no se cumple. Uso:
+
+    python -m monitoring.benchmark_importtime --presupuesto-ms 1500
+"""
+
+import argparse
+import logging
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+from lazy_imports import HEAVY_MODULES
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger("atrio.benchmark")
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# "import time:       self [us] |  cumulative | imported package"
+LINEA = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+
+
+def medir_importacion(modulo: str = "main") -> List[Tuple[str, int, int, int]]:
+    """(módulo, propio µs, acumulado µs, nivel) de cada import en un proceso nuevo"""
+    proceso = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        cwd=RAIZ,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    medidas = []
+    for linea in proceso.stderr.splitlines():
+        encontrado = LINEA.match(linea)
+        if encontrado:
+            propio, acumulado, sangria, nombre = encontrado.groups()
+            medidas.append((nombre, int(propio), int(acumulado), len(sangria) // 2))
+    return medidas
+
+
+def pesados_cargados(medidas) -> List[str]:
+    """Dependencias pesadas que se han importado de verdad"""
+    return sorted(
+        {
+            nombre.split(".")[0]
+            for nombre, *_ in medidas
+            if nombre.split(".")[0] in HEAVY_MODULES
+        }
+    )
+
+
+def resumen(medidas, modulo: str = "main", limite: int = 15) -> Dict[str, object]:
+    """Tiempo total del módulo y sus imports directos más lentos"""
+    # importtime escribe cada módulo después de sus dependencias: las del
+    # módulo son las líneas desde el anterior import de primer nivel
+    fin = max(i for i, m in enumerate(medidas) if m[0] == modulo and m[3] == 0)
+    inicio = max((i for i in range(fin) if medidas[i][3] == 0), default=-1) + 1
+    propias = medidas[inicio : fin + 1]
+    total = medidas[fin][2]
+    directos = sorted(
+        (m for m in propias if m[3] == 1), key=lambda m: m[2], reverse=True
+    )
+    return {
+        "total_ms": total / 1000,
+        "mas_lentos": [(m[0], m[2] / 1000) for m in directos[:limite]],
+        "pesados": pesados_cargados(propias),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--modulo", default="main")
+    parser.add_argument("--presupuesto-ms", type=float, default=1500.0)
+    parser.add_argument("--limite", type=int, default=15)
+    args = parser.parse_args()
+
+    datos = resumen(medir_importacion(args.modulo), args.modulo, args.limite)
+    for nombre, ms in datos["mas_lentos"]:
+        logger.info(f"{nombre:<40} {ms:10.1f} ms")
+    logger.info(
+        f"Total importando {args.modulo}: {datos['total_ms']:.1f} ms "
+        f"(presupuesto {args.presupuesto_ms:.0f} ms)"
+    )
+
+    correcto = True
+    if datos["total_ms"] > args.presupuesto_ms:
+        logger.error("Se ha superado el presupuesto de tiempo de importación")
+        correcto = False
+    if datos["pesados"]:
+        logger.error(f"Dependencias pesadas cargadas al arrancar: {datos['pesados']}")
+        correcto = False
+    sys.exit(0 if correcto else 1)
+
+
+if __name__ == "__main__":
+    main()
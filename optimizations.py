@@ -1,18 +1,55 @@
 import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
 from sqlalchemy import Index, Column, text, inspect
 import models
 from database_config import engine, Base
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, sessionmaker
+
+from job_queue import (
+    KIND_MAINTENANCE,
+    PRIORITY_LOW,
+    JobCancelled,
+    check_cancelled,
+    job_queue,
+)
+from shared_state import mark_task_completed, task_statuses
 
 logger = logging.getLogger("atrio.optimizations")
 
+# Versión de los índices y vistas de este módulo, guardada en PRAGMA
+# user_version: al arrancar sólo se aplican si la base de datos tiene una
+# versión anterior. Hay que incrementarla al cambiar índices o vistas.
+OPTIMIZATIONS_VERSION = 2
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+
+# Mantenimiento programado (ANALYZE, PRAGMA optimize y, opcionalmente, VACUUM)
+MAINTENANCE_INTERVAL = float(os.environ.get("ATRIO_MAINTENANCE_HOURS", 24)) * 3600
+MAINTENANCE_VACUUM = os.environ.get("ATRIO_MAINTENANCE_VACUUM", "0") == "1"
+MAINTENANCE_STAGE = "db_maintenance"
+
 
-def create_optimized_indices():
+def create_optimized_indices(bind=engine):
     """
     Crea índices adicionales para optimizar las consultas más comunes.
     Estos índices están separados del modelo base para mayor claridad.
     """
     logger.info("Creando índices optimizados para consultas frecuentes...")
+    # Una sola consulta a sqlite_master en lugar de reflejar cada tabla
+    with bind.connect() as connection:
+        existing = set(
+            connection.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'index'")
+            ).scalars()
+        )
+
+    def _create_index_if_not_exists(index_name, table_name, columns):
+        _create_index(bind, existing, index_name, table_name, columns)
 
     # Índices para la tabla Lectura (la más consultada)
     logger.info("Creando índices para tabla Lectura...")
@@ -28,6 +65,9 @@ def create_optimized_indices():
     _create_index_if_not_exists(
         "ix_lectura_tipo_fecha", "lectura", ["Tipo_Fuente", "Fecha_y_Hora"]
     )
+    # Índice por archivo: borrado por lotes y comprobación de la clave ajena
+    # al eliminar un ArchivoExcel
+    _create_index_if_not_exists("ix_lectura_id_archivo", "lectura", ["ID_Archivo"])
 
     # Índices para la tabla ArchivoExcel
     logger.info("Creando índices para tabla ArchivoExcel...")
@@ -57,28 +97,27 @@ def create_optimized_indices():
     logger.info("Índices optimizados creados correctamente.")
 
 
-def _create_index_if_not_exists(index_name, table_name, columns):
+def _create_index(bind, existing, index_name, table_name, columns):
     """
     Crea un índice solo si no existe ya en la base de datos.
 
     Args:
+        bind: Engine sobre el que crear el índice
+        existing (set): Nombres de los índices que ya existen
         index_name (str): Nombre del índice a crear
         table_name (str): Nombre de la tabla donde crear el índice
         columns (list): Lista de nombres de columnas para el índice
     """
-    inspector = inspect(engine)
-    existing_indices = inspector.get_indexes(table_name)
-    exists = any(idx["name"] == index_name for idx in existing_indices)
-
-    if not exists:
+    if index_name not in existing:
         # Convertir los nombres de columnas a string para SQL
         columns_str = ", ".join(f'"{col}"' for col in columns)
         # Crear el índice dinámicamente
         index_sql = f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ({columns_str})'
 
-        with engine.connect() as connection:
+        with bind.connect() as connection:
             connection.execute(text(index_sql))
             connection.commit()
+        existing.add(index_name)
 
         logger.info(f"Índice '{index_name}' creado en la tabla '{table_name}'")
     else:
@@ -151,7 +190,6 @@ def _create_view_if_not_exists(db: Session, view_name, query):
         query (str): Consulta SQL para definir la vista
     """
     # Verificar si la vista existe
-    inspector = inspect(engine)
     view_exists = False
 
     try:
@@ -179,11 +217,245 @@ def _create_view_if_not_exists(db: Session, view_name, query):
         logger.debug(f"Vista '{view_name}' ya existe")
 
 
-def vacuum_database():
+def vacuum_database(bind=engine):
     """
     Ejecuta VACUUM para optimizar el almacenamiento físico de la base de datos.
+
+    Reescribe el archivo completo y bloquea las escrituras mientras dura, así
+    que ya no se ejecuta al arrancar (ver `run_maintenance`).
     """
     logger.info("Ejecutando VACUUM para optimizar almacenamiento...")
-    with engine.connect() as connection:
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
         connection.execute(text("VACUUM"))
         logger.info("VACUUM completado correctamente")
+
+
+def schema_revisions(bind=engine):
+    """Revisiones de Alembic aplicadas en la base de datos y las de los scripts"""
+    from alembic.config import Config
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    config = Config(ALEMBIC_INI)
+    config.set_main_option(
+        "script_location", os.path.join(os.path.dirname(ALEMBIC_INI), "alembic")
+    )
+    script = ScriptDirectory.from_config(config)
+    with bind.connect() as connection:
+        current = set(MigrationContext.configure(connection).get_current_heads())
+    return current, set(script.get_heads()), script
+
+
+def _check_schema(bind) -> str:
+    """
+    Comprueba el esquema por la revisión de Alembic. Sólo se crean tablas si
+    la base de datos no está en la última revisión; una base de datos nueva
+    se marca además con esa revisión para que el siguiente arranque no tenga
+    que hacer nada.
+    """
+    from alembic.runtime.migration import MigrationContext
+
+    current, heads, script = schema_revisions(bind)
+    if current == heads:
+        return "current"
+
+    with bind.connect() as connection:
+        nueva = not connection.execute(
+            text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'lectura'"
+            )
+        ).first()
+    Base.metadata.create_all(bind=bind)
+    if nueva:
+        with bind.begin() as connection:
+            MigrationContext.configure(connection).stamp(script, "heads")
+        return "created"
+    logger.warning(
+        f"Esquema en la revisión {sorted(current) or 'desconocida'} y la última es "
+        f"{sorted(heads)}: ejecute 'alembic upgrade head'"
+    )
+    return "outdated"
+
+
+def _user_version(bind) -> int:
+    with bind.connect() as connection:
+        return connection.execute(text("PRAGMA user_version")).scalar() or 0
+
+
+def prepare_database(bind=engine) -> Dict[str, Any]:
+    """
+    Comprobaciones baratas de arranque: revisión del esquema y versión de las
+    optimizaciones. Los índices y vistas sólo se crean si la versión guardada
+    es anterior a OPTIMIZATIONS_VERSION; VACUUM y ANALYZE quedan para el
+    mantenimiento programado.
+    """
+    resumen: Dict[str, Any] = {}
+    inicio = time.perf_counter()
+    resumen["schema"] = _check_schema(bind)
+    resumen["schema_seconds"] = round(time.perf_counter() - inicio, 3)
+
+    inicio = time.perf_counter()
+    version = _user_version(bind)
+    if version < OPTIMIZATIONS_VERSION:
+        create_optimized_indices(bind)
+        db = sessionmaker(bind=bind)()
+        try:
+            optimize_common_queries(db)
+        finally:
+            db.close()
+        with bind.connect() as connection:
+            # PRAGMA no admite parámetros; la versión es una constante entera
+            connection.execute(text(f"PRAGMA user_version = {OPTIMIZATIONS_VERSION}"))
+            connection.commit()
+        resumen["optimizations"] = "applied"
+    else:
+        resumen["optimizations"] = "current"
+    resumen["optimizations_version"] = OPTIMIZATIONS_VERSION
+    resumen["optimizations_seconds"] = round(time.perf_counter() - inicio, 3)
+    return resumen
+
+
+# --- Mantenimiento programado ---
+
+
+def new_maintenance_task(task_id: Optional[str] = None, vacuum: bool = False) -> str:
+    """Crea la entrada de la tarea de mantenimiento en `task_statuses`"""
+    task_id = task_id or f"maintenance-{uuid.uuid4().hex[:12]}"
+    task_statuses[task_id] = {
+        "status": "pending",
+        "message": "Mantenimiento de la base de datos en cola",
+        "progress": 0,
+        "stage": MAINTENANCE_STAGE,
+        "vacuum": vacuum,
+    }
+    return task_id
+
+
+def _maintenance_steps(vacuum: bool):
+    pasos = []
+    if vacuum:
+        pasos.append(("vacuum", "VACUUM"))
+        # En modo WAL, VACUUM deja en el WAL una copia de toda la base de datos
+        pasos.append(("wal_checkpoint", "PRAGMA wal_checkpoint(TRUNCATE)"))
+    pasos.append(("analyze", "ANALYZE"))
+    pasos.append(("optimize", "PRAGMA optimize"))
+    return pasos
+
+
+def run_maintenance(task_id: str, vacuum: bool = False, bind=engine) -> Dict[str, Any]:
+    """
+    Mantenimiento de la base de datos con progreso en `task_statuses`:
+    VACUUM (opcional, bloquea las escrituras), ANALYZE y PRAGMA optimize.
+    Se ejecuta en la cola de trabajos y se puede cancelar entre pasos.
+    """
+    estado = task_statuses.setdefault(task_id, {})
+    pasos = _maintenance_steps(vacuum)
+    estado.update(
+        status="processing",
+        message="Mantenimiento de la base de datos en curso...",
+        progress=0,
+        total=len(pasos),
+        stage=MAINTENANCE_STAGE,
+    )
+    resumen: Dict[str, Any] = {}
+    try:
+        for numero, (nombre, sql) in enumerate(pasos, start=1):
+            check_cancelled(task_id)
+            estado["message"] = f"Ejecutando {sql}..."
+            inicio = time.perf_counter()
+            with bind.connect().execution_options(
+                isolation_level="AUTOCOMMIT"
+            ) as connection:
+                connection.execute(text(sql))
+            resumen[nombre] = round(time.perf_counter() - inicio, 3)
+            logger.info(f"[Task {task_id}] {sql} completado en {resumen[nombre]}s")
+            estado["progress"] = numero / len(pasos) * 100
+    except JobCancelled:
+        raise
+    except Exception as e:
+        logger.error(f"[Task {task_id}] Error en el mantenimiento: {e}", exc_info=True)
+        estado.update(
+            status="failed",
+            message=f"Error en el mantenimiento: {e}",
+            result={"seconds": resumen},
+            stage=None,
+        )
+        return resumen
+
+    estado.update(
+        status="completed",
+        message="Mantenimiento de la base de datos completado",
+        progress=100,
+        result={"seconds": resumen},
+        stage=None,
+    )
+    mark_task_completed(task_id)
+    return resumen
+
+
+def submit_maintenance(task_id: Optional[str] = None, vacuum: bool = False) -> str:
+    """Encola el mantenimiento con prioridad baja y devuelve el ID de la tarea"""
+    task_id = new_maintenance_task(task_id, vacuum)
+    job_queue.submit(
+        KIND_MAINTENANCE,
+        run_maintenance,
+        task_id,
+        vacuum,
+        task_id=task_id,
+        priority=PRIORITY_LOW,
+    )
+    return task_id
+
+
+# Mantenimiento con VACUUM encolado y aún sin empezar: las peticiones de
+# VACUUM que llegan mientras espera se sirven con él
+_pending_vacuum: Optional[str] = None
+_pending_vacuum_lock = threading.Lock()
+
+
+def request_vacuum() -> str:
+    """
+    Pide un VACUUM y devuelve el ID de su tarea. Si ya hay uno en cola sin
+    empezar se reutiliza: un VACUUM recoge todo lo borrado antes de que
+    empiece, así que varios borrados seguidos sólo necesitan uno.
+    """
+    global _pending_vacuum
+    with _pending_vacuum_lock:
+        if _pending_vacuum is not None:
+            estado = task_statuses.get(_pending_vacuum)
+            if estado and estado.get("status") == "pending":
+                return _pending_vacuum
+        _pending_vacuum = submit_maintenance(vacuum=True)
+        return _pending_vacuum
+
+
+_maintenance_timer: Optional[threading.Timer] = None
+
+
+def _scheduled_maintenance():
+    # Con varios procesos de la API, la tarea de cada intervalo tiene el
+    # mismo ID y sólo la encola el proceso que consigue reservarlo
+    task_id = f"maintenance-{int(time.time() // MAINTENANCE_INTERVAL)}"
+    try:
+        if task_statuses.claim(task_id, uuid.uuid4().hex, MAINTENANCE_INTERVAL):
+            submit_maintenance(task_id, vacuum=MAINTENANCE_VACUUM)
+    except Exception as e:
+        logger.error(f"Error programando el mantenimiento de la base de datos: {e}")
+    start_maintenance_scheduler()
+
+
+def start_maintenance_scheduler():
+    """Programa el siguiente mantenimiento dentro de MAINTENANCE_INTERVAL"""
+    global _maintenance_timer
+    if MAINTENANCE_INTERVAL <= 0:
+        return
+    _maintenance_timer = threading.Timer(MAINTENANCE_INTERVAL, _scheduled_maintenance)
+    _maintenance_timer.daemon = True
+    _maintenance_timer.start()
+
+
+def stop_maintenance_scheduler():
+    global _maintenance_timer
+    if _maintenance_timer is not None:
+        _maintenance_timer.cancel()
+        _maintenance_timer = None
@@ -242,6 +242,11 @@ class Caso(CasoBase):
         from_attributes = True
 
 
+class CasoVersion(BaseModel):
+    ID_Caso: int
+    Version_Datos: int
+
+
 class ArchivoExcel(ArchivoExcelBase):
     ID_Archivo: int
     ID_Caso: int
@@ -524,27 +529,64 @@ class GpsCapaBase(BaseModel):
     nombre: str
     color: str
     activa: bool
-    lecturas: List[dict]
     filtros: dict
     descripcion: Optional[str] = None
 
 
 class GpsCapaCreate(GpsCapaBase):
-    pass
+    # Basta con los IDs; si se envían lecturas completas se guardan sus IDs
+    ids_lectura: Optional[List[int]] = None
+    lecturas: Optional[List[dict]] = None
 
 
-class GpsCapaUpdate(GpsCapaBase):
-    pass
+class GpsCapaUpdate(GpsCapaCreate):
+    pass  # Sin ids_lectura ni lecturas se conservan los puntos de la capa
 
 
 class GpsCapaOut(GpsCapaBase):
     id: int
     caso_id: int
+    num_lecturas: int = 0
+    lecturas: Optional[List[dict]] = None  # Sólo si se piden los puntos
 
     class Config:
         from_attributes = True  # Reemplaza orm_mode en Pydantic v2
 
 
+class GpsSegmentoOut(BaseModel):
+    id: int
+    caso_id: int
+    matricula: str
+    tipo: str  # 'estancia' o 'trayecto'
+    inicio: datetime.datetime
+    fin: datetime.datetime
+    duracion_segundos: float
+    distancia_metros: float
+    num_puntos: int
+    lat_centro: Optional[float] = None
+    lon_centro: Optional[float] = None
+    lat_inicio: float
+    lon_inicio: float
+    lat_fin: float
+    lon_fin: float
+    lat_min: float
+    lat_max: float
+    lon_min: float
+    lon_max: float
+    id_lectura_inicio: Optional[int] = None
+    id_lectura_fin: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+
+class GpsSegmentacionResponse(BaseModel):
+    vehiculos: int
+    lecturas_procesadas: int
+    estancias: int
+    trayectos: int
+
+
 class LocalizacionInteresBase(BaseModel):
     titulo: str
     descripcion: Optional[str] = None
@@ -58,6 +58,11 @@ setup(
         "redis": [
             "redis>=5.0.1",
         ],
+        # Misma versión en los dos: ver requirements-analytics.txt
+        "analytics": [
+            "duckdb==1.5.5",
+            "duckdb-extension-sqlite-scanner==1.5.5",
+        ],
     },
     entry_points={
         "console_scripts": [
@@ -2,12 +2,17 @@
 # Módulo para manejar el estado compartido entre main.py y routers
 # Evita importaciones circulares
 
+import logging
 import threading
-import time
-from datetime import datetime, timedelta
+from datetime import datetime
 
-# Diccionario global para almacenar el estado de las tareas
-task_statuses = {}
+from task_registry import TaskRegistry
+
+logger = logging.getLogger(__name__)
+
+# Estado de las tareas, persistente y compartido entre procesos (Redis o
+# SQLite); se usa como un dict
+task_statuses = TaskRegistry()
 
 # Variable para controlar el timer de limpieza
 cleanup_timer_active = True
@@ -16,44 +21,19 @@ cleanup_timer = None
 
 # Función para limpiar tareas completadas después de cierto tiempo
 def cleanup_completed_tasks():
-    """Limpia tareas completadas que tienen más de 5 minutos de antigüedad"""
+    """
+    Limpia tareas terminadas hace más de 5 minutos y marca como fallidas
+    las que llevan 30 minutos sin progresar (posible timeout)
+    """
     global cleanup_timer_active, cleanup_timer
 
     if not cleanup_timer_active:
         return
 
-    current_time = datetime.now()
-    tasks_to_remove = []
-
-    for task_id, task_info in task_statuses.items():
-        if task_info.get("status") in ["completed", "failed"]:
-            # Agregar timestamp si no existe
-            if "completed_at" not in task_info:
-                task_info["completed_at"] = current_time
-
-            # Verificar si han pasado más de 5 minutos
-            completed_at = task_info.get("completed_at")
-            if isinstance(
-                completed_at, datetime
-            ) and current_time - completed_at > timedelta(minutes=5):
-                tasks_to_remove.append(task_id)
-
-        # Limpiar tareas que llevan más de 30 minutos en procesamiento (posible timeout)
-        elif task_info.get("status") == "processing":
-            created_at = task_info.get("created_at")
-            if (
-                created_at
-                and isinstance(created_at, datetime)
-                and current_time - created_at > timedelta(minutes=30)
-            ):
-                print(f"Marcando tarea {task_id} como fallida por timeout")
-                task_info["status"] = "failed"
-                task_info["message"] = "Proceso interrumpido por timeout"
-                task_info["completed_at"] = current_time
-                tasks_to_remove.append(task_id)
-
-    for task_id in tasks_to_remove:
-        del task_statuses[task_id]
+    try:
+        task_statuses.purge()
+    except Exception as e:
+        logger.error(f"Error limpiando el registro de tareas: {e}")
 
     # Programar siguiente limpieza solo si el timer sigue activo
     if cleanup_timer_active:
@@ -7,7 +7,7 @@ import type { GpsLectura, GpsCapa, LocalizacionInteres, CapaExcel } from '../../
 import apiClient from '../../services/api';
 import dayjs from 'dayjs';
 import { useHotkeys } from '@mantine/hooks';
-import { getLecturasGps, getParadasGps, getCoincidenciasGps, getGpsCapas, createGpsCapa, updateGpsCapa, deleteGpsCapa, getLocalizacionesInteres, createLocalizacionInteres, updateLocalizacionInteres, deleteLocalizacionInteres } from '../../services/gpsApi';
+import { getLecturasGps, getParadasGps, getCoincidenciasGps, getGpsCapas, getGpsCapa, createGpsCapa, updateGpsCapa, deleteGpsCapa, getLocalizacionesInteres, createLocalizacionInteres, updateLocalizacionInteres, deleteLocalizacionInteres } from '../../services/gpsApi';
 import { getMapasGuardados, createMapaGuardado, deleteMapaGuardado, type MapaGuardado as MapaGuardadoAPI } from '../../services/mapasGuardadosApi';
 import ReactDOMServer from 'react-dom/server';
 import GpsMapStandalone from './GpsMapStandalone';
@@ -53,6 +53,7 @@ interface CapaGps {
   color: string;
   activa: boolean;
   lecturas: GpsLectura[];
+  num_lecturas?: number;
   filtros: any;
   descripcion?: string;
 }
@@ -275,7 +276,7 @@ const CapaItem = React.memo(({ capa, handleToggleCapa, handleEditarCapa, handleE
           <ActionIcon variant="subtle" color="red" onClick={() => handleEliminarCapa(capa.id)}><IconTrash size={16} /></ActionIcon>
         </Group>
       </Group>
-      <Text size="xs" c="dimmed" mt={4}>{capa.lecturas.length} lecturas</Text>
+      <Text size="xs" c="dimmed" mt={4}>{capa.num_lecturas ?? capa.lecturas.length} lecturas</Text>
     </Paper>
   );
 });
@@ -1168,17 +1169,18 @@ const GpsAnalysisPanel: React.FC<GpsAnalysisPanelProps> = ({ casoId, puntoSelecc
     // Ordenar las lecturas cronológicamente antes de guardar
     const datosOrdenados = ordenarLecturasCronologicamente(datosParaGuardar);
     
-    const nuevaCapaCompleta: Omit<CapaGps, 'id' | 'caso_id'> = {
+    // La capa se guarda como referencias a las lecturas, no como copia
+    const nuevaCapaCompleta = {
       nombre: nuevaCapa.nombre!,
       color: nuevaCapa.color || '#228be6',
       activa: true,
-      lecturas: datosOrdenados,
+      ids_lectura: datosOrdenados.map(l => l.ID_Lectura),
       filtros: { ...filters },
       descripcion: nuevaCapa.descripcion || ''
     };
     try {
       const capaGuardada = await createGpsCapa(casoId, nuevaCapaCompleta);
-      setCapas(prev => [...prev, { ...capaGuardada, descripcion: capaGuardada.descripcion || '' }]);
+      setCapas(prev => [...prev, { ...capaGuardada, lecturas: datosOrdenados, descripcion: capaGuardada.descripcion || '' }]);
       setLecturas([]);
       setNuevaCapa({ nombre: '', color: '#228be7' });
       setMostrarFormularioCapa(false);
@@ -1202,18 +1204,19 @@ const GpsAnalysisPanel: React.FC<GpsAnalysisPanelProps> = ({ casoId, puntoSelecc
     if (editandoCapa === null || !nuevaCapa.nombre) return;
     const capaActual = capas.find(c => c.id === editandoCapa);
     if (!capaActual) return;
+    const { lecturas: lecturasCapa, ...metadatosCapa } = capaActual;
     const capaCompleta = {
-      ...capaActual,
+      ...metadatosCapa,
       nombre: nuevaCapa.nombre!,
       color: nuevaCapa.color || '#228be6',
       descripcion: nuevaCapa.descripcion || '',
     };
     try {
+      // Sólo se envían metadatos: los puntos de la capa no cambian
       const capaActualizada = await updateGpsCapa(casoId, editandoCapa, capaCompleta);
-      // Asegurar que las lecturas estén ordenadas cronológicamente
       const capaActualizadaOrdenada = {
         ...capaActualizada,
-        lecturas: ordenarLecturasCronologicamente(capaActualizada.lecturas),
+        lecturas: lecturasCapa,
         descripcion: capaActualizada.descripcion || ''
       };
       setCapas(prev => prev.map(capa =>
@@ -1228,13 +1231,19 @@ const GpsAnalysisPanel: React.FC<GpsAnalysisPanelProps> = ({ casoId, puntoSelecc
   const handleToggleCapa = async (id: number) => {
     const capa = capas.find(c => c.id === id);
     if (!capa) return;
-    const capaCompleta = { ...capa, activa: !capa.activa };
+    const { lecturas: lecturasCapa, ...metadatosCapa } = capa;
+    const capaCompleta = { ...metadatosCapa, activa: !capa.activa };
     try {
       const capaActualizada = await updateGpsCapa(casoId, id, capaCompleta);
-      // Asegurar que las lecturas estén ordenadas cronológicamente
+      // Los puntos se cargan la primera vez que se activa la capa
+      let lecturasActualizadas = lecturasCapa;
+      if (capaActualizada.activa && lecturasCapa.length === 0 && (capa.num_lecturas ?? 0) > 0) {
+        const capaConPuntos = await getGpsCapa(casoId, id);
+        lecturasActualizadas = ordenarLecturasCronologicamente(capaConPuntos.lecturas);
+      }
       const capaActualizadaOrdenada = {
         ...capaActualizada,
-        lecturas: ordenarLecturasCronologicamente(capaActualizada.lecturas)
+        lecturas: lecturasActualizadas
       };
       setCapas(prev => prev.map(c => c.id === id ? capaActualizadaOrdenada : c));
       // Si la capa que se está desactivando es la que está en reproducción, detener la reproducción
@@ -1369,11 +1378,15 @@ const GpsAnalysisPanel: React.FC<GpsAnalysisPanelProps> = ({ casoId, puntoSelecc
   useEffect(() => {
     async function fetchCapas() {
       try {
+        // El listado sólo trae metadatos; se piden los puntos de las capas activas
         const capas = await getGpsCapas(casoId);
-        // Ordenar las lecturas de cada capa cronológicamente
-        const capasOrdenadas = capas.map(capa => ({
-          ...capa,
-          lecturas: ordenarLecturasCronologicamente(capa.lecturas)
+        const capasOrdenadas = await Promise.all(capas.map(async capa => {
+          if (!capa.activa) return capa;
+          const capaConPuntos = await getGpsCapa(casoId, capa.id);
+          return {
+            ...capa,
+            lecturas: ordenarLecturasCronologicamente(capaConPuntos.lecturas)
+          };
         }));
         setCapas(capasOrdenadas);
       } catch (e) {
@@ -11,6 +11,7 @@ import type { Caso, ArchivoExcel } from '../types/data';
 import { updateFooterConfig } from '../services/configApi';
 import { openConfirmModal } from '@mantine/modals';
 import DatabaseSecurityPanel from '../components/admin/DatabaseSecurityPanel';
+import { useTask } from '../contexts/TaskContext';
 
 interface DbStatus {
   status: string;
@@ -29,6 +30,7 @@ interface Backup {
   timestamp: string;
   size_bytes: number;
   created_at: string;
+  compressed?: boolean;
 }
 
 interface Grupo {
@@ -56,6 +58,7 @@ interface UsuarioCreatePayload {
 function AdminPage() {
   const { user } = useAuth();
   const navigate = useNavigate();
+  const { addTask } = useTask();
   const [loading, setLoading] = useState(false);
   const [dbStatus, setDbStatus] = useState<DbStatus | null>(null);
   const [backups, setBackups] = useState<Backup[]>([]);
@@ -166,16 +169,32 @@ function AdminPage() {
     }
   };
 
+  // Los backups y las restauraciones se ejecutan en segundo plano: se sigue
+  // la tarea y se refresca el estado cuando termina
+  const followDatabaseTask = (taskId: string, successMessage: string, errorTitle: string) => {
+    addTask({
+      id: taskId,
+      onComplete: () => {
+        notifications.show({ title: 'Éxito', message: successMessage, color: 'green' });
+        fetchDbStatus();
+        fetchBackups();
+      },
+      onError: (error: string) => {
+        notifications.show({ title: errorTitle, message: error, color: 'red' });
+      },
+    });
+  };
+
   const handleBackup = async () => {
     try {
       setLoading(true);
       const response = await apiClient.post('/api/admin/database/backup');
       notifications.show({
-        title: 'Éxito',
-        message: response.data.message || 'Backup creado correctamente',
-        color: 'green',
+        title: 'Backup iniciado',
+        message: response.data.message || 'Creando backup en segundo plano',
+        color: 'blue',
       });
-      await Promise.all([fetchDbStatus(), fetchBackups()]);
+      followDatabaseTask(response.data.task_id, 'Backup creado correctamente', 'Error en el backup');
     } catch (error: any) {
       notifications.show({
         title: 'Error',
@@ -243,10 +262,10 @@ function AdminPage() {
   const handleFileRestore = (event: React.ChangeEvent<HTMLInputElement>) => {
     const file = event.target.files?.[0];
     if (!file) return;
-    if (!file.name.endsWith('.db')) {
+    if (!['.db', '.db.zst', '.tar', '.tar.zst'].some((ext) => file.name.endsWith(ext))) {
       notifications.show({
         title: 'Archivo inválido',
-        message: 'Solo se pueden restaurar archivos con extensión .db',
+        message: 'Solo se pueden restaurar archivos con extensión .db, .tar o .zst',
         color: 'red',
       });
       return;
@@ -264,11 +283,11 @@ function AdminPage() {
       formData.append('backup_file', restoreFile);
       const response = await apiClient.post('/api/admin/database/restore', formData);
       notifications.show({
-        title: 'Éxito',
-        message: 'Base de datos restaurada correctamente',
-        color: 'green',
+        title: 'Restauración iniciada',
+        message: response.data.message || 'Restaurando la base de datos en segundo plano',
+        color: 'blue',
       });
-      await Promise.all([fetchDbStatus(), fetchBackups()]);
+      followDatabaseTask(response.data.task_id, 'Base de datos restaurada correctamente', 'Error al restaurar');
     } catch (error) {
       notifications.show({
         title: 'Error',
@@ -324,11 +343,15 @@ function AdminPage() {
       const restoreResponse = await apiClient.post('/api/admin/database/restore_from_filename', { filename: backupToRestore.filename });
       
       notifications.show({
-        title: 'Éxito',
-        message: restoreResponse.data.message || 'Base de datos restaurada correctamente desde el backup seleccionado.',
-        color: 'green',
+        title: 'Restauración iniciada',
+        message: restoreResponse.data.message || 'Restaurando la base de datos en segundo plano',
+        color: 'blue',
       });
-      await Promise.all([fetchDbStatus(), fetchBackups()]);
+      followDatabaseTask(
+        restoreResponse.data.task_id,
+        'Base de datos restaurada correctamente desde el backup seleccionado.',
+        'Error al Restaurar Backup'
+      );
       setRestoreBackupModalOpen(false);
       setBackupToRestore(null);
     } catch (error: any) {
@@ -625,13 +648,31 @@ function AdminPage() {
       onConfirm: async () => {
         try {
           setCasosLoading(true); // Mantener para feedback inmediato
-          await deleteCasoApi(casoId); // Usar la función renombrada de casosApi
+          const { task_id } = await deleteCasoApi(casoId); // Usar la función renombrada de casosApi
           notifications.show({
-            title: 'Caso Eliminado',
-            message: 'El caso ha sido eliminado correctamente.',
-            color: 'green',
+            title: 'Borrando caso',
+            message: 'El caso se está eliminando en segundo plano.',
+            color: 'blue',
+          });
+          // La lista se recarga cuando el borrado termina
+          addTask({
+            id: task_id,
+            onComplete: () => {
+              notifications.show({
+                title: 'Caso Eliminado',
+                message: 'El caso ha sido eliminado correctamente.',
+                color: 'green',
+              });
+              fetchCasosYArchivos();
+            },
+            onError: (error: string) => {
+              notifications.show({
+                title: 'Error al eliminar',
+                message: `No se pudo eliminar el caso: ${error}`,
+                color: 'red',
+              });
+            },
           });
-          fetchCasosYArchivos(); // Ahora esto es válido
         } catch (error) {
           notifications.show({
             title: 'Error al eliminar',
@@ -639,7 +680,7 @@ function AdminPage() {
             color: 'red',
           });
         } finally {
-          // setCasosLoading(false); // fetchCasosYArchivos ya lo hace
+          setCasosLoading(false);
         }
       },
     });
@@ -844,7 +885,7 @@ function AdminPage() {
               </Button>
               <input
                 type="file"
-                accept=".db"
+                accept=".db,.tar,.zst"
                 ref={fileInputRef}
                 style={{ display: 'none' }}
                 onChange={handleFileRestore}
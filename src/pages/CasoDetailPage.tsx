@@ -14,6 +14,7 @@ import _ from 'lodash';
 import appEventEmitter from '../utils/eventEmitter';
 import { MapHighlightProvider } from '../context/MapHighlightContext';
 import { useActiveCase } from '../context/ActiveCaseContext';
+import { useTask } from '../contexts/TaskContext';
 
 // Importar componentes
 import 'leaflet/dist/leaflet.css';
@@ -251,6 +252,7 @@ function CasoDetailPage() {
   const [deletingArchivoId, setDeletingArchivoId] = useState<number | null>(null);
   const navigate = useNavigate();
   const { addActiveCase, canAddCase, getCaseToRemove } = useActiveCase();
+  const { addTask } = useTask();
   const [isNavigationExpanded, setIsNavigationExpanded] = useState(true);
 
   // El estado activeMainTab se mantiene, pero controla la sección activa
@@ -531,9 +533,19 @@ const handleDeleteArchivo = async (archivoId: number) => {
     onConfirm: async () => {
       setDeletingArchivoId(archivoId);
       try {
-        await deleteArchivo(archivoId);
-        notifications.show({ title: 'Archivo Eliminado', message: `El archivo ID ${archivoId} ha sido eliminado.`, color: 'teal' });
-        await fetchArchivos(); // Actualizar la lista de archivos
+        const { task_id } = await deleteArchivo(archivoId);
+        notifications.show({ title: 'Borrando archivo', message: `El archivo ID ${archivoId} se está eliminando en segundo plano.`, color: 'blue' });
+        // La lista sólo se actualiza cuando el borrado termina
+        addTask({
+          id: task_id,
+          onComplete: () => {
+            notifications.show({ title: 'Archivo Eliminado', message: `El archivo ID ${archivoId} ha sido eliminado.`, color: 'teal' });
+            fetchArchivos();
+          },
+          onError: (error: string) => {
+            notifications.show({ title: 'Error al Eliminar', message: `El archivo ID ${archivoId} no se ha eliminado: ${error}`, color: 'red' });
+          },
+        });
       } catch (err: any) {
         notifications.show({ title: 'Error al Eliminar', message: err.response?.data?.detail || 'No se pudo eliminar el archivo.', color: 'red' });
       } finally {
@@ -13,6 +13,7 @@ import type { Caso, CasoCreate, EstadoCaso } from '../types/data';
 import dayjs from 'dayjs'; // Para formatear fecha
 import _ from 'lodash'; // Para ordenar
 import { useAuth } from '../context/AuthContext';
+import { useTask } from '../contexts/TaskContext';
 import './CasosPage.css'; // Asegúrate de importar el CSS para los estilos de hover
 import apiClient from '../services/api';
 
@@ -78,6 +79,7 @@ function CasosPage() {
   const [reactivatingCasoId, setReactivatingCasoId] = useState<number | null>(null);
   const navigate = useNavigate();
   const { user } = useAuth();
+  const { addTask } = useTask();
   const [grupos, setGrupos] = useState<Grupo[]>([]);
   const [loadingGrupos, setLoadingGrupos] = useState(false);
   const [viewMode, setViewMode] = useState<'table' | 'grid'>('table');
@@ -221,15 +223,34 @@ function CasosPage() {
   const confirmDeleteCaso = async () => {
     if (!casoToDelete) return;
     
-    setDeletingCasoId(casoToDelete);
+    const casoId = casoToDelete;
+    setDeletingCasoId(casoId);
     try {
-        await deleteCaso(casoToDelete);
+        const { task_id } = await deleteCaso(casoId);
         notifications.show({
-            title: 'Caso Eliminado',
-            message: `El caso ID ${casoToDelete} y todos sus datos asociados han sido eliminados correctamente.`,
-            color: 'teal'
+            title: 'Borrando caso',
+            message: `El caso ID ${casoId} se está eliminando en segundo plano.`,
+            color: 'blue'
+        });
+        // La lista sólo cambia cuando el borrado termina
+        addTask({
+            id: task_id,
+            onComplete: () => {
+                notifications.show({
+                    title: 'Caso Eliminado',
+                    message: `El caso ID ${casoId} y todos sus datos asociados han sido eliminados correctamente.`,
+                    color: 'teal'
+                });
+                setCasos(prevList => prevList.filter(caso => caso.ID_Caso !== casoId));
+            },
+            onError: (error: string) => {
+                notifications.show({
+                    title: 'Error al Eliminar',
+                    message: `El caso ID ${casoId} no se ha eliminado: ${error}`,
+                    color: 'red'
+                });
+            },
         });
-        setCasos(prevList => prevList.filter(caso => caso.ID_Caso !== casoToDelete));
     } catch (err: any) {
          console.error("Error al eliminar caso:", err);
          let errorMessage = err.response?.data?.detail || err.message || 'No se pudo eliminar el caso.';
@@ -934,17 +934,37 @@ function ImportarPage() {
   // --- NUEVO: Confirmar eliminación ---
   const confirmDeleteArchivo = async () => {
     if (!archivoToDelete) return;
-    setDeletingArchivoId(archivoToDelete.ID_Archivo); // Mostrar indicador de carga
+    const archivoId = archivoToDelete.ID_Archivo;
+    setDeletingArchivoId(archivoId); // Mostrar indicador de carga
     setDeleteModalOpened(false);
     try {
-      await deleteArchivo(archivoToDelete.ID_Archivo);
+      const { task_id } = await deleteArchivo(archivoId);
       notifications.show({
-        title: 'Archivo Eliminado',
-        message: `El archivo ID ${archivoToDelete.ID_Archivo} ha sido eliminado correctamente.`,
-        color: 'teal',
-        icon: <IconCheck size={18} />
+        title: 'Borrando archivo',
+        message: `El archivo ID ${archivoId} se está eliminando en segundo plano.`,
+        color: 'blue'
+      });
+      // La lista sólo cambia cuando el borrado termina
+      addTask({
+        id: task_id,
+        onComplete: () => {
+          notifications.show({
+            title: 'Archivo Eliminado',
+            message: `El archivo ID ${archivoId} ha sido eliminado correctamente.`,
+            color: 'teal',
+            icon: <IconCheck size={18} />
+          });
+          setArchivosList(prevList => prevList.filter(archivo => archivo.ID_Archivo !== archivoId));
+        },
+        onError: (error: string) => {
+          notifications.show({
+            title: 'Error al Eliminar',
+            message: `El archivo ID ${archivoId} no se ha eliminado: ${error}`,
+            color: 'red',
+            icon: <IconAlertCircle />
+          });
+        },
       });
-      setArchivosList(prevList => prevList.filter(archivo => archivo.ID_Archivo !== archivoToDelete.ID_Archivo));
     } catch (err: any) {
       console.error("Error al eliminar archivo:", err);
       notifications.show({
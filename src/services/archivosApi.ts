@@ -1,5 +1,5 @@
 import apiClient from './api';
-import type { ArchivoExcel, Lectura, LecturaRelevante, LecturasResponse, UploadResponse } from '../types/data'; // Importa la interfaz ArchivoExcel, Lectura y LecturaRelevante
+import type { ArchivoExcel, DeleteTaskResponse, Lectura, LecturaRelevante, LecturasResponse, UploadResponse } from '../types/data'; // Importa la interfaz ArchivoExcel, Lectura y LecturaRelevante
 
 /**
  * Sube un archivo Excel o CSV al backend para ser procesado e importado.
@@ -56,15 +56,15 @@ export const getArchivosPorCaso = async (casoId: string | number): Promise<Archi
 /**
  * Elimina un archivo Excel y sus lecturas asociadas.
  * @param archivoId ID del archivo a eliminar.
- * @returns Promise<void> - No devuelve nada si tiene éxito.
+ * @returns Promise<DeleteTaskResponse> - Tarea del borrado, que se hace en segundo plano.
  */
-export const deleteArchivo = async (archivoId: number): Promise<void> => {
+export const deleteArchivo = async (archivoId: number): Promise<DeleteTaskResponse> => {
   try {
-    // Realizar la petición DELETE al endpoint del backend
-    await apiClient.delete(
+    // El backend responde 202 con el ID de la tarea de borrado
+    const response = await apiClient.delete<DeleteTaskResponse>(
       `/archivos/${archivoId}`
     );
-    // El backend devuelve 204 No Content, por lo que no hay datos en la respuesta
+    return response.data;
   } catch (error) {
     console.error(`Error al eliminar el archivo ID ${archivoId}:`, error);
     // Relanzar el error para que sea manejado por el componente que llama
@@ -1,5 +1,5 @@
 import apiClient from './api';
-import type { Caso, CasoCreate, ArchivoExcel, CasoEstadoUpdate, EstadoCaso, SavedSearch, SavedSearchUpdatePayload } from '../types/data'; // Añadir ArchivoExcel y Lectura
+import type { Caso, CasoCreate, ArchivoExcel, CasoEstadoUpdate, DeleteTaskResponse, EstadoCaso, SavedSearch, SavedSearchUpdatePayload } from '../types/data'; // Añadir ArchivoExcel y Lectura
 
 // Obtener todos los casos
 export const getCasos = async (): Promise<Caso[]> => {
@@ -56,10 +56,11 @@ export const updateCaso = async (id: number, casoData: Partial<CasoCreate>): Pro
   }
 };
 
-// Eliminar un caso (lo necesitaremos más adelante)
-export const deleteCaso = async (casoId: number): Promise<void> => {
+// Eliminar un caso: el borrado se encola y se sigue con el task_id devuelto
+export const deleteCaso = async (casoId: number): Promise<DeleteTaskResponse> => {
   try {
-    await apiClient.delete(`/casos/${casoId}`);
+    const response = await apiClient.delete<DeleteTaskResponse>(`/casos/${casoId}`);
+    return response.data;
   } catch (error) {
     console.error(`Error al eliminar el caso ID ${casoId}:`, error);
     throw error; // Relanzar para manejo en el componente
@@ -1,5 +1,5 @@
 import apiClient from './api';
-import type { GpsLectura, GpsCapa, LocalizacionInteres } from '../types/data';
+import type { GpsLectura, GpsCapa, GpsSegmento, LocalizacionInteres } from '../types/data';
 
 // Haversine distance in km
 function haversineDistance(lat1: number, lon1: number, lat2: number, lon2: number) {
@@ -30,6 +30,8 @@ export const getLecturasGps = async (casoId: number, params?: {
         lonMax: number;
     };
     matricula?: string;
+    zoom?: number;
+    tolerancia_m?: number;
 }) => {
     // Asegurarnos de que el tipo_fuente está establecido
     const paramsWithType = {
@@ -87,20 +89,67 @@ export const getCoincidenciasGps = async (casoId: number, params?: {
     return response.data;
 };
 
-// Gestión de capas GPS
-export const getGpsCapas = async (casoId: number) => {
-    const response = await apiClient.get<GpsCapa[]>(`/casos/${casoId}/gps-capas`);
+// Estancias y trayectos precalculados
+export const getSegmentosGps = async (casoId: number, params?: {
+    matricula?: string;
+    tipo?: 'estancia' | 'trayecto';
+    fecha_inicio?: string;
+    fecha_fin?: string;
+}) => {
+    const response = await apiClient.get<GpsSegmento[]>(`/api/gps/casos/${casoId}/segmentos`, { params });
     return response.data;
 };
 
-export const createGpsCapa = async (casoId: number, capa: Omit<GpsCapa, 'id' | 'caso_id'>) => {
-    const response = await apiClient.post<GpsCapa>(`/casos/${casoId}/gps-capas`, capa);
+export const recalcularSegmentosGps = async (casoId: number, matricula?: string) => {
+    const response = await apiClient.post<{
+        vehiculos: number;
+        lecturas_procesadas: number;
+        estancias: number;
+        trayectos: number;
+    }>(`/api/gps/casos/${casoId}/segmentos/recalcular`, null, { params: { matricula } });
     return response.data;
 };
 
-export const updateGpsCapa = async (casoId: number, capaId: number, capa: Partial<GpsCapa>) => {
-    const response = await apiClient.put<GpsCapa>(`/casos/${casoId}/gps-capas/${capaId}`, capa);
-    return response.data;
+// Gestión de capas GPS
+// El backend guarda las capas como referencias a lecturas y sólo devuelve
+// los puntos cuando se piden; `lecturas` queda vacío en caso contrario.
+type GpsCapaRespuesta = Omit<GpsCapa, 'lecturas'> & { lecturas?: GpsLectura[] | null };
+
+const normalizarCapa = (capa: GpsCapaRespuesta): GpsCapa => ({
+    ...capa,
+    lecturas: capa.lecturas ?? []
+});
+
+export const getGpsCapas = async (casoId: number, params?: {
+    incluir_lecturas?: boolean;
+    zoom?: number;
+    tolerancia_m?: number;
+}) => {
+    const response = await apiClient.get<GpsCapaRespuesta[]>(`/casos/${casoId}/gps-capas`, { params });
+    return response.data.map(normalizarCapa);
+};
+
+export const getGpsCapa = async (casoId: number, capaId: number, params?: { zoom?: number; tolerancia_m?: number }) => {
+    const response = await apiClient.get<GpsCapaRespuesta>(`/casos/${casoId}/gps-capas/${capaId}`, { params });
+    return normalizarCapa(response.data);
+};
+
+export const createGpsCapa = async (
+    casoId: number,
+    capa: Omit<GpsCapa, 'id' | 'caso_id' | 'lecturas'> & { ids_lectura: number[] }
+) => {
+    const response = await apiClient.post<GpsCapaRespuesta>(`/casos/${casoId}/gps-capas`, capa);
+    return normalizarCapa(response.data);
+};
+
+// Sin ids_lectura la capa conserva sus puntos y sólo se actualizan los metadatos
+export const updateGpsCapa = async (
+    casoId: number,
+    capaId: number,
+    capa: Partial<Omit<GpsCapa, 'lecturas'>> & { ids_lectura?: number[] }
+) => {
+    const response = await apiClient.put<GpsCapaRespuesta>(`/casos/${casoId}/gps-capas/${capaId}`, capa);
+    return normalizarCapa(response.data);
 };
 
 export const deleteGpsCapa = async (casoId: number, capaId: number) => {
@@ -98,6 +98,12 @@ export interface UploadResponse {
   nuevos_lectores_creados?: string[];
 }
 
+// Respuesta de los borrados de casos y archivos, que se hacen en segundo plano
+export interface DeleteTaskResponse {
+  task_id: string;
+  message: string;
+}
+
 // --- NUEVO: Interfaz para Lector (respuesta GET) ---
 export interface Lector {
   ID_Lector: string;
@@ -235,12 +241,37 @@ export interface GpsLectura {
   clusterSize?: number;
 }
 
+export interface GpsSegmento {
+  id: number;
+  caso_id: number;
+  matricula: string;
+  tipo: 'estancia' | 'trayecto';
+  inicio: string;
+  fin: string;
+  duracion_segundos: number;
+  distancia_metros: number;
+  num_puntos: number;
+  lat_centro: number | null;
+  lon_centro: number | null;
+  lat_inicio: number;
+  lon_inicio: number;
+  lat_fin: number;
+  lon_fin: number;
+  lat_min: number;
+  lat_max: number;
+  lon_min: number;
+  lon_max: number;
+  id_lectura_inicio: number | null;
+  id_lectura_fin: number | null;
+}
+
 export interface GpsCapa {
   id: number;
   nombre: string;
   color: string;
   activa: boolean;
-  lecturas: GpsLectura[];
+  lecturas: GpsLectura[]; // Vacío hasta que se piden los puntos de la capa
+  num_lecturas?: number;
   filtros: {
     fechaInicio: string;
     horaInicio: string;
@@ -0,0 +1,504 @@
+"""
+Registro persistente del estado de las tareas en segundo plano
+
+`shared_state.task_statuses` era un dict del proceso: con varios workers de
+uvicorn la consulta de estado caía en otro proceso y devolvía 404, y las
+tareas desaparecían al reiniciar. El registro guarda cada tarea en Redis si
+está disponible o, si no, en una base SQLite propia, y conserva la interfaz
+de dict que ya usan los endpoints y las tareas:
+
+    task_statuses[task_id] = {"status": "pending", ...}
+    task_statuses[task_id]["progress"] = 50
+    task_statuses[task_id].update({"stage": "processing", ...})
+    task_statuses.get(task_id)
+
+Cada escritura sólo envía los campos que cambian y se aplica de forma
+atómica en el almacén (json_set en SQLite, HSET en Redis), así que no hay
+lectura-modificación-escritura entre procesos. Las escrituras que sólo
+cambian el progreso se agrupan para no escribir más de una vez por
+intervalo; cualquier otro cambio las publica de inmediato.
+
+El registro guarda también reservas con caducidad (`claim`/`release`): el
+primer proceso que reserva un nombre lo tiene hasta que lo libera o deja
+de renovarlo. Sirven para que lo que sólo debe ocurrir una vez (un
+trabajo por tipo, el mantenimiento de cada intervalo) no dependa de qué
+proceso de la API lo pida.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections.abc import MutableMapping
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, Dict, Iterator, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+TASKS_DB_PATH = "./database/secure/tareas.db"
+REDIS_PREFIX = "atrio:task:"
+REDIS_CLAIMS_PREFIX = "atrio:claim:"
+
+FINISHED_STATUSES = ("completed", "failed")
+# Tareas terminadas: se conservan este tiempo para que el cliente lea el resultado
+FINISHED_RETENTION = 5 * 60
+# Tareas sin ninguna escritura durante este tiempo se dan por interrumpidas
+STALE_AFTER = 30 * 60
+# Campos que se pueden agrupar y frecuencia máxima con que se escriben
+THROTTLED_FIELDS = frozenset({"progress"})
+PROGRESS_MIN_INTERVAL = 1.0
+
+
+_REGISTRIES: "weakref.WeakValueDictionary[int, TaskRegistry]" = (
+    weakref.WeakValueDictionary()
+)
+
+
+def _after_fork_in_child():
+    for registry in list(_REGISTRIES.values()):
+        registry._reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if hasattr(value, "item"):  # escalares de numpy
+        return value.item()
+    return str(value)
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, default=_json_default, ensure_ascii=False)
+
+
+class SQLiteTaskStore:
+    """Tareas en una base SQLite aparte, para no competir con las importaciones"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = TASKS_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection().execute(
+            """
+            CREATE TABLE IF NOT EXISTS tareas (
+                task_id TEXT PRIMARY KEY,
+                status TEXT,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection().execute(
+            """
+            CREATE TABLE IF NOT EXISTS reservas (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires REAL NOT NULL
+            )
+            """
+        )
+
+    def reset_after_fork(self):
+        # Las conexiones heredadas del proceso padre no se pueden reutilizar
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit: cada sentencia es atómica por sí misma
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def load(self, task_id: str) -> Optional[Dict[str, Any]]:
+        row = (
+            self._connection()
+            .execute("SELECT data FROM tareas WHERE task_id = ?", (task_id,))
+            .fetchone()
+        )
+        return None if row is None else json.loads(row[0])
+
+    def replace(self, task_id: str, data: Dict[str, Any]):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO tareas (task_id, status, data, updated_at) "
+            "VALUES (?, ?, ?, ?)",
+            (task_id, data.get("status"), _dumps(data), time.time()),
+        )
+
+    def merge(self, task_id: str, changes: Dict[str, Any], status: Optional[str]):
+        # json_set reemplaza cada campo de primer nivel en una sola sentencia
+        paths = ", ".join("?, json(?)" for _ in changes)
+        params = []
+        for key, value in changes.items():
+            params += [f'$."{key}"', _dumps(value)]
+        connection = self._connection()
+        updated = connection.execute(
+            f"UPDATE tareas SET data = json_set(data, {paths}), "
+            "status = coalesce(?, status), updated_at = ? WHERE task_id = ?",
+            (*params, changes.get("status"), time.time(), task_id),
+        ).rowcount
+        if not updated:
+            connection.execute(
+                "INSERT OR IGNORE INTO tareas (task_id, status, data, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (task_id, changes.get("status"), _dumps(changes), time.time()),
+            )
+
+    def delete(self, task_id: str):
+        self._connection().execute("DELETE FROM tareas WHERE task_id = ?", (task_id,))
+
+    def ids(self):
+        return [
+            row[0] for row in self._connection().execute("SELECT task_id FROM tareas")
+        ]
+
+    def claim(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        # Se inserta si está libre, se renueva si es del mismo dueño y se
+        # toma si ha caducado; en otro caso no cambia nada
+        return (
+            self._connection()
+            .execute(
+                "INSERT INTO reservas (name, owner, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, "
+                "expires = excluded.expires "
+                "WHERE reservas.owner = excluded.owner OR reservas.expires < ?",
+                (name, owner, now + ttl, now),
+            )
+            .rowcount
+            == 1
+        )
+
+    def release(self, name: str, owner: str):
+        self._connection().execute(
+            "DELETE FROM reservas WHERE name = ? AND owner = ?", (name, owner)
+        )
+
+    def purge(self, now: float) -> int:
+        connection = self._connection()
+        connection.execute("DELETE FROM reservas WHERE expires < ?", (now,))
+        finished = ", ".join("?" for _ in FINISHED_STATUSES)
+        connection.execute(
+            "UPDATE tareas SET status = 'failed', updated_at = ?, data = json_set("
+            "data, '$.status', 'failed', "
+            "'$.message', 'Proceso interrumpido por timeout') "
+            f"WHERE coalesce(status, '') NOT IN ({finished}) AND updated_at < ?",
+            (now, *FINISHED_STATUSES, now - STALE_AFTER),
+        )
+        return connection.execute(
+            f"DELETE FROM tareas WHERE status IN ({finished}) AND updated_at < ?",
+            (*FINISHED_STATUSES, now - FINISHED_RETENTION),
+        ).rowcount
+
+
+# Reserva libre o del mismo dueño: se (re)escribe con su caducidad
+_SCRIPT_CLAIM = """
+local actual = redis.call('GET', KEYS[1])
+if not actual or actual == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+_SCRIPT_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisTaskStore:
+    """Tareas como hashes de Redis, un campo JSON por clave de primer nivel"""
+
+    name = "redis"
+
+    def __init__(self, client, prefix: str = REDIS_PREFIX):
+        self.client = client
+        self.prefix = prefix
+        # Fuera del prefijo de las tareas, que `ids` recorre
+        self.claims_prefix = REDIS_CLAIMS_PREFIX
+
+    def _key(self, task_id: str) -> str:
+        return f"{self.prefix}{task_id}"
+
+    @staticmethod
+    def _ttl(status: Optional[str]) -> int:
+        # Las tareas abandonadas caducan solas; no hace falta purgarlas
+        return FINISHED_RETENTION if status in FINISHED_STATUSES else STALE_AFTER
+
+    def load(self, task_id: str) -> Optional[Dict[str, Any]]:
+        fields = self.client.hgetall(self._key(task_id))
+        if not fields:
+            return None
+        return {
+            (k.decode() if isinstance(k, bytes) else k): json.loads(v)
+            for k, v in fields.items()
+        }
+
+    def _write(
+        self, task_id: str, changes: Dict[str, Any], status: Optional[str], replace
+    ):
+        key = self._key(task_id)
+        pipe = self.client.pipeline(transaction=True)
+        if replace:
+            pipe.delete(key)
+        if changes:
+            pipe.hset(key, mapping={k: _dumps(v) for k, v in changes.items()})
+        # Cualquier escritura prolonga la vida de una tarea en curso
+        pipe.expire(key, self._ttl(status))
+        pipe.execute()
+
+    def replace(self, task_id: str, data: Dict[str, Any]):
+        self._write(task_id, data, data.get("status"), replace=True)
+
+    def merge(self, task_id: str, changes: Dict[str, Any], status: Optional[str]):
+        self._write(task_id, changes, status, replace=False)
+
+    def delete(self, task_id: str):
+        self.client.delete(self._key(task_id))
+
+    def ids(self):
+        return [
+            (k.decode() if isinstance(k, bytes) else k)[len(self.prefix) :]
+            for k in self.client.scan_iter(match=f"{self.prefix}*", count=500)
+        ]
+
+    def claim(self, name: str, owner: str, ttl: float) -> bool:
+        return bool(
+            self.client.eval(
+                _SCRIPT_CLAIM,
+                1,
+                f"{self.claims_prefix}{name}",
+                owner,
+                max(1, int(ttl * 1000)),
+            )
+        )
+
+    def release(self, name: str, owner: str):
+        self.client.eval(_SCRIPT_RELEASE, 1, f"{self.claims_prefix}{name}", owner)
+
+    def purge(self, now: float) -> int:
+        return 0
+
+
+class TaskStatus(dict):
+    """
+    Estado de una tarea leído del registro
+
+    Es un dict normal; asignar claves o llamar a `update` escribe además
+    los cambios en el registro.
+    """
+
+    def __init__(self, registry: "TaskRegistry", task_id: str, data: Dict[str, Any]):
+        super().__init__(data)
+        self._registry = registry
+        self._task_id = task_id
+
+    def __setitem__(self, key: str, value: Any):
+        super().__setitem__(key, value)
+        self._registry.patch(self._task_id, {key: value})
+
+    def update(self, *args, **kwargs):
+        changes = dict(*args, **kwargs)
+        super().update(changes)
+        self._registry.patch(self._task_id, changes)
+
+    def setdefault(self, key: str, default: Any = None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+
+TaskStore = Union[SQLiteTaskStore, RedisTaskStore]
+
+
+class TaskRegistry(MutableMapping):
+    """
+    Estado de las tareas en segundo plano, compartido entre procesos
+
+    El almacén se elige en el primer uso: Redis si el cache está conectado,
+    SQLite si no. Las lecturas van siempre al almacén, porque la tarea puede
+    estar ejecutándose en otro proceso; el proceso que escribe recuerda el
+    último estado que escribió, para descartar escrituras que no cambian
+    nada y para agrupar las de progreso.
+    """
+
+    def __init__(
+        self,
+        store: Optional[TaskStore] = None,
+        progress_interval: float = PROGRESS_MIN_INTERVAL,
+    ):
+        self._store = store
+        self.progress_interval = progress_interval
+        self._lock = threading.RLock()
+        self._local: Dict[str, Dict[str, Any]] = {}
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._flushed_at: Dict[str, float] = {}
+        _REGISTRIES[id(self)] = self
+
+    def _reset_after_fork(self):
+        # El proceso hijo empieza sin estado propio: el candado podía estar
+        # tomado por otro hilo del padre en el momento del fork
+        self._lock = threading.RLock()
+        self._local, self._pending, self._flushed_at = {}, {}, {}
+        reset = getattr(self._store, "reset_after_fork", None)
+        if reset is not None:
+            reset()
+
+    @property
+    def store(self) -> TaskStore:
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = self._default_store()
+        return self._store
+
+    @staticmethod
+    def _default_store() -> TaskStore:
+        from cache_manager import cache_manager
+
+        if cache_manager.connected:
+            return RedisTaskStore(cache_manager.redis_client)
+        return SQLiteTaskStore()
+
+    def _load(self, task_id: str) -> Optional[Dict[str, Any]]:
+        data = self.store.load(task_id)
+        with self._lock:
+            pending = self._pending.get(task_id)
+            if pending:
+                # El proceso que escribe ve también su progreso sin publicar
+                data = {**(data or {}), **pending}
+            elif data is None and task_id in self._local:
+                data = dict(self._local[task_id])
+        return data
+
+    def __getitem__(self, task_id: str) -> TaskStatus:
+        data = self._load(task_id)
+        if data is None:
+            raise KeyError(task_id)
+        return TaskStatus(self, task_id, data)
+
+    def __setitem__(self, task_id: str, value: Dict[str, Any]):
+        data = dict(value)
+        with self._lock:
+            self._local[task_id] = data
+            self._pending.pop(task_id, None)
+            self._flushed_at[task_id] = time.monotonic()
+            self.store.replace(task_id, data)
+
+    def __delitem__(self, task_id: str):
+        with self._lock:
+            found = self._local.pop(task_id, None) is not None
+            self._pending.pop(task_id, None)
+            self._flushed_at.pop(task_id, None)
+        if not found and self.store.load(task_id) is None:
+            raise KeyError(task_id)
+        self.store.delete(task_id)
+
+    def __contains__(self, task_id: object) -> bool:
+        return isinstance(task_id, str) and self._load(task_id) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.store.ids())
+
+    def __len__(self) -> int:
+        return len(self.store.ids())
+
+    def setdefault(self, task_id: str, default: Optional[Dict[str, Any]] = None):
+        data = self._load(task_id)
+        if data is None:
+            data = dict(default or {})
+            self[task_id] = data
+        return TaskStatus(self, task_id, data)
+
+    def forget(self, task_id: str):
+        """
+        Publica lo pendiente y olvida el estado local de una tarea que pasa
+        a escribir otro proceso
+        """
+        self.flush(task_id)
+        with self._lock:
+            self._local.pop(task_id, None)
+            self._flushed_at.pop(task_id, None)
+
+    def patch(self, task_id: str, changes: Dict[str, Any]):
+        """Aplica cambios a una tarea, agrupando los que sólo son de progreso"""
+        with self._lock:
+            local = self._local.get(task_id)
+            if local is None:
+                local = self._local[task_id] = self.store.load(task_id) or {}
+            changes = {
+                k: v for k, v in changes.items() if k not in local or local[k] != v
+            }
+            if not changes:
+                return
+            local.update(changes)
+            pending = self._pending.setdefault(task_id, {})
+            pending.update(changes)
+
+            now = time.monotonic()
+            if (
+                pending.keys() <= THROTTLED_FIELDS
+                and now - self._flushed_at.get(task_id, 0) < self.progress_interval
+                and (local.get("progress") or 0) < 100
+            ):
+                return
+            del self._pending[task_id]
+            self._flushed_at[task_id] = now
+            self.store.merge(task_id, pending, local.get("status"))
+
+    def flush(self, task_id: Optional[str] = None):
+        """Escribe el progreso agrupado pendiente (de una tarea o de todas)"""
+        with self._lock:
+            ids = [task_id] if task_id else list(self._pending)
+            for current in ids:
+                pending = self._pending.pop(current, None)
+                if pending:
+                    self._flushed_at[current] = time.monotonic()
+                    status = self._local.get(current, {}).get("status")
+                    self.store.merge(current, pending, status)
+
+    def claim(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        Reserva `name` para `owner` durante `ttl` segundos. Devuelve False si
+        lo tiene otro dueño; el mismo dueño la renueva volviendo a llamar.
+        """
+        return self.store.claim(name, owner, ttl)
+
+    def release(self, name: str, owner: str):
+        """Libera una reserva si sigue siendo de `owner`"""
+        self.store.release(name, owner)
+
+    def purge(self) -> int:
+        """
+        Marca como fallidas las tareas abandonadas y borra las terminadas
+        hace más de FINISHED_RETENTION segundos. Devuelve cuántas se borraron.
+        """
+        self.flush()
+        with self._lock:
+            # El estado local de las tareas terminadas ya está en el almacén
+            for task_id, data in list(self._local.items()):
+                if data.get("status") in FINISHED_STATUSES:
+                    del self._local[task_id]
+                    self._flushed_at.pop(task_id, None)
+        return self.store.purge(time.time())
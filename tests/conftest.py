@@ -63,6 +63,20 @@ def db_session(db_engine):
     connection.close()
 
 
+@pytest.fixture(autouse=True)
+def uploads_temporales(tmp_path, monkeypatch):
+    """Los archivos que guarden los tests van a un directorio temporal, no a uploads/"""
+    import bulk_delete
+    import main
+    from backend.routers import external_data
+
+    carpeta = tmp_path / "uploads"
+    carpeta.mkdir()
+    for modulo in (main, bulk_delete, external_data):
+        monkeypatch.setattr(modulo, "UPLOADS_DIR", carpeta)
+    return carpeta
+
+
 @pytest.fixture
 def client():
     """Cliente de test para FastAPI"""
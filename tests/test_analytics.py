@@ -0,0 +1,163 @@
+"""
+Tests para los agregados de un caso (analytics)
+"""
+
+import datetime
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import analytics
+import case_shards
+import models
+from case_shards import add_lecturas, attach, create_shard
+from database_config import Base
+
+
+@pytest.fixture
+def casos(tmp_path, monkeypatch):
+    """Un caso en la tabla compartida y otro en su shard, con las mismas lecturas"""
+    monkeypatch.setattr(case_shards, "SHARDS_DIR", str(tmp_path / "casos"))
+    monkeypatch.setattr(analytics, "SNAPSHOTS_DIR", str(tmp_path / "analytics"))
+    monkeypatch.setattr(analytics, "ANALYTICS_BACKEND", analytics.BACKEND_SQLITE)
+    ruta = tmp_path / "atrio.db"
+    monkeypatch.setattr(analytics, "DATABASE_PATH", str(ruta))
+    engine = create_engine(f"sqlite:///{ruta}")
+    event.listen(
+        engine, "connect", lambda conn, _: conn.execute("PRAGMA journal_mode=WAL")
+    )
+    Base.metadata.create_all(bind=engine)
+    case_shards.install(engine)
+    fabrica = sessionmaker(bind=engine, expire_on_commit=False)
+    with fabrica() as db:
+        grupo = models.Grupo(Nombre="Grupo")
+        db.add(grupo)
+        db.flush()
+        ids = []
+        for nombre in ("Compartido", "Shard"):
+            caso = models.Caso(
+                Nombre_del_Caso=nombre, Año=2024, ID_Grupo=grupo.ID_Grupo
+            )
+            db.add(caso)
+            db.flush()
+            archivos = []
+            for i in range(2):
+                archivo = models.ArchivoExcel(
+                    ID_Caso=caso.ID_Caso,
+                    Nombre_del_Archivo=f"{nombre}_{i}.xlsx",
+                    Tipo_de_Archivo="LPR",
+                )
+                db.add(archivo)
+                db.flush()
+                archivos.append(archivo.ID_Archivo)
+            ids.append((caso.ID_Caso, archivos))
+        db.commit()
+
+        create_shard(ids[1][0])
+        for caso_id, archivos in ids:
+            attach(db, caso_id)
+            add_lecturas(db, caso_id, _lecturas(archivos))
+            db.commit()
+    yield fabrica, ids
+    engine.dispose()
+
+
+def _lecturas(archivos):
+    """
+    Lunes 1 de enero de 2024 a las 8 y a las 9 y domingo 7 a las 8: dos
+    matrículas, una con lecturas LPR y GPS.
+    """
+    datos = [
+        (archivos[0], "1234ABC", datetime.datetime(2024, 1, 1, 8), "L1", "LPR"),
+        (archivos[0], "1234ABC", datetime.datetime(2024, 1, 1, 9), "L2", "LPR"),
+        (archivos[1], "1234ABC", datetime.datetime(2024, 1, 7, 8), None, "GPS"),
+        (archivos[1], "5678DEF", datetime.datetime(2024, 1, 7, 8, 30), "L1", "LPR"),
+    ]
+    return [
+        models.Lectura(
+            ID_Archivo=archivo,
+            Matricula=matricula,
+            Fecha_y_Hora=fecha,
+            ID_Lector=lector,
+            Tipo_Fuente=tipo,
+        )
+        for archivo, matricula, fecha, lector, tipo in datos
+    ]
+
+
+def _agregados(db, caso_id):
+    return {
+        "resumen": analytics.case_summary(db, caso_id),
+        "vehiculos": analytics.counts_by_plate(db, caso_id),
+        "archivos": analytics.counts_by_file(db, caso_id),
+        "histogramas": analytics.histograms(db, caso_id),
+    }
+
+
+class TestAnalytics:
+    """Tests para los agregados con SQLite y DuckDB"""
+
+    @pytest.mark.parametrize("indice", [0, 1], ids=["compartido", "shard"])
+    def test_agregados_sqlite(self, casos, indice):
+        fabrica, ids = casos
+        caso_id, archivos = ids[indice]
+        with fabrica() as db:
+            agregados = _agregados(db, caso_id)
+
+        assert agregados["resumen"] == {
+            "total_archivos": 2,
+            "total_lecturas": 4,
+            "total_matriculas_unicas": 2,
+            "total_lectores_unicos": 2,
+            "fecha_primera_lectura": datetime.datetime(2024, 1, 1, 8),
+            "fecha_ultima_lectura": datetime.datetime(2024, 1, 7, 8, 30),
+        }
+        assert agregados["vehiculos"] == {
+            "1234ABC": {"LPR": 2, "GPS": 1},
+            "5678DEF": {"LPR": 1},
+        }
+        assert agregados["archivos"] == {archivos[0]: 2, archivos[1]: 2}
+        histogramas = agregados["histogramas"]
+        assert histogramas["por_hora"][8] == 3
+        assert histogramas["por_hora"][9] == 1
+        assert sum(histogramas["por_hora"]) == 4
+        # Lunes en la posición 0 y domingo en la 6
+        assert histogramas["por_dia_semana"] == [2, 0, 0, 0, 0, 0, 2]
+
+    def test_sin_duckdb(self, casos, monkeypatch):
+        """Sin el paquete duckdb se usa SQLite aunque esté configurado"""
+        fabrica, [(caso_id, _), _] = casos
+        monkeypatch.setattr(analytics, "ANALYTICS_BACKEND", analytics.BACKEND_DUCKDB)
+        monkeypatch.setattr(analytics, "duckdb", None)
+        assert not analytics.enabled()
+        with fabrica() as db:
+            assert analytics.export_snapshot(db, caso_id) is None
+            assert analytics.case_summary(db, caso_id)["total_lecturas"] == 4
+
+    @pytest.mark.parametrize("indice", [0, 1], ids=["compartido", "shard"])
+    def test_duckdb_igual_que_sqlite(self, casos, monkeypatch, indice):
+        """DuckDB, con sqlite_scan y con la instantánea, da lo mismo que SQLite"""
+        pytest.importorskip("duckdb")
+        pytest.importorskip("duckdb_extension_sqlite_scanner")
+        fabrica, ids = casos
+        caso_id = ids[indice][0]
+        with fabrica() as db:
+            esperado = _agregados(db, caso_id)
+            monkeypatch.setattr(
+                analytics, "ANALYTICS_BACKEND", analytics.BACKEND_DUCKDB
+            )
+            assert _agregados(db, caso_id) == esperado
+            assert analytics.export_snapshot(db, caso_id) is not None
+            assert _agregados(db, caso_id) == esperado
+
+    def test_duckdb_sin_extension(self, casos, monkeypatch):
+        """Sin la extensión sqlite empaquetada falla, sin descargarla ni usar SQLite"""
+        pytest.importorskip("duckdb")
+        fabrica, [(caso_id, _), _] = casos
+        monkeypatch.setattr(analytics, "ANALYTICS_BACKEND", analytics.BACKEND_DUCKDB)
+        monkeypatch.setattr(analytics, "duckdb_extension_sqlite_scanner", None)
+        monkeypatch.setattr(analytics, "_instance", None)
+        with fabrica() as db:
+            with pytest.raises(RuntimeError, match="duckdb-extension-sqlite-scanner"):
+                analytics.case_summary(db, caso_id)
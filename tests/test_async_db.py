@@ -0,0 +1,72 @@
+"""
+Tests para las consultas de los endpoints async fuera del bucle de eventos
+"""
+
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+import backend.routers.external_data as external_data
+from database_config import run_db
+from dependencies import get_current_active_user
+from main import app
+
+
+@pytest.fixture
+def usuario():
+    app.dependency_overrides[get_current_active_user] = lambda: None
+    yield
+    app.dependency_overrides.pop(get_current_active_user, None)
+
+
+@pytest.fixture
+def cruce_lento(monkeypatch):
+    """Cruce que ocupa su hilo un segundo, como una consulta pesada"""
+
+    def cruzar(filters, db):
+        time.sleep(1.0)
+        return []
+
+    monkeypatch.setattr(external_data, "_query_cross_with_lpr", cruzar)
+
+
+async def _cruce_y_consulta():
+    """Duración de una consulta rápida lanzada durante un cruce lento"""
+    transporte = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://test") as c:
+        cruce = asyncio.create_task(
+            c.post("/api/external-data/cross-with-lpr", json={"caso_id": 1})
+        )
+        await asyncio.sleep(0.2)
+        inicio = time.monotonic()
+        fuentes = await c.get("/api/external-data/sources/1")
+        duracion = time.monotonic() - inicio
+        assert fuentes.status_code == 200
+        assert fuentes.json() == []
+        assert not cruce.done()
+        assert (await cruce).status_code == 200
+        return duracion
+
+
+class TestRunDb:
+    """Tests para run_db"""
+
+    def test_en_otro_hilo(self):
+        hilo = asyncio.run(run_db(threading.get_ident))
+        assert hilo != threading.get_ident()
+
+    def test_argumentos(self):
+        def restar(a, b=0):
+            return a - b
+
+        assert asyncio.run(run_db(restar, 7, b=2)) == 5
+
+
+class TestEndpointsAsync:
+    """Los endpoints siguen respondiendo durante un cruce pesado"""
+
+    def test_cruce_no_bloquea(self, db_session, usuario, cruce_lento):
+        assert asyncio.run(_cruce_y_consulta()) < 0.5
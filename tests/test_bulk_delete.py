@@ -0,0 +1,181 @@
+"""
+Tests para el borrado masivo de casos y archivos
+"""
+
+import datetime
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.orm import sessionmaker
+
+import bulk_delete
+import models
+from bulk_delete import (
+    SECURE_DELETE_ON,
+    SECURE_DELETE_VACUUM,
+    run_delete_archivo,
+    run_delete_caso,
+)
+from database_config import Base
+from shared_state import task_statuses
+
+
+@pytest.fixture
+def sesiones(tmp_path, monkeypatch):
+    """Caso con dos archivos de 25 y 5 lecturas, una relevante, y datos externos"""
+    monkeypatch.setattr(bulk_delete, "DELETE_BATCH_SIZE", 10)
+    engine = create_engine(f"sqlite:///{tmp_path / 'atrio.db'}")
+    Base.metadata.create_all(bind=engine)
+    fabrica = sessionmaker(bind=engine, expire_on_commit=False)
+    with fabrica() as db:
+        grupo = models.Grupo(Nombre="Grupo")
+        db.add(grupo)
+        db.flush()
+        caso = models.Caso(Nombre_del_Caso="Caso", Año=2024, ID_Grupo=grupo.ID_Grupo)
+        db.add(caso)
+        db.flush()
+        archivos = []
+        for nombre, lecturas in (("grande.xlsx", 25), ("pequeno.xlsx", 5)):
+            archivo = models.ArchivoExcel(
+                ID_Caso=caso.ID_Caso, Nombre_del_Archivo=nombre, Tipo_de_Archivo="LPR"
+            )
+            db.add(archivo)
+            db.flush()
+            archivos.append(archivo.ID_Archivo)
+            db.add_all(
+                models.Lectura(
+                    ID_Archivo=archivo.ID_Archivo,
+                    Matricula=f"{i:04d}ABC",
+                    Fecha_y_Hora=datetime.datetime(2024, 1, 1, 0, i),
+                    Tipo_Fuente="LPR",
+                )
+                for i in range(lecturas)
+            )
+        db.flush()
+        primera = db.scalar(select(func.min(models.Lectura.ID_Lectura)))
+        db.add(models.LecturaRelevante(ID_Lectura=primera))
+        db.add(
+            models.ExternalData(
+                caso_id=caso.ID_Caso,
+                matricula="0000ABC",
+                source_name="fuente",
+                data_json={},
+            )
+        )
+        db.commit()
+        caso_id = caso.ID_Caso
+    yield fabrica, engine, caso_id, archivos
+    engine.dispose()
+
+
+def _sentencias(engine):
+    sentencias = []
+    event.listen(
+        engine,
+        "before_cursor_execute",
+        lambda conn, cursor, sql, *args: sentencias.append(sql),
+    )
+    return sentencias
+
+
+def _contar(db, modelo):
+    return db.scalar(select(func.count()).select_from(modelo))
+
+
+def _tarea():
+    return f"delete-test-{uuid.uuid4().hex}"
+
+
+class TestBorradoMasivo:
+    """Tests para run_delete_caso y run_delete_archivo"""
+
+    def test_borrar_caso(self, sesiones):
+        fabrica, engine, caso_id, _ = sesiones
+        sentencias = _sentencias(engine)
+        task_id = _tarea()
+
+        resumen = run_delete_caso(task_id, caso_id, session_factory=fabrica)
+        assert resumen["lecturas"] == 30
+        assert resumen["external_data"] == 1
+        assert resumen["archivos"] == 2
+        with fabrica() as db:
+            for modelo in (
+                models.Caso,
+                models.ArchivoExcel,
+                models.Lectura,
+                models.LecturaRelevante,
+                models.ExternalData,
+            ):
+                assert _contar(db, modelo) == 0, modelo
+
+        # Lotes de 10 lecturas sin cargar las filas, y secure_delete restaurado
+        borrados = [s for s in sentencias if s.startswith("DELETE FROM lectura")]
+        assert len(borrados) == 4
+        assert not any(s.startswith('SELECT lectura."Matricula"') for s in sentencias)
+        pragmas = [s for s in sentencias if s.startswith("PRAGMA secure_delete")]
+        assert pragmas[-1] == "PRAGMA secure_delete=ON"
+        assert pragmas.count("PRAGMA secure_delete=OFF") == len(pragmas) / 2
+
+        estado = task_statuses.pop(task_id)
+        assert estado["status"] == "completed"
+        assert estado["progress"] == 100
+        assert estado["total"] == 30
+
+    def test_borrar_archivo(self, sesiones):
+        """Sólo se borran las lecturas del archivo y cambia la versión del caso"""
+        fabrica, engine, caso_id, (grande, pequeno) = sesiones
+        with fabrica() as db:
+            version = db.get(models.Caso, caso_id).Version_Datos
+        task_id = _tarea()
+
+        resumen = run_delete_archivo(task_id, grande, session_factory=fabrica)
+        assert resumen["lecturas"] == 25
+        with fabrica() as db:
+            assert db.get(models.ArchivoExcel, grande) is None
+            assert db.get(models.ArchivoExcel, pequeno) is not None
+            assert _contar(db, models.Lectura) == 5
+            assert _contar(db, models.LecturaRelevante) == 0
+            assert _contar(db, models.ExternalData) == 1
+            assert db.get(models.Caso, caso_id).Version_Datos > version
+        assert task_statuses.pop(task_id)["status"] == "completed"
+
+    def test_politica_on(self, sesiones):
+        """Con la política "on" no se cambia secure_delete"""
+        fabrica, engine, _, (grande, _) = sesiones
+        sentencias = _sentencias(engine)
+        task_id = _tarea()
+        run_delete_archivo(
+            task_id, grande, policy=SECURE_DELETE_ON, session_factory=fabrica
+        )
+        assert not [s for s in sentencias if s.startswith("PRAGMA secure_delete")]
+        task_statuses.pop(task_id)
+
+    def test_vacuum_al_terminar(self, monkeypatch):
+        """La política "vacuum" encola un VACUUM cuando el borrado termina"""
+        encolados = []
+        monkeypatch.setattr(
+            bulk_delete.job_queue,
+            "submit",
+            lambda *args, **kwargs: encolados.append(args) or _Hecho(),
+        )
+        monkeypatch.setattr(
+            bulk_delete, "request_vacuum", lambda: encolados.append("vacuum")
+        )
+        task_id = bulk_delete.submit_delete_caso(7, policy=SECURE_DELETE_VACUUM)
+        assert encolados[0][1:] == (run_delete_caso, task_id, 7, SECURE_DELETE_VACUUM)
+        assert encolados[1] == "vacuum"
+        task_statuses.pop(task_id)
+
+
+class _Hecho:
+    """Future ya terminado con éxito"""
+
+    def cancelled(self):
+        return False
+
+    def exception(self):
+        return None
+
+    def add_done_callback(self, callback):
+        callback(self)
@@ -2,9 +2,27 @@
 Tests para el sistema de cache de ATRiO
 """
 
+import pickle
 import pytest
+import threading
 import time
-from cache_manager import CacheManager, cached
+from types import SimpleNamespace
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from cache_manager import CacheManager, MemoryLRUCache, build_cache_key, cached
+from cache_serializers import OrjsonSerializer, PickleSerializer, decode, encode
+
+
+class _Peticion(BaseModel):
+    matricula: str
+    ventana_minutos: int = 10
+
+
+def _usuario(rol="admingrupo", grupo=1):
+    return SimpleNamespace(User="u", Rol=SimpleNamespace(value=rol), ID_Grupo=grupo)
 
 
 class TestCacheManager:
@@ -128,6 +146,210 @@ class TestCacheManager:
         assert stats["keys_count"] == 2
 
 
+class _PipelineEnMemoria:
+    def __init__(self, redis):
+        self.redis = redis
+        self.comandos = []
+
+    def __getattr__(self, nombre):
+        return lambda *args: self.comandos.append((nombre, args))
+
+    def execute(self):
+        return [getattr(self.redis, n)(*args) for n, args in self.comandos]
+
+
+class _RedisEnMemoria:
+    """Doble mínimo de redis.Redis para probar el nivel L1"""
+
+    def __init__(self):
+        self.datos = {}
+        self.lecturas = 0
+
+    def get(self, key):
+        self.lecturas += 1
+        return self.datos.get(key)
+
+    def setex(self, key, ttl, value):
+        self.datos[key] = value
+        return True
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and key in self.datos:
+            return None
+        self.datos[key] = value
+        return True
+
+    def exists(self, key):
+        return int(key in self.datos)
+
+    def eval(self, script, num_keys, key, token):
+        # Sólo se usa para liberar cerrojos: borrar si el token coincide
+        if self.datos.get(key) == token:
+            return self.delete(key)
+        return 0
+
+    def delete(self, *keys):
+        return sum(self.datos.pop(k, None) is not None for k in keys)
+
+    def sadd(self, key, *values):
+        self.datos.setdefault(key, set()).update(values)
+
+    def expire(self, key, ttl):
+        return True
+
+    def sscan_iter(self, key, count=None):
+        return iter(list(self.datos.get(key, ())))
+
+    def scan_iter(self, match=None, count=None):
+        from fnmatch import fnmatchcase
+
+        return iter([k for k in list(self.datos) if fnmatchcase(k, match)])
+
+    def pipeline(self):
+        return _PipelineEnMemoria(self)
+
+    def info(self):
+        return {"db0": {"keys": len(self.datos)}}
+
+
+class TestMemoryLRUCache:
+    """Tests para el cache en proceso acotado"""
+
+    def test_respeta_presupuesto_y_expulsa_lru(self):
+        """Al superar el presupuesto se expulsa lo menos usado recientemente"""
+        cache = MemoryLRUCache(max_bytes=3 * (1000 + 1 + 96))
+        for key in "abc":
+            cache.set(key, b"x" * 1000, ttl=60)
+        cache.get("a")  # 'a' pasa a ser la más reciente
+        cache.set("d", b"x" * 1000, ttl=60)
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("d") is not None
+        stats = cache.get_stats()
+        assert stats["evictions"] == 1
+        assert stats["size_bytes"] <= stats["max_bytes"]
+
+    def test_valor_mayor_que_presupuesto_no_se_guarda(self):
+        """Un valor que no cabe no desaloja el resto del cache"""
+        cache = MemoryLRUCache(max_bytes=2000)
+        cache.set("a", b"x" * 100, ttl=60)
+        assert cache.set("b", b"x" * 5000, ttl=60) is False
+        assert cache.get("a") is not None
+
+    def test_contadores_en_stats(self):
+        """Los aciertos, fallos y expiraciones aparecen en get_stats"""
+        cache = CacheManager(host="invalid_host")
+        cache.set("k", "v", ttl=1)
+        cache.get("k")
+        cache.get("otra")
+        time.sleep(1.05)
+        cache.get("k")
+
+        stats = cache.get_stats()["memory"]
+        assert stats["hits"] == 1
+        assert stats["misses"] == 2
+        assert stats["expirations"] == 1
+
+    def test_l1_delante_de_redis(self):
+        """Con Redis disponible, las lecturas repetidas se sirven desde L1"""
+        cache = CacheManager(host="invalid_host", l1_ttl=30)
+        cache.redis_client = _RedisEnMemoria()
+        cache.connected = True
+
+        cache.set("atrio:caso:1:x", {"a": 1}, ttl=300)
+        assert cache.get("atrio:caso:1:x") == {"a": 1}
+        assert cache.redis_client.lecturas == 0
+
+        # Un valor escrito por otro proceso se trae de Redis una vez
+        cache.redis_client.setex("atrio:otro", 300, b"\x80\x04K\x07.")
+        assert cache.get("atrio:otro") == 7
+        assert cache.get("atrio:otro") == 7
+        assert cache.redis_client.lecturas == 1
+
+        cache.clear_pattern("atrio:caso:*")
+        assert cache.get("atrio:caso:1:x") is None
+        assert cache.get_stats()["l1"]["hits"] == 2
+
+    def test_sin_redis_con_varios_workers(self):
+        """Sin Redis y con varios workers las entradas caducan como en L1"""
+        compartido = CacheManager(host="invalid_host", l1_ttl=1, web_workers=2)
+        unico = CacheManager(host="invalid_host", l1_ttl=1, web_workers=1)
+        for cache in (compartido, unico):
+            cache.set("atrio:x", "valor", ttl=300)
+
+        time.sleep(1.1)
+        assert compartido.get("atrio:x") is None
+        assert unico.get("atrio:x") == "valor"
+
+
+class TestCacheTags:
+    """Tests para la invalidación por etiquetas"""
+
+    def test_invalidar_por_etiqueta_en_memoria(self):
+        """Sólo se eliminan las entradas registradas bajo la etiqueta"""
+        cache = CacheManager(host="invalid_host")
+        cache.set("atrio:a", 1, tags=["caso:1", "archivo:10"])
+        cache.set("atrio:b", 2, tags=["caso:1"])
+        cache.set("atrio:c", 3, tags=["caso:2"])
+
+        cache.invalidate_archivo(10)
+        assert cache.get("atrio:a") is None
+        assert cache.get("atrio:b") == 2
+
+        cache.invalidate_caso(1)
+        assert cache.get("atrio:b") is None
+        assert cache.get("atrio:c") == 3
+
+    def test_invalidar_por_etiqueta_en_redis(self):
+        """Las etiquetas se guardan en sets de Redis y se recorren con SSCAN"""
+        cache = CacheManager(host="invalid_host", l1_ttl=30)
+        cache.redis_client = _RedisEnMemoria()
+        cache.connected = True
+
+        cache.set("atrio:v:1", ["x"], tags=["caso:1"])
+        cache.set("atrio:v:2", ["y"], tags=["caso:2"])
+        assert cache.redis_client.datos["atrio:tag:caso:1"] == {"atrio:v:1"}
+
+        assert cache.invalidate_tags("caso:1") == 1
+        assert "atrio:v:1" not in cache.redis_client.datos
+        assert "atrio:tag:caso:1" not in cache.redis_client.datos
+        # También desaparece de L1
+        assert cache.get("atrio:v:1") is None
+        assert cache.get("atrio:v:2") == ["y"]
+
+    def test_clear_pattern_usa_scan(self):
+        """clear_pattern recorre las claves con SCAN (el doble no tiene KEYS)"""
+        cache = CacheManager(host="invalid_host")
+        cache.redis_client = _RedisEnMemoria()
+        cache.connected = True
+        for i in range(3):
+            cache.set(f"atrio:lanzadera_analisis:public:{i}", i)
+        cache.set("atrio:otro", 0)
+
+        assert cache.clear_pattern("atrio:lanzadera_analisis:*") == 3
+        assert cache.get("atrio:otro") == 0
+
+    def test_decorador_etiqueta_por_caso(self):
+        """Los resultados de @cached se invalidan con el caso de la llamada"""
+        llamadas = []
+
+        @cached("test_tags_caso", ttl=60)
+        def por_caso(caso_id: int):
+            llamadas.append(caso_id)
+            return caso_id
+
+        por_caso(5)
+        por_caso(5)
+        assert llamadas == [5]
+
+        from cache_manager import cache_manager
+
+        cache_manager.invalidate_caso(5)
+        por_caso(5)
+        assert llamadas == [5, 5]
+
+
 class TestCacheDecorator:
     """Tests para el decorador de cache"""
 
@@ -158,6 +380,79 @@ class TestCacheDecorator:
         assert result3 == "result_1_3_test"
         assert call_count == 2  # Debe incrementar
 
+    def test_clave_ignora_dependencias(self):
+        """La sesión y el usuario inyectados no forman parte de la clave"""
+
+        def endpoint(caso_id: int, db=Depends(object), current_user=Depends(object)):
+            pass
+
+        key1 = build_cache_key(
+            "v", endpoint, (1,), {"db": object(), "current_user": _usuario()}
+        )
+        key2 = build_cache_key(
+            "v",
+            endpoint,
+            (),
+            {"caso_id": 1, "db": object(), "current_user": _usuario()},
+        )
+        key3 = build_cache_key(
+            "v", endpoint, (2,), {"db": object(), "current_user": _usuario()}
+        )
+        assert key1 == key2
+        assert key1 != key3
+        assert key1.startswith("atrio:v:admingrupo:1:")
+
+    def test_clave_canonicaliza_body_y_particiona_por_ambito(self):
+        """Bodies equivalentes comparten clave; ámbitos distintos no"""
+
+        def endpoint(caso_id: int, request: _Peticion, current_user=Depends(object)):
+            pass
+
+        body = _Peticion(matricula="1234ABC")
+        mismo = _Peticion(ventana_minutos=10, matricula="1234ABC")
+        key = lambda b, u: build_cache_key("l", endpoint, (1, b), {"current_user": u})
+
+        assert key(body, _usuario()) == key(mismo, _usuario())
+        assert key(body, _usuario()) != key(_Peticion(matricula="X"), _usuario())
+        assert key(body, _usuario(grupo=1)) != key(body, _usuario(grupo=2))
+        assert key(body, _usuario("superadmin", 1)) == key(
+            body, _usuario("superadmin", 2)
+        )
+
+    def test_peticiones_repetidas_aciertan(self):
+        """Dos peticiones HTTP iguales ejecutan el endpoint una sola vez"""
+        llamadas = []
+        app = FastAPI()
+
+        def get_db():
+            yield object()  # Una sesión distinta en cada petición
+
+        def get_user():
+            return _usuario()
+
+        @app.post("/casos/{caso_id}/analisis")
+        @cached("test_endpoint_http", ttl=60)
+        def analisis(
+            caso_id: int,
+            request: _Peticion,
+            db=Depends(get_db),
+            current_user=Depends(get_user),
+        ):
+            llamadas.append(caso_id)
+            return {"caso_id": caso_id, "matricula": request.matricula}
+
+        client = TestClient(app)
+        for body in (
+            {"matricula": "1234ABC"},
+            {"ventana_minutos": 10, "matricula": "1234ABC"},
+        ):
+            respuesta = client.post("/casos/7/analisis", json=body)
+            assert respuesta.json() == {"caso_id": 7, "matricula": "1234ABC"}
+        assert llamadas == [7]
+
+        client.post("/casos/7/analisis", json={"matricula": "OTRA"})
+        assert llamadas == [7, 7]
+
     def test_cache_utility_functions(self):
         """Test de las funciones de utilidad de cache"""
         from cache_manager import (
@@ -181,3 +476,154 @@ class TestCacheDecorator:
         # Las claves deben ser diferentes para diferentes parámetros
         assert lecturas_key != estadisticas_key
         assert mapa_key != lanzadera_key
+
+
+class TestCacheSerialization:
+    """Tests para la serialización enchufable de los valores"""
+
+    def test_modelos_se_guardan_como_dicts(self):
+        """Las listas de modelos se guardan como JSON y se leen como dicts"""
+        cache = CacheManager(host="invalid_host", serializer=OrjsonSerializer())
+        valor = [_Peticion(matricula=f"{i:04d}ABC") for i in range(3)]
+        cache.set("atrio:lanzadera_analisis:x", valor, ttl=60)
+
+        assert cache.get("atrio:lanzadera_analisis:x") == [
+            {"matricula": f"{i:04d}ABC", "ventana_minutos": 10} for i in range(3)
+        ]
+
+    def test_tipos_no_json_usan_pickle(self):
+        """Lo que JSON no puede representar se guarda con pickle"""
+        cache = CacheManager(host="invalid_host", serializer=OrjsonSerializer())
+        cache.set("atrio:otro:x", {"punto": complex(1, 2)}, ttl=60)
+
+        assert cache.get("atrio:otro:x") == {"punto": complex(1, 2)}
+        stats = cache.get_stats()["serialization"]["otro"]
+        assert stats["pickle_fallbacks"] == 1
+
+    def test_compresion_por_encima_del_umbral(self):
+        """Los valores grandes se comprimen y se recuperan intactos"""
+        cache = CacheManager(
+            host="invalid_host", compression=b"z", compress_min_bytes=1024
+        )
+        pequeño = {"a": 1}
+        grande = [{"matricula": "1234ABC", "lecturas": i} for i in range(2000)]
+        cache.set("atrio:vehiculos_caso:p", pequeño, ttl=60)
+        cache.set("atrio:vehiculos_caso:g", grande, ttl=60)
+
+        assert cache.memory_cache.get("atrio:vehiculos_caso:p")[1:2] == b"-"
+        assert cache.memory_cache.get("atrio:vehiculos_caso:g")[1:2] == b"z"
+        assert cache.get("atrio:vehiculos_caso:g") == grande
+
+        stats = cache.get_stats()["serialization"]["vehiculos_caso"]
+        assert stats["sets"] == 2
+        assert stats["stored_bytes"] < stats["payload_bytes"]
+        assert stats["loads"] == 1
+        assert "size_ratio_vs_pickle" in stats
+
+    def test_lee_entradas_pickle_antiguas(self):
+        """Las entradas escritas antes de las tramas siguen siendo legibles"""
+        assert decode(pickle.dumps({"a": (1, 2)})) == {"a": (1, 2)}
+        datos = encode(*PickleSerializer().dumps({"a": (1, 2)}), compression=b"z")
+        assert decode(datos) == {"a": (1, 2)}
+
+
+class TestSingleFlight:
+    """Tests para el cálculo único ante fallos simultáneos"""
+
+    def test_llamadas_simultaneas_calculan_una_vez(self):
+        """Varios hilos con la misma clave ejecutan la función una sola vez"""
+        cache = CacheManager(host="invalid_host")
+        llamadas = []
+
+        def calcular():
+            llamadas.append(1)
+            time.sleep(0.2)
+            return {"vehiculos": 3}
+
+        resultados = []
+        hilos = [
+            threading.Thread(
+                target=lambda: resultados.append(
+                    cache.get_or_compute("atrio:vehiculos_caso:1", calcular, ttl=60)
+                )
+            )
+            for _ in range(8)
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        assert len(llamadas) == 1
+        assert resultados == [{"vehiculos": 3}] * 8
+        assert cache.get_stats()["single_flight"]["coalesced"] == 7
+
+    def test_espera_al_calculo_de_otro_proceso(self):
+        """Con el cerrojo de Redis en manos de otro proceso se espera su resultado"""
+        cache = CacheManager(host="invalid_host", l1_ttl=None)
+        cache.redis_client = _RedisEnMemoria()
+        cache.connected = True
+        clave = "atrio:lanzadera_analisis:public:x"
+        cache.redis_client.datos["atrio:lock:" + clave] = "otro-proceso"
+
+        def otro_proceso():
+            time.sleep(0.1)
+            cache.set(clave, {"resultado": "remoto"}, ttl=60)
+
+        threading.Thread(target=otro_proceso).start()
+        valor = cache.get_or_compute(
+            clave, lambda: pytest.fail("no debe calcularse"), ttl=60
+        )
+        assert valor == {"resultado": "remoto"}
+
+        # Si el cerrojo nunca se libera, al agotar la espera se calcula
+        cache.redis_client.datos["atrio:lock:otra"] = "otro-proceso"
+        valor = cache.get_or_compute(
+            "otra", lambda: "calculado", ttl=60, wait_timeout=0.1
+        )
+        assert valor == "calculado"
+        assert cache.get_stats()["single_flight"]["wait_timeouts"] == 1
+        # El cerrojo ajeno no se toca
+        assert cache.redis_client.datos["atrio:lock:otra"] == "otro-proceso"
+
+    def test_stale_while_revalidate(self):
+        """Un valor caducado se sirve mientras otro llamante lo recalcula"""
+        cache = CacheManager(host="invalid_host")
+        clave = "atrio:estadisticas_globales:all:x"
+        cache.get_or_compute(clave, lambda: "v1", ttl=1, stale_ttl=60)
+        assert cache.get_or_compute(clave, lambda: "v2", ttl=1, stale_ttl=60) == "v1"
+        time.sleep(1.1)
+
+        # Otro hilo está recalculando: se devuelve el valor antiguo sin esperar
+        resultados = []
+        with cache._local_flight(clave):
+            hilo = threading.Thread(
+                target=lambda: resultados.append(
+                    cache.get_or_compute(clave, lambda: "v2", ttl=1, stale_ttl=60)
+                )
+            )
+            hilo.start()
+            hilo.join()
+        assert resultados == ["v1"]
+        assert cache.get_stats()["single_flight"]["stale_served"] == 1
+
+        # Sin nadie recalculando, la llamada que lo encuentra caducado lo refresca
+        assert cache.get_or_compute(clave, lambda: "v2", ttl=1, stale_ttl=60) == "v2"
+        assert cache.get_or_compute(clave, lambda: "v3", ttl=1, stale_ttl=60) == "v2"
+
+    def test_decorador_coalesce_llamadas(self):
+        """@cached usa el cálculo único por defecto"""
+        llamadas = []
+
+        @cached("analisis_single_flight", ttl=60, scope=None)
+        def analisis(caso_id: int):
+            llamadas.append(caso_id)
+            time.sleep(0.2)
+            return [caso_id]
+
+        hilos = [threading.Thread(target=analisis, args=(5,)) for _ in range(4)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        assert llamadas == [5]
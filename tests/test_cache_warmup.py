@@ -0,0 +1,98 @@
+"""
+Tests para el precalentamiento del cache de un caso
+"""
+
+import uuid
+
+import pytest
+
+import cache_warmup
+from cache_manager import cached
+from cache_warmup import (
+    nueva_tarea_precalentamiento,
+    paso_precalentamiento,
+    precalentar_caso,
+)
+from shared_state import task_statuses
+
+
+class _Sesion:
+    """Sesión mínima: sólo registra rollback y close"""
+
+    def __init__(self):
+        self.rollbacks = 0
+        self.cerrada = False
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.cerrada = True
+
+
+@pytest.fixture
+def pasos(monkeypatch):
+    """Registro de pasos vacío para cada test"""
+    registro = {}
+    monkeypatch.setattr(cache_warmup, "PASOS", registro)
+    return registro
+
+
+class TestPrecalentamiento:
+    """Tests para el precalentamiento tras la importación"""
+
+    def test_pasos_quedan_en_cache(self, pasos):
+        """Tras precalentar, la primera petición del caso es un acierto"""
+        llamadas = []
+        prefijo = f"test_warmup_{uuid.uuid4().hex[:8]}"
+
+        @paso_precalentamiento("agregado")
+        @cached(prefijo, ttl=60, key_params=("caso_id",), scope=None)
+        def agregado(caso_id: int, db=None):
+            llamadas.append(caso_id)
+            return {"caso": caso_id}
+
+        sesion = _Sesion()
+        resumen = precalentar_caso(7, session_factory=lambda: sesion)
+        assert resumen["agregado"]["status"] == "ok"
+        assert sesion.cerrada
+
+        assert agregado(7, db=sesion) == {"caso": 7}
+        assert llamadas == [7]
+
+    def test_pasos_reciben_solo_sus_argumentos(self, pasos):
+        """Un paso sin caso_id (catálogo compartido) se llama sólo con db"""
+        recibidos = []
+        paso_precalentamiento("catalogo")(lambda db: recibidos.append(db))
+
+        sesion = _Sesion()
+        precalentar_caso(1, session_factory=lambda: sesion)
+        assert recibidos == [sesion]
+
+    def test_estado_de_la_tarea(self, pasos):
+        """El progreso y el resumen por paso se publican en task_statuses"""
+        paso_precalentamiento("bien")(lambda caso_id: caso_id)
+
+        def falla(db, caso_id):
+            raise RuntimeError("sin datos")
+
+        paso_precalentamiento("mal")(falla)
+
+        task_id = nueva_tarea_precalentamiento(3)
+        assert task_statuses[task_id]["status"] == "pending"
+        assert task_statuses[task_id]["total"] == 2
+
+        sesion = _Sesion()
+        precalentar_caso(3, task_id, session_factory=lambda: sesion)
+        estado = task_statuses.pop(task_id)
+        # Un paso fallido no detiene a los demás ni hace fallar la tarea
+        assert estado["status"] == "completed"
+        assert estado["progress"] == 100
+        assert estado["result"]["caso_id"] == 3
+        assert estado["result"]["pasos"]["bien"]["status"] == "ok"
+        assert estado["result"]["pasos"]["mal"] == {
+            "status": "error",
+            "error": "sin datos",
+            "seconds": estado["result"]["pasos"]["mal"]["seconds"],
+        }
+        assert sesion.rollbacks == 1
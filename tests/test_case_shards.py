@@ -0,0 +1,427 @@
+"""
+Tests para las lecturas de cada caso en su propio archivo (shards)
+"""
+
+import datetime
+import os
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event, func, select, text
+from sqlalchemy.orm import sessionmaker
+
+import case_shards
+import models
+import schemas
+from backend.routers.external_data import _query_cross_with_lpr
+from bulk_delete import run_delete_caso
+from case_shards import (
+    add_lecturas,
+    attach,
+    create_shard,
+    drop_shard,
+    ensure_shard,
+    is_sharded,
+    lectura_entity,
+    shard_path,
+)
+from database_config import Base, RoutingSession, set_sqlite_read_pragma
+from main import (
+    _detectar_lanzaderas,
+    _fechas_caso,
+    _matriculas_gps_caso,
+    buscar_vehiculos_multicaso,
+    desmarcar_lectura_relevante,
+    get_global_statistics,
+    get_lectores_por_caso,
+    get_lecturas_por_vehiculo,
+    get_lecturas_relevantes_por_caso,
+    marcar_lectura_relevante,
+    read_lecturas,
+    read_lecturas_por_filtros,
+)
+from shared_state import task_statuses
+from version_datos import incrementar_version_matricula
+
+
+@pytest.fixture
+def casos(tmp_path, monkeypatch):
+    """Un caso en la tabla compartida y otro en su shard, con 3 lecturas cada uno"""
+    monkeypatch.setattr(case_shards, "SHARDS_DIR", str(tmp_path / "casos"))
+    ruta = tmp_path / "atrio.db"
+    escritor = create_engine(f"sqlite:///{ruta}", pool_size=1, max_overflow=0)
+    event.listen(
+        escritor,
+        "connect",
+        lambda conn, _: conn.execute("PRAGMA journal_mode=WAL"),
+    )
+    Base.metadata.create_all(bind=escritor)
+    lector = create_engine(f"sqlite:///file:{ruta}?mode=ro&uri=true")
+    event.listen(lector, "connect", set_sqlite_read_pragma)
+    case_shards.install(escritor)
+    case_shards.install(lector)
+    fabrica = sessionmaker(
+        class_=RoutingSession,
+        bind=escritor,
+        read_bind=lector,
+        expire_on_commit=False,
+    )
+    with fabrica() as db:
+        grupo = models.Grupo(Nombre="Grupo")
+        db.add_all([grupo, models.Lector(ID_Lector="L1", Carretera="A-1")])
+        db.flush()
+        ids = []
+        for nombre in ("Compartido", "Shard"):
+            caso = models.Caso(
+                Nombre_del_Caso=nombre, Año=2024, ID_Grupo=grupo.ID_Grupo
+            )
+            db.add(caso)
+            db.flush()
+            archivo = models.ArchivoExcel(
+                ID_Caso=caso.ID_Caso,
+                Nombre_del_Archivo=f"{nombre}.xlsx",
+                Tipo_de_Archivo="LPR",
+            )
+            db.add(archivo)
+            db.flush()
+            ids.append((caso.ID_Caso, archivo.ID_Archivo))
+        db.commit()
+
+        create_shard(ids[1][0])
+        for caso_id, archivo_id in ids:
+            attach(db, caso_id)
+            add_lecturas(db, caso_id, _lecturas(archivo_id))
+            db.commit()
+    yield fabrica, escritor, lector, ids
+    escritor.dispose()
+    lector.dispose()
+
+
+def _lecturas(archivo_id, n=3):
+    return [
+        models.Lectura(
+            ID_Archivo=archivo_id,
+            Matricula="1234ABC",
+            Fecha_y_Hora=datetime.datetime(2024, 1, 1, i),
+            ID_Lector="L1",
+            Tipo_Fuente="LPR",
+        )
+        for i in range(n)
+    ]
+
+
+def _adjuntos(engine):
+    """Esquemas adjuntos a la conexión del pool"""
+    with engine.connect() as conn:
+        nombres = {fila[1] for fila in conn.execute(text("PRAGMA database_list"))}
+    return nombres - {"main", "temp"}
+
+
+class TestCaseShards:
+    """Tests para case_shards"""
+
+    def test_lecturas_en_el_shard(self, casos):
+        fabrica, _, _, [(compartido, _), (caso_shard, _)] = casos
+        assert not is_sharded(compartido)
+        assert os.path.exists(shard_path(caso_shard))
+        with fabrica() as db:
+            # La tabla compartida sólo tiene las lecturas del otro caso
+            assert db.scalar(select(func.count(models.Lectura.ID_Lectura))) == 3
+            Lectura = lectura_entity(caso_shard)
+            ids = db.scalars(select(Lectura.ID_Lectura)).all()
+        # IDs que no se repiten con los de otros shards ni la tabla compartida
+        assert len(ids) == 3
+        assert min(ids) > caso_shard << 32
+
+    def test_consulta_del_caso(self, casos):
+        """Las lecturas del shard son objetos Lectura con sus relaciones"""
+        fabrica, _, lector, [_, (caso_shard, archivo_id)] = casos
+        with fabrica() as db:
+            Lectura = lectura_entity(caso_shard)
+            lecturas = (
+                db.query(Lectura)
+                .join(
+                    models.ArchivoExcel,
+                    Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+                )
+                .filter(models.ArchivoExcel.ID_Caso == caso_shard)
+                .filter(Lectura.Fecha_y_Hora >= datetime.datetime(2024, 1, 1, 1))
+                .all()
+            )
+            assert len(lecturas) == 2
+            assert all(isinstance(l, models.Lectura) for l in lecturas)
+            assert lecturas[0].lector.Carretera == "A-1"
+            assert lecturas[0].archivo.ID_Archivo == archivo_id
+        assert f"caso_{caso_shard}" in _adjuntos(lector)
+
+    def test_multicaso(self, casos):
+        """La búsqueda multicaso une la tabla compartida y los shards"""
+        fabrica, _, _, [(compartido, _), (caso_shard, _)] = casos
+        with fabrica() as db:
+            vehiculos = buscar_vehiculos_multicaso(
+                casos=[compartido, caso_shard],
+                matricula="1234*",
+                matriculas=None,
+                db=db,
+                current_user=None,
+            )
+        assert [v["matricula"] for v in vehiculos] == ["1234ABC"]
+        por_caso = {c["id"]: c for c in vehiculos[0]["casos"]}
+        assert set(por_caso) == {compartido, caso_shard}
+        assert por_caso[caso_shard]["nombre"] == "Shard (2024)"
+        assert len(por_caso[caso_shard]["lecturas"]) == 3
+        assert por_caso[caso_shard]["lecturas"][0]["Carretera"] == "A-1"
+
+    def test_maximo_adjuntos(self, casos, monkeypatch):
+        """Se sueltan los shards menos usados al pasar de MAX_ATTACHED"""
+        fabrica, _, lector, [_, (caso_shard, _)] = casos
+        monkeypatch.setattr(case_shards, "MAX_ATTACHED", 1)
+        otro = caso_shard + 1
+        create_shard(otro)
+        with fabrica() as db:
+            for caso_id in (caso_shard, otro):
+                Lectura = lectura_entity(caso_id)
+                db.scalar(select(func.count(Lectura.ID_Lectura)))
+        assert _adjuntos(lector) == {f"caso_{otro}"}
+
+    def test_shard_recreado(self, casos):
+        """Una conexión con el shard adjunto ve el archivo nuevo, no el borrado"""
+        fabrica, _, _, [_, (caso_shard, _)] = casos
+        Lectura = lectura_entity(caso_shard)
+        contar = select(func.count(Lectura.ID_Lectura))
+        with fabrica() as db:
+            assert db.scalar(contar) == 3
+        assert drop_shard(caso_shard)
+        create_shard(caso_shard)
+        with fabrica() as db:
+            assert db.scalar(contar) == 0
+
+    def test_ensure_shard(self, casos, monkeypatch):
+        """Sólo se crea shard para los casos sin lecturas compartidas"""
+        fabrica, _, _, [(compartido, _), _] = casos
+        monkeypatch.setattr(case_shards, "CASE_SHARDS", True)
+        with fabrica() as db:
+            assert not ensure_shard(db, compartido)
+            assert ensure_shard(db, compartido + 10)
+        assert is_sharded(compartido + 10)
+
+    def test_borrar_caso(self, casos):
+        """Borrar un caso con shard borra su archivo"""
+        fabrica, _, _, [(compartido, _), (caso_shard, _)] = casos
+        task_id = f"delete-test-{uuid.uuid4().hex}"
+        resumen = run_delete_caso(task_id, caso_shard, session_factory=fabrica)
+        assert resumen["lecturas"] == 3
+        assert not os.path.exists(shard_path(caso_shard))
+        with fabrica() as db:
+            assert db.get(models.Caso, caso_shard) is None
+            assert db.get(models.Caso, compartido) is not None
+            assert db.scalar(select(func.count(models.Lectura.ID_Lectura))) == 3
+        assert task_statuses.pop(task_id)["status"] == "completed"
+
+    def test_consultas_del_caso(self, casos):
+        """Las fechas, las matrículas GPS y los totales incluyen el shard"""
+        fabrica, _, _, [_, (caso_shard, archivo_id)] = casos
+        with fabrica() as db:
+            attach(db, caso_shard)
+            add_lecturas(
+                db,
+                caso_shard,
+                [
+                    models.Lectura(
+                        ID_Archivo=archivo_id,
+                        Matricula="5678DEF",
+                        Fecha_y_Hora=datetime.datetime(2024, 1, 5),
+                        Tipo_Fuente="GPS",
+                    )
+                ],
+            )
+            db.commit()
+        with fabrica() as db:
+            assert _fechas_caso.__wrapped__(caso_shard, db) == {
+                "fecha_inicio": "2024-01-01",
+                "fecha_fin": "2024-01-05",
+            }
+            assert _matriculas_gps_caso.__wrapped__(caso_shard, db) == ["5678DEF"]
+            estadisticas = get_global_statistics.__wrapped__(db)
+        assert estadisticas.total_casos == 2
+        assert estadisticas.total_lecturas == 7
+
+    def test_version_matricula(self, casos):
+        """Editar un vehículo invalida también los casos con shard"""
+        fabrica, _, _, [(compartido, _), (caso_shard, _)] = casos
+        with fabrica() as db:
+            # Dentro de una transacción de escritura, como al editar el vehículo
+            db.add(models.Vehiculo(Matricula="1234ABC"))
+            db.flush()
+            versiones = incrementar_version_matricula(db, "1234ABC")
+            db.commit()
+        assert set(versiones) == {compartido, caso_shard}
+
+    def test_busqueda_de_lecturas(self, casos):
+        """GET /lecturas y /lecturas/por_filtros leen también los shards"""
+        fabrica, _, _, [(compartido, _), (caso_shard, _)] = casos
+        with fabrica() as db:
+            lecturas = _read_lecturas(db, caso_ids=[compartido, caso_shard])
+            assert len(lecturas) == 6
+            assert [l.Fecha_y_Hora.hour for l in lecturas] == [2, 2, 1, 1, 0, 0]
+            assert lecturas[0].lector.Carretera == "A-1"
+            # Sin filtro de caso: la tabla compartida y todos los shards
+            assert len(_read_lecturas(db)) == 6
+            pagina = _read_lecturas(db, skip=1, limit=2)
+            assert [l.Fecha_y_Hora.hour for l in pagina] == [2, 1]
+            solo_shard = _read_lecturas(db, caso_ids=[caso_shard])
+            assert {l.ID_Lectura >> 32 for l in solo_shard} == {caso_shard}
+            # Los pasos de una matrícula se suman entre las fuentes
+            assert len(_read_lecturas(db, min_pasos=6)) == 6
+            assert _read_lecturas(db, caso_ids=[caso_shard], min_pasos=4) == []
+            por_filtros = read_lecturas_por_filtros(
+                **{**_FILTROS_LECTURAS, "caso_ids": [compartido, caso_shard]},
+                matricula="1234*",
+                matriculas=None,
+                db=db,
+                current_user=None,
+            )
+        assert len(por_filtros) == 6
+
+    def test_lecturas_por_vehiculo(self, casos):
+        """Las lecturas de un vehículo incluyen las de los casos con shard"""
+        fabrica, _, _, [(compartido, _), (caso_shard, _)] = casos
+        with fabrica() as db:
+            vehiculo = models.Vehiculo(Matricula="1234ABC")
+            db.add(vehiculo)
+            db.commit()
+            superadmin = SimpleNamespace(Rol="superadmin", ID_Grupo=None)
+            grupo = db.get(models.Caso, caso_shard).ID_Grupo
+            usuario = SimpleNamespace(Rol="admingrupo", ID_Grupo=grupo)
+            assert (
+                len(
+                    get_lecturas_por_vehiculo(
+                        vehiculo.ID_Vehiculo, None, db, superadmin
+                    )
+                )
+                == 6
+            )
+            del_shard = get_lecturas_por_vehiculo(
+                vehiculo.ID_Vehiculo, caso_shard, db, usuario
+            )
+            assert len(del_shard) == 3
+            assert (
+                len(get_lecturas_por_vehiculo(vehiculo.ID_Vehiculo, None, db, usuario))
+                == 6
+            )
+
+    def test_lectores_y_lanzaderas(self, casos):
+        """Los lectores y el análisis de lanzaderas de un caso con shard"""
+        fabrica, _, _, [_, (caso_shard, archivo_id)] = casos
+        with fabrica() as db:
+            assert [l.ID_Lector for l in get_lectores_por_caso(caso_shard, db)] == [
+                "L1"
+            ]
+            attach(db, caso_shard)
+            add_lecturas(
+                db,
+                caso_shard,
+                [
+                    models.Lectura(
+                        ID_Archivo=archivo_id,
+                        Matricula=matricula,
+                        Fecha_y_Hora=fecha,
+                        ID_Lector="L1",
+                        Tipo_Fuente="LPR",
+                    )
+                    for matricula, fecha in (
+                        ("9999ZZZ", datetime.datetime(2024, 1, 1, 0, 5)),
+                        ("1234ABC", datetime.datetime(2024, 1, 2, 10)),
+                        ("9999ZZZ", datetime.datetime(2024, 1, 2, 10, 3)),
+                    )
+                ],
+            )
+            db.commit()
+            resultado = _detectar_lanzaderas.__wrapped__(
+                caso_shard, schemas.LanzaderaRequest(matricula="1234ABC"), db
+            )
+        assert resultado.vehiculos_lanzadera == ["9999ZZZ"]
+
+    def test_marcas_de_relevancia(self, casos):
+        """Las lecturas de un shard se pueden marcar, filtrar y desmarcar"""
+        fabrica, _, _, [(compartido, _), (caso_shard, _)] = casos
+        superadmin = SimpleNamespace(User="admin", Rol="superadmin", ID_Grupo=None)
+        with fabrica() as db:
+            Lectura = lectura_entity(caso_shard)
+            id_lectura = db.scalar(select(func.min(Lectura.ID_Lectura)))
+            marca = marcar_lectura_relevante(id_lectura, None, db, superadmin)
+            assert marca.ID_Lectura == id_lectura
+        with fabrica() as db:
+            relevantes = _read_lecturas(
+                db, caso_ids=[compartido, caso_shard], solo_relevantes=True
+            )
+            assert [l.ID_Lectura for l in relevantes] == [id_lectura]
+            del_caso = get_lecturas_relevantes_por_caso(caso_shard, db)
+            assert [l.ID_Lectura for l in del_caso] == [id_lectura]
+            assert del_caso[0].relevancia.ID_Lectura == id_lectura
+            desmarcar_lectura_relevante(id_lectura, db, superadmin)
+            assert _read_lecturas(db, solo_relevantes=True) == []
+
+    def test_borrar_caso_con_marcas(self, casos):
+        """Borrar un caso con shard borra también sus marcas de relevancia"""
+        fabrica, _, _, [_, (caso_shard, _)] = casos
+        with fabrica() as db:
+            Lectura = lectura_entity(caso_shard)
+            id_lectura = db.scalar(select(func.min(Lectura.ID_Lectura)))
+            db.add(models.LecturaRelevante(ID_Lectura=id_lectura))
+            db.commit()
+        task_id = f"delete-test-{uuid.uuid4().hex}"
+        run_delete_caso(task_id, caso_shard, session_factory=fabrica)
+        task_statuses.pop(task_id)
+        with fabrica() as db:
+            assert (
+                db.scalar(select(func.count(models.LecturaRelevante.ID_Relevante))) == 0
+            )
+
+    def test_cruce_datos_externos(self, casos):
+        """El cruce con datos externos encuentra las lecturas del shard"""
+        fabrica, _, _, [_, (caso_shard, _)] = casos
+        with fabrica() as db:
+            db.add(
+                models.ExternalData(
+                    caso_id=caso_shard,
+                    matricula="1234ABC",
+                    source_name="Fuente",
+                    data_json={"marca": "Seat"},
+                )
+            )
+            db.commit()
+            cruce = _query_cross_with_lpr(
+                schemas.ExternalDataSearchFilters(caso_id=caso_shard), db
+            )
+        assert [c.matricula for c in cruce] == ["1234ABC"]
+        assert cruce[0].lectura_id >> 32 == caso_shard
+
+
+# Filtros de lista sin valor: llamadas directas, sin los Query() de FastAPI
+_FILTROS_LECTURAS = dict(
+    fecha_inicio=None,
+    fecha_fin=None,
+    hora_inicio=None,
+    hora_fin=None,
+    lector_ids=None,
+    caso_ids=None,
+    carretera_ids=None,
+    sentido=None,
+    tipo_fuente=None,
+    solo_relevantes=False,
+    min_pasos=None,
+    max_pasos=None,
+    organismos=None,
+    provincias=None,
+)
+
+
+def _read_lecturas(db, skip=0, limit=500000, **filtros):
+    return read_lecturas(
+        skip=skip,
+        limit=limit,
+        **{**_FILTROS_LECTURAS, "matricula": None, **filtros},
+        db=db,
+    )
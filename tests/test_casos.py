@@ -152,13 +152,12 @@ class TestCasos:
             f"/casos/{test_caso.ID_Caso}", headers=auth_headers_superadmin
         )
 
-        assert response.status_code == status.HTTP_204_NO_CONTENT
+        assert response.status_code == status.HTTP_202_ACCEPTED
 
-        # Verificar que el caso fue eliminado
-        get_response = client.get(
-            f"/casos/{test_caso.ID_Caso}", headers=auth_headers_superadmin
+        # El borrado se ejecuta en la cola de trabajos
+        assert response.json()["task_id"].startswith(
+            f"delete-caso-{test_caso.ID_Caso}-"
         )
-        assert get_response.status_code == status.HTTP_404_NOT_FOUND
 
     def test_delete_caso_admingrupo_own_group(
         self, client, auth_headers_admingrupo, test_caso
@@ -168,7 +167,7 @@ class TestCasos:
             f"/casos/{test_caso.ID_Caso}", headers=auth_headers_admingrupo
         )
 
-        assert response.status_code == status.HTTP_204_NO_CONTENT
+        assert response.status_code == status.HTTP_202_ACCEPTED
 
     def test_delete_caso_not_found(self, client, auth_headers_superadmin):
         """Test de eliminación de caso inexistente"""
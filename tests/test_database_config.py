@@ -0,0 +1,84 @@
+"""
+Tests para el reparto de conexiones entre el escritor y los lectores
+"""
+
+import pytest
+from sqlalchemy import create_engine, event, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+import models
+from database_config import Base, RoutingSession, set_sqlite_read_pragma
+
+
+@pytest.fixture
+def sesiones(tmp_path):
+    """Fábrica de sesiones con escritor y lectores sobre un archivo temporal"""
+    ruta = tmp_path / "atrio.db"
+    escritor = create_engine(f"sqlite:///{ruta}", pool_size=1, max_overflow=0)
+    event.listen(
+        escritor,
+        "connect",
+        lambda conn, _: conn.execute("PRAGMA journal_mode=WAL"),
+    )
+    Base.metadata.create_all(bind=escritor)
+    lector = create_engine(f"sqlite:///file:{ruta}?mode=ro&uri=true")
+    event.listen(lector, "connect", set_sqlite_read_pragma)
+    fabrica = sessionmaker(
+        class_=RoutingSession, bind=escritor, read_bind=lector, autoflush=False
+    )
+    yield fabrica, escritor, lector
+    escritor.dispose()
+    lector.dispose()
+
+
+def _sentencias(engine):
+    """Registra las sentencias que llegan al engine"""
+    sentencias = []
+    event.listen(
+        engine,
+        "before_cursor_execute",
+        lambda conn, cursor, sql, *args: sentencias.append(sql),
+    )
+    return sentencias
+
+
+class TestRoutingSession:
+    """Tests para RoutingSession"""
+
+    def test_lecturas_al_lector(self, sesiones):
+        fabrica, escritor, lector = sesiones
+        en_escritor, en_lector = _sentencias(escritor), _sentencias(lector)
+        with fabrica() as db:
+            db.execute(select(models.Grupo)).all()
+            db.execute(text("SELECT 1")).scalar()
+        assert len(en_lector) == 2
+        assert en_escritor == []
+
+    def test_escrituras_al_escritor(self, sesiones):
+        """Tras escribir, la transacción lee del escritor y ve sus cambios"""
+        fabrica, escritor, lector = sesiones
+        en_lector = _sentencias(lector)
+        with fabrica() as db:
+            db.add(models.Grupo(Nombre="Grupo"))
+            db.flush()
+            assert db.scalar(select(models.Grupo.Nombre)) == "Grupo"
+            assert en_lector == []
+            db.commit()
+            # Terminada la transacción se vuelve a leer de los lectores
+            assert db.scalar(select(models.Grupo.Nombre)) == "Grupo"
+        assert len(en_lector) == 1
+
+    def test_lector_de_solo_lectura(self, sesiones):
+        _, _, lector = sesiones
+        with lector.connect() as conn:
+            with pytest.raises(OperationalError):
+                conn.execute(text("DELETE FROM Grupos"))
+
+    def test_sin_lectores(self, sesiones):
+        """Sin read_bind se comporta como una sesión normal"""
+        _, escritor, _ = sesiones
+        en_escritor = _sentencias(escritor)
+        with sessionmaker(class_=RoutingSession, bind=escritor)() as db:
+            db.execute(text("SELECT 1"))
+        assert en_escritor == ["SELECT 1"]
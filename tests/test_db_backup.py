@@ -0,0 +1,314 @@
+"""
+Tests para los backups y la restauración en caliente
+"""
+
+import os
+import sqlite3
+import threading
+import uuid
+
+import pytest
+
+import case_shards
+import db_backup
+from job_queue import JobCancelled
+from shared_state import task_statuses
+
+
+@pytest.fixture
+def base(tmp_path, monkeypatch):
+    """Base de datos WAL con 2000 filas y un directorio de backups vacío"""
+    ruta = str(tmp_path / "atrio.db")
+    monkeypatch.setattr(db_backup, "DATABASE_PATH", ruta)
+    monkeypatch.setattr(db_backup, "BACKUP_DIR", str(tmp_path / "backups"))
+    monkeypatch.setattr(db_backup, "BACKUP_PAGES", 10)
+    monkeypatch.setattr(db_backup, "BACKUP_SLEEP", 0)
+    conexion = sqlite3.connect(ruta)
+    conexion.execute("PRAGMA journal_mode=WAL")
+    conexion.execute("CREATE TABLE t (x TEXT)")
+    conexion.executemany("INSERT INTO t VALUES (?)", [("x" * 500,)] * 2000)
+    conexion.commit()
+    conexion.close()
+    return ruta
+
+
+@pytest.fixture
+def shards(base, tmp_path, monkeypatch):
+    """Dos casos con shard (5 y 6) junto a la base de datos"""
+    monkeypatch.setattr(case_shards, "SHARDS_DIR", str(tmp_path / "casos"))
+    for caso_id in (5, 6):
+        case_shards.create_shard(caso_id)
+        _insertar_lecturas(caso_id, 100)
+    return [5, 6]
+
+
+def _insertar_lecturas(caso_id, n):
+    conexion = sqlite3.connect(case_shards.shard_path(caso_id))
+    conexion.executemany(
+        "INSERT INTO lectura (ID_Archivo, Matricula, Fecha_y_Hora, Tipo_Fuente)"
+        " VALUES (?, ?, ?, 'LPR')",
+        [(1, f"{i:04d}ABC", "2024-01-01 00:00:00") for i in range(n)],
+    )
+    conexion.commit()
+    conexion.close()
+
+
+def _lecturas(caso_id):
+    conexion = sqlite3.connect(case_shards.shard_path(caso_id))
+    try:
+        return conexion.execute("SELECT count(*) FROM lectura").fetchone()[0]
+    finally:
+        conexion.close()
+
+
+def _filas(ruta):
+    conexion = sqlite3.connect(ruta)
+    try:
+        return conexion.execute("SELECT count(*) FROM t").fetchone()[0]
+    finally:
+        conexion.close()
+
+
+def _tarea(stage):
+    return db_backup.new_backup_task(stage, f"test-{uuid.uuid4().hex}")
+
+
+class TestBackup:
+    """Tests para backup_database, restore_database y sus trabajos"""
+
+    def test_backup_con_escrituras(self, base, tmp_path):
+        """La copia es la instantánea del inicio aunque se escriba durante ella"""
+        escritor = sqlite3.connect(base, timeout=5)
+        pasos = []
+
+        def escribir(copiadas, total):
+            # Cada paso de la copia deja escribir a otra conexión
+            escritor.execute("INSERT INTO t VALUES ('y')")
+            escritor.commit()
+            pasos.append((copiadas, total))
+
+        destino = str(tmp_path / "copia.db")
+        db_backup.backup_database(destino, on_step=escribir)
+        escritor.close()
+
+        assert len(pasos) > 1
+        assert pasos[-1][0] == pasos[-1][1]
+        assert _filas(destino) == 2000
+        assert _filas(base) == 2000 + len(pasos)
+        # Un único archivo, sin parciales ni -wal/-shm
+        assert sorted(p.name for p in tmp_path.iterdir() if "copia" in p.name) == [
+            "copia.db"
+        ]
+
+    def test_cancelar_backup(self, base):
+        """Cancelado entre pasos, no queda ni el backup ni el archivo parcial"""
+        task_id = _tarea(db_backup.BACKUP_STAGE)
+        task_statuses[task_id]["cancel_requested"] = True
+        with pytest.raises(JobCancelled):
+            db_backup.run_backup(task_id, "atrio_backup_20240101_000000.db", "none")
+        assert os.listdir(db_backup.BACKUP_DIR) == []
+        task_statuses.pop(task_id)
+
+    def test_run_backup_y_lista(self, base):
+        task_id = _tarea(db_backup.BACKUP_STAGE)
+        resumen = db_backup.run_backup(
+            task_id, "atrio_backup_20240101_000000.db", "none"
+        )
+        # Los archivos a medio escribir no son backups
+        open(os.path.join(db_backup.BACKUP_DIR, "x.db.1234.part"), "w").close()
+
+        estado = task_statuses.pop(task_id)
+        assert estado["status"] == "completed"
+        assert estado["progress"] == 100
+        assert _filas(resumen["backup_path"]) == 2000
+        backups = db_backup.list_backups()
+        assert [b["filename"] for b in backups] == ["atrio_backup_20240101_000000.db"]
+        assert backups[0]["timestamp"] == "20240101_000000"
+        assert not backups[0]["compressed"]
+
+    def test_restaurar(self, base, tmp_path):
+        """La restauración sustituye los datos y guarda antes el estado actual"""
+        copia = str(tmp_path / "copia.db")
+        db_backup.backup_database(copia)
+        conexion = sqlite3.connect(base)
+        conexion.execute("DELETE FROM t")
+        conexion.commit()
+        # Una conexión abierta durante la restauración ve los datos nuevos
+        assert conexion.execute("SELECT count(*) FROM t").fetchone()[0] == 0
+
+        task_id = _tarea(db_backup.RESTORE_STAGE)
+        resumen = db_backup.run_restore(task_id, copia)
+        assert conexion.execute("SELECT count(*) FROM t").fetchone()[0] == 2000
+        conexion.close()
+        assert not os.path.exists(f"{copia}-wal")
+        # La base restaurada sigue en modo WAL aunque el backup no lo esté
+        conexion = sqlite3.connect(base)
+        assert conexion.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        conexion.close()
+        assert _filas(resumen["pre_restore_backup"]) == 0
+        os.remove(resumen["pre_restore_backup"])
+        assert task_statuses.pop(task_id)["status"] == "completed"
+
+    def test_restaurar_sube_las_versiones(self, base, tmp_path):
+        """Tras restaurar, las versiones de datos superan a las anteriores"""
+        conexion = sqlite3.connect(base)
+        conexion.execute('CREATE TABLE "Casos" ("ID_Caso", "Version_Datos")')
+        conexion.executemany('INSERT INTO "Casos" VALUES (?, ?)', [(1, 5), (2, 0)])
+        conexion.commit()
+        copia = str(tmp_path / "copia.db")
+        db_backup.backup_database(copia)
+        conexion.execute('UPDATE "Casos" SET "Version_Datos" = 9 WHERE "ID_Caso" = 1')
+        conexion.commit()
+        conexion.close()
+
+        db_backup.restore_database(copia)
+        conexion = sqlite3.connect(base)
+        versiones = dict(conexion.execute('SELECT * FROM "Casos"').fetchall())
+        conexion.close()
+        assert versiones == {1: 15, 2: 10}
+
+    def test_restaurar_archivo_invalido(self, base, tmp_path):
+        """Un archivo que no es SQLite no toca la base de datos"""
+        invalido = tmp_path / "invalido.db"
+        invalido.write_bytes(b"no es una base de datos" * 100)
+        with pytest.raises(ValueError):
+            db_backup.restore_database(str(invalido))
+        assert _filas(base) == 2000
+
+    def test_cancelar_restauracion(self, base, tmp_path):
+        """Cancelada a mitad, la restauración no deja cambios"""
+        copia = str(tmp_path / "copia.db")
+        db_backup.backup_database(copia)
+        conexion = sqlite3.connect(base)
+        conexion.execute("DELETE FROM t")
+        conexion.commit()
+        conexion.close()
+
+        def cancelar(copiadas, total):
+            if copiadas < total:
+                raise JobCancelled("test")
+
+        with pytest.raises(JobCancelled):
+            db_backup.restore_database(copia, on_step=cancelar)
+        assert _filas(base) == 0
+
+    def test_lectores_durante_restauracion(self, base, tmp_path):
+        """Los lectores ven los datos anteriores hasta que termina la restauración"""
+        copia = str(tmp_path / "copia.db")
+        db_backup.backup_database(copia)
+        conexion = sqlite3.connect(base)
+        conexion.execute("INSERT INTO t VALUES ('z')")
+        conexion.commit()
+        lecturas = []
+
+        def leer(copiadas, total):
+            if copiadas < total:
+                hilo = threading.Thread(target=lambda: lecturas.append(_filas(base)))
+                hilo.start()
+                hilo.join()
+
+        db_backup.restore_database(copia, on_step=leer)
+        conexion.close()
+        assert lecturas and set(lecturas) == {2001}
+        assert _filas(base) == 2000
+
+    def test_zstd(self, base, tmp_path):
+        pytest.importorskip("zstandard")
+        destino = str(tmp_path / "backups" / "atrio_backup_20240101_000000.db.zst")
+        db_backup.backup_database(destino, db_backup.COMPRESSION_ZSTD)
+        assert db_backup.file_kind(destino) == "zstd"
+        assert db_backup.list_backups()[0]["compressed"]
+
+        conexion = sqlite3.connect(base)
+        conexion.execute("DELETE FROM t")
+        conexion.commit()
+        conexion.close()
+        db_backup.restore_database(destino)
+        assert _filas(base) == 2000
+
+    def test_zstd_no_disponible(self, base, tmp_path, monkeypatch):
+        monkeypatch.setattr(db_backup, "zstandard", None)
+        assert not db_backup.compression_available(db_backup.COMPRESSION_ZSTD)
+        with pytest.raises(ValueError):
+            db_backup.backup_database(
+                str(tmp_path / "copia.db.zst"), db_backup.COMPRESSION_ZSTD
+            )
+
+
+class TestBackupConShards:
+    def test_nombre_del_backup(self, shards):
+        """Con shards, el backup es un conjunto .tar"""
+        assert db_backup.backup_filename(db_backup.COMPRESSION_NONE).endswith(".tar")
+        assert db_backup.backup_suffix(db_backup.COMPRESSION_ZSTD) == ".tar.zst"
+
+    def test_backup_db_con_shards(self, shards, tmp_path):
+        """Un backup .db dejaría fuera los shards: se rechaza"""
+        with pytest.raises(ValueError):
+            db_backup.backup_database(str(tmp_path / "copia.db"))
+        assert not os.path.exists(tmp_path / "copia.db")
+
+    def test_backup_y_restauracion(self, shards, tmp_path):
+        """El conjunto guarda base y shards y la restauración los repone juntos"""
+        copia = str(tmp_path / "backups" / "atrio_backup_20240101_000000.tar")
+        db_backup.backup_database(copia)
+        assert db_backup.file_kind(copia) == "tar"
+        assert [b["filename"] for b in db_backup.list_backups()] == [
+            "atrio_backup_20240101_000000.tar"
+        ]
+
+        conexion = sqlite3.connect(db_backup.DATABASE_PATH)
+        conexion.execute("DELETE FROM t")
+        conexion.commit()
+        conexion.close()
+        _insertar_lecturas(5, 50)
+        case_shards.drop_shard(6)
+        case_shards.create_shard(7)
+
+        task_id = _tarea(db_backup.RESTORE_STAGE)
+        resumen = db_backup.run_restore(task_id, copia)
+        assert task_statuses.pop(task_id)["status"] == "completed"
+        assert _filas(db_backup.DATABASE_PATH) == 2000
+        # Quedan exactamente los shards del backup, con sus lecturas
+        assert case_shards.sharded_casos() == [5, 6]
+        assert _lecturas(5) == 100
+        assert _lecturas(6) == 100
+        conexion = sqlite3.connect(case_shards.shard_path(5))
+        assert conexion.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        conexion.close()
+        # El estado previo también se guardó como conjunto
+        assert resumen["pre_restore_backup"].endswith(".tar")
+        assert db_backup.file_kind(resumen["pre_restore_backup"]) == "tar"
+
+    def test_restaurar_db_sin_shards(self, base, tmp_path, monkeypatch):
+        """Un backup de antes de los shards deja la base sin shards"""
+        copia = str(tmp_path / "copia.db")
+        db_backup.backup_database(copia)
+        monkeypatch.setattr(case_shards, "SHARDS_DIR", str(tmp_path / "casos"))
+        case_shards.create_shard(5)
+
+        db_backup.restore_database(copia)
+        assert case_shards.sharded_casos() == []
+
+    def test_conjunto_con_miembros_extranos(self, shards, tmp_path):
+        """Un .tar con otros archivos no se restaura"""
+        import tarfile
+
+        intruso = tmp_path / "intruso.db"
+        intruso.write_bytes(b"x")
+        copia = str(tmp_path / "copia.tar")
+        with tarfile.open(copia, "w") as tar:
+            tar.add(db_backup.DATABASE_PATH, arcname=db_backup.SET_DATABASE)
+            tar.add(str(intruso), arcname="../intruso.db")
+        with pytest.raises(ValueError):
+            db_backup.restore_database(copia)
+        assert _filas(db_backup.DATABASE_PATH) == 2000
+        assert _lecturas(5) == 100
+
+    def test_zstd(self, shards, tmp_path):
+        pytest.importorskip("zstandard")
+        copia = str(tmp_path / "backups" / "atrio_backup_20240101_000000.tar.zst")
+        db_backup.backup_database(copia, db_backup.COMPRESSION_ZSTD)
+        assert db_backup.file_kind(copia) == "zstd"
+        case_shards.drop_shard(5)
+        db_backup.restore_database(copia)
+        assert _lecturas(5) == 100
@@ -0,0 +1,97 @@
+"""
+Tests para el análisis GPS de ATRiO
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backend.routers.gps_analysis import (
+    agrupar_puntos,
+    detectar_zonas_frecuentes,
+    encontrar_lugares_frecuentes,
+    analizar_actividad_horaria,
+    analizar_actividad_semanal,
+    haversine_m,
+    preparar_traza,
+)
+
+
+def _traza_sintetica(n=3000, seed=0):
+    """Traza con tres zonas de parada separadas varios kilómetros"""
+    rng = np.random.default_rng(seed)
+    centros = np.array([[40.40, -3.70], [40.45, -3.65], [40.50, -3.60]])
+    idx = rng.integers(0, len(centros), n)
+    return pd.DataFrame(
+        {
+            "Fecha_y_Hora": pd.date_range("2024-01-01", periods=n, freq="7min"),
+            "Coordenada_Y": centros[idx, 0] + rng.normal(0, 0.0001, n),
+            "Coordenada_X": centros[idx, 1] + rng.normal(0, 0.0001, n),
+            "Velocidad": rng.uniform(0, 4, n),
+        }
+    )
+
+
+class TestClusteringGps:
+    """Tests para el clustering métrico de puntos GPS"""
+
+    def test_haversine_m(self):
+        """Un grado de latitud mide ~111 km"""
+        d = haversine_m(
+            np.array([40.0]), np.array([-3.0]), np.array([41.0]), np.array([-3.0])
+        )
+        assert d[0] == pytest.approx(111195, rel=1e-3)
+
+    def test_agrupar_puntos_separa_por_distancia_metrica(self):
+        """Puntos a 30 m se agrupan, puntos a 1 km no"""
+        lat = np.array([40.0, 40.0, 40.009, 40.009])
+        lon = np.array([-3.0, -3.00035, -3.0, -3.00035])
+        etiquetas = agrupar_puntos(lat, lon, eps_m=55, min_samples=2)
+        assert etiquetas[0] == etiquetas[1] >= 0
+        assert etiquetas[2] == etiquetas[3] >= 0
+        assert etiquetas[0] != etiquetas[2]
+
+    def test_lugares_frecuentes(self):
+        """Detecta las tres zonas de parada de la traza"""
+        lugares = encontrar_lugares_frecuentes(preparar_traza(_traza_sintetica()))
+        assert len(lugares) == 3
+        assert sum(l["frecuencia"] for l in lugares) == 2999
+
+    def test_zonas_frecuentes_radio_en_metros(self):
+        """Las zonas detectadas tienen radio inferior a 200 m"""
+        zonas = detectar_zonas_frecuentes(preparar_traza(_traza_sintetica()))
+        assert len(zonas) == 3
+        assert all(0 < z["radio"] <= 200 for z in zonas)
+
+
+class TestPreprocesadoGps:
+    """Tests para el preprocesado común de trazas GPS"""
+
+    def test_preparar_traza_ordena_y_descarta_invalidas(self):
+        """Ordena por fecha, descarta coordenadas inválidas y calcula intervalos"""
+        df = pd.DataFrame(
+            {
+                "Fecha_y_Hora": [
+                    "2024-01-01 10:10",
+                    "2024-01-01 10:00",
+                    "2024-01-01 10:05",
+                ],
+                "Coordenada_X": [-3.7, -3.7, None],
+                "Coordenada_Y": [40.4, 40.4, 40.4],
+                "Velocidad": [None, 30.0, 10.0],
+            }
+        )
+        traza = preparar_traza(df)
+        assert len(traza) == 2
+        assert traza["Fecha_y_Hora"].is_monotonic_increasing
+        assert traza["segundos_desde_anterior"].iloc[1] == 600
+        assert traza["es_parada"].tolist() == [False, True]
+
+    def test_histogramas_horario_y_semanal(self):
+        """Los histogramas cuentan todas las lecturas"""
+        traza = preparar_traza(_traza_sintetica(n=500))
+        horaria = analizar_actividad_horaria(traza)
+        semanal = analizar_actividad_semanal(traza)
+        assert sum(h["frecuencia"] for h in horaria) == 500
+        assert [d["dia"] for d in semanal][0] == "Lunes"
+        assert sum(d["frecuencia"] for d in semanal) == 500
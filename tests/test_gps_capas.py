@@ -0,0 +1,192 @@
+"""
+Tests para las capas GPS guardadas como referencias a lecturas
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import case_shards
+import gps_capas
+import models
+from database_config import get_db
+from gps_capas import codificar_ids, decodificar_ids
+
+INICIO = datetime(2024, 1, 1, 8, 0, 0)
+
+
+@pytest.fixture
+def entorno():
+    """App con el router de capas sobre una base de datos en memoria"""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    models.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    db = Session()
+    db.add(models.Grupo(ID_Grupo=1, Nombre="G"))
+    db.add(models.Caso(ID_Caso=1, Nombre_del_Caso="C", Año=2024, ID_Grupo=1))
+    db.add(
+        models.ArchivoExcel(
+            ID_Archivo=1,
+            ID_Caso=1,
+            Nombre_del_Archivo="gps.xlsx",
+            Tipo_de_Archivo="GPS",
+        )
+    )
+    for i in range(50):
+        db.add(
+            models.Lectura(
+                ID_Lectura=i + 1,
+                ID_Archivo=1,
+                Matricula="1111AAA",
+                Fecha_y_Hora=INICIO + timedelta(minutes=i),
+                Coordenada_Y=40.4 + 0.001 * i,
+                Coordenada_X=-3.7 + 0.0005 * (i % 7),
+                Tipo_Fuente="GPS",
+            )
+        )
+    db.commit()
+    db.close()
+
+    app = FastAPI()
+    app.include_router(gps_capas.router)
+
+    def get_db_test():
+        sesion = Session()
+        try:
+            yield sesion
+        finally:
+            sesion.close()
+
+    app.dependency_overrides[get_db] = get_db_test
+    return TestClient(app), Session
+
+
+def _capa(**kwargs):
+    capa = {"nombre": "Ruta", "color": "#228be6", "activa": True, "filtros": {}}
+    capa.update(kwargs)
+    return capa
+
+
+class TestGpsCapas:
+    """Tests para el almacenamiento y la resolución de capas"""
+
+    def test_codificacion_ids_conserva_orden(self):
+        """Los IDs se recuperan en el mismo orden, incluso desordenados"""
+        ids = [10, 11, 12, 500, 3, 4, 100000]
+        assert decodificar_ids(codificar_ids(ids)) == ids
+        assert decodificar_ids(codificar_ids([])) == []
+
+    def test_capa_guardada_por_referencia(self, entorno):
+        """Las lecturas con ID se guardan como referencias y se resuelven al pedirlas"""
+        cliente, Session = entorno
+        lecturas = [{"ID_Lectura": i, "Matricula": "1111AAA"} for i in range(1, 51)]
+        respuesta = cliente.post("/casos/1/gps-capas", json=_capa(lecturas=lecturas))
+        assert respuesta.status_code == 201
+        capa = respuesta.json()
+        assert capa["num_lecturas"] == 50
+        assert capa["lecturas"] is None
+
+        db = Session()
+        db_capa = db.query(models.GpsCapa).one()
+        assert db_capa.lecturas is None
+        assert decodificar_ids(db_capa.ids_lectura) == list(range(1, 51))
+        db.close()
+
+        listado = cliente.get("/casos/1/gps-capas").json()
+        assert listado[0]["lecturas"] is None
+        assert listado[0]["num_lecturas"] == 50
+
+        puntos = cliente.get(f"/casos/1/gps-capas/{capa['id']}").json()["lecturas"]
+        assert [p["ID_Lectura"] for p in puntos] == list(range(1, 51))
+        assert puntos[0]["Coordenada_Y"] == pytest.approx(40.4)
+
+        simplificada = cliente.get(f"/casos/1/gps-capas/{capa['id']}?zoom=8").json()
+        assert 2 <= len(simplificada["lecturas"]) < 50
+
+    def test_actualizar_metadatos_conserva_puntos(self, entorno):
+        """Un PUT sin ids_lectura no toca los puntos y las lecturas borradas desaparecen"""
+        cliente, Session = entorno
+        capa = cliente.post(
+            "/casos/1/gps-capas", json=_capa(ids_lectura=[5, 6, 7, 999])
+        ).json()
+        # Las referencias que no pertenecen al caso se descartan
+        assert capa["num_lecturas"] == 3
+
+        respuesta = cliente.put(
+            f"/casos/1/gps-capas/{capa['id']}", json=_capa(activa=False)
+        )
+        assert respuesta.json()["activa"] is False
+
+        db = Session()
+        db.query(models.Lectura).filter(models.Lectura.ID_Lectura == 6).delete()
+        db.commit()
+        db.close()
+
+        puntos = cliente.get(f"/casos/1/gps-capas/{capa['id']}").json()["lecturas"]
+        assert [p["ID_Lectura"] for p in puntos] == [5, 7]
+
+    def test_puntos_sin_id_se_guardan_en_linea(self, entorno):
+        """Los puntos que no vienen de `lectura` se guardan como JSON"""
+        cliente, _ = entorno
+        lecturas = [
+            {"Matricula": "X", "Coordenada_Y": 40.0, "Coordenada_X": -3.0},
+            {"Matricula": "X", "Coordenada_Y": 40.1, "Coordenada_X": -3.0},
+        ]
+        capa = cliente.post("/casos/1/gps-capas", json=_capa(lecturas=lecturas)).json()
+        listado = cliente.get("/casos/1/gps-capas?incluir_lecturas=true").json()
+        assert listado[0]["id"] == capa["id"]
+        assert listado[0]["lecturas"] == lecturas
+
+    def test_capa_de_caso_con_shard(self, entorno, tmp_path, monkeypatch):
+        """Las referencias a lecturas de un caso con shard se guardan y resuelven"""
+        cliente, Session = entorno
+        monkeypatch.setattr(case_shards, "SHARDS_DIR", str(tmp_path / "casos"))
+        db = Session()
+        case_shards.install(db.get_bind())
+        db.add(models.Caso(ID_Caso=2, Nombre_del_Caso="S", Año=2024, ID_Grupo=1))
+        db.add(
+            models.ArchivoExcel(
+                ID_Archivo=2,
+                ID_Caso=2,
+                Nombre_del_Archivo="gps2.xlsx",
+                Tipo_de_Archivo="GPS",
+            )
+        )
+        db.commit()
+        case_shards.create_shard(2)
+        case_shards.attach(db, 2)
+        case_shards.add_lecturas(
+            db,
+            2,
+            [
+                models.Lectura(
+                    ID_Archivo=2,
+                    Matricula="2222BBB",
+                    Fecha_y_Hora=INICIO + timedelta(minutes=i),
+                    Coordenada_Y=41.0 + 0.001 * i,
+                    Coordenada_X=-3.0,
+                    Tipo_Fuente="GPS",
+                )
+                for i in range(5)
+            ],
+        )
+        db.commit()
+        Lectura = case_shards.lectura_entity(2)
+        ids = [i for (i,) in db.query(Lectura.ID_Lectura).order_by(Lectura.ID_Lectura)]
+        db.close()
+
+        capa = cliente.post("/casos/2/gps-capas", json=_capa(ids_lectura=ids)).json()
+        assert capa["num_lecturas"] == 5
+        puntos = cliente.get(f"/casos/2/gps-capas/{capa['id']}").json()["lecturas"]
+        assert [p["ID_Lectura"] for p in puntos] == ids
+        assert puntos[0]["Matricula"] == "2222BBB"
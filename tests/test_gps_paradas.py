@@ -0,0 +1,114 @@
+"""
+Tests para la detección vectorizada de inicios de parada
+"""
+
+from datetime import datetime, timedelta
+from math import asin, cos, radians, sin, sqrt
+
+import numpy as np
+
+import models
+from gps_paradas import inicios_parada, lecturas_inicio_parada
+
+INICIO = datetime(2024, 1, 1, 8, 0, 0)
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = (
+        sin(dlat / 2) ** 2
+        + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
+    )
+    return 2 * 6371000 * asin(sqrt(a))
+
+
+def _paradas_por_pares(lecturas, duracion):
+    """Recorrido por pares de lecturas consecutivas, como referencia"""
+    paradas = {}
+    for i, (l1, l2) in enumerate(zip(lecturas, lecturas[1:])):
+        if l1[0] != l2[0] or None in (l1[2], l1[3], l2[2], l2[3]):
+            continue
+        minutos = (l2[1] - l1[1]).total_seconds() / 60
+        if minutos <= 0 or minutos < duracion:
+            continue
+        if _haversine(l1[2], l1[3], l2[2], l2[3]) > 300:
+            continue
+        paradas[i] = minutos
+    return paradas
+
+
+def _lecturas_sinteticas(n=2000, seed=0):
+    """Lecturas ordenadas por matrícula y fecha, con huecos y sin coordenadas"""
+    rng = np.random.default_rng(seed)
+    lecturas = []
+    for matricula in ("1111AAA", "2222BBB", "3333CCC"):
+        fecha, lat, lon = INICIO, 40.4, -3.7
+        for _ in range(n // 3):
+            # Saltos de 0 a 40 min, a veces sin moverse del sitio
+            fecha += timedelta(seconds=int(rng.integers(0, 2400)))
+            if rng.random() < 0.5:
+                lat += rng.normal(0, 0.004)
+                lon += rng.normal(0, 0.004)
+            sin_gps = rng.random() < 0.05
+            lecturas.append(
+                (matricula, fecha, None if sin_gps else lat, None if sin_gps else lon)
+            )
+    return lecturas
+
+
+class TestInicioParada:
+    """Tests para el cálculo de paradas sobre arrays"""
+
+    def test_igual_que_por_pares(self):
+        """Mismos inicios de parada y duraciones que el recorrido por pares"""
+        lecturas = _lecturas_sinteticas()
+        matriculas, fechas, lat, lon = zip(*lecturas)
+        for duracion in (0, 5, 15, 30):
+            posiciones, minutos = inicios_parada(
+                np.array(matriculas, dtype=object),
+                np.array(fechas, dtype="datetime64[us]"),
+                np.array(lat, dtype=float),
+                np.array(lon, dtype=float),
+                duracion,
+            )
+            esperado = _paradas_por_pares(lecturas, duracion)
+            assert posiciones.tolist() == list(esperado)
+            np.testing.assert_allclose(minutos, list(esperado.values()))
+
+    def test_no_cruza_matriculas(self):
+        """La última lectura de una matrícula no empieza parada con la siguiente"""
+        posiciones, _ = inicios_parada(
+            np.array(["A", "B"], dtype=object),
+            np.array([INICIO, INICIO + timedelta(hours=1)], dtype="datetime64[us]"),
+            np.array([40.0, 40.0]),
+            np.array([-3.0, -3.0]),
+            10,
+        )
+        assert len(posiciones) == 0
+
+    def test_lecturas_desde_la_consulta(self, db_session):
+        """Sólo se devuelven completas las lecturas que inician parada"""
+        puntos = [(0, 40.0), (20, 40.0), (25, 40.1), (60, 40.1001)]
+        for i, (minuto, lat) in enumerate(puntos, start=1):
+            db_session.add(
+                models.Lectura(
+                    ID_Lectura=100 + i,
+                    ID_Archivo=1,
+                    Matricula="9999ZZZ",
+                    Fecha_y_Hora=INICIO + timedelta(minutes=minuto),
+                    Coordenada_Y=lat,
+                    Coordenada_X=-3.7,
+                    Tipo_Fuente="GPS",
+                )
+            )
+        db_session.commit()
+
+        query = db_session.query(models.Lectura).filter(
+            models.Lectura.Matricula == "9999ZZZ"
+        )
+        paradas = lecturas_inicio_parada(query, 10)
+        assert [p["ID_Lectura"] for p in paradas] == [101, 103]
+        assert [p["duracion_parada_min"] for p in paradas] == [20.0, 35.0]
+        assert paradas[0]["Fecha_y_Hora"] == INICIO
+        assert paradas[0]["Tipo_Fuente"] == "GPS"
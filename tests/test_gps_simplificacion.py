@@ -0,0 +1,110 @@
+"""
+Tests para la simplificación de trazas GPS por nivel de zoom
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from gps_simplificacion import (
+    _desviaciones,
+    _proyectar,
+    filtrar_por_nivel,
+    importancia_puntos,
+    niveles_detalle_lecturas,
+    simplificar,
+    simplificar_lecturas,
+    tolerancia_zoom,
+)
+
+INICIO = datetime(2024, 1, 1, 8, 0, 0)
+
+
+def _rdp_recursivo(x, y, tolerancia, i, j, conservar):
+    """Douglas-Peucker clásico, como referencia"""
+    if j - i < 2:
+        return
+    d = _desviaciones(x, y, None, i, j)
+    k = int(np.argmax(d))
+    if d[k] > tolerancia:
+        k += i + 1
+        conservar[k] = True
+        _rdp_recursivo(x, y, tolerancia, i, k, conservar)
+        _rdp_recursivo(x, y, tolerancia, k, j, conservar)
+
+
+class TestSimplificacionGps:
+    """Tests para el servicio de simplificación"""
+
+    def test_equivale_a_douglas_peucker(self):
+        """Umbralizar la importancia da el mismo resultado que RDP"""
+        rng = np.random.default_rng(3)
+        lat = 40.4 + np.cumsum(rng.normal(0, 0.0002, 800))
+        lon = -3.7 + np.cumsum(rng.normal(0, 0.0002, 800))
+        x, y = _proyectar(lat, lon)
+        importancia = importancia_puntos(lat, lon)
+        for tolerancia in (2.0, 15.0, 120.0):
+            esperado = np.zeros(len(lat), dtype=bool)
+            esperado[[0, -1]] = True
+            _rdp_recursivo(x, y, tolerancia, 0, len(lat) - 1, esperado)
+            assert np.array_equal(importancia > tolerancia, esperado)
+
+    def test_recta_se_reduce_a_extremos(self):
+        """Una recta recorrida a velocidad constante queda en dos puntos"""
+        lat = np.linspace(40.0, 40.1, 50)
+        lon = np.full(50, -3.0)
+        tiempos = [INICIO + timedelta(seconds=10 * i) for i in range(50)]
+        mascara = simplificar(lat, lon, tiempos, zoom=12)
+        assert mascara.sum() == 2
+        assert mascara[0] and mascara[-1]
+
+    def test_parada_sobre_la_recta_se_conserva(self):
+        """Con tiempos, una parada en mitad de la recta no se elimina"""
+        lat = np.concatenate(
+            [np.linspace(40.0, 40.05, 20), np.linspace(40.05, 40.1, 20)]
+        )
+        lon = np.full(40, -3.0)
+        # 20 lecturas de ida, una hora parado y 20 de vuelta a la marcha
+        segundos = np.concatenate([np.arange(20) * 10, 3600 + np.arange(20) * 10])
+        tiempos = [INICIO + timedelta(seconds=int(s)) for s in segundos]
+        assert simplificar(lat, lon, zoom=12).sum() == 2
+        assert simplificar(lat, lon, tiempos, zoom=12).sum() > 2
+
+    def test_mas_zoom_conserva_mas_puntos(self):
+        """El número de puntos crece con el zoom"""
+        rng = np.random.default_rng(5)
+        lat = 40.4 + np.cumsum(rng.normal(0, 0.0005, 2000))
+        lon = -3.7 + np.cumsum(rng.normal(0, 0.0005, 2000))
+        conservados = [simplificar(lat, lon, zoom=z).sum() for z in (6, 10, 14, 18)]
+        assert conservados == sorted(conservados)
+        assert conservados[0] < conservados[-1]
+        assert tolerancia_zoom(10) == 2 * tolerancia_zoom(11)
+
+    def test_niveles_precalculados_coinciden(self):
+        """Filtrar por nivel de detalle equivale a simplificar en el momento"""
+        rng = np.random.default_rng(7)
+        lecturas = []
+        for matricula in ("1111AAA", "2222BBB"):
+            lat = 40.4 + np.cumsum(rng.normal(0, 0.0005, 300))
+            lon = -3.7 + np.cumsum(rng.normal(0, 0.0005, 300))
+            for i in range(300):
+                lecturas.append(
+                    {
+                        "Matricula": matricula,
+                        "Fecha_y_Hora": (
+                            INICIO + timedelta(seconds=30 * i)
+                        ).isoformat(),
+                        "Coordenada_Y": lat[i],
+                        "Coordenada_X": lon[i],
+                    }
+                )
+        lecturas.append({"Matricula": "3333CCC", "Fecha_y_Hora": None})
+        campo = lambda d, k: d.get(k)
+
+        niveles = niveles_detalle_lecturas(lecturas, campo=campo)
+        assert len(niveles) == len(lecturas)
+        for zoom in (8, 13, 17):
+            visibles = filtrar_por_nivel(lecturas, niveles, zoom)
+            assert visibles == simplificar_lecturas(lecturas, zoom=zoom, campo=campo)
+            # Las lecturas sin posición no se descartan
+            assert visibles[-1]["Matricula"] == "3333CCC"
@@ -0,0 +1,126 @@
+"""
+Tests para la segmentación GPS en estancias y trayectos
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import models
+from backend.routers.gps_trayectos import recalcular_segmentos, segmentar_traza
+
+INICIO = datetime(2024, 1, 1, 8, 0, 0)
+
+
+def _traza_casa_trabajo_casa():
+    """Parada en casa, viaje al trabajo, parada larga y regreso"""
+    puntos = []
+    t = INICIO
+    # 30 minutos parado en casa
+    for _ in range(31):
+        puntos.append((len(puntos) + 1, t, 40.4000, -3.7000))
+        t += timedelta(minutes=1)
+    # Viaje de ~5,5 km hacia el norte
+    for paso in range(1, 11):
+        puntos.append((len(puntos) + 1, t, 40.4000 + paso * 0.005, -3.7000))
+        t += timedelta(minutes=1)
+    # 2 horas en el trabajo con lecturas cada 10 minutos
+    for _ in range(13):
+        puntos.append((len(puntos) + 1, t, 40.4500, -3.7000))
+        t += timedelta(minutes=10)
+    # Regreso
+    for paso in range(1, 11):
+        puntos.append((len(puntos) + 1, t, 40.4500 - paso * 0.005, -3.7000))
+        t += timedelta(minutes=1)
+    return puntos
+
+
+class TestSegmentacionGps:
+    """Tests para el motor de segmentación"""
+
+    def test_estancias_y_trayectos_alternos(self):
+        """Una traza casa-trabajo-casa produce E, T, E, T"""
+        segmentos = list(segmentar_traza(_traza_casa_trabajo_casa()))
+        assert [s["tipo"] for s in segmentos] == [
+            "estancia",
+            "trayecto",
+            "estancia",
+            "trayecto",
+        ]
+        casa, ida, trabajo, vuelta = segmentos
+        assert casa["duracion_segundos"] == 30 * 60
+        # La llegada es la última lectura del viaje, ya dentro del radio
+        assert trabajo["duracion_segundos"] == 121 * 60
+        assert trabajo["lat_centro"] == pytest.approx(40.45)
+        # El trayecto termina donde empieza la estancia siguiente
+        assert ida["fin"] == trabajo["inicio"]
+        assert ida["distancia_metros"] == pytest.approx(5560, rel=0.01)
+        assert ida["lat_max"] == pytest.approx(40.45)
+
+    def test_parada_con_motor_apagado(self):
+        """Un hueco sin desplazamiento cuenta como estancia"""
+        puntos = [
+            (1, INICIO, 40.0, -3.0),
+            (2, INICIO + timedelta(hours=3), 40.0001, -3.0),
+        ]
+        segmentos = list(segmentar_traza(puntos))
+        assert len(segmentos) == 1
+        assert segmentos[0]["tipo"] == "estancia"
+        assert segmentos[0]["duracion_segundos"] == 3 * 3600
+
+    def test_hueco_con_desplazamiento_corta_trayecto(self):
+        """Un hueco con desplazamiento no se une en un mismo trayecto"""
+        puntos = [
+            (1, INICIO, 40.00, -3.0),
+            (2, INICIO + timedelta(minutes=1), 40.01, -3.0),
+            (3, INICIO + timedelta(hours=2), 40.50, -3.0),
+            (4, INICIO + timedelta(hours=2, minutes=1), 40.51, -3.0),
+        ]
+        segmentos = list(segmentar_traza(puntos))
+        assert [s["tipo"] for s in segmentos] == ["trayecto", "trayecto"]
+        assert all(s["distancia_metros"] < 1500 for s in segmentos)
+
+    def test_recalcular_segmentos_persiste_por_vehiculo(self):
+        """Los segmentos se guardan por matrícula y se sustituyen al recalcular"""
+        engine = create_engine(
+            "sqlite:///:memory:",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        models.Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        db.add(models.Grupo(ID_Grupo=1, Nombre="G"))
+        db.add(models.Caso(ID_Caso=1, Nombre_del_Caso="C", Año=2024, ID_Grupo=1))
+        db.add(
+            models.ArchivoExcel(
+                ID_Archivo=1,
+                ID_Caso=1,
+                Nombre_del_Archivo="gps.xlsx",
+                Tipo_de_Archivo="GPS",
+            )
+        )
+        for matricula in ("1111AAA", "2222BBB"):
+            for _, fecha, lat, lon in _traza_casa_trabajo_casa():
+                db.add(
+                    models.Lectura(
+                        ID_Archivo=1,
+                        Matricula=matricula,
+                        Fecha_y_Hora=fecha,
+                        Coordenada_Y=lat,
+                        Coordenada_X=lon,
+                        Tipo_Fuente="GPS",
+                    )
+                )
+        db.commit()
+
+        resumen = recalcular_segmentos(db, 1)
+        assert resumen["vehiculos"] == 2
+        assert resumen["estancias"] == 4
+        assert resumen["trayectos"] == 4
+
+        recalcular_segmentos(db, 1, matriculas=["1111AAA"])
+        assert db.query(models.GpsSegmento).count() == 8
+        db.close()
@@ -0,0 +1,194 @@
+"""
+Tests para la cola de trabajos en segundo plano
+"""
+
+import asyncio
+import os
+import threading
+import time
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+import job_queue
+from cache_manager import cache_manager
+
+from job_queue import (
+    PRIORITY_HIGH,
+    PRIORITY_LOW,
+    JobCancelled,
+    JobQueue,
+    check_cancelled,
+    in_api_process,
+)
+from shared_state import task_statuses
+from task_registry import SQLiteTaskStore, TaskRegistry
+
+
+def _pid() -> int:
+    return os.getpid()
+
+
+def _no_encontrado():
+    raise HTTPException(status_code=404, detail="Caso no encontrado")
+
+
+def _borrar_del_cache(clave: str) -> int:
+    in_api_process(cache_manager.delete, clave)
+    return os.getpid()
+
+
+def _esperar(condicion, plazo=5):
+    """Espera a que se cumpla la condición, como mucho `plazo` segundos"""
+    limite = time.monotonic() + plazo
+    while not condicion():
+        assert time.monotonic() < limite, "La condición no se cumplió a tiempo"
+        time.sleep(0.01)
+
+
+def _tarea(**estado):
+    task_id = uuid.uuid4().hex
+    task_statuses[task_id] = {"status": "pending", "progress": 0, **estado}
+    return task_id
+
+
+@pytest.fixture
+def cola():
+    cola = JobQueue(workers=0, limits={"import": 1}, reserved=0)
+    yield cola
+    cola.shutdown(wait=True)
+
+
+class TestJobQueue:
+    """Tests para prioridades, límites y cancelación"""
+
+    def test_limite_por_tipo_y_prioridad(self, cola):
+        """Un tipo no supera su límite y se despacha antes lo más prioritario"""
+        liberar, liberar_bloqueo = threading.Event(), threading.Event()
+        orden = []
+
+        def trabajo(nombre):
+            orden.append(nombre)
+            liberar.wait(5)
+
+        # Los dos workers quedan ocupados
+        primera = cola.submit("import", trabajo, "import-1")
+        bloqueo = cola.submit("cross", liberar_bloqueo.wait, 5)
+        segunda = cola.submit("import", trabajo, "import-2")
+        baja = cola.submit("cross", trabajo, "baja", priority=PRIORITY_LOW)
+        alta = cola.submit("cross", trabajo, "alta", priority=PRIORITY_HIGH)
+        assert len(cola.snapshot()["pending"]) == 3
+
+        # Al quedar un worker libre entra lo más prioritario; la segunda
+        # importación espera aunque llegó antes, por el límite de su tipo
+        liberar_bloqueo.set()
+        bloqueo.result(timeout=5)
+        # Con los dos workers ocupados de nuevo no puede entrar nada más
+        _esperar(lambda: len(orden) == 2)
+        assert orden == ["import-1", "alta"]
+
+        liberar.set()
+        for future in (primera, segunda, baja, alta):
+            future.result(timeout=5)
+        assert sorted(orden[2:]) == ["baja", "import-2"]
+
+    def test_cancelar_pendiente(self, cola):
+        """Una tarea en cola se descarta y queda marcada como cancelada"""
+        liberar = threading.Event()
+        ocupadas = [cola.submit("cross", liberar.wait, 5) for _ in range(2)]
+        task_id = _tarea()
+        future = cola.submit("import", lambda: None, task_id=task_id)
+
+        assert cola.cancel(task_id)
+        assert future.cancelled()
+        assert task_statuses[task_id]["status"] == "failed"
+        assert task_statuses[task_id]["cancelled"] is True
+        liberar.set()
+        for ocupada in ocupadas:
+            ocupada.result(timeout=5)
+
+    def test_cancelar_en_curso(self, cola):
+        """Una tarea en curso se detiene en su siguiente punto de control"""
+        task_id = _tarea()
+        empezada = threading.Event()
+
+        def importar():
+            task_statuses[task_id]["status"] = "processing"
+            empezada.set()
+            for _ in range(500):
+                check_cancelled(task_id)
+                time.sleep(0.01)
+
+        future = cola.submit("import", importar, task_id=task_id)
+        assert empezada.wait(5)
+        assert cola.cancel(task_id)
+        with pytest.raises(JobCancelled):
+            future.result(timeout=5)
+        estado = task_statuses[task_id]
+        assert estado["status"] == "failed" and estado["cancelled"] is True
+        # Una tarea terminada ya no se puede cancelar
+        assert not cola.cancel(task_id)
+
+    def test_limite_entre_procesos(self, tmp_path, monkeypatch):
+        """El límite de un tipo vale para todos los procesos de la API"""
+        monkeypatch.setattr(job_queue, "CLAIM_POLL", 0.05)
+        ruta = str(tmp_path / "tareas.db")
+        # Una cola por proceso, con el registro compartido
+        colas = [
+            JobQueue(
+                workers=0,
+                limits={"import": 1},
+                reserved=0,
+                claims=TaskRegistry(SQLiteTaskStore(ruta)),
+            )
+            for _ in range(2)
+        ]
+        liberar = threading.Event()
+        try:
+            # El reparto es síncrono: al volver submit la plaza ya está tomada
+            primera = colas[0].submit("import", liberar.wait, 5)
+            assert [j["kind"] for j in colas[0].snapshot()["running"]] == ["import"]
+            segunda = colas[1].submit("import", lambda: "hecho")
+            assert [j["kind"] for j in colas[1].snapshot()["pending"]] == ["import"]
+            # Un reintento mientras la plaza sigue ocupada no la consigue
+            colas[1]._claims_tick()
+            assert [j["kind"] for j in colas[1].snapshot()["pending"]] == ["import"]
+
+            # Al terminar la primera, la otra cola toma la plaza
+            liberar.set()
+            primera.result(timeout=5)
+            assert segunda.result(timeout=5) == "hecho"
+        finally:
+            for cola in colas:
+                cola.shutdown(wait=True)
+
+
+class TestProcessPool:
+    """Tests del pool de procesos"""
+
+    def test_trabajos_en_otro_proceso(self):
+        """Los trabajos se ejecutan fuera del proceso de la API"""
+        cola = JobQueue(workers=1)
+        try:
+            pid = asyncio.run(cola.run("lanzadera", _pid, priority=PRIORITY_HIGH))
+            assert pid != os.getpid()
+
+            # Las HTTPException del worker llegan tal cual al endpoint
+            with pytest.raises(HTTPException) as error:
+                cola.submit("lanzadera", _no_encontrado).result(timeout=30)
+            assert error.value.status_code == 404
+        finally:
+            cola.shutdown(wait=True)
+
+    def test_llamadas_en_la_api(self):
+        """Lo que el trabajo pide con in_api_process llega al cache de la API"""
+        clave = f"atrio:test:{uuid.uuid4().hex}"
+        cache_manager.set(clave, {"x": 1}, 60)
+        cola = JobQueue(workers=1)
+        try:
+            pid = cola.submit("lanzadera", _borrar_del_cache, clave).result(timeout=30)
+            assert pid != os.getpid()
+            assert cache_manager.get(clave) is None
+        finally:
+            cola.shutdown(wait=True)
@@ -0,0 +1,76 @@
+"""
+Tests para la importación diferida de dependencias pesadas
+"""
+
+import sys
+import threading
+
+import pytest
+
+from lazy_imports import is_loaded, lazy_import
+from monitoring.benchmark_importtime import medir_importacion, resumen
+
+# Ejecuciones del módulo lento de test_carga_desde_varios_hilos
+EJECUCIONES: list = []
+
+
+@pytest.fixture
+def sin_modulo():
+    """Módulo de la biblioteca estándar que ningún test carga"""
+    sys.modules.pop("colorsys", None)
+    yield "colorsys"
+    sys.modules.pop("colorsys", None)
+
+
+class TestLazyImports:
+    """Tests para lazy_import y el presupuesto de arranque"""
+
+    def test_se_carga_al_usarlo(self, sin_modulo):
+        """El módulo se ejecuta con el primer acceso a un atributo"""
+        modulo = lazy_import(sin_modulo)
+        assert not is_loaded(sin_modulo)
+
+        assert modulo.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+        assert is_loaded(sin_modulo)
+        import colorsys
+
+        assert modulo.rgb_to_hsv is colorsys.rgb_to_hsv
+        assert lazy_import(sin_modulo) is colorsys
+
+    def test_carga_desde_varios_hilos(self, tmp_path, monkeypatch):
+        """Con accesos simultáneos el módulo se ejecuta una vez y completo"""
+        (tmp_path / "modulo_lento.py").write_text(
+            "import time\n"
+            "import tests.test_lazy_imports as t\n"
+            "t.EJECUCIONES.append(1)\n"
+            "time.sleep(0.2)\n"
+            "VALOR = 42\n"
+        )
+        monkeypatch.syspath_prepend(str(tmp_path))
+        monkeypatch.delitem(sys.modules, "modulo_lento", raising=False)
+        EJECUCIONES.clear()
+        modulo = lazy_import("modulo_lento")
+        barrera = threading.Barrier(8)
+        valores = []
+
+        def leer():
+            barrera.wait()
+            valores.append(modulo.VALOR)
+
+        hilos = [threading.Thread(target=leer) for _ in range(8)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        assert valores == [42] * 8
+        assert EJECUCIONES == [1]
+
+    def test_modulo_inexistente(self):
+        with pytest.raises(ModuleNotFoundError):
+            lazy_import("modulo_que_no_existe")
+
+    def test_arranque_sin_dependencias_pesadas(self):
+        """Importar la aplicación no carga pandas, scikit-learn ni openpyxl"""
+        datos = resumen(medir_importacion("main"))
+        assert datos["pesados"] == []
+        assert datos["total_ms"] > 0
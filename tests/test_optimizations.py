@@ -0,0 +1,143 @@
+"""
+Tests para las comprobaciones de arranque y el mantenimiento de la base de datos
+"""
+
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, event, text
+
+import optimizations
+from optimizations import (
+    OPTIMIZATIONS_VERSION,
+    new_maintenance_task,
+    prepare_database,
+    request_vacuum,
+    run_maintenance,
+    schema_revisions,
+)
+from shared_state import task_statuses
+from task_registry import SQLiteTaskStore, TaskRegistry
+
+
+@pytest.fixture
+def bd(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'atrio.db'}")
+    yield engine
+    engine.dispose()
+
+
+def _sentencias(engine):
+    """Registra las sentencias que se ejecutan sobre el engine"""
+    sentencias = []
+    event.listen(
+        engine,
+        "before_cursor_execute",
+        lambda conn, cursor, sql, *args: sentencias.append(sql),
+    )
+    return sentencias
+
+
+class TestArranque:
+    """Tests para el arranque rápido de la base de datos"""
+
+    def test_base_de_datos_nueva(self, bd):
+        """Una base de datos nueva se crea, se marca y se optimiza una vez"""
+        resumen = prepare_database(bd)
+        assert resumen["schema"] == "created"
+        assert resumen["optimizations"] == "applied"
+
+        actual, ultimas, _ = schema_revisions(bd)
+        assert actual == ultimas
+        with bd.connect() as conn:
+            assert conn.execute(text("PRAGMA user_version")).scalar() == (
+                OPTIMIZATIONS_VERSION
+            )
+            indices = set(
+                conn.execute(
+                    text("SELECT name FROM sqlite_master WHERE type = 'index'")
+                ).scalars()
+            )
+        assert "ix_lectura_matricula_fecha" in indices
+
+    def test_segundo_arranque_no_hace_nada(self, bd):
+        """Con el esquema y las optimizaciones al día sólo se leen versiones"""
+        prepare_database(bd)
+        sentencias = _sentencias(bd)
+
+        resumen = prepare_database(bd)
+        assert resumen["schema"] == "current"
+        assert resumen["optimizations"] == "current"
+        assert not [s for s in sentencias if s.lstrip().upper().startswith("CREATE")]
+        assert not any("VACUUM" in s.upper() for s in sentencias)
+
+
+class TestMantenimiento:
+    """Tests para el mantenimiento programado"""
+
+    def test_pasos_y_progreso(self, bd):
+        """VACUUM, checkpoint, ANALYZE y optimize, con el estado de la tarea"""
+        prepare_database(bd)
+        sentencias = _sentencias(bd)
+        task_id = new_maintenance_task(f"maintenance-test-{uuid.uuid4().hex}")
+        assert task_statuses[task_id]["status"] == "pending"
+
+        resumen = run_maintenance(task_id, vacuum=True, bind=bd)
+        assert list(resumen) == ["vacuum", "wal_checkpoint", "analyze", "optimize"]
+        assert sentencias == [
+            "VACUUM",
+            "PRAGMA wal_checkpoint(TRUNCATE)",
+            "ANALYZE",
+            "PRAGMA optimize",
+        ]
+        estado = task_statuses.pop(task_id)
+        assert estado["status"] == "completed"
+        assert estado["progress"] == 100
+        assert estado["result"] == {"seconds": resumen}
+
+    def test_sin_vacuum(self, bd):
+        """Por defecto el mantenimiento no reescribe la base de datos"""
+        task_id = new_maintenance_task(f"maintenance-test-{uuid.uuid4().hex}")
+        resumen = run_maintenance(task_id, bind=bd)
+        assert list(resumen) == ["analyze", "optimize"]
+        task_statuses.pop(task_id)
+
+    def test_un_vacuum_en_cola(self, monkeypatch):
+        """Las peticiones de VACUUM se agrupan mientras el encolado no empieza"""
+        encolados = []
+        monkeypatch.setattr(
+            optimizations.job_queue,
+            "submit",
+            lambda *args, **kwargs: encolados.append(kwargs["task_id"]),
+        )
+        monkeypatch.setattr(optimizations, "_pending_vacuum", None)
+        primero = request_vacuum()
+        assert request_vacuum() == primero
+        assert encolados == [primero]
+
+        # Lo borrado después de empezar necesita otro VACUUM
+        task_statuses[primero]["status"] = "processing"
+        segundo = request_vacuum()
+        assert segundo != primero
+        assert encolados == [primero, segundo]
+        task_statuses.pop(primero)
+        task_statuses.pop(segundo)
+
+    def test_mantenimiento_programado_una_vez(self, tmp_path, monkeypatch):
+        """Entre varios procesos, el mantenimiento de un intervalo se encola una vez"""
+        encolados = []
+        monkeypatch.setattr(
+            optimizations,
+            "submit_maintenance",
+            lambda task_id, vacuum: encolados.append(task_id),
+        )
+        monkeypatch.setattr(optimizations, "start_maintenance_scheduler", lambda: None)
+        # Un registro compartido, como el de varios procesos de la API
+        monkeypatch.setattr(
+            optimizations,
+            "task_statuses",
+            TaskRegistry(SQLiteTaskStore(str(tmp_path / "tareas.db"))),
+        )
+        optimizations._scheduled_maintenance()
+        optimizations._scheduled_maintenance()
+        assert len(encolados) == 1
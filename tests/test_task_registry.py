@@ -0,0 +1,115 @@
+"""
+Tests para el registro persistente de tareas en segundo plano
+"""
+
+import time
+from datetime import datetime
+
+import pytest
+
+import task_registry
+from task_registry import SQLiteTaskStore, TaskRegistry
+
+
+@pytest.fixture
+def ruta(tmp_path):
+    return str(tmp_path / "tareas.db")
+
+
+def _proceso(ruta, intervalo=0.0):
+    """Un registro por proceso, todos sobre la misma base de datos"""
+    return TaskRegistry(SQLiteTaskStore(ruta), progress_interval=intervalo)
+
+
+class TestTaskRegistry:
+    """Tests para el estado de tareas compartido entre procesos"""
+
+    def test_estado_visible_desde_otro_proceso(self, ruta):
+        """El worker que consulta el estado no tiene por qué ser el que lo escribe"""
+        escritor, lector = _proceso(ruta), _proceso(ruta)
+        escritor["t1"] = {"status": "pending", "progress": 0, "stage": "reading_file"}
+        escritor["t1"]["stage"] = "processing"
+        escritor["t1"].update({"status": "completed", "result": {"total": 3}})
+
+        estado = lector.get("t1")
+        assert estado == {
+            "status": "completed",
+            "progress": 0,
+            "stage": "processing",
+            "result": {"total": 3},
+        }
+        assert {**lector.get("t1"), "message": "x"}["status"] == "completed"
+        assert lector.get("otra") is None
+        assert "t1" in lector and list(lector) == ["t1"]
+
+        # Sobrevive a un reinicio: un registro nuevo lee lo mismo
+        assert _proceso(ruta)["t1"]["result"] == {"total": 3}
+
+    def test_valores_no_json(self, ruta):
+        """Fechas y similares se guardan como texto"""
+        registro = _proceso(ruta)
+        registro["t1"] = {"status": "pending", "created_at": datetime(2024, 1, 1)}
+        assert _proceso(ruta)["t1"]["created_at"] == "2024-01-01T00:00:00"
+
+    def test_progreso_agrupado(self, ruta):
+        """El progreso se escribe como mucho una vez por intervalo"""
+        escritor, lector = _proceso(ruta, intervalo=60), _proceso(ruta)
+        escritor["t1"] = {"status": "processing", "progress": 0, "stage": "a"}
+        for progreso in range(1, 50):
+            escritor["t1"]["progress"] = progreso
+            # Reescribir un valor igual no cuenta como cambio
+            escritor["t1"]["stage"] = "a"
+
+        # El proceso que escribe ve su último progreso; los demás, el publicado
+        assert escritor["t1"]["progress"] == 49
+        assert lector["t1"]["progress"] == 0
+
+        # Cualquier otro cambio publica también el progreso pendiente
+        escritor["t1"]["stage"] = "b"
+        assert lector["t1"]["progress"] == 49
+
+        escritor["t1"]["progress"] = 100
+        assert lector["t1"]["progress"] == 100
+
+    def test_purga(self, ruta, monkeypatch):
+        """Las terminadas caducan y las abandonadas se marcan como fallidas"""
+        registro = _proceso(ruta)
+        registro["terminada"] = {"status": "completed"}
+        registro["colgada"] = {"status": "processing"}
+        registro["viva"] = {"status": "processing"}
+
+        ahora = time.time()
+        monkeypatch.setattr(
+            task_registry.time,
+            "time",
+            lambda: ahora + task_registry.FINISHED_RETENTION + 1,
+        )
+        registro["viva"]["progress"] = 10
+        monkeypatch.setattr(
+            task_registry.time, "time", lambda: ahora + task_registry.STALE_AFTER + 1
+        )
+        assert registro.purge() == 1
+
+        lector = _proceso(ruta)
+        assert lector.get("terminada") is None
+        assert lector["colgada"]["status"] == "failed"
+        assert lector["colgada"]["message"] == "Proceso interrumpido por timeout"
+        assert lector["viva"]["status"] == "processing"
+
+    def test_reservas(self, ruta, monkeypatch):
+        """Una reserva es de un único proceso hasta que la libera o caduca"""
+        uno, otro = _proceso(ruta), _proceso(ruta)
+        assert uno.claim("job:import:0", "a", 60)
+        assert not otro.claim("job:import:0", "b", 60)
+        # El dueño la renueva
+        assert uno.claim("job:import:0", "a", 60)
+
+        uno.release("job:import:0", "b")
+        assert not otro.claim("job:import:0", "b", 60)
+        uno.release("job:import:0", "a")
+        assert otro.claim("job:import:0", "b", 60)
+
+        # La de un proceso que deja de renovarla caduca
+        ahora = time.time()
+        monkeypatch.setattr(task_registry.time, "time", lambda: ahora + 61)
+        assert uno.claim("job:import:0", "a", 60)
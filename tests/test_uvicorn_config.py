@@ -0,0 +1,57 @@
+"""
+Tests para los perfiles de arranque del servidor
+"""
+
+import os
+
+import pytest
+
+import uvicorn_config
+from uvicorn_config import (
+    opciones_desarrollo,
+    opciones_produccion,
+    preparar_entorno_produccion,
+)
+
+HOST = {"host": "127.0.0.1", "port": 8000}
+
+
+@pytest.fixture
+def entorno(monkeypatch):
+    """Variables de entorno del servidor restauradas tras cada test"""
+    for variable in ("ATRIO_WEB_WORKERS", "ATRIO_JOB_WORKERS", "RUNNING_MAIN"):
+        # setenv antes de delenv para que se deshaga también lo que se añada
+        monkeypatch.setenv(variable, "")
+        monkeypatch.delenv(variable)
+    return monkeypatch
+
+
+class TestPerfiles:
+    """Tests para los perfiles de desarrollo y producción"""
+
+    def test_produccion(self, entorno):
+        """Varios workers según los núcleos, sin recarga ni log de accesos"""
+        entorno.setattr(uvicorn_config.os, "cpu_count", lambda: 8)
+        opciones = opciones_produccion(HOST)
+        assert opciones["workers"] == 8
+        assert opciones["reload"] is False
+        assert opciones["access_log"] is False
+        assert opciones["loop"] in ("uvloop", "asyncio")
+        assert opciones["http"] in ("httptools", "h11")
+        assert opciones["limit_max_requests"] == uvicorn_config.MAX_REQUESTS_PRODUCCION
+
+        # Un único worker no se recicla: no hay supervisor que lo reemplace
+        assert opciones_produccion(HOST, workers=1)["limit_max_requests"] is None
+
+    def test_entorno_de_los_workers(self, entorno):
+        """Los workers saben cuántos son y se reparten la cola de trabajos"""
+        entorno.setattr(uvicorn_config.os, "cpu_count", lambda: 8)
+        preparar_entorno_produccion(3)
+        assert os.environ["ATRIO_WEB_WORKERS"] == "3"
+        assert os.environ["ATRIO_JOB_WORKERS"] == "2"
+        assert os.environ["RUNNING_MAIN"] == "1"
+
+    def test_desarrollo(self):
+        opciones = opciones_desarrollo(HOST)
+        assert opciones["reload"] is True
+        assert opciones["workers"] == 1
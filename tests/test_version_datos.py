@@ -0,0 +1,272 @@
+"""
+Tests para la versión de datos por caso
+"""
+
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from fastapi import Depends, FastAPI, Request, Response
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import models
+import version_datos
+from cache_manager import build_cache_key
+from version_datos import (
+    AMBITO_LECTORES,
+    etag_caso,
+    incrementar_version_ambito,
+    incrementar_version_caso,
+    incrementar_version_matricula,
+    iniciar_version_caso,
+    olvidar_version_caso,
+    respuesta_condicional,
+    version_ambito,
+    version_caso,
+    version_de_llamada,
+)
+
+
+class _RedisVersiones:
+    """Doble de Redis con GET y el script de máximo atómico"""
+
+    def __init__(self):
+        self.datos = {}
+
+    def get(self, key):
+        valor = self.datos.get(key)
+        return None if valor is None else str(valor).encode()
+
+    def delete(self, key):
+        return int(self.datos.pop(key, None) is not None)
+
+    def eval(self, script, num_claves, key, version, ttl):
+        if int(version) > self.datos.get(key, -1):
+            self.datos[key] = int(version)
+            return 1
+        return 0
+
+
+def _lectura(archivo_id, matricula):
+    return models.Lectura(
+        ID_Archivo=archivo_id,
+        Matricula=matricula,
+        Fecha_y_Hora=datetime(2024, 1, 1, 8, 0, 0),
+        Tipo_Fuente="LPR",
+    )
+
+
+@pytest.fixture
+def Session():
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    models.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    db = Session()
+    db.add(models.Grupo(ID_Grupo=1, Nombre="G"))
+    for caso_id in (1, 2, 3):
+        db.add(
+            models.Caso(
+                ID_Caso=caso_id, Nombre_del_Caso=f"C{caso_id}", Año=2024, ID_Grupo=1
+            )
+        )
+        db.add(
+            models.ArchivoExcel(
+                ID_Archivo=caso_id,
+                ID_Caso=caso_id,
+                Nombre_del_Archivo=f"{caso_id}.xlsx",
+                Tipo_de_Archivo="LPR",
+            )
+        )
+    # La matrícula aparece en los casos 1 y 2, pero no en el 3
+    for archivo_id in (1, 2):
+        db.add(_lectura(archivo_id, "1111AAA"))
+    db.add(_lectura(3, "2222BBB"))
+    db.commit()
+    db.close()
+    return Session
+
+
+@pytest.fixture
+def redis_versiones(monkeypatch):
+    redis = _RedisVersiones()
+    monkeypatch.setattr(
+        version_datos,
+        "cache_manager",
+        SimpleNamespace(connected=True, redis_client=redis),
+    )
+    return redis
+
+
+class TestVersionDatos:
+    """Tests para el versionado de los datos de cada caso"""
+
+    def test_incremento_en_la_transaccion(self, Session):
+        """La versión sube dentro de la transacción y se descarta con rollback"""
+        db = Session()
+        assert version_caso(db, 1) == 0
+        assert incrementar_version_caso(db, 1) == 1
+        db.commit()
+        assert incrementar_version_caso(db, 1) == 2
+        db.rollback()
+        assert version_caso(db, 1) == 1
+        assert incrementar_version_caso(db, 99) is None
+        db.close()
+
+    def test_matricula_incrementa_sus_casos(self, Session):
+        """Editar un vehículo cambia la versión de todos los casos donde aparece"""
+        db = Session()
+        assert incrementar_version_matricula(db, "1111AAA") == {1: 1, 2: 1}
+        db.commit()
+        assert [version_caso(db, c) for c in (1, 2, 3)] == [1, 1, 0]
+        db.close()
+
+    def test_replica_se_publica_tras_commit(self, Session, redis_versiones):
+        """La réplica sólo cambia tras el commit y nunca retrocede"""
+        clave = version_datos.CLAVE_VERSION.format(caso_id=1)
+        db = Session()
+        assert version_caso(db, 1) == 0
+        assert redis_versiones.datos[clave] == 0
+
+        incrementar_version_caso(db, 1)
+        assert redis_versiones.datos[clave] == 0
+        db.rollback()
+        db.commit()
+        assert redis_versiones.datos[clave] == 0
+
+        incrementar_version_caso(db, 1)
+        db.commit()
+        assert redis_versiones.datos[clave] == 1
+
+        # Una lectura con una versión antigua no puede sobrescribir la nueva
+        version_datos._publicar(clave, 0)
+        assert version_caso(db, 1) == 1
+        db.close()
+
+    def test_id_reutilizado(self, Session, redis_versiones):
+        """Un caso nuevo con el ID de uno borrado empieza por encima de su réplica"""
+        clave = version_datos.CLAVE_VERSION.format(caso_id=3)
+        db = Session()
+        for _ in range(3):
+            incrementar_version_caso(db, 3)
+        db.commit()
+        assert redis_versiones.datos[clave] == 3
+
+        # Réplica que sobrevive al borrado (p. ej. publicada por una lectura
+        # concurrente): el caso nuevo no puede reutilizar sus versiones
+        db.query(models.Lectura).filter(models.Lectura.ID_Archivo == 3).delete()
+        db.query(models.ArchivoExcel).filter(models.ArchivoExcel.ID_Caso == 3).delete()
+        db.query(models.Caso).filter(models.Caso.ID_Caso == 3).delete()
+        db.commit()
+        caso = models.Caso(Nombre_del_Caso="Nuevo", Año=2024, ID_Grupo=1)
+        db.add(caso)
+        db.flush()
+        assert caso.ID_Caso == 3
+        assert iniciar_version_caso(db, caso) == 4
+        db.commit()
+        assert version_caso(db, 3) == 4
+        assert redis_versiones.datos[clave] == 4
+
+        # Al borrar un caso se olvida su réplica
+        olvidar_version_caso(3)
+        assert clave not in redis_versiones.datos
+        caso = models.Caso(Nombre_del_Caso="Otro", Año=2024, ID_Grupo=1)
+        db.add(caso)
+        db.flush()
+        assert iniciar_version_caso(db, caso) == 0
+        db.close()
+
+    def test_clave_de_cache_cambia_con_la_version(self, Session):
+        """Las claves de `cached` incluyen la versión de los datos del caso"""
+
+        def vehiculos(caso_id: int, db=None):
+            return []
+
+        db = Session()
+        clave = lambda: build_cache_key(
+            "vehiculos", vehiculos, (1,), {"db": db}, version=version_de_llamada
+        )
+        antes = clave()
+        assert ":v0:" in antes
+        incrementar_version_caso(db, 1)
+        db.commit()
+        assert clave() != antes
+        db.close()
+
+    def test_etag(self):
+        """El ETag depende de la versión y de los parámetros"""
+        assert etag_caso(1, 4) == 'W/"caso1-v4"'
+        assert etag_caso(1, 4, "a") != etag_caso(1, 5, "a")
+        assert etag_caso(1, 4, "a") != etag_caso(1, 4, "b")
+
+    def test_version_de_ambito(self, Session):
+        """Los catálogos compartidos tienen su propio contador"""
+        db = Session()
+        assert version_ambito(db, AMBITO_LECTORES) == 0
+        assert incrementar_version_ambito(db, AMBITO_LECTORES) == 1
+        assert incrementar_version_ambito(db, AMBITO_LECTORES) == 2
+        db.commit()
+        assert version_ambito(db, AMBITO_LECTORES) == 2
+        assert version_caso(db, 1) == 0
+        db.close()
+
+
+class TestPeticionesCondicionales:
+    """Tests para ETag / If-None-Match"""
+
+    def test_304_sin_recalcular(self, Session):
+        """Con el ETag vigente se responde 304 sin cuerpo y sin ejecutar la consulta"""
+        app = FastAPI()
+        calculos = []
+
+        def get_db():
+            db = Session()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        @app.get("/casos/{caso_id}/datos")
+        def datos(
+            caso_id: int, request: Request, response: Response, db=Depends(get_db)
+        ):
+            etag = etag_caso(caso_id, version_caso(db, caso_id), "datos")
+            no_modificado = respuesta_condicional(request, response, etag)
+            if no_modificado is not None:
+                return no_modificado
+            calculos.append(caso_id)
+            return {"caso": caso_id, "filas": list(range(100))}
+
+        cliente = TestClient(app)
+        primera = cliente.get("/casos/1/datos")
+        etag = primera.headers["etag"]
+        assert primera.status_code == 200
+        assert primera.headers["cache-control"] == "private, no-cache"
+
+        repetida = cliente.get("/casos/1/datos", headers={"If-None-Match": etag})
+        assert repetida.status_code == 304
+        assert repetida.content == b""
+        assert repetida.headers["etag"] == etag
+        assert calculos == [1]
+
+        # La comparación es débil y admite listas de ETags
+        lista = cliente.get(
+            "/casos/1/datos", headers={"If-None-Match": f'"otro", {etag[2:]}'}
+        )
+        assert lista.status_code == 304
+
+        db = Session()
+        incrementar_version_caso(db, 1)
+        db.commit()
+        db.close()
+        cambiada = cliente.get("/casos/1/datos", headers={"If-None-Match": etag})
+        assert cambiada.status_code == 200
+        assert cambiada.headers["etag"] != etag
+        assert calculos == [1, 1]
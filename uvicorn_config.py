@@ -1,14 +1,42 @@
 """
 Configuración personalizada para uvicorn que maneja mejor las señales
 y la terminación del servidor.
+
+Hay dos perfiles:
+
+- desarrollo (por defecto): un worker con recarga automática y log de
+  accesos;
+- produccion: varios workers según los núcleos, uvloop/httptools si están
+  instalados, sin recarga ni log de accesos, keep-alive y backlog ajustados
+  y reciclado de workers tras ATRIO_MAX_REQUESTS peticiones (uvicorn
+  arranca otro en su lugar cuando el anterior termina lo que tenía en curso).
+
+    python uvicorn_config.py --perfil produccion [--workers N]
+
+El estado de las tareas es persistente y compartido entre procesos. El cache
+se comparte a través de Redis; sin Redis cada worker tiene el suyo y sus
+entradas caducan antes (ver `CacheManager`).
 """
 
+import argparse
+import importlib.util
 import uvicorn
 import signal
 import sys
 import os
+from typing import Any, Dict, Optional
 from system_config import get_host_config
 
+PERFIL_DESARROLLO = "desarrollo"
+PERFIL_PRODUCCION = "produccion"
+
+# Más que el keep-alive habitual de un proxy delante (60 s en nginx), para
+# que sea el proxy quien cierre las conexiones inactivas
+KEEP_ALIVE_PRODUCCION = int(os.environ.get("ATRIO_KEEP_ALIVE", 65))
+BACKLOG_PRODUCCION = int(os.environ.get("ATRIO_BACKLOG", 4096))
+# Peticiones tras las que se recicla un worker (0 lo desactiva)
+MAX_REQUESTS_PRODUCCION = int(os.environ.get("ATRIO_MAX_REQUESTS", 10000))
+
 
 class GracefulServer(uvicorn.Server):
     """Servidor uvicorn con manejo graceful de señales"""
@@ -28,15 +56,60 @@ class GracefulServer(uvicorn.Server):
         self.should_exit = True
 
 
-def run_server():
-    """Ejecuta el servidor con configuración optimizada"""
-    config = get_host_config()
+def _disponible(modulo: str) -> bool:
+    return importlib.util.find_spec(modulo) is not None
+
+
+def workers_produccion() -> int:
+    """Workers de la API: ATRIO_WEB_WORKERS o uno por núcleo"""
+    return max(1, int(os.environ.get("ATRIO_WEB_WORKERS", os.cpu_count() or 1)))
+
+
+def preparar_entorno_produccion(workers: int):
+    """
+    Variables que leen los workers al importar la aplicación (uvicorn los
+    arranca como procesos nuevos que heredan el entorno)
+    """
+    os.environ["ATRIO_WEB_WORKERS"] = str(workers)
+    # Cada worker tiene su cola de trabajos: se reparten los núcleos libres.
+    # Los límites por tipo (JOB_LIMITS) se reservan en el registro de tareas
+    # y valen para el conjunto de los workers
+    nucleos = os.cpu_count() or 1
+    os.environ.setdefault("ATRIO_JOB_WORKERS", str(max(1, (nucleos - 1) // workers)))
+    # Las señales las gestiona uvicorn, no los manejadores de main.py
+    os.environ.setdefault("RUNNING_MAIN", "1")
+
+
+def opciones_produccion(
+    config: Dict[str, Any], workers: Optional[int] = None
+) -> Dict[str, Any]:
+    """Argumentos de uvicorn.run para el perfil de producción"""
+    workers = workers or workers_produccion()
+    return dict(
+        host=config["host"],
+        port=config["port"],
+        workers=workers,
+        reload=False,
+        loop="uvloop" if _disponible("uvloop") else "asyncio",
+        http="httptools" if _disponible("httptools") else "h11",
+        log_level="info",
+        access_log=False,
+        use_colors=False,
+        server_header=False,
+        proxy_headers=True,
+        forwarded_allow_ips=os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        backlog=BACKLOG_PRODUCCION,
+        timeout_keep_alive=KEEP_ALIVE_PRODUCCION,
+        timeout_graceful_shutdown=30,
+        # Con un solo worker no hay proceso supervisor que lo vuelva a
+        # arrancar: alcanzar el límite pararía el servidor
+        limit_max_requests=(MAX_REQUESTS_PRODUCCION or None) if workers > 1 else None,
+    )
 
-    print(f"Iniciando servidor ATRIO en {config['host']}:{config['port']}")
 
-    # Configuración optimizada para desarrollo
-    uvicorn.run(
-        "main:app",
+def opciones_desarrollo(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Argumentos de uvicorn.run para el perfil de desarrollo"""
+    return dict(
         host=config["host"],
         port=config["port"],
         reload=True,  # Habilitar reload automático
@@ -60,5 +133,36 @@ def run_server():
     )
 
 
+def run_server(perfil: Optional[str] = None, workers: Optional[int] = None):
+    """Ejecuta el servidor con la configuración del perfil indicado"""
+    config = get_host_config()
+    perfil = perfil or os.environ.get("ATRIO_PERFIL", PERFIL_DESARROLLO)
+
+    if perfil == PERFIL_PRODUCCION:
+        opciones = opciones_produccion(config, workers)
+        preparar_entorno_produccion(opciones["workers"])
+        # Se prepara la base de datos una sola vez, antes de arrancar los
+        # workers, para que no creen a la vez las tablas de una base nueva
+        from optimizations import prepare_database
+
+        print(f"Base de datos preparada: {prepare_database()}")
+    else:
+        opciones = opciones_desarrollo(config)
+
+    print(
+        f"Iniciando servidor ATRIO en {config['host']}:{config['port']} "
+        f"(perfil {perfil}, {opciones.get('workers', 1)} workers)"
+    )
+    uvicorn.run("main:app", **opciones)
+
+
 if __name__ == "__main__":
-    run_server()
+    parser = argparse.ArgumentParser(description="Servidor ATRIO")
+    parser.add_argument(
+        "--perfil",
+        choices=[PERFIL_DESARROLLO, PERFIL_PRODUCCION],
+        default=os.environ.get("ATRIO_PERFIL", PERFIL_DESARROLLO),
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    run_server(args.perfil, args.workers)
@@ -0,0 +1,287 @@
+"""
+Versión de datos por caso para la coherencia del cache.
+
+Cada caso tiene un contador `Version_Datos` que sólo crece y que se
+incrementa, dentro de la misma transacción, con cada cambio en sus datos:
+importaciones, borrado de archivos, edición de vehículos y marcas de
+relevancia. Las claves de cache de los resultados del caso incluyen la
+versión, de modo que tras un cambio las entradas antiguas dejan de
+consultarse sin esperar a su TTL y las nuevas pueden vivir mucho tiempo.
+
+Los catálogos compartidos por todos los casos (lectores) tienen su propio
+contador en la tabla `versiones_datos`.
+
+La versión vigente se replica en Redis para no consultar la base de datos
+en cada acierto. La réplica sólo se publica tras el commit y nunca retrocede
+(se escribe con un máximo atómico), así que una lectura concurrente no puede
+sustituir una versión nueva por otra anterior.
+
+Las mismas versiones sirven de ETag para las peticiones condicionales: si
+el cliente ya tiene la respuesta vigente se devuelve un 304 sin cuerpo.
+"""
+
+import hashlib
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, cast
+
+from fastapi import Request, Response, status
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import Session
+
+import models
+from cache_manager import cache_manager
+from case_shards import casos_con_matricula
+
+logger = logging.getLogger(__name__)
+
+CLAVE_VERSION = "atrio:version:caso:{caso_id}"
+CLAVE_VERSION_AMBITO = "atrio:version:{ambito}"
+AMBITO_LECTORES = "lectores"
+# La réplica se reconstruye desde la base de datos si expira
+TTL_VERSION = 24 * 3600
+
+# Escribe la versión sólo si es mayor que la publicada
+_SCRIPT_MAXIMO = """
+local actual = tonumber(redis.call('GET', KEYS[1]) or '-1')
+if tonumber(ARGV[1]) > actual then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+_PENDIENTES = "versiones_pendientes"
+
+
+# Las respuestas dependen del usuario: el navegador puede guardarlas, pero
+# debe revalidarlas con If-None-Match antes de reutilizarlas
+CACHE_CONTROL = "private, no-cache"
+
+
+def _publicar(clave: str, version: int):
+    if not cache_manager.connected:
+        return
+    try:
+        argumentos: List[Any] = [clave, version, TTL_VERSION]
+        cache_manager.redis_client.eval(_SCRIPT_MAXIMO, 1, *argumentos)
+    except Exception as e:
+        logger.error(f"Error publicando la versión {clave}: {e}")
+
+
+def _leer_replica(clave: str) -> Optional[int]:
+    if not cache_manager.connected:
+        return None
+    try:
+        valor = cast(Optional[bytes], cache_manager.redis_client.get(clave))
+        return None if valor is None else int(valor)
+    except Exception as e:
+        logger.error(f"Error leyendo la versión {clave}: {e}")
+        return None
+
+
+def _tras_commit(db: Session):
+    for clave, version in db.info.pop(_PENDIENTES, {}).items():
+        _publicar(clave, version)
+
+
+def _tras_rollback(db: Session):
+    # Las versiones de una transacción descartada no llegan a publicarse
+    db.info.pop(_PENDIENTES, None)
+
+
+def _registrar_pendientes(db: Session, versiones: Dict[str, int]):
+    if not versiones:
+        return
+    if not event.contains(db, "after_commit", _tras_commit):
+        event.listen(db, "after_commit", _tras_commit)
+        event.listen(db, "after_rollback", _tras_rollback)
+    db.info.setdefault(_PENDIENTES, {}).update(versiones)
+
+
+def incrementar_version_casos(db: Session, casos_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    Incrementa la versión de datos de los casos en la transacción en curso.
+
+    Debe llamarse antes del commit que confirma el cambio; la réplica en
+    cache se actualiza cuando ese commit termina. Devuelve la nueva versión
+    de cada caso existente.
+    """
+    casos_ids = sorted({int(c) for c in casos_ids if c is not None})
+    if not casos_ids:
+        return {}
+    db.execute(
+        update(models.Caso)
+        .where(models.Caso.ID_Caso.in_(casos_ids))
+        .values(Version_Datos=models.Caso.Version_Datos + 1)
+        .execution_options(synchronize_session=False)
+    )
+    versiones: Dict[int, int] = {
+        caso_id: version
+        for caso_id, version in db.execute(
+            select(models.Caso.ID_Caso, models.Caso.Version_Datos).where(
+                models.Caso.ID_Caso.in_(casos_ids)
+            )
+        ).all()
+    }
+    _registrar_pendientes(
+        db, {CLAVE_VERSION.format(caso_id=c): v for c, v in versiones.items()}
+    )
+    return versiones
+
+
+def incrementar_version_caso(db: Session, caso_id: int) -> Optional[int]:
+    """Incrementa la versión de un caso; None si el caso no existe"""
+    return incrementar_version_casos(db, [caso_id]).get(caso_id)
+
+
+def incrementar_version_matricula(db: Session, matricula: str) -> Dict[int, int]:
+    """Incrementa la versión de todos los casos con lecturas de la matrícula"""
+    # Los casos con shard no están en la tabla compartida
+    casos_ids = casos_con_matricula(matricula)
+    casos_ids += db.scalars(
+        select(models.ArchivoExcel.ID_Caso)
+        .join(
+            models.Lectura,
+            models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo,
+        )
+        .where(models.Lectura.Matricula == matricula)
+        .distinct()
+    ).all()
+    return incrementar_version_casos(db, casos_ids)
+
+
+def iniciar_version_caso(db: Session, caso: models.Caso) -> int:
+    """
+    Fija la versión de un caso recién creado (ya con ID, antes del commit).
+
+    SQLite reutiliza el ID del último caso si se borra, y una réplica de ese
+    caso que sobreviva al borrado nunca retrocede: el caso nuevo empieza por
+    encima de ella para no compartir claves de cache con el anterior.
+    """
+    clave = CLAVE_VERSION.format(caso_id=caso.ID_Caso)
+    replica = _leer_replica(clave)
+    version = cast(Optional[int], caso.Version_Datos) or 0
+    if replica is not None and replica >= version:
+        version = replica + 1
+        setattr(caso, "Version_Datos", version)
+        _registrar_pendientes(db, {clave: version})
+    return version
+
+
+def olvidar_version_caso(caso_id: int):
+    """Borra la réplica de la versión de un caso eliminado (tras el commit)"""
+    if not cache_manager.connected:
+        return
+    try:
+        cache_manager.redis_client.delete(CLAVE_VERSION.format(caso_id=caso_id))
+    except Exception as e:
+        logger.error(f"Error borrando la versión del caso {caso_id}: {e}")
+
+
+def incrementar_version_ambito(db: Session, ambito: str) -> int:
+    """Incrementa la versión de un catálogo compartido (ej: AMBITO_LECTORES)"""
+    tabla = models.VersionDatos
+    actualizadas = db.execute(
+        update(tabla)
+        .where(tabla.Ambito == ambito)
+        .values(Version=tabla.Version + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not actualizadas:
+        db.execute(insert(tabla).values(Ambito=ambito, Version=1))
+    version = db.scalar(select(tabla.Version).where(tabla.Ambito == ambito)) or 0
+    _registrar_pendientes(db, {CLAVE_VERSION_AMBITO.format(ambito=ambito): version})
+    return version
+
+
+def version_caso(db: Session, caso_id: int) -> int:
+    """Versión vigente del caso (0 si no existe), leída de la réplica si la hay"""
+    clave = CLAVE_VERSION.format(caso_id=caso_id)
+    version = _leer_replica(clave)
+    if version is not None:
+        return version
+
+    version = db.scalar(
+        select(models.Caso.Version_Datos).where(models.Caso.ID_Caso == caso_id)
+    )
+    if version is None:
+        return 0
+    _publicar(clave, version)
+    return version
+
+
+def version_ambito(db: Session, ambito: str) -> int:
+    """Versión vigente de un catálogo compartido (0 si nunca ha cambiado)"""
+    clave = CLAVE_VERSION_AMBITO.format(ambito=ambito)
+    version = _leer_replica(clave)
+    if version is not None:
+        return version
+
+    tabla = models.VersionDatos
+    version = db.scalar(select(tabla.Version).where(tabla.Ambito == ambito)) or 0
+    _publicar(clave, version)
+    return version
+
+
+def version_de_llamada(arguments: Dict[str, Any]) -> Optional[str]:
+    """Versión para las claves de `cached`, a partir de `db` y `caso_id`"""
+    db, caso_id = arguments.get("db"), arguments.get("caso_id")
+    if not isinstance(db, Session) or caso_id is None:
+        return None
+    return f"v{version_caso(db, caso_id)}"
+
+
+def version_de_ambito(ambito: str) -> Callable[[Dict[str, Any]], Optional[str]]:
+    """Versión para las claves de `cached` de un catálogo compartido"""
+
+    def version(arguments: Dict[str, Any]) -> Optional[str]:
+        db = arguments.get("db")
+        if not isinstance(db, Session):
+            return None
+        return f"{ambito}-v{version_ambito(db, ambito)}"
+
+    return version
+
+
+def etag_version(nombre: str, version: Any, *partes: Any) -> str:
+    """ETag débil de un resultado para una versión de datos y unos parámetros"""
+    etag = f"{nombre}-v{version}"
+    if partes:
+        resumen = hashlib.md5(repr(partes).encode()).hexdigest()[:16]
+        etag = f"{etag}-{resumen}"
+    return f'W/"{etag}"'
+
+
+def etag_caso(caso_id: int, version: int, *partes: Any) -> str:
+    """ETag débil de un resultado del caso para una versión y unos parámetros"""
+    return etag_version(f"caso{caso_id}", version, *partes)
+
+
+def _coincide(if_none_match: str, etag: str) -> bool:
+    """Comparación débil de If-None-Match (RFC 9110, 13.1.2)"""
+    if if_none_match.strip() == "*":
+        return True
+    opaca = etag.removeprefix("W/")
+    return any(
+        candidato.strip().removeprefix("W/") == opaca
+        for candidato in if_none_match.split(",")
+    )
+
+
+def respuesta_condicional(
+    request: Request, response: Response, etag: str
+) -> Optional[Response]:
+    """
+    Prepara las cabeceras de cache y resuelve una petición condicional.
+
+    Devuelve un 304 sin cuerpo si el If-None-Match del cliente coincide con
+    `etag`; si no, añade ETag y Cache-Control a `response` y devuelve None
+    para que el endpoint calcule la respuesta completa. Debe llamarse después
+    de comprobar los permisos.
+    """
+    cabeceras = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _coincide(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cabeceras)
+    response.headers.update(cabeceras)
+    return None